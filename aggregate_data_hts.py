@@ -1,15 +1,41 @@
+import numpy as np
 import pandas as pd
 import os
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 import re
 
+from cleaning_lookup import apply_distinct, source_fingerprint
+from daily_index import build_daily_index
+from date_quality import report_date_quality
+from incremental import PartialCounts, run_fingerprint
+from indicator_counts import assemble_counts, count_indicators, mer_disaggregation, save_disaggregates, count_matrix, save_line_lists
+from ingestion import list_input_files, load_extracts
+from mask_engine import as_mask
+from profiling import save_profile, stage, start_profile
+from rollups import ROLLUP_SHEET, facility_geography, rollup_counts
+from schema import as_key_category
+from trend import count_trend, parse_periods, save_trend
+
 # Path to the directory containing the CSV files
 folder_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/HTS_IPP/hts 3rd Oct/CS_Filtered2'  
 
 # Output path for the final Excel file
 output_file_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/HTS_Aggregates by Facility_CS_3rd Oct_ACE-1b.xlsx'
 
+# Output path for the line lists of line_list_indicators
+line_list_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/HTS_Aggregates by Facility_CS_3rd Oct_ACE-1b_line_lists.xlsx'
+
+# Output path for the MER age/sex disaggregates (disaggregate_by_age_sex)
+disaggregates_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/HTS_Aggregates by Facility_CS_3rd Oct_ACE-1b_disaggregates.xlsx'
+
+# Output path for the trend of trend_periods
+trend_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/HTS_Aggregates by Facility_CS_3rd Oct_ACE-1b_trend.xlsx'
+
+# Workbook the blank and unparseable date counts per column and facility are saved to, with the first rows
+# holding a date that could not be read (see date_quality.py). None only prints the summary.
+invalid_dates_sample_path = None
+
 # Output path for troubleshooting HIV Testing Setting and Modality Output
 hts_setting_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Extracted_HTS_setting.xlsx'
 
@@ -18,1038 +44,578 @@ hts_setting_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium Int
 Start_of_quarter = pd.to_datetime('2025-07-01')
 End_of_quarter = pd.to_datetime('2025-09-30')
 
-# Combine all CSV files into one DataFrame, specifying 'latin1' encoding
-all_files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith(('.csv', '.xlsx', '.xls'))]
-
-
-# Combine all files into one DataFrame
-combined_data = pd.DataFrame()
-
-for file in all_files:
-    try:
-        if file.endswith('.csv'):
-            data = pd.read_csv(file, encoding='latin1', on_bad_lines='skip')
-        elif file.endswith('.xlsx'):
-            data = pd.read_excel(file, engine='openpyxl')
-        elif file.endswith('.xls'):
-            data = pd.read_excel(file)
-        else:
-            continue
-        
-        # Add Filename column
-        data['Filename'] = os.path.basename(file)
-        combined_data = pd.concat([combined_data, data], ignore_index=True)
-    except Exception as e:
-        print(f"Error processing file {file}: {e}")
-
-if combined_data.empty:
-    print("No valid files found or data could not be combined.")
-    exit()
-
-# Extract project name from the 'Filename' column
-# IMPORTANT: Ensure 'Filename' column exists before attempting to split
-if 'Filename' not in combined_data.columns:
-    print("FATAL ERROR: 'Filename' column is missing from the combined data. Cannot extract ProjectName.")
-    exit()
-
-combined_data['ProjectName'] = combined_data['Filename'].str.split('_').str[0]
-
-# --- Robust column validation ---
-# Check if 'ProjectName' and 'Facility' columns exist and are not entirely empty
-required_cols_for_aggregation = ['ProjectName', 'Facility', 'Facility Id (Datim)']
-for col in required_cols_for_aggregation:
-    if col not in combined_data.columns:
-        print(f"FATAL ERROR: Required column '{col}' is missing from the combined data.")
-        if col == 'ProjectName':
-            print("This usually means the 'Filename' column couldn't be processed to extract ProjectName.")
-            print(f"First 5 filenames: {combined_data['Filename'].head().tolist()}")
-        exit()
-    
-    # Convert to string and handle potential NaNs before further processing
-    combined_data[col] = combined_data[col].astype(str).fillna('UNKNOWN')
-
-    if (combined_data[col] == 'UNKNOWN').all():
-        print(f"Warning: Column '{col}' is entirely 'UNKNOWN' (or NaN in original data). This might affect grouping and filtering.")
-    elif combined_data[col].nunique() == 1 and combined_data[col].iloc[0] == 'UNKNOWN':
-         print(f"Warning: Column '{col}' contains only 'UNKNOWN' values. This might indicate an issue with data extraction or input.")
-
-# --- End of NEW column validation ---
-
-
-# Ensure date columns are in datetime format
+# Number of worker processes used to read the extracts in parallel
+# (1 reads the files one after another, None uses one worker per CPU)
+ingest_workers = 1
+
+# Folder where the parsed extracts are cached between runs (None switches the cache off).
+# Files that have not changed since the last run are loaded from the cache instead of being parsed again.
+cache_dir = None
+
+# Indicators whose matching rows are also saved as line lists, one sheet per indicator
+# (e.g. ['HTS_TST_Index', 'HTS_Index_Positive']). Left empty, only the facility counts are computed.
+line_list_indicators = []
+
+# Also count every indicator by MER fine age band (<1, 1-4, 5-9, ..., 65+) and Sex, saved to
+# disaggregates_output_path as a long table. With disaggregates_wide_sheet, a second sheet holds one
+# column per age band/Sex combination.
+disaggregate_by_age_sex = False
+disaggregates_wide_sheet = False
+
+# Also write the totals of the facility counts per LGA, State, project and nationally to a 'Rollups'
+# sheet of the output file. The LGA/State levels use rollup_geography_columns where the extracts have them.
+include_rollups = False
+rollup_geography_columns = ['State', 'LGA']
+
+# Trend mode: the (start, end) of every reporting period to count from the same extracts, e.g.
+# [('2024-10-01', '2024-12-31'), ('2025-01-01', '2025-03-31')]. The extracts are read once and the facility
+# counts of every period are saved to trend_output_path, one row per period and facility.
+trend_periods = []
+
+# Daily index (needs cache_dir): the number of tests per facility, HTS modality, test result and day, stored
+# next to the cached extracts and only updated for the files that changed. Date-range counts can then be read
+# without re-running this script: daily_index.load_daily_index(cache_dir, 'hts').count(start, end, filters).
+keep_daily_index = False
+
+# Incremental mode (needs cache_dir): the facility counts of every input file are kept next to the cached
+# extracts, so a re-run only reads and counts the files that changed since the last run and adds up the
+# stored counts of the others. The line lists, disaggregates, trend, daily index, State/LGA rollups and the
+# HTS setting export need every row, so they are skipped in this mode.
+incremental = False
+
+# Save a profile of the run as JSON next to output_file_path (<name>_profile.json): the duration and peak memory
+# of every stage, i.e. reading and coercing each file, cleaning, the indicator masks, counting, assembling and
+# writing the output. Tracing the memory slows the run down somewhat, so it is off by default.
+profile_run = False
+
+# Date columns, converted to datetime format as each extract is read (invalid dates become NaT)
 date_columns = [
     'Date Of HIV Testing (yyyy-mm-dd)'
 ]
 
-for col in date_columns:
-    combined_data[col] = pd.to_datetime(combined_data[col], errors='coerce')
-
-# Check for invalid dates
-invalid_dates = combined_data[date_columns].isnull().any(axis=1)
-if invalid_dates.any():
-    print(f"Warning: Invalid dates found in the following rows:\n{combined_data[invalid_dates]}")
-
-# Ensure Numeric field is numeric
-combined_data['Age'] = pd.to_numeric(combined_data['Age'], errors='coerce')
-
-
-HTS_TST_Emergency = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Emergency'])) &
-    (combined_data['Modality'].isin(['Emergency'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '') 
-]
-
-
-HTS_Emergency_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Emergency'])) &
-    (combined_data['Modality'].isin(['Emergency'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_Emergency_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Emergency'])) &
-    (combined_data['Modality'].isin(['Emergency'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_Index = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility', 'Community'])) &
-    (combined_data['Testing Setting'].isin(['Index'])) &
-    (combined_data['Modality'].isin(['Index'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_Index_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility', 'Community'])) &
-    (combined_data['Testing Setting'].isin(['Index'])) &
-    (combined_data['Modality'].isin(['Index'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_Index_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility', 'Community'])) &
-    (combined_data['Testing Setting'].isin(['Index'])) &
-    (combined_data['Modality'].isin(['Index'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_Inpatient = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Inpatient', 'Ward/Inpatient', 'Ward'])) &
-    (combined_data['Modality'].isin(['Inpatient'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_Inpatient_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Inpatient', 'Ward/Inpatient', 'Ward'])) &
-    (combined_data['Modality'].isin(['Inpatient'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_Inpatient_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Inpatient', 'Ward/Inpatient', 'Ward'])) &
-    (combined_data['Modality'].isin(['Inpatient'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_Malnutrition = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Malnutrition', 'Malnutrition Clinic'])) &
-    (combined_data['Modality'].isin(['Malnutrition', 'Malnutrition Clinic'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Positive'])) &
-    (combined_data['Age'] <5) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_Malnutrition_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Malnutrition', 'Malnutrition Clinic'])) &
-    (combined_data['Modality'].isin(['Malnutrition', 'Malnutrition Clinic'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative'])) &
-    (combined_data['Age'] <5) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_Malnutrition_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Malnutrition', 'Malnutrition Clinic'])) &
-    (combined_data['Modality'].isin(['Malnutrition', 'Malnutrition Clinic'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (combined_data['Age'] <5) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_MobileMod = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['Outreach'])) &
-    (combined_data['Modality'].isin(['Mobile'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive','Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_MobileMod_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['Outreach'])) &
-    (combined_data['Modality'].isin(['Mobile'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_MobileMod_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['Outreach'])) &
-    (combined_data['Modality'].isin(['Mobile'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_OtherMod = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['Others', 'Standalone', 'Standalone HTS', 'OVC'])) & #, 'Outreach (Community)', 'Outreach',
-    (combined_data['Modality'].isin(['Other Community Platforms'])) & #, 'Other (Community)'
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_OtherMod_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['Others', 'Standalone', 'Standalone HTS', 'OVC'])) & #, 'Outreach (Community)', 'Outreach'
-    (combined_data['Modality'].isin(['Other Community Platforms'])) & #, 'Other (Community)'
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_OtherMod_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['Others', 'Standalone', 'Standalone HTS', 'OVC'])) & #, 'Outreach (Community)', 'Outreach' 
-    (combined_data['Modality'].isin(['Other Community Platforms'])) & #, 'Other (Community)'
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_OtherPITC = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Others', 'FP', 'BloodBank', 'Standalone', 'Standalone HTS', 'TB', 'Others (Specify)'])) &
-    (combined_data['Modality'].isin(['Other PITC']))) |
-
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['TB'])) &
-    (combined_data['Modality'].isin(['TB_STAT/OtherPITC']))) |
-
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-     (combined_data['Testing Setting'].isin(['Pediatrics <5 Clinic', 'Pediatric'])) &
-    (combined_data['Modality'].isin(['Pediatrics <5 Clinic', 'Pediatric'])) &
-    (combined_data['Age'] >=5) ) |
-
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-     (combined_data['Testing Setting'].isin(['Malnutrition', 'Malnutrition Clinic'])) &
-    (combined_data['Modality'].isin(['Malnutrition', 'Malnutrition Clinic'])) &
-    (combined_data['Age'] >=5))
-    ) &
-
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_OtherPITC_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Others', 'FP', 'BloodBank', 'Standalone', 'Standalone HTS', 'TB', 'Others (Specify)'])) &
-    (combined_data['Modality'].isin(['Other PITC']))) |
-
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['TB'])) &
-    (combined_data['Modality'].isin(['TB_STAT/OtherPITC']))) |
-
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-     (combined_data['Testing Setting'].isin(['Pediatrics <5 Clinic', 'Pediatric'])) &
-    (combined_data['Modality'].isin(['Pediatrics <5 Clinic', 'Pediatric'])) &
-    (combined_data['Age'] >=5) ) |
-
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-     (combined_data['Testing Setting'].isin(['Malnutrition', 'Malnutrition Clinic'])) &
-    (combined_data['Modality'].isin(['Malnutrition', 'Malnutrition Clinic'])) &
-    (combined_data['Age'] >=5))
-    ) &
-
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-
-HTS_OtherPITC_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Others', 'FP', 'BloodBank','Blood Bank','Standalone', 'Standalone HTS', 'TB', 'Others (Specify)'])) &
-    (combined_data['Modality'].isin(['Other PITC']))) |
-
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['TB'])) &
-    (combined_data['Modality'].isin(['TB_STAT/OtherPITC']))) |
-
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-     (combined_data['Testing Setting'].isin(['Pediatrics <5 Clinic', 'Pediatric'])) &
-    (combined_data['Modality'].isin(['Pediatrics <5 Clinic', 'Pediatric'])) &
-    (combined_data['Age'] >=5) ) |
-
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-     (combined_data['Testing Setting'].isin(['Malnutrition', 'Malnutrition Clinic'])) &
-    (combined_data['Modality'].isin(['Malnutrition', 'Malnutrition Clinic'])) &
-    (combined_data['Age'] >=5))
-    ) &
-
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_Pediatric = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Pediatrics <5 Clinic', 'Pediatric'])) &
-    (combined_data['Modality'].isin(['Pediatrics <5 Clinic', 'Pediatric'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (combined_data['Age'] <5) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_Pediatric_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Pediatrics <5 Clinic', 'Pediatric'])) &
-    (combined_data['Modality'].isin(['Pediatrics <5 Clinic', 'Pediatric'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (combined_data['Age'] <5) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_Pediatric_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Pediatrics <5 Clinic', 'Pediatric'])) &
-    (combined_data['Modality'].isin(['Pediatrics <5 Clinic', 'Pediatric'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (combined_data['Age'] <5) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-PMTCT_ANC = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['ANC', 'Spoke health facility'])) &
-    (combined_data['Modality'].isin(['PMTCT (ANC1 Only)']))) |
-     ((combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['Congregational setting', 'Delivery homes','TBA Orthodx', 'TBA Orthodox', 'TBA rt-HCW'])) &
-    (combined_data['Modality'].isin(['PMTCT (ANC1 Only)']))) 
-     )
-     &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-PMTCT_ANC_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['ANC', 'Spoke health facility'])) &
-    (combined_data['Modality'].isin(['PMTCT (ANC1 Only)']))) |
-
-     ((combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['Congregational setting', 'Delivery homes','TBA Orthodx', 'TBA Orthodox', 'TBA rt-HCW' ])) &
-    (combined_data['Modality'].isin(['PMTCT (ANC1 Only)']))) 
-     )
-     &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-PMTCT_ANC_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (
-    ((combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['ANC', 'Spoke health facility'])) &
-    (combined_data['Modality'].isin(['PMTCT (ANC1 Only)']))) |
-     ((combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['Congregational setting', 'Delivery homes','TBA Orthodx', 'TBA Orthodox','TBA rt-HCW' ])) &
-    (combined_data['Modality'].isin(['PMTCT (ANC1 Only)']))) 
-     )
-     &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_PMTCT_Post_ANC1_Breastfeeding = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Post Natal Ward/Breastfeeding'])) &
-    (combined_data['Modality'].isin(['PMTCT (Post ANC1: Breastfeeding)'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative','Negetive', 'Positive'])) &
-    (combined_data['Sex'] == 'Female') &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_PMTCT_Post_ANC1_Breastfeeding_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Post Natal Ward/Breastfeeding'])) &
-    (combined_data['Modality'].isin(['PMTCT (Post ANC1: Breastfeeding)'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative'])) &
-    (combined_data['Sex'] == 'Female') &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_PMTCT_Post_ANC1_Breastfeeding_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['Post Natal Ward/Breastfeeding'])) &
-    (combined_data['Modality'].isin(['PMTCT (Post ANC1: Breastfeeding)'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (combined_data['Sex'] == 'Female') &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_TST_PMTCT_PostANC1_Pregnant_Labour_and_Delivery = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['L&D', 'Retesting'])) &  
-    (combined_data['Modality'].isin(['PMTCT (Post ANC1: Pregnancy/L&D)'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Positive'])) &
-    (combined_data['Sex'] == 'Female') &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['L&D', 'Retesting'])) & #, Retesting'
-    (combined_data['Modality'].isin(['PMTCT (Post ANC1: Pregnancy/L&D)'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (combined_data['Sex'] == 'Female') &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['L&D', 'Retesting'])) &  #, Retesting'
-    (combined_data['Modality'].isin(['PMTCT (Post ANC1: Pregnancy/L&D)'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (combined_data['Sex'] == 'Female') &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_SNS = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['SNS'])) &
-    (combined_data['Modality'].isin(['SNS'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_SNS_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['SNS'])) &
-    (combined_data['Modality'].isin(['SNS'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_SNS_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['SNS'])) &
-    (combined_data['Modality'].isin(['SNS'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_TST_SNSMod = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['SNS'])) &
-    (combined_data['Modality'].isin(['SNS'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive','Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_SNSMod_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['SNS'])) &
-    (combined_data['Modality'].isin(['SNS'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_SNSMod_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['SNS'])) &
-    (combined_data['Modality'].isin(['SNS'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_STI = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['STI'])) &
-    (combined_data['Modality'].isin(['STI'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_STI_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['STI'])) &
-    (combined_data['Modality'].isin(['STI'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_STI_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['STI'])) &
-    (combined_data['Modality'].isin(['STI'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_VCT = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['CT'])) &
-    (combined_data['Modality'].isin(['VCT', 'CT'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_VCT_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['CT'])) &
-    (combined_data['Modality'].isin(['VCT', 'CT'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_VCT_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['CT'])) &
-    (combined_data['Modality'].isin(['VCT', 'CT'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_TST_PrEP = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['PrEP Testing'])) &
-    (combined_data['Modality'].isin(['PrEP_CT HTS'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-HTS_PrEP_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['PrEP Testing'])) &
-    (combined_data['Modality'].isin(['PrEP_CT HTS'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-HTS_PrEP_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['PrEP Testing'])) &
-    (combined_data['Modality'].isin(['PrEP_CT HTS'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
+# Numeric fields, converted with pd.to_numeric as each extract is read
+numeric_columns = ['Age']
+
+# Columns read from the extracts: the facility keys, the date/numeric columns above and every
+# column the indicators below filter on. All other columns are skipped when the files are read.
+required_columns = ['Facility', 'Facility Id (Datim)'] + date_columns + numeric_columns + [
+    'Entry Point',
+    'Testing Setting',
+    'Modality',
+    'Final HIV Test Result',
+    'Sex'
+]
+
+# Low-cardinality columns loaded as categoricals (each distinct value is stored once and the
+# indicator filters compare integer codes instead of strings)
+categorical_columns = [
+    'Sex',
+    'Entry Point',
+    'Testing Setting',
+    'Modality',
+    'Final HIV Test Result'
+]
+
+# HTS modality of a test: (modality, Entry Point values, Testing Setting values, Modality values, extra condition).
+# The rules do not overlap, so each test gets at most one modality. The extra condition is one of the
+# row flags built in classify_hts_modality ('Under 5', '5 and above', 'Female').
+hts_modality_rules = [
+    ('Emergency', ['Facility'], ['Emergency'], ['Emergency'], None),
+    ('Index', ['Facility', 'Community'], ['Index'], ['Index'], None),
+    ('Inpatient', ['Facility'], ['Inpatient', 'Ward/Inpatient', 'Ward'], ['Inpatient'], None),
+    ('Malnutrition', ['Facility'], ['Malnutrition', 'Malnutrition Clinic'], ['Malnutrition', 'Malnutrition Clinic'], 'Under 5'),
+    ('MobileMod', ['Community'], ['Outreach'], ['Mobile'], None),
+    ('OtherMod', ['Community'], ['Others', 'Standalone', 'Standalone HTS', 'OVC'], ['Other Community Platforms'], None), #, 'Outreach (Community)', 'Outreach' / 'Other (Community)'
+    ('OtherPITC', ['Facility'], ['Others', 'FP', 'BloodBank', 'Standalone', 'Standalone HTS', 'TB', 'Others (Specify)'], ['Other PITC'], None),
+    ('OtherPITC', ['Facility'], ['TB'], ['TB_STAT/OtherPITC'], None),
+    ('OtherPITC', ['Facility'], ['Pediatrics <5 Clinic', 'Pediatric'], ['Pediatrics <5 Clinic', 'Pediatric'], '5 and above'),
+    ('OtherPITC', ['Facility'], ['Malnutrition', 'Malnutrition Clinic'], ['Malnutrition', 'Malnutrition Clinic'], '5 and above'),
+    # 'Blood Bank' (with a space) only counts towards HTS_OtherPITC_Positive
+    ('OtherPITC (Blood Bank)', ['Facility'], ['Blood Bank'], ['Other PITC'], None),
+    ('Pediatric', ['Facility'], ['Pediatrics <5 Clinic', 'Pediatric'], ['Pediatrics <5 Clinic', 'Pediatric'], 'Under 5'),
+    ('PMTCT_ANC', ['Facility'], ['ANC', 'Spoke health facility'], ['PMTCT (ANC1 Only)'], None),
+    ('PMTCT_ANC', ['Community'], ['Congregational setting', 'Delivery homes', 'TBA Orthodx', 'TBA Orthodox', 'TBA rt-HCW'], ['PMTCT (ANC1 Only)'], None),
+    ('PMTCT_Post_ANC1_Breastfeeding', ['Facility'], ['Post Natal Ward/Breastfeeding'], ['PMTCT (Post ANC1: Breastfeeding)'], 'Female'),
+    ('PMTCT_PostANC1_Pregnant_Labour_and_Delivery', ['Facility'], ['L&D', 'Retesting'], ['PMTCT (Post ANC1: Pregnancy/L&D)'], 'Female'),
+    ('SNS', ['Facility'], ['SNS'], ['SNS'], None),
+    ('SNSMod', ['Community'], ['SNS'], ['SNS'], None),
+    ('STI', ['Facility'], ['STI'], ['STI'], None),
+    ('VCT', ['Facility'], ['CT'], ['VCT', 'CT'], None),
+    ('PrEP', ['Facility'], ['PrEP Testing'], ['PrEP_CT HTS'], None),
+    ('TB', ['Facility'], ['TB'], ['TB'], None),
+    ('VCTMod', ['Community'], ['CT'], ['VCT'], None),
+]
+
+# Final HIV Test Result values counted by the indicators
+negative_or_positive = ['Negative', 'Positive']
+any_result = ['Negative', 'Negetive', 'Positive']
+negative = ['Negative']
+negative_any_spelling = ['Negative', 'Negetive']
+positive = ['Positive']
+
+# Modality indicators: (indicator, modalities, Final HIV Test Result values)
+hts_modality_indicators = [
+    ('HTS_TST_Emergency', ['Emergency'], negative_or_positive),
+    ('HTS_Emergency_Negative', ['Emergency'], negative),
+    ('HTS_Emergency_Positive', ['Emergency'], positive),
+    ('HTS_TST_Index', ['Index'], negative_or_positive),
+    ('HTS_Index_Negative', ['Index'], negative_any_spelling),
+    ('HTS_Index_Positive', ['Index'], positive),
+    ('HTS_TST_Inpatient', ['Inpatient'], negative_or_positive),
+    ('HTS_Inpatient_Negative', ['Inpatient'], negative),
+    ('HTS_Inpatient_Positive', ['Inpatient'], positive),
+    ('HTS_TST_Malnutrition', ['Malnutrition'], negative_or_positive),
+    ('HTS_Malnutrition_Negative', ['Malnutrition'], negative),
+    ('HTS_Malnutrition_Positive', ['Malnutrition'], positive),
+    ('HTS_TST_MobileMod', ['MobileMod'], any_result),
+    ('HTS_MobileMod_Negative', ['MobileMod'], negative_any_spelling),
+    ('HTS_MobileMod_Positive', ['MobileMod'], positive),
+    ('HTS_TST_OtherMod', ['OtherMod'], negative_or_positive),
+    ('HTS_OtherMod_Negative', ['OtherMod'], negative_any_spelling),
+    ('HTS_OtherMod_Positive', ['OtherMod'], positive),
+    ('HTS_TST_OtherPITC', ['OtherPITC'], negative_or_positive),
+    ('HTS_OtherPITC_Negative', ['OtherPITC'], negative_any_spelling),
+    ('HTS_OtherPITC_Positive', ['OtherPITC', 'OtherPITC (Blood Bank)'], positive),
+    ('HTS_TST_Pediatric', ['Pediatric'], any_result),
+    ('HTS_Pediatric_Negative', ['Pediatric'], negative_any_spelling),
+    ('HTS_Pediatric_Positive', ['Pediatric'], positive),
+    ('PMTCT_ANC', ['PMTCT_ANC'], any_result),
+    ('PMTCT_ANC_Negative', ['PMTCT_ANC'], negative_any_spelling),
+    ('PMTCT_ANC_Positive', ['PMTCT_ANC'], positive),
+    ('HTS_TST_PMTCT_Post_ANC1_Breastfeeding', ['PMTCT_Post_ANC1_Breastfeeding'], any_result),
+    ('HTS_PMTCT_Post_ANC1_Breastfeeding_Negative', ['PMTCT_Post_ANC1_Breastfeeding'], negative),
+    ('HTS_PMTCT_Post_ANC1_Breastfeeding_Positive', ['PMTCT_Post_ANC1_Breastfeeding'], positive),
+    ('HTS_TST_PMTCT_PostANC1_Pregnant_Labour_and_Delivery', ['PMTCT_PostANC1_Pregnant_Labour_and_Delivery'], negative_or_positive),
+    ('HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Negative', ['PMTCT_PostANC1_Pregnant_Labour_and_Delivery'], negative_any_spelling),
+    ('HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Positive', ['PMTCT_PostANC1_Pregnant_Labour_and_Delivery'], positive),
+    ('HTS_TST_SNS', ['SNS'], any_result),
+    ('HTS_SNS_Negative', ['SNS'], negative_any_spelling),
+    ('HTS_SNS_Positive', ['SNS'], positive),
+    ('HTS_TST_SNSMod', ['SNSMod'], any_result),
+    ('HTS_SNSMod_Negative', ['SNSMod'], negative_any_spelling),
+    ('HTS_SNSMod_Positive', ['SNSMod'], positive),
+    ('HTS_TST_STI', ['STI'], any_result),
+    ('HTS_STI_Negative', ['STI'], negative_any_spelling),
+    ('HTS_STI_Positive', ['STI'], positive),
+    ('HTS_TST_VCT', ['VCT'], any_result),
+    ('HTS_VCT_Negative', ['VCT'], negative_any_spelling),
+    ('HTS_VCT_Positive', ['VCT'], positive),
+    ('HTS_TST_PrEP', ['PrEP'], any_result),
+    ('HTS_PrEP_Negative', ['PrEP'], negative_any_spelling),
+    ('HTS_PrEP_Positive', ['PrEP'], positive),
+    ('HTS_TST_TB', ['TB'], any_result),
+    ('HTS_TB_Negative', ['TB'], negative_any_spelling),
+    ('HTS_TB_Positive', ['TB'], positive),
+    ('HTS_TST_VCTMod', ['VCTMod'], any_result),
+    ('HTS_VCTMod_Negative', ['VCTMod'], negative_any_spelling),
+    ('HTS_VCTMod_Positive', ['VCTMod'], positive),
+]
+
+# Column order of the output
+summary_indicators = [
+    # 'HTS_TST',
+    'HTS_TST_Emergency',
+    'HTS_Emergency_Negative',
+    'HTS_Emergency_Positive',
+    'HTS_TST_Index',
+    'HTS_Index_Negative',
+    'HTS_Index_Positive',
+    'HTS_TST_Inpatient',
+    'HTS_Inpatient_Negative',
+    'HTS_Inpatient_Positive',
+    'HTS_TST_Malnutrition',
+    'HTS_Malnutrition_Negative',
+    'HTS_Malnutrition_Positive',
+    'HTS_TST_MobileMod',
+    'HTS_MobileMod_Negative',
+    'HTS_MobileMod_Positive',
+    'HTS_TST_OtherMod',
+    'HTS_OtherMod_Negative',
+    'HTS_OtherMod_Positive',
+    'HTS_TST_OtherPITC',
+    'HTS_OtherPITC_Negative',
+    'HTS_OtherPITC_Positive',
+    'HTS_TST_Pediatric',
+    'HTS_Pediatric_Negative',
+    'HTS_Pediatric_Positive',
+    'PMTCT_ANC',
+    'PMTCT_ANC_Negative',
+    'PMTCT_ANC_Positive',
+    'HTS_TST_PMTCT_Post_ANC1_Breastfeeding',
+    'HTS_PMTCT_Post_ANC1_Breastfeeding_Negative',
+    'HTS_PMTCT_Post_ANC1_Breastfeeding_Positive',
+    'HTS_TST_PMTCT_PostANC1_Pregnant_Labour_and_Delivery',
+    'HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Negative',
+    'HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Positive',
+    'HTS_TST_SNS',
+    'HTS_SNS_Negative',
+    'HTS_SNS_Positive',
+    'HTS_TST_SNSMod',
+    'HTS_SNSMod_Negative',
+    'HTS_SNSMod_Positive',
+    'HTS_TST_STI',
+    'HTS_STI_Negative',
+    'HTS_STI_Positive',
+    'HTS_TST_TB',
+    'HTS_TB_Negative',
+    'HTS_TB_Positive',
+    'HTS_TST_TB',
+    'HTS_TB_Negative',
+    'HTS_TB_Positive',
+    'HTS_TST_VCTMod',
+    'HTS_VCTMod_Negative',
+    'HTS_VCTMod_Positive',
+    'HTS_TST_VCT',
+    'HTS_VCT_Negative',
+    'HTS_VCT_Positive',
+    'Setting_no_Modality',
+    'Blank_Entry_Point',
+]
+
+
+def classify_hts_modality(tests):
+    """
+    Returns the 'HTS Modality' of distinct (Entry Point, Testing Setting, Modality, Under 5, 5 and above,
+    Female) combinations under hts_modality_rules, NaN when no rule applies.
+    """
+    conditions = []
+    for modality, entry_points, settings, modalities, extra in hts_modality_rules:
+        condition = (
+            (tests['Entry Point'].isin(entry_points)) &
+            (tests['Testing Setting'].isin(settings)) &
+            (tests['Modality'].isin(modalities))
+        )
+        if extra is not None:
+            condition &= tests[extra]
+        conditions.append(condition.to_numpy())
+    labels = [rule[0] for rule in hts_modality_rules]
+    hts_modality = np.select(conditions, labels, default=None)
+    return pd.DataFrame({'HTS Modality': pd.Categorical(hts_modality, categories=list(dict.fromkeys(labels)))})
+
+
+
+# Date that puts a row in a reporting period: every indicator below only counts the rows whose test date falls in the
+# period, so a trend run counts all of its periods in one grouped reduction by this date (see count_trend), with
+# Start_of_quarter/End_of_quarter holding the bounds of each row's own period
+period_date_column = 'Date Of HIV Testing (yyyy-mm-dd)'
+
+
+# Indicator filters of one reporting period (Start_of_quarter to End_of_quarter): the tests counted by
+# the modality indicators and the (name, mask) pair of every other indicator. Only reads combined_data,
+# so it can be called once per period of a trend run.
+def period_indicators(combined_data, Start_of_quarter, End_of_quarter):
+    # Tests counted by the indicators: tested within the quarter, with Sex and Age recorded
+    tested_in_quarter = (
+        (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
+        (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
+        (~combined_data['Sex'].isna()) &
+        (~combined_data['Age'].isna()) &
+         (combined_data['Age'] != '')
+    )
+
+
+    Blank_Entry_Point = (
+        (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
+        (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
+        (combined_data['Entry Point'].isna()) &
+        (~combined_data['Sex'].isna()) &
+        (~combined_data['Age'].isna()) &
+         (combined_data['Age'] != '')
+    )
+
+
+    Setting_no_Modality = (
+        (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
+        (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
+        (~combined_data['Testing Setting'].isna()) &
+        (combined_data['Modality'].isna()) &
+        (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
+        (~combined_data['Sex'].isna()) &
+        (~combined_data['Age'].isna()) &
+         (combined_data['Age'] != '')
+    )
+
+
+    # The remaining indicators are boolean row masks, counted per facility at once
+    indicators = [
+        ('Setting_no_Modality', Setting_no_Modality),
+        ('Blank_Entry_Point', Blank_Entry_Point),
+    ]
+    return tested_in_quarter, indicators
+
+
+# Pivots of the indicators of the output (in summary_indicators order) counted per group of keys, from the
+# tests and indicator masks of period_indicators. With by (see mer_disaggregation), the same counts split by
+# age band and Sex are returned along with them.
+def summary_pivots(combined_data, tested_in_quarter, indicators, keys, by=None):
+    indicator_names = [name for name, modalities, results in hts_modality_indicators] + [name for name, mask in indicators]
+    if by is None:
+        pivots_by_name = dict(zip(indicator_names,
+                                  count_matrix(combined_data, keys, tested_in_quarter, 'HTS Modality', 'Final HIV Test Result',
+                                               hts_modality_indicators) +
+                                  count_indicators(combined_data, indicators, keys)))
+        return [pivots_by_name[name] for name in summary_indicators]
+
+    # The same grouped sums, also split by age band and Sex (the facility totals are summed from them)
+    modality_pivots, modality_disaggregates = count_matrix(combined_data, keys, tested_in_quarter, 'HTS Modality',
+                                                           'Final HIV Test Result', hts_modality_indicators, by=by)
+    mask_pivots, mask_disaggregates = count_indicators(combined_data, indicators, keys, by=by)
+    pivots_by_name = dict(zip(indicator_names, modality_pivots + mask_pivots))
+    return ([pivots_by_name[name] for name in summary_indicators],
+            pd.concat([modality_disaggregates, mask_disaggregates], ignore_index=True))
+
+
+# Reads the extracts of all_files into one DataFrame, validated and with the HTS modality of every test
+def load_files(all_files):
+    # Combine all files into one DataFrame (files are parsed by ingest_workers processes, or taken from the
+    # cache, with the date/numeric columns already converted, and concatenated once)
+    # State/LGA are only read for the rollups, and only from the files that have them
+    rollup_columns = rollup_geography_columns if include_rollups else []
+    combined_data = load_extracts(all_files, workers=ingest_workers, date_columns=date_columns, numeric_columns=numeric_columns, usecols=required_columns,
+                                  categorical_columns=categorical_columns + rollup_columns, cache_dir=cache_dir,
+                                  optional_columns=rollup_columns)
+
+    if combined_data.empty:
+        print("No valid files found or data could not be combined.")
+        exit()
 
+    # Extract project name from the 'Filename' column
+    # IMPORTANT: Ensure 'Filename' column exists before attempting to split
+    if 'Filename' not in combined_data.columns:
+        print("FATAL ERROR: 'Filename' column is missing from the combined data. Cannot extract ProjectName.")
+        exit()
 
-HTS_TST_TB = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['TB'])) &
-    (combined_data['Modality'].isin(['TB'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
+    combined_data['ProjectName'] = combined_data['Filename'].str.split('_').str[0]
 
+    # Every column the indicators need must be present in at least one input file
+    missing_columns = [col for col in required_columns if col not in combined_data.columns]
+    if missing_columns:
+        print(f"FATAL ERROR: Required column(s) missing from all input files: {missing_columns}")
+        exit()
 
-HTS_TB_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['TB'])) &
-    (combined_data['Modality'].isin(['TB'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
+    # --- Robust column validation ---
+    # Check if 'ProjectName' and 'Facility' columns exist and are not entirely empty
+    required_cols_for_aggregation = ['ProjectName', 'Facility', 'Facility Id (Datim)']
+    for col in required_cols_for_aggregation:
+        if col not in combined_data.columns:
+            print(f"FATAL ERROR: Required column '{col}' is missing from the combined data.")
+            if col == 'ProjectName':
+                print("This usually means the 'Filename' column couldn't be processed to extract ProjectName.")
+                print(f"First 5 filenames: {combined_data['Filename'].head().tolist()}")
+            exit()
+
+        # Convert to string and handle potential NaNs before further processing
+        # Stored as a categorical of strings: same values as astype(str), so missing values become 'nan'
+        combined_data[col] = as_key_category(combined_data[col])
+
+        if (combined_data[col] == 'UNKNOWN').all():
+            print(f"Warning: Column '{col}' is entirely 'UNKNOWN' (or NaN in original data). This might affect grouping and filtering.")
+        elif combined_data[col].nunique() == 1 and combined_data[col].iloc[0] == 'UNKNOWN':
+             print(f"Warning: Column '{col}' contains only 'UNKNOWN' values. This might indicate an issue with data extraction or input.")
+
+    # --- End of NEW column validation ---
+
+
+    # Blank and unparseable dates, counted per column and facility (the rows themselves only go to
+    # invalid_dates_sample_path)
+    report_date_quality(combined_data, date_columns, ['ProjectName', 'Facility', 'Facility Id (Datim)'], invalid_dates_sample_path)
+
+
+    # HTS modality of every test, classified once per distinct combination of the columns the rules use
+    modality_columns = pd.DataFrame({
+        'Entry Point': combined_data['Entry Point'],
+        'Testing Setting': combined_data['Testing Setting'],
+        'Modality': combined_data['Modality'],
+        'Under 5': combined_data['Age'] <5,
+        '5 and above': combined_data['Age'] >=5,
+        'Female': combined_data['Sex'] == 'Female',
+    })
+    combined_data['HTS Modality'] = apply_distinct(modality_columns, classify_hts_modality)['HTS Modality']
+    return combined_data
+
+
+# Reads every CSV/Excel extract in folder (see load_files)
+def load(folder):
+    return load_files(list_input_files(folder))
+
+
+# tested_in_quarter and the indicators of period_indicators for period, a (start, end) pair of dates, or the
+# quarter in Defining Periods when None
+def period_masks(combined_data, period=None):
+    if period is None:
+        with stage('indicator masks'):
+            return period_indicators(combined_data, Start_of_quarter, End_of_quarter)
+    label, start, end = parse_periods([period])[0]
+    with stage('indicator masks'):
+        return period_indicators(combined_data, start, end)
+
+
+# The (name, mask) of every indicator of the output for period (see period_masks), in the order of its columns,
+# the modality indicators included (the filters equivalence.py counts the legacy way). As in summary_indicators,
+# the TB masks stand in for the PrEP ones.
+def indicator_masks(combined_data, period=None):
+    tested_in_quarter, indicators = period_masks(combined_data, period)
+    tested_in_quarter = as_mask(tested_in_quarter)
+    masks = dict(indicators)
+    for name, modalities, results in hts_modality_indicators:
+        masks[name] = (tested_in_quarter &
+                       as_mask(combined_data['HTS Modality'].isin(modalities)) &
+                       as_mask(combined_data['Final HIV Test Result'].isin(results)))
+    return [(name, masks[name]) for name in summary_indicators]
+
+
+# Facility counts of every indicator over combined_data (from load) for period, a (start, end) pair of dates,
+# or the quarter in Defining Periods when None. The same table as the main output, without the rollups.
+def aggregate(combined_data, period=None):
+    keys = ['ProjectName', 'Facility', 'Facility Id (Datim)']
+    tested_in_quarter, indicators = period_masks(combined_data, period)
+    return assemble_counts(combined_data[keys].drop_duplicates(), summary_pivots(combined_data, tested_in_quarter, indicators, keys), keys)
+
+
+# Saves the facility counts (and their rollups) to output_path (output_file_path when None). geography holds
+# the rollup columns of every facility (see facility_geography), None to only total by project and nationally.
+def save_report(master_aggregated_df, geography=None, output_path=None):
+    output_path = output_path or output_file_path
+
+    # Create the Excel writer object
+    with stage('write report'), pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+        if not master_aggregated_df.empty:
+            # Sort the DataFrame for better readability in the final output
+            master_aggregated_df.sort_values(by=['ProjectName', 'Facility','Facility Id (Datim)'], inplace=True)
+
+            # Save the entire master aggregated data to a single sheet
+            sheet_name = 'Facility_Aggregates'
+            master_aggregated_df.to_excel(writer, sheet_name=sheet_name, index=False)
+            print(f"All aggregated data saved to a single sheet '{sheet_name}'.")
+        else:
+            print("Master aggregated DataFrame is empty. No data will be saved.")
+
+        # LGA, State, project and national totals, summed from the facility rows
+        if include_rollups and not master_aggregated_df.empty:
+            rollups = rollup_counts(master_aggregated_df, ['ProjectName', 'Facility', 'Facility Id (Datim)'], geography)
+            rollups.to_excel(writer, sheet_name=ROLLUP_SHEET, index=False)
+            print(f"Totals by {', '.join(rollups['Level'].unique())} saved to sheet '{ROLLUP_SHEET}'.")
+
+    print(f"Analysis complete. Results saved to: {output_path}")
+
+
+# Incremental run (see incremental): only the files changed since the last run are read and counted, per
+# file, and the stored counts of every file are added up into the facility counts
+def run_incremental(all_files):
+    skipped = [name for name, setting in [('line_list_indicators', line_list_indicators),
+                                          ('disaggregate_by_age_sex', disaggregate_by_age_sex),
+                                          ('trend_periods', trend_periods),
+                                          ('keep_daily_index', keep_daily_index),
+                                          ('rollup_geography_columns', include_rollups and rollup_geography_columns)] if setting]
+    if skipped:
+        print(f"Warning: {', '.join(skipped)} need every row and are ignored in incremental mode.")
+
+    keys = ['ProjectName', 'Facility', 'Facility Id (Datim)']
+    # The stored counts depend on the indicator filters, on everything load_files derives their columns with (the
+    # columns read and converted, the cleaners and classifiers, flags such as age cut-offs) and on the period, not
+    # on the settings only used after loading (line lists, trend, ...), which can change without a recount
+    fingerprint = run_fingerprint([period_indicators, summary_pivots, load_files], Start_of_quarter, End_of_quarter)
+    partials = PartialCounts(cache_dir, 'hts', fingerprint)
+    changed = partials.changed_files(all_files)
+    if changed:
+        combined_data = load_files(changed)
+        with stage('indicator masks'):
+            tested_in_quarter, indicators = period_indicators(combined_data, Start_of_quarter, End_of_quarter)
+        # Counted per file as well, so the counts of every file are kept apart
+        partials.update(combined_data, summary_pivots(combined_data, tested_in_quarter, indicators, ['Filename'] + keys), keys, changed)
+
+    save_report(partials.combine(keys))
+
+
+# Runs the whole aggregation. Kept behind the __main__ guard so that the worker
+# processes used for reading the extracts can import this script safely.
+def main():
+    # List all CSV/Excel extracts in the input folder
+    all_files = list_input_files(folder_path)
+
+    if incremental:
+        if cache_dir is not None:
+            run_incremental(all_files)
+            return
+        print("Warning: incremental needs a cache_dir to keep the counts of every file in. Every file is read and counted.")
+
+    combined_data = load_files(all_files)
+
+    # Daily index of the tests with Sex and Age recorded (see keep_daily_index)
+    if keep_daily_index:
+        if cache_dir is None:
+            print("Warning: keep_daily_index needs a cache_dir to store the index in. No daily index is built.")
+        else:
+            build_daily_index(combined_data, all_files, cache_dir, 'hts', 'Date Of HIV Testing (yyyy-mm-dd)',
+                              ['ProjectName', 'Facility', 'Facility Id (Datim)'], ['HTS Modality', 'Final HIV Test Result'],
+                              row_filter=(~combined_data['Sex'].isna()) & (~combined_data['Age'].isna()),
+                              definition=source_fingerprint([load_files], include_values=True))
 
-HTS_TB_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Facility'])) &
-    (combined_data['Testing Setting'].isin(['TB'])) &
-    (combined_data['Modality'].isin(['TB'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
 
+    # Indicator filters of the quarter defined at the top of the file
+    with stage('indicator masks'):
+        tested_in_quarter, indicators = period_indicators(combined_data, Start_of_quarter, End_of_quarter)
 
-HTS_TST_VCTMod = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['CT'])) &
-    (combined_data['Modality'].isin(['VCT'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
+    keys = ['ProjectName', 'Facility', 'Facility Id (Datim)']
 
+    # All modality indicators come from one groupby over facility, HTS modality and test result
+    if disaggregate_by_age_sex:
+        all_pivots_for_summary, disaggregates = summary_pivots(combined_data, tested_in_quarter, indicators, keys,
+                                                               by=mer_disaggregation(combined_data))
+        save_disaggregates(disaggregates, keys, disaggregates_output_path, wide=disaggregates_wide_sheet)
+    else:
+        all_pivots_for_summary = summary_pivots(combined_data, tested_in_quarter, indicators, keys)
+
+    # Line lists (the matching rows) are only built for the indicators listed in line_list_indicators
+    line_list_masks = [(name, lambda modalities=modalities, results=results: tested_in_quarter &
+                        combined_data['HTS Modality'].isin(modalities) & combined_data['Final HIV Test Result'].isin(results))
+                       for name, modalities, results in hts_modality_indicators] + indicators
+    save_line_lists(combined_data, line_list_masks, line_list_indicators, line_list_output_path)
+
+    # Get all unique combinations of ProjectName and Facility from the original combined data
+    # This ensures all facilities are represented, even if they have no metrics for a pivot
+    if not combined_data.empty:
+        unique_project_facility_combinations = combined_data[['ProjectName', 'Facility','Facility Id (Datim)']].drop_duplicates()
+    else:
+        unique_project_facility_combinations = pd.DataFrame(columns=['ProjectName', 'Facility', 'Facility Id (Datim)'])
 
-HTS_VCTMod_Negative = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['CT'])) &
-    (combined_data['Modality'].isin(['VCT'])) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
+    # Put all calculated pivots next to the facilities in one keyed step
+    master_aggregated_df = assemble_counts(unique_project_facility_combinations, all_pivots_for_summary,
+                                           ['ProjectName', 'Facility', 'Facility Id (Datim)'])
 
-HTS_VCTMod_Positive = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isin(['Community'])) &
-    (combined_data['Testing Setting'].isin(['CT'])) &
-    (combined_data['Modality'].isin(['VCT'])) &
-    (combined_data['Final HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
+    # State/LGA of every facility for the rollups, where the extracts have them
+    geography = [col for col in rollup_geography_columns if include_rollups and col in combined_data.columns]
+    save_report(master_aggregated_df, facility_geography(combined_data, keys, geography) if geography else None)
 
+    # Trend mode: the same indicators for every period of trend_periods, counted from the data loaded above
+    if trend_periods:
+        def count_period(start, end, keys):
+            return summary_pivots(combined_data, *period_indicators(combined_data, start, end), keys)
 
-Blank_Entry_Point = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Entry Point'].isna()) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
+        save_trend(count_trend(unique_project_facility_combinations, keys, trend_periods, count_period,
+                               data=combined_data, period_dates=period_date_column), trend_output_path)
 
 
-Setting_no_Modality = combined_data[
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['Date Of HIV Testing (yyyy-mm-dd)'] <= End_of_quarter) &
-    (~combined_data['Testing Setting'].isna()) &
-    (combined_data['Modality'].isna()) &
-    (combined_data['Final HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
 
+    hts_columns = ['Entry Point','Testing Setting', 'Modality', 'Date Of HIV Testing (yyyy-mm-dd)', 'Facility']
+    if all(col in combined_data.columns for col in hts_columns):
+        cutoff_date = Start_of_quarter   #pd.to_datetime('2025-06-30')
+        filtered_data = combined_data[combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= cutoff_date].copy()
+        hts_setting_df = filtered_data[hts_columns].copy()
+        distinct_hts_setting_df = hts_setting_df.drop_duplicates()
 
-# Pivot_data function to group by 'ProjectName' AND 'Facility'
-# This ensures we can later filter by project but still have facility-level aggregates
-def pivot_data(data, value_name):
-    # Ensure the data passed to pivot_data has the required columns
-    for col in ['ProjectName', 'Facility','Facility Id (Datim)']:
-        if col not in data.columns:
-            print(f"Error: '{col}' not found in data passed to pivot_data. Skipping pivot.")
-            return pd.DataFrame(columns=['ProjectName', 'Facility', 'Facility Id (Datim)', value_name]) # Return empty DataFrame
-
-    return data.groupby(['ProjectName', 'Facility', 'Facility Id (Datim)']).size().reset_index(name=value_name)
-
-# Apply the pivot, aggregated by ProjectName and Facility
-# HTS_TST_pivot = pivot_data(HTS_TST, 'HTS_TST')
-HTS_TST_Emergency_pivot = pivot_data(HTS_TST_Emergency, 'HTS_TST_Emergency')
-HTS_Emergency_Negative_pivot = pivot_data(HTS_Emergency_Negative, 'HTS_Emergency_Negative')
-HTS_Emergency_Positive_pivot = pivot_data(HTS_Emergency_Positive, 'HTS_Emergency_Positive')
-HTS_TST_Index_pivot = pivot_data(HTS_TST_Index, 'HTS_TST_Index')
-HTS_Index_Negative_pivot = pivot_data(HTS_TST_Index_Negative, 'HTS_Index_Negative')
-HTS_Index_Positive_pivot = pivot_data(HTS_TST_Index_Positive, 'HTS_Index_Positive')
-HTS_TST_Inpatient_pivot = pivot_data(HTS_TST_Inpatient, 'HTS_TST_Inpatient')
-HTS_Inpatient_Negative_pivot = pivot_data(HTS_Inpatient_Negative, 'HTS_Inpatient_Negative')
-HTS_Inpatient_Positive_pivot = pivot_data(HTS_Inpatient_Positive, 'HTS_Inpatient_Positive')
-HTS_TST_Malnutrition_pivot = pivot_data(HTS_TST_Malnutrition, 'HTS_TST_Malnutrition')
-HTS_Malnutrition_Negative_pivot = pivot_data(HTS_Malnutrition_Negative, 'HTS_Malnutrition_Negative')
-HTS_Malnutrition_Positive_pivot = pivot_data(HTS_Malnutrition_Positive, 'HTS_Malnutrition_Positive')
-HTS_TST_MobileMod_pivot = pivot_data(HTS_TST_MobileMod, 'HTS_TST_MobileMod')
-HTS_MobileMod_Negative_pivot = pivot_data(HTS_MobileMod_Negative, 'HTS_MobileMod_Negative')
-HTS_MobileMod_Positive_pivot = pivot_data(HTS_MobileMod_Positive, 'HTS_MobileMod_Positive')
-HTS_TST_OtherMod_pivot = pivot_data(HTS_TST_OtherMod, 'HTS_TST_OtherMod')
-HTS_OtherMod_Negative_pivot = pivot_data(HTS_OtherMod_Negative, 'HTS_OtherMod_Negative')
-HTS_OtherMod_Positive_pivot = pivot_data(HTS_OtherMod_Positive, 'HTS_OtherMod_Positive')
-HTS_TST_OtherPITC_pivot = pivot_data(HTS_TST_OtherPITC, 'HTS_TST_OtherPITC')
-HTS_OtherPITC_Negative_pivot = pivot_data(HTS_OtherPITC_Negative, 'HTS_OtherPITC_Negative')
-HTS_OtherPITC_Positive_pivot = pivot_data(HTS_OtherPITC_Positive, 'HTS_OtherPITC_Positive')
-HTS_TST_Pediatric_pivot = pivot_data(HTS_TST_Pediatric, 'HTS_TST_Pediatric')
-HTS_Pediatric_Negative_pivot = pivot_data(HTS_Pediatric_Negative, 'HTS_Pediatric_Negative')
-HTS_Pediatric_Positive_pivot = pivot_data(HTS_Pediatric_Positive, 'HTS_Pediatric_Positive')
-PMTCT_ANC_pivot = pivot_data(PMTCT_ANC, 'PMTCT_ANC')
-PMTCT_ANC_Negative_pivot = pivot_data(PMTCT_ANC_Negative, 'PMTCT_ANC_Negative')
-PMTCT_ANC_Positive_pivot = pivot_data(PMTCT_ANC_Positive, 'PMTCT_ANC_Positive')
-HTS_TST_PMTCT_Post_ANC1_Breastfeeding_pivot = pivot_data(HTS_TST_PMTCT_Post_ANC1_Breastfeeding, 'HTS_TST_PMTCT_Post_ANC1_Breastfeeding')
-HTS_PMTCT_Post_ANC1_Breastfeeding_Negative_pivot = pivot_data(HTS_PMTCT_Post_ANC1_Breastfeeding_Negative, 'HTS_PMTCT_Post_ANC1_Breastfeeding_Negative')
-HTS_PMTCT_Post_ANC1_Breastfeeding_Positive_pivot = pivot_data(HTS_PMTCT_Post_ANC1_Breastfeeding_Positive, 'HTS_PMTCT_Post_ANC1_Breastfeeding_Positive')
-HTS_TST_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_pivot = pivot_data(HTS_TST_PMTCT_PostANC1_Pregnant_Labour_and_Delivery, 'HTS_TST_PMTCT_PostANC1_Pregnant_Labour_and_Delivery')
-HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Negative_pivot = pivot_data(HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Negative, 'HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Negative')
-HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Positive_pivot = pivot_data(HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Positive, 'HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Positive')
-HTS_TST_SNS_pivot = pivot_data(HTS_TST_SNS, 'HTS_TST_SNS')
-HTS_SNS_Negative_pivot = pivot_data(HTS_SNS_Negative, 'HTS_SNS_Negative')
-HTS_SNS_Positive_pivot = pivot_data(HTS_SNS_Positive, 'HTS_SNS_Positive')
-HTS_TST_SNSMod_pivot = pivot_data(HTS_TST_SNSMod, 'HTS_TST_SNSMod')
-HTS_SNSMod_Negative_pivot = pivot_data(HTS_SNSMod_Negative, 'HTS_SNSMod_Negative')
-HTS_SNSMod_Positive_pivot = pivot_data(HTS_SNSMod_Positive, 'HTS_SNSMod_Positive')
-HTS_TST_STI_pivot = pivot_data(HTS_TST_STI, 'HTS_TST_STI')
-HTS_STI_Negative_pivot = pivot_data(HTS_STI_Negative, 'HTS_STI_Negative')
-HTS_STI_Positive_pivot = pivot_data(HTS_STI_Positive, 'HTS_STI_Positive')
-HTS_TST_TB_pivot = pivot_data(HTS_TST_TB, 'HTS_TST_TB')
-HTS_TB_Negative_pivot = pivot_data(HTS_TB_Negative, 'HTS_TB_Negative')
-HTS_TB_Positive_pivot = pivot_data(HTS_TB_Positive, 'HTS_TB_Positive')
-HTS_TST_PrEP_pivot = pivot_data(HTS_TST_TB, 'HTS_TST_TB')
-HTS_PrEP_Negative_pivot = pivot_data(HTS_TB_Negative, 'HTS_TB_Negative')
-HTS_PrEP_Positive_pivot = pivot_data(HTS_TB_Positive, 'HTS_TB_Positive')
-HTS_TST_VCTMod_pivot = pivot_data(HTS_TST_VCTMod, 'HTS_TST_VCTMod')
-HTS_VCTMod_Negative_pivot = pivot_data(HTS_VCTMod_Negative, 'HTS_VCTMod_Negative')
-HTS_VCTMod_Positive_pivot = pivot_data(HTS_VCTMod_Positive, 'HTS_VCTMod_Positive')
-HTS_TST_VCT_pivot = pivot_data(HTS_TST_VCT, 'HTS_TST_VCT')
-HTS_VCT_Negative_pivot = pivot_data(HTS_VCT_Negative, 'HTS_VCT_Negative')
-HTS_VCT_Positive_pivot = pivot_data(HTS_VCT_Positive, 'HTS_VCT_Positive')
-Setting_no_Modality_pivot = pivot_data(Setting_no_Modality, 'Setting_no_Modality')
-Blank_Entry_Point_pivot = pivot_data(Blank_Entry_Point, 'Blank_Entry_Point')
-
-
-# List of all pivots to be merged into the master summary DataFrame
-all_pivots_for_summary = [
-    HTS_TST_Emergency_pivot,
-    HTS_Emergency_Negative_pivot,
-    HTS_Emergency_Positive_pivot,
-    HTS_TST_Index_pivot,
-    HTS_Index_Negative_pivot,
-    HTS_Index_Positive_pivot,
-    HTS_TST_Inpatient_pivot,
-    HTS_Inpatient_Negative_pivot,
-    HTS_Inpatient_Positive_pivot,
-    HTS_TST_Malnutrition_pivot,
-    HTS_Malnutrition_Negative_pivot,
-    HTS_Malnutrition_Positive_pivot,
-    HTS_TST_MobileMod_pivot,
-    HTS_MobileMod_Negative_pivot,
-    HTS_MobileMod_Positive_pivot,
-    HTS_TST_OtherMod_pivot,
-    HTS_OtherMod_Negative_pivot,
-    HTS_OtherMod_Positive_pivot,
-    HTS_TST_OtherPITC_pivot,
-    HTS_OtherPITC_Negative_pivot,
-    HTS_OtherPITC_Positive_pivot,
-    HTS_TST_Pediatric_pivot,
-    HTS_Pediatric_Negative_pivot,
-    HTS_Pediatric_Positive_pivot,
-    PMTCT_ANC_pivot,
-    PMTCT_ANC_Negative_pivot,
-    PMTCT_ANC_Positive_pivot,
-    HTS_TST_PMTCT_Post_ANC1_Breastfeeding_pivot,
-    HTS_PMTCT_Post_ANC1_Breastfeeding_Negative_pivot,
-    HTS_PMTCT_Post_ANC1_Breastfeeding_Positive_pivot,
-    HTS_TST_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_pivot,
-    HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Negative_pivot,
-    HTS_PMTCT_PostANC1_Pregnant_Labour_and_Delivery_Positive_pivot,
-    HTS_TST_SNS_pivot ,
-    HTS_SNS_Negative_pivot,
-    HTS_SNS_Positive_pivot,
-    HTS_TST_SNSMod_pivot,
-    HTS_SNSMod_Negative_pivot,
-    HTS_SNSMod_Positive_pivot,
-    HTS_TST_STI_pivot,
-    HTS_STI_Negative_pivot,
-    HTS_STI_Positive_pivot,
-    HTS_TST_TB_pivot,
-    HTS_TB_Negative_pivot,
-    HTS_TB_Positive_pivot,
-    HTS_TST_PrEP_pivot,
-    HTS_PrEP_Negative_pivot,
-    HTS_PrEP_Positive_pivot,
-    HTS_TST_VCTMod_pivot,
-    HTS_VCTMod_Negative_pivot,
-    HTS_VCTMod_Positive_pivot,
-    HTS_TST_VCT_pivot,
-    HTS_VCT_Negative_pivot,
-    HTS_VCT_Positive_pivot,
-    Setting_no_Modality_pivot,
-    Blank_Entry_Point_pivot   
-    ] 
-
-# Get all unique combinations of ProjectName and Facility from the original combined data
-# This ensures all facilities are represented, even if they have no metrics for a pivot
-if not combined_data.empty:
-    unique_project_facility_combinations = combined_data[['ProjectName', 'Facility','Facility Id (Datim)']].drop_duplicates()
-else:
-    unique_project_facility_combinations = pd.DataFrame(columns=['ProjectName', 'Facility', 'Facility Id (Datim)'])
-
-# Initialize a master DataFrame that will contain all aggregated data (by ProjectName and Facility)
-master_aggregated_df = unique_project_facility_combinations.copy()
-
-# Merge all calculated pivots onto the master aggregated DataFrame
-for pivot_df in all_pivots_for_summary:
-    # Ensure pivot_df is not empty and has the keys before merging
-    if not pivot_df.empty and 'ProjectName' in pivot_df.columns and 'Facility' in pivot_df.columns:
-        master_aggregated_df = pd.merge(master_aggregated_df, pivot_df, 
-                                        on=['ProjectName', 'Facility', 'Facility Id (Datim)'], how='left')
-    else:
-        print(f"Warning: An aggregated pivot is empty or missing key columns (ProjectName/Facility/Datim Id) and will not be merged.")
-        
-# Create the Excel writer object
-with pd.ExcelWriter(output_file_path, engine='openpyxl') as writer:
-    if not master_aggregated_df.empty:
-        # Sort the DataFrame for better readability in the final output
-        master_aggregated_df.sort_values(by=['ProjectName', 'Facility','Facility Id (Datim)'], inplace=True)
-        
-        # Save the entire master aggregated data to a single sheet
-        sheet_name = 'Facility_Aggregates'
-        master_aggregated_df.to_excel(writer, sheet_name=sheet_name, index=False)
-        print(f"All aggregated data saved to a single sheet '{sheet_name}'.")
+        try:
+            distinct_hts_setting_df.to_excel(hts_setting_output_path, index=False)
+            print(f"\nSuccessfully saved distinct hts setting data to: {hts_setting_output_path}")
+        except Exception as e:
+            print(f"\nError saving hts setting data: {e}")
     else:
-        print("Master aggregated DataFrame is empty. No data will be saved.")
-
-print(f"Analysis complete. Results saved to: {output_file_path}")
-
-
+        print("\nWarning: 'Testing Setting' or 'Modality' column not found. Skipping hts setting data export.")
 
-hts_columns = ['Entry Point','Testing Setting', 'Modality', 'Date Of HIV Testing (yyyy-mm-dd)', 'Facility']
-if all(col in combined_data.columns for col in hts_columns):
-    cutoff_date = Start_of_quarter   #pd.to_datetime('2025-06-30')
-    filtered_data = combined_data[combined_data['Date Of HIV Testing (yyyy-mm-dd)'] >= cutoff_date].copy()
-    hts_setting_df = filtered_data[hts_columns].copy()
-    distinct_hts_setting_df = hts_setting_df.drop_duplicates()
 
-    try:
-        distinct_hts_setting_df.to_excel(hts_setting_output_path, index=False)
-        print(f"\nSuccessfully saved distinct hts setting data to: {hts_setting_output_path}")
-    except Exception as e:
-        print(f"\nError saving hts setting data: {e}")
-else:
-    print("\nWarning: 'Testing Setting' or 'Modality' column not found. Skipping hts setting data export.")
+if __name__ == '__main__':
+    if profile_run:
+        start_profile()
+    main()
+    if profile_run:
+        save_profile(output_file_path, script=os.path.basename(__file__))
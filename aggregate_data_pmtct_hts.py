@@ -4,12 +4,34 @@ from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 import re
 
+from date_quality import report_date_quality
+from incremental import PartialCounts, run_fingerprint
+from indicator_counts import assemble_counts, count_indicators, mer_disaggregation, save_disaggregates, save_line_lists
+from ingestion import list_input_files, load_extracts
+from profiling import save_profile, stage, start_profile
+from rollups import ROLLUP_SHEET, facility_geography, rollup_counts
+from schema import as_key_category
+from trend import count_trend, parse_periods, save_trend
+
 # Path to the directory containing the CSV files
 folder_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/HTS_IPP/pmtct_hts'
 
 # Output path for the final Excel file
 output_file_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/PMTCT_HTS_Aggregates by Facility_IP.xlsx'
 
+# Output path for the line lists of line_list_indicators
+line_list_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/PMTCT_HTS_Aggregates by Facility_IP_line_lists.xlsx'
+
+# Output path for the MER age/sex disaggregates (disaggregate_by_age_sex)
+disaggregates_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/PMTCT_HTS_Aggregates by Facility_IP_disaggregates.xlsx'
+
+# Output path for the trend of trend_periods
+trend_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/PMTCT_HTS_Aggregates by Facility_IP_trend.xlsx'
+
+# Workbook the blank and unparseable date counts per column and facility are saved to, with the first rows
+# holding a date that could not be read (see date_quality.py). None only prints the summary.
+invalid_dates_sample_path = None
+
 # Output path for troubleshooting HIV Testing Setting and Modality Output
 pmtct_setting_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Extracted_HTS_setting.xlsx'
 
@@ -17,335 +39,466 @@ pmtct_setting_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium I
 Start_of_quarter = pd.to_datetime('2025-07-01')
 End_of_quarter = pd.to_datetime('2025-09-30')
 
-# Combine all CSV files into one DataFrame, specifying 'latin1' encoding
-all_files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith(('.csv', '.xlsx', '.xls'))]
+# Number of worker processes used to read the extracts in parallel
+# (1 reads the files one after another, None uses one worker per CPU)
+ingest_workers = 1
+
+# Folder where the parsed extracts are cached between runs (None switches the cache off).
+# Files that have not changed since the last run are loaded from the cache instead of being parsed again.
+cache_dir = None
+
+# Indicators whose matching rows are also saved as line lists, one sheet per indicator
+# (e.g. ['PMTCT_ANC_Facility']). Left empty, only the facility counts are computed.
+line_list_indicators = []
+
+# Also count every indicator by MER fine age band (<1, 1-4, 5-9, ..., 65+), saved to disaggregates_output_path
+# as a long table (the PMTCT extracts have no Sex column, so there is no Sex split). With
+# disaggregates_wide_sheet, a second sheet holds one column per age band.
+disaggregate_by_age_sex = False
+disaggregates_wide_sheet = False
+
+# Also write the totals of the facility counts per LGA, State, project and nationally to a 'Rollups'
+# sheet of the output file. The LGA/State levels use rollup_geography_columns where the extracts have them.
+include_rollups = False
+rollup_geography_columns = ['State', 'LGA']
+
+# Trend mode: the (start, end) of every reporting period to count from the same extracts, e.g.
+# [('2024-10-01', '2024-12-31'), ('2025-01-01', '2025-03-31')]. The extracts are read once and the facility
+# counts of every period are saved to trend_output_path, one row per period and facility.
+trend_periods = []
+
+# Incremental mode (needs cache_dir): the facility counts of every input file are kept next to the cached
+# extracts, so a re-run only reads and counts the files that changed since the last run and adds up the
+# stored counts of the others. The line lists, disaggregates, trend, State/LGA rollups and the ANC setting
+# export need every row, so they are skipped in this mode.
+incremental = False
+
+# Save a profile of the run as JSON next to output_file_path (<name>_profile.json): the duration and peak memory
+# of every stage, i.e. reading and coercing each file, cleaning, the indicator masks, counting, assembling and
+# writing the output. Tracing the memory slows the run down somewhat, so it is off by default.
+profile_run = False
+
+# Date columns, converted to datetime format as each extract is read (invalid dates become NaT)
+date_columns = [
+    'Date Tested for HIV'
+]
 
-# Combine all files into one DataFrame
-combined_data = pd.DataFrame()
+# Numeric fields, converted with pd.to_numeric as each extract is read
+numeric_columns = ['Age']
 
-for file in all_files:
-    try:
-        if file.endswith('.csv'):
-            data = pd.read_csv(file, encoding='latin1', on_bad_lines='skip')
-        elif file.endswith('.xlsx'):
-            data = pd.read_excel(file, engine='openpyxl')
-        elif file.endswith('.xls'):
-            data = pd.read_excel(file)
-        else:
-            continue
-        
-        # Add Filename column
-        data['Filename'] = os.path.basename(file)
-        combined_data = pd.concat([combined_data, data], ignore_index=True)
-    except Exception as e:
-        print(f"Error processing file {file}: {e}")
-
-if combined_data.empty:
-    print("No valid files found or data could not be combined.")
-    exit()
-
-# Extract project name from the 'Filename' column
-# IMPORTANT: Ensure 'Filename' column exists before attempting to split
-if 'Filename' not in combined_data.columns:
-    print("FATAL ERROR: 'Filename' column is missing from the combined data. Cannot extract ProjectName.")
-    exit()
-
-combined_data['ProjectName'] = combined_data['Filename'].str.split('_').str[0]
-
-
-# Check if 'ProjectName' and 'Facility' columns exist and are not entirely empty
-required_cols_for_aggregation = ['ProjectName', 'Facility']
-for col in required_cols_for_aggregation:
-    if col not in combined_data.columns:
-        print(f"FATAL ERROR: Required column '{col}' is missing from the combined data.")
-        if col == 'ProjectName':
-            print("This usually means the 'Filename' column couldn't be processed to extract ProjectName.")
-            print(f"First 5 filenames: {combined_data['Filename'].head().tolist()}")
-        exit()
-    
-    # Convert to string and handle potential NaNs before further processing
-    combined_data[col] = combined_data[col].astype(str).fillna('UNKNOWN')
+# Columns read from the extracts: the facility keys, the date/numeric columns above and every
+# column the indicators below filter on. All other columns are skipped when the files are read.
+required_columns = ['Facility'] + date_columns + numeric_columns + [
+    'Point of Entry',
+    'ANC Setting',
+    'Modality',
+    'HIV Test Result'
+]
 
-    if (combined_data[col] == 'UNKNOWN').all():
-        print(f"Warning: Column '{col}' is entirely 'UNKNOWN' (or NaN in original data). This might affect grouping and filtering.")
-    elif combined_data[col].nunique() == 1 and combined_data[col].iloc[0] == 'UNKNOWN':
-         print(f"Warning: Column '{col}' contains only 'UNKNOWN' values. This might indicate an issue with data extraction or input.")
+# Low-cardinality columns loaded as categoricals (each distinct value is stored once and the
+# indicator filters compare integer codes instead of strings)
+categorical_columns = [
+    'Point of Entry',
+    'ANC Setting',
+    'Modality',
+    'HIV Test Result'
+]
 
 
 
-# Ensure date columns are in datetime format
-date_columns = [
-    'Date Tested for HIV'
-]
+# Date that puts a row in a reporting period: every indicator below only counts the rows whose test date falls in the
+# period, so a trend run counts all of its periods in one grouped reduction by this date (see count_trend), with
+# Start_of_quarter/End_of_quarter holding the bounds of each row's own period
+period_date_column = 'Date Tested for HIV'
+
+
+# Indicator filters of one reporting period (Start_of_quarter to End_of_quarter). Returns the (name, mask)
+# pair of every indicator, in the column order of the summary. Only reads combined_data, so it can be
+# called once per period of a trend run.
+def period_indicators(combined_data, Start_of_quarter, End_of_quarter):
+    PMTCT_ANC_Facility = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (combined_data['Point of Entry'].isin(['Facility'])) &
+        (combined_data['ANC Setting'].isin(['ANC', 'Spoke health facility', 'PMTCT (ANC1 Only)'])) &
+        (combined_data['Modality'].isin(['PMTCT (ANC1 Only)'])) &
+        (combined_data['HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
+        (~combined_data['Age'].isna()) &
+        (combined_data['Age'] != '')
+    )
+
+    PMTCT_ANC_Facility_Negative = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (combined_data['Point of Entry'].isin(['Facility'])) &
+        (combined_data['ANC Setting'].isin(['ANC', 'Spoke health facility', 'PMTCT (ANC1 Only)'])) &
+        (combined_data['Modality'].isin(['PMTCT (ANC1 Only)'])) &
+        (combined_data['HIV Test Result'].isin(['Negative', 'Negetive'])) &
+        (~combined_data['Age'].isna()) &
+        (combined_data['Age'] != '')
+    )
+
+    PMTCT_ANC_Facility_Positive = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (combined_data['Point of Entry'].isin(['Facility'])) &
+        (combined_data['ANC Setting'].isin(['ANC', 'Spoke health facility', 'PMTCT (ANC1 Only)'])) &
+        (combined_data['Modality'].isin(['PMTCT (ANC1 Only)'])) &
+        (combined_data['HIV Test Result'].isin(['Positive'])) &
+        (~combined_data['Age'].isna()) &
+        (combined_data['Age'] != '')
+    )
+
+
+    PMTCT_ANC_Community = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (combined_data['Point of Entry'].isin(['Community'])) &
+        (combined_data['ANC Setting'].isin(['Congregational setting', 'Delivery homes','TBA Orthodx', 'TBA Orthodox', 'TBA rt-HCW'])) &
+        (combined_data['Modality'].isin(['PMTCT (ANC1 Only)'])) &
+        (combined_data['HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
+        (~combined_data['Age'].isna()) &
+        (combined_data['Age'] != '')
+    )
+
+    PMTCT_ANC_Community_Negative = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (combined_data['Point of Entry'].isin(['Community'])) &
+        (combined_data['ANC Setting'].isin(['Congregational setting', 'Delivery homes','TBA Orthodx', 'TBA Orthodox', 'TBA rt-HCW'])) &
+        (combined_data['Modality'].isin(['PMTCT (ANC1 Only)'])) &
+        (combined_data['HIV Test Result'].isin(['Negative', 'Negetive'])) &
+        (~combined_data['Age'].isna()) &
+        (combined_data['Age'] != '')
+    )
+
+    PMTCT_ANC_Community_Positive = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (combined_data['Point of Entry'].isin(['Community'])) &
+        (combined_data['ANC Setting'].isin(['Congregational setting', 'Delivery homes','TBA Orthodx', 'TBA Orthodox', 'TBA rt-HCW'])) &
+        (combined_data['Modality'].isin(['PMTCT (ANC1 Only)'])) &
+        (combined_data['HIV Test Result'].isin(['Positive'])) &
+        (~combined_data['Age'].isna()) &
+        (combined_data['Age'] != '')
+    )
+
+
+    PMTCT_LD = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (combined_data['Point of Entry'].isin(['Facility'])) &
+        (combined_data['ANC Setting'].isin(['L&D'])) &
+        (combined_data['Modality'].isin(['PMTCT (Post ANC1: Pregnancy/L&D)'])) &
+        (combined_data['HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
+        (~combined_data['Age'].isna()) &
+        (combined_data['Age'] != '')
+    )
+
+    PMTCT_LD_Negative = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (combined_data['Point of Entry'].isin(['Facility'])) &
+        (combined_data['ANC Setting'].isin(['L&D'])) &
+        (combined_data['Modality'].isin(['PMTCT (Post ANC1: Pregnancy/L&D)'])) &
+        (combined_data['HIV Test Result'].isin(['Negative', 'Negetive'])) &
+        (~combined_data['Age'].isna()) &
+        (combined_data['Age'] != '')
+    )
+
+    PMTCT_LD_Positive = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (combined_data['Point of Entry'].isin(['Facility'])) &
+        (combined_data['ANC Setting'].isin(['L&D'])) &
+        (combined_data['Modality'].isin(['PMTCT (Post ANC1: Pregnancy/L&D)'])) &
+        (combined_data['HIV Test Result'].isin(['Positive'])) &
+        (~combined_data['Age'].isna()) &
+        (combined_data['Age'] != '')
+    )
+
+
+    PMTCT_Breastfeeding = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (combined_data['Point of Entry'].isin(['Facility'])) &
+        (combined_data['ANC Setting'].isin(['Post Natal Ward/Breastfeeding'])) &
+        (combined_data['Modality'].isin(['PMTCT (Post ANC1: Breastfeeding)'])) &
+        (combined_data['HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
+        (~combined_data['Age'].isna()) &
+        (combined_data['Age'] != '')
+    )
+
+    PMTCT_Breastfeeding_Negative = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (combined_data['Point of Entry'].isin(['Facility'])) &
+        (combined_data['ANC Setting'].isin(['Post Natal Ward/Breastfeeding'])) &
+        (combined_data['Modality'].isin(['PMTCT (Post ANC1: Breastfeeding)'])) &
+        (combined_data['HIV Test Result'].isin(['Negative', 'Negetive'])) &
+        (~combined_data['Age'].isna()) &
+        (combined_data['Age'] != '')
+    )
+
+    PMTCT_Breastfeeding_Positive = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (combined_data['Point of Entry'].isin(['Facility'])) &
+        (combined_data['ANC Setting'].isin(['Post Natal Ward/Breastfeeding'])) &
+        (combined_data['Modality'].isin(['PMTCT (Post ANC1: Breastfeeding)'])) &
+        (combined_data['HIV Test Result'].isin(['Positive'])) &
+        (~combined_data['Age'].isna()) &
+        (combined_data['Age'] != '')
+    )
+
+
+
+    Setting_no_Modality = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (~combined_data['ANC Setting'].isna()) &
+        (combined_data['Modality'].isna()) &
+        (combined_data['HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
+        (~combined_data['Age'].isna()) &
+         (combined_data['Age'] != '')
+    )
+
+    Modality_no_Setting = (
+        (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
+        (combined_data['Date Tested for HIV'] <= End_of_quarter) &
+        (combined_data['ANC Setting'].isna()) &
+        (~combined_data['Modality'].isna()) &
+        (combined_data['HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
+        (~combined_data['Age'].isna()) &
+         (combined_data['Age'] != '')
+    )
+
+
+
+    # Every indicator is a boolean row mask; all of them are counted per facility at once
+    # (one grouped sum over the masks), in the column order of the summary below
+    indicators = [
+        ('PMTCT_ANC_Facility', PMTCT_ANC_Facility),
+        ('PMTCT_ANC_Facility_Negative', PMTCT_ANC_Facility_Negative),
+        ('PMTCT_ANC_Facility_Positive', PMTCT_ANC_Facility_Positive),
+        ('PMTCT_ANC_Community', PMTCT_ANC_Community),
+        ('PMTCT_ANC_Community_Negative', PMTCT_ANC_Community_Negative),
+        ('PMTCT_ANC_Community_Positive', PMTCT_ANC_Community_Positive),
+        ('PMTCT_Breastfeeding', PMTCT_Breastfeeding),
+        ('PMTCT_Breastfeeding_Negative', PMTCT_Breastfeeding_Negative),
+        ('PMTCT_Breastfeeding_Positive', PMTCT_Breastfeeding_Positive),
+        ('PMTCT_LD', PMTCT_LD),
+        ('PMTCT_LD_Negative', PMTCT_LD_Negative),
+        ('PMTCT_LD_Positive', PMTCT_LD_Positive),
+        ('Setting_no_Modality', Setting_no_Modality),
+        ('Modality_no_Setting', Modality_no_Setting),
+    ]
+    return indicators
+
+
+# Reads the extracts of all_files into one validated DataFrame
+def load_files(all_files):
+    # Combine all files into one DataFrame (files are parsed by ingest_workers processes, or taken from the
+    # cache, with the date/numeric columns already converted, and concatenated once)
+    # State/LGA are only read for the rollups, and only from the files that have them
+    rollup_columns = rollup_geography_columns if include_rollups else []
+    combined_data = load_extracts(all_files, workers=ingest_workers, date_columns=date_columns, numeric_columns=numeric_columns, usecols=required_columns,
+                                  categorical_columns=categorical_columns + rollup_columns, cache_dir=cache_dir,
+                                  optional_columns=rollup_columns)
+
+    if combined_data.empty:
+        print("No valid files found or data could not be combined.")
+        exit()
 
-for col in date_columns:
-    combined_data[col] = pd.to_datetime(combined_data[col], errors='coerce')
+    # Extract project name from the 'Filename' column
+    # IMPORTANT: Ensure 'Filename' column exists before attempting to split
+    if 'Filename' not in combined_data.columns:
+        print("FATAL ERROR: 'Filename' column is missing from the combined data. Cannot extract ProjectName.")
+        exit()
 
-# Check for invalid dates
-invalid_dates = combined_data[date_columns].isnull().any(axis=1)
-if invalid_dates.any():
-    print(f"Warning: Invalid dates found in the following rows:\n{combined_data[invalid_dates]}")
+    combined_data['ProjectName'] = combined_data['Filename'].str.split('_').str[0]
 
-# Ensure Numeric field is numeric
-combined_data['Age'] = pd.to_numeric(combined_data['Age'], errors='coerce')
+    # Every column the indicators need must be present in at least one input file
+    missing_columns = [col for col in required_columns if col not in combined_data.columns]
+    if missing_columns:
+        print(f"FATAL ERROR: Required column(s) missing from all input files: {missing_columns}")
+        exit()
 
 
+    # Check if 'ProjectName' and 'Facility' columns exist and are not entirely empty
+    required_cols_for_aggregation = ['ProjectName', 'Facility']
+    for col in required_cols_for_aggregation:
+        if col not in combined_data.columns:
+            print(f"FATAL ERROR: Required column '{col}' is missing from the combined data.")
+            if col == 'ProjectName':
+                print("This usually means the 'Filename' column couldn't be processed to extract ProjectName.")
+                print(f"First 5 filenames: {combined_data['Filename'].head().tolist()}")
+            exit()
 
-PMTCT_ANC_Facility = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (combined_data['Point of Entry'].isin(['Facility'])) &
-    (combined_data['ANC Setting'].isin(['ANC', 'Spoke health facility', 'PMTCT (ANC1 Only)'])) &
-    (combined_data['Modality'].isin(['PMTCT (ANC1 Only)'])) &
-    (combined_data['HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Age'].isna()) &
-    (combined_data['Age'] != '')
-]
+        # Convert to string and handle potential NaNs before further processing
+        # Stored as a categorical of strings: same values as astype(str), so missing values become 'nan'
+        combined_data[col] = as_key_category(combined_data[col])
 
-PMTCT_ANC_Facility_Negative = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (combined_data['Point of Entry'].isin(['Facility'])) &
-    (combined_data['ANC Setting'].isin(['ANC', 'Spoke health facility', 'PMTCT (ANC1 Only)'])) &
-    (combined_data['Modality'].isin(['PMTCT (ANC1 Only)'])) &
-    (combined_data['HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Age'].isna()) &
-    (combined_data['Age'] != '')
-]
+        if (combined_data[col] == 'UNKNOWN').all():
+            print(f"Warning: Column '{col}' is entirely 'UNKNOWN' (or NaN in original data). This might affect grouping and filtering.")
+        elif combined_data[col].nunique() == 1 and combined_data[col].iloc[0] == 'UNKNOWN':
+             print(f"Warning: Column '{col}' contains only 'UNKNOWN' values. This might indicate an issue with data extraction or input.")
 
-PMTCT_ANC_Facility_Positive = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (combined_data['Point of Entry'].isin(['Facility'])) &
-    (combined_data['ANC Setting'].isin(['ANC', 'Spoke health facility', 'PMTCT (ANC1 Only)'])) &
-    (combined_data['Modality'].isin(['PMTCT (ANC1 Only)'])) &
-    (combined_data['HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Age'].isna()) &
-    (combined_data['Age'] != '')
-]
 
 
-PMTCT_ANC_Community = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (combined_data['Point of Entry'].isin(['Community'])) &
-    (combined_data['ANC Setting'].isin(['Congregational setting', 'Delivery homes','TBA Orthodx', 'TBA Orthodox', 'TBA rt-HCW'])) &
-    (combined_data['Modality'].isin(['PMTCT (ANC1 Only)'])) &
-    (combined_data['HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Age'].isna()) &
-    (combined_data['Age'] != '')
-]
+    # Blank and unparseable dates, counted per column and facility (the rows themselves only go to
+    # invalid_dates_sample_path)
+    report_date_quality(combined_data, date_columns, ['ProjectName', 'Facility'], invalid_dates_sample_path)
+    return combined_data
 
-PMTCT_ANC_Community_Negative = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (combined_data['Point of Entry'].isin(['Community'])) &
-    (combined_data['ANC Setting'].isin(['Congregational setting', 'Delivery homes','TBA Orthodx', 'TBA Orthodox', 'TBA rt-HCW'])) &
-    (combined_data['Modality'].isin(['PMTCT (ANC1 Only)'])) &
-    (combined_data['HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Age'].isna()) &
-    (combined_data['Age'] != '')
-]
 
-PMTCT_ANC_Community_Positive = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (combined_data['Point of Entry'].isin(['Community'])) &
-    (combined_data['ANC Setting'].isin(['Congregational setting', 'Delivery homes','TBA Orthodx', 'TBA Orthodox', 'TBA rt-HCW'])) &
-    (combined_data['Modality'].isin(['PMTCT (ANC1 Only)'])) &
-    (combined_data['HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Age'].isna()) &
-    (combined_data['Age'] != '')
-]
+# Reads every CSV/Excel extract in folder (see load_files)
+def load(folder):
+    return load_files(list_input_files(folder))
 
 
-PMTCT_LD = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (combined_data['Point of Entry'].isin(['Facility'])) &
-    (combined_data['ANC Setting'].isin(['L&D'])) &
-    (combined_data['Modality'].isin(['PMTCT (Post ANC1: Pregnancy/L&D)'])) &
-    (combined_data['HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Age'].isna()) &
-    (combined_data['Age'] != '')
-]
+# The (name, mask) of every indicator of the output for period, a (start, end) pair of dates, or the quarter in
+# Defining Periods when None, in the order of its columns (the filters equivalence.py counts the legacy way)
+def indicator_masks(combined_data, period=None):
+    if period is None:
+        with stage('indicator masks'):
+            return period_indicators(combined_data, Start_of_quarter, End_of_quarter)
+    label, start, end = parse_periods([period])[0]
+    with stage('indicator masks'):
+        return period_indicators(combined_data, start, end)
 
-PMTCT_LD_Negative = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (combined_data['Point of Entry'].isin(['Facility'])) &
-    (combined_data['ANC Setting'].isin(['L&D'])) &
-    (combined_data['Modality'].isin(['PMTCT (Post ANC1: Pregnancy/L&D)'])) &
-    (combined_data['HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Age'].isna()) &
-    (combined_data['Age'] != '')
-]
 
-PMTCT_LD_Positive = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (combined_data['Point of Entry'].isin(['Facility'])) &
-    (combined_data['ANC Setting'].isin(['L&D'])) &
-    (combined_data['Modality'].isin(['PMTCT (Post ANC1: Pregnancy/L&D)'])) &
-    (combined_data['HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Age'].isna()) &
-    (combined_data['Age'] != '')
-]
+# Facility counts of every indicator over combined_data (from load) for period, a (start, end) pair of dates,
+# or the quarter in Defining Periods when None. The same table as the main output, without the rollups.
+def aggregate(combined_data, period=None):
+    keys = ['ProjectName', 'Facility']
+    indicators = indicator_masks(combined_data, period)
+    return assemble_counts(combined_data[keys].drop_duplicates(), count_indicators(combined_data, indicators, keys), keys)
 
 
-PMTCT_Breastfeeding = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (combined_data['Point of Entry'].isin(['Facility'])) &
-    (combined_data['ANC Setting'].isin(['Post Natal Ward/Breastfeeding'])) &
-    (combined_data['Modality'].isin(['PMTCT (Post ANC1: Breastfeeding)'])) &
-    (combined_data['HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Age'].isna()) &
-    (combined_data['Age'] != '')
-]
+# Saves the facility counts (and their rollups) to output_path (output_file_path when None). geography holds
+# the rollup columns of every facility (see facility_geography), None to only total by project and nationally.
+def save_report(master_aggregated_df, geography=None, output_path=None):
+    output_path = output_path or output_file_path
 
-PMTCT_Breastfeeding_Negative = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (combined_data['Point of Entry'].isin(['Facility'])) &
-    (combined_data['ANC Setting'].isin(['Post Natal Ward/Breastfeeding'])) &
-    (combined_data['Modality'].isin(['PMTCT (Post ANC1: Breastfeeding)'])) &
-    (combined_data['HIV Test Result'].isin(['Negative', 'Negetive'])) &
-    (~combined_data['Age'].isna()) &
-    (combined_data['Age'] != '')
-]
+    # Create the Excel writer object
+    with stage('write report'), pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+        if not master_aggregated_df.empty:
+            # Sort the DataFrame for better readability in the final output
+            master_aggregated_df.sort_values(by=['ProjectName', 'Facility'], inplace=True)
 
-PMTCT_Breastfeeding_Positive = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (combined_data['Point of Entry'].isin(['Facility'])) &
-    (combined_data['ANC Setting'].isin(['Post Natal Ward/Breastfeeding'])) &
-    (combined_data['Modality'].isin(['PMTCT (Post ANC1: Breastfeeding)'])) &
-    (combined_data['HIV Test Result'].isin(['Positive'])) &
-    (~combined_data['Age'].isna()) &
-    (combined_data['Age'] != '')
-]
+            # Save the entire master aggregated data to a single sheet
+            sheet_name = 'Facility_Aggregates'
+            master_aggregated_df.to_excel(writer, sheet_name=sheet_name, index=False)
+            print(f"All aggregated data saved to a single sheet '{sheet_name}'.")
+        else:
+            print("Master aggregated DataFrame is empty. No data will be saved.")
+
+        # LGA, State, project and national totals, summed from the facility rows
+        if include_rollups and not master_aggregated_df.empty:
+            rollups = rollup_counts(master_aggregated_df, ['ProjectName', 'Facility'], geography)
+            rollups.to_excel(writer, sheet_name=ROLLUP_SHEET, index=False)
+            print(f"Totals by {', '.join(rollups['Level'].unique())} saved to sheet '{ROLLUP_SHEET}'.")
+
+    print(f"Analysis complete. Results saved to: {output_path}")
+
+
+# Incremental run (see incremental): only the files changed since the last run are read and counted, per
+# file, and the stored counts of every file are added up into the facility counts
+def run_incremental(all_files):
+    skipped = [name for name, setting in [('line_list_indicators', line_list_indicators),
+                                          ('disaggregate_by_age_sex', disaggregate_by_age_sex),
+                                          ('trend_periods', trend_periods),
+                                          ('rollup_geography_columns', include_rollups and rollup_geography_columns)] if setting]
+    if skipped:
+        print(f"Warning: {', '.join(skipped)} need every row and are ignored in incremental mode.")
+
+    keys = ['ProjectName', 'Facility']
+    # The stored counts depend on the indicator filters, on everything load_files derives their columns with (the
+    # columns read and converted, the cleaners and classifiers, flags such as age cut-offs) and on the period, not
+    # on the settings only used after loading (line lists, trend, ...), which can change without a recount
+    partials = PartialCounts(cache_dir, 'pmtct', run_fingerprint([period_indicators, load_files], Start_of_quarter, End_of_quarter))
+    changed = partials.changed_files(all_files)
+    if changed:
+        combined_data = load_files(changed)
+        # Counted per file as well, so the counts of every file are kept apart
+        partials.update(combined_data, count_indicators(combined_data, period_indicators(combined_data, Start_of_quarter, End_of_quarter),
+                                                        ['Filename'] + keys), keys, changed)
+
+    save_report(partials.combine(keys))
+
+
+# Runs the whole aggregation. Kept behind the __main__ guard so that the worker
+# processes used for reading the extracts can import this script safely.
+def main():
+    # List all CSV/Excel extracts in the input folder
+    all_files = list_input_files(folder_path)
+
+    if incremental:
+        if cache_dir is not None:
+            run_incremental(all_files)
+            return
+        print("Warning: incremental needs a cache_dir to keep the counts of every file in. Every file is read and counted.")
+
+    combined_data = load_files(all_files)
+
+    # Indicator filters of the quarter defined at the top of the file
+    with stage('indicator masks'):
+        indicators = period_indicators(combined_data, Start_of_quarter, End_of_quarter)
+    if disaggregate_by_age_sex:
+        # The same grouped sum, also split by age band (the facility totals are summed from it)
+        all_pivots_for_summary, disaggregates = count_indicators(combined_data, indicators, ['ProjectName', 'Facility'],
+                                                                 by=mer_disaggregation(combined_data))
+        save_disaggregates(disaggregates, ['ProjectName', 'Facility'], disaggregates_output_path, wide=disaggregates_wide_sheet)
+    else:
+        all_pivots_for_summary = count_indicators(combined_data, indicators, ['ProjectName', 'Facility'])
 
+    # Line lists (the matching rows) are only built for the indicators listed in line_list_indicators
+    save_line_lists(combined_data, indicators, line_list_indicators, line_list_output_path)
 
+    # Get all unique combinations of ProjectName and Facility from the original combined data
+    # This ensures all facilities are represented, even if they have no metrics for a pivot
+    if not combined_data.empty:
+        unique_project_facility_combinations = combined_data[['ProjectName', 'Facility']].drop_duplicates()
+    else:
+        unique_project_facility_combinations = pd.DataFrame(columns=['ProjectName', 'Facility'])
 
-Setting_no_Modality = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (~combined_data['ANC Setting'].isna()) &
-    (combined_data['Modality'].isna()) &
-    (combined_data['HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
+    # Put all calculated pivots next to the facilities in one keyed step
+    master_aggregated_df = assemble_counts(unique_project_facility_combinations, all_pivots_for_summary,
+                                           ['ProjectName', 'Facility'])
 
-Modality_no_Setting = combined_data[
-    (combined_data['Date Tested for HIV'] >= Start_of_quarter) &
-    (combined_data['Date Tested for HIV'] <= End_of_quarter) &
-    (combined_data['ANC Setting'].isna()) &
-    (~combined_data['Modality'].isna()) &
-    (combined_data['HIV Test Result'].isin(['Negative', 'Negetive', 'Positive'])) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
+    # State/LGA of every facility for the rollups, where the extracts have them
+    geography = [col for col in rollup_geography_columns if include_rollups and col in combined_data.columns]
+    save_report(master_aggregated_df, facility_geography(combined_data, ['ProjectName', 'Facility'], geography) if geography else None)
 
+    # Trend mode: the same indicators for every period of trend_periods, counted from the data loaded above
+    if trend_periods:
+        trend = count_trend(unique_project_facility_combinations, ['ProjectName', 'Facility'], trend_periods,
+                            lambda start, end, keys: count_indicators(combined_data, period_indicators(combined_data, start, end), keys),
+                            data=combined_data, period_dates=period_date_column)
+        save_trend(trend, trend_output_path)
 
 
-# Pivot_data function to group by 'ProjectName' AND 'Facility'
-# This ensures we can later filter by project but still have facility-level aggregates
-def pivot_data(data, value_name):
-    # Ensure the data passed to pivot_data has the required columns
-    for col in ['ProjectName', 'Facility']:
-        if col not in data.columns:
-            print(f"Error: '{col}' not found in data passed to pivot_data. Skipping pivot.")
-            return pd.DataFrame(columns=['ProjectName', 'Facility', value_name]) # Return empty DataFrame
-
-    return data.groupby(['ProjectName', 'Facility']).size().reset_index(name=value_name)
-
-# Apply the pivot, aggregated by ProjectName and Facility
-PMTCT_ANC_Facility_pivot = pivot_data(PMTCT_ANC_Facility, 'PMTCT_ANC_Facility')
-PMTCT_ANC_Facility_Negative_pivot = pivot_data(PMTCT_ANC_Facility_Negative, 'PMTCT_ANC_Facility_Negative')
-PMTCT_ANC_Facility_Positive_pivot = pivot_data(PMTCT_ANC_Facility_Positive, 'PMTCT_ANC_Facility_Positive')
-PMTCT_ANC_Community_pivot = pivot_data(PMTCT_ANC_Community, 'PMTCT_ANC_Community')
-PMTCT_ANC_Community_Negative_pivot = pivot_data(PMTCT_ANC_Community_Negative, 'PMTCT_ANC_Community_Negative')
-PMTCT_ANC_Community_Positive_pivot = pivot_data(PMTCT_ANC_Community_Positive, 'PMTCT_ANC_Community_Positive')
-PMTCT_Breastfeeding_pivot = pivot_data(PMTCT_Breastfeeding, 'PMTCT_Breastfeeding')
-PMTCT_Breastfeeding_Negative_pivot = pivot_data(PMTCT_Breastfeeding_Negative, 'PMTCT_Breastfeeding_Negative')
-PMTCT_Breastfeeding_Positive_pivot = pivot_data(PMTCT_Breastfeeding_Positive, 'PMTCT_Breastfeeding_Positive')
-PMTCT_LD_pivot = pivot_data(PMTCT_LD, 'PMTCT_LD')
-PMTCT_LD_Negative_pivot = pivot_data(PMTCT_LD_Negative, 'PMTCT_LD_Negative')
-PMTCT_LD_Positive_pivot = pivot_data(PMTCT_LD_Positive, 'PMTCT_LD_Positive')
-Setting_no_Modality_pivot = pivot_data(Setting_no_Modality, 'Setting_no_Modality')
-Modality_no_Setting_pivot = pivot_data(Modality_no_Setting, 'Modality_no_Setting')
-
-
-
-# List of all pivots to be merged into the master summary DataFrame
-all_pivots_for_summary = [
-    PMTCT_ANC_Facility_pivot,
-    PMTCT_ANC_Facility_Negative_pivot,
-    PMTCT_ANC_Facility_Positive_pivot,
-    PMTCT_ANC_Community_pivot,
-    PMTCT_ANC_Community_Negative_pivot,
-    PMTCT_ANC_Community_Positive_pivot,
-    PMTCT_Breastfeeding_pivot,
-    PMTCT_Breastfeeding_Negative_pivot,
-    PMTCT_Breastfeeding_Positive_pivot,
-    PMTCT_LD_pivot,
-    PMTCT_LD_Negative_pivot,
-    PMTCT_LD_Positive_pivot,
-    Setting_no_Modality_pivot,
-    Modality_no_Setting_pivot
-    ] 
-
-# Get all unique combinations of ProjectName and Facility from the original combined data
-# This ensures all facilities are represented, even if they have no metrics for a pivot
-if not combined_data.empty:
-    unique_project_facility_combinations = combined_data[['ProjectName', 'Facility']].drop_duplicates()
-else:
-    unique_project_facility_combinations = pd.DataFrame(columns=['ProjectName', 'Facility'])
-
-# Initialize a master DataFrame that will contain all aggregated data (by ProjectName and Facility)
-master_aggregated_df = unique_project_facility_combinations.copy()
-
-# Merge all calculated pivots onto the master aggregated DataFrame
-for pivot_df in all_pivots_for_summary:
-    # Ensure pivot_df is not empty and has the keys before merging
-    if not pivot_df.empty and 'ProjectName' in pivot_df.columns and 'Facility' in pivot_df.columns:
-        master_aggregated_df = pd.merge(master_aggregated_df, pivot_df, 
-                                        on=['ProjectName', 'Facility'], how='left')
-    else:
-        print(f"Warning: An aggregated pivot is empty or missing key columns (ProjectName/Facility) and will not be merged.")
-        
-
-
-# Create the Excel writer object
-with pd.ExcelWriter(output_file_path, engine='openpyxl') as writer:
-    if not master_aggregated_df.empty:
-        # Sort the DataFrame for better readability in the final output
-        master_aggregated_df.sort_values(by=['ProjectName', 'Facility'], inplace=True)
-        
-        # Save the entire master aggregated data to a single sheet
-        sheet_name = 'Facility_Aggregates'
-        master_aggregated_df.to_excel(writer, sheet_name=sheet_name, index=False)
-        print(f"All aggregated data saved to a single sheet '{sheet_name}'.")
-    else:
-        print("Master aggregated DataFrame is empty. No data will be saved.")
-
-print(f"Analysis complete. Results saved to: {output_file_path}")
 
+    pmtct_hts_columns = ['ANC Setting', 'Modality', 'Date Tested for HIV', 'Facility']
+    if all(col in combined_data.columns for col in pmtct_hts_columns):
+        cutoff_date = Start_of_quarter  #pd.to_datetime('2025-06-30')
+        filtered_data = combined_data[combined_data['Date Tested for HIV'] >= cutoff_date].copy()
+        pmtct_hts_setting_df = filtered_data[pmtct_hts_columns].copy()
+        distinct_pmtct_hts_setting_df = pmtct_hts_setting_df  #.drop_duplicates()
 
+        try:
+            distinct_pmtct_hts_setting_df.to_excel(pmtct_setting_output_path, index=False)
+            print(f"\nSuccessfully saved distinct hts setting data to: {pmtct_setting_output_path}")
+        except Exception as e:
+            print(f"\nError saving hts setting data: {e}")
+    else:
+        print("\nWarning: 'ANC Setting' or 'Modality' column not found. Skipping hts setting data export.")
 
-pmtct_hts_columns = ['ANC Setting', 'Modality', 'Date Tested for HIV', 'Facility']
-if all(col in combined_data.columns for col in pmtct_hts_columns):
-    cutoff_date = Start_of_quarter  #pd.to_datetime('2025-06-30')
-    filtered_data = combined_data[combined_data['Date Tested for HIV'] >= cutoff_date].copy()
-    pmtct_hts_setting_df = filtered_data[pmtct_hts_columns].copy()
-    distinct_pmtct_hts_setting_df = pmtct_hts_setting_df  #.drop_duplicates()
 
-    try:
-        distinct_pmtct_hts_setting_df.to_excel(pmtct_setting_output_path, index=False)
-        print(f"\nSuccessfully saved distinct hts setting data to: {pmtct_setting_output_path}")
-    except Exception as e:
-        print(f"\nError saving hts setting data: {e}")
-else:
-    print("\nWarning: 'ANC Setting' or 'Modality' column not found. Skipping hts setting data export.")
+if __name__ == '__main__':
+    if profile_run:
+        start_profile()
+    main()
+    if profile_run:
+        save_profile(output_file_path, script=os.path.basename(__file__))
@@ -4,329 +4,506 @@ from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 import re
 
+from date_quality import report_date_quality
+from incremental import PartialCounts, run_fingerprint
+from indicator_counts import assemble_counts, count_indicators, mer_disaggregation, save_disaggregates, save_line_lists
+from ingestion import list_input_files, load_extracts
+from profiling import save_profile, stage, start_profile
+from rollups import ROLLUP_SHEET, facility_geography, rollup_counts
+from schema import as_key_category
+from trend import count_trend, parse_periods, save_trend
+
 # Path to the directory containing the CSV files
 folder_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/FY26Q1_PrEP'
 
 # Define output directory for projects
 output_file_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/PrEP_Aggregate.xlsx'
 
-# Defining Periods
-Start_of_quarter = pd.to_datetime('2025-04-01')
-End_of_quarter = pd.to_datetime('2025-06-30')
-
-# Combine all CSV files into one DataFrame, specifying 'latin1' encoding
-all_files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith(('.csv', '.xlsx', '.xls'))]
+# Output path for the line lists of line_list_indicators
+line_list_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/PrEP_Aggregate_line_lists.xlsx'
 
-# Combine all files into one DataFrame
-combined_data = pd.DataFrame()
+# Output path for the MER age/sex disaggregates (disaggregate_by_age_sex)
+disaggregates_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/PrEP_Aggregate_disaggregates.xlsx'
 
-for file in all_files:
-    try:
-        if file.endswith('.csv'):
-            data = pd.read_csv(file, encoding='latin1', on_bad_lines='skip')
-        elif file.endswith('.xlsx'):
-            data = pd.read_excel(file, engine='openpyxl')
-        elif file.endswith('.xls'):
-            data = pd.read_excel(file)
-        else:
-            continue
-        
-        # Add Filename column
-        data['Filename'] = os.path.basename(file)
-        combined_data = pd.concat([combined_data, data], ignore_index=True)
-    except Exception as e:
-        print(f"Error processing file {file}: {e}")
-
-if combined_data.empty:
-    print("No valid files found or data could not be combined.")
-    exit()
-
-# Extract project name from the 'Filename' column
-# IMPORTANT: Ensure 'Filename' column exists before attempting to split
-if 'Filename' not in combined_data.columns:
-    print("FATAL ERROR: 'Filename' column is missing from the combined data. Cannot extract ProjectName.")
-    exit()
-
-combined_data['ProjectName'] = combined_data['Filename'].str.split('_').str[0]
-
-
-# Check if 'ProjectName' and 'Facility Name' columns exist and are not entirely empty
-required_cols_for_aggregation = ['ProjectName', 'Facility Name', 'Facility Id (Datim)']
-for col in required_cols_for_aggregation:
-    if col not in combined_data.columns:
-        print(f"FATAL ERROR: Required column '{col}' is missing from the combined data.")
-        if col == 'ProjectName':
-            print("This usually means the 'Filename' column couldn't be processed to extract ProjectName.")
-            print(f"First 5 filenames: {combined_data['Filename'].head().tolist()}")
-        exit()
-    
-    # Convert to string and handle potential NaNs before further processing
-    # This helps prevent type-related errors in groupby/merge
-    combined_data[col] = combined_data[col].astype(str).fillna('UNKNOWN')
+# Output path for the trend of trend_periods
+trend_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/PrEP_Aggregate_trend.xlsx'
 
-    if (combined_data[col] == 'UNKNOWN').all():
-        print(f"Warning: Column '{col}' is entirely 'UNKNOWN' (or NaN in original data). This might affect grouping and filtering.")
-    elif combined_data[col].nunique() == 1 and combined_data[col].iloc[0] == 'UNKNOWN':
-         print(f"Warning: Column '{col}' contains only 'UNKNOWN' values. This might indicate an issue with data extraction or input.")
+# Workbook the blank and unparseable date counts per column and facility are saved to, with the first rows
+# holding a date that could not be read (see date_quality.py). None only prints the summary.
+invalid_dates_sample_path = None
 
+# Defining Periods
+Start_of_quarter = pd.to_datetime('2025-04-01')
+End_of_quarter = pd.to_datetime('2025-06-30')
 
-# Ensure date columns are in datetime format
+# Number of worker processes used to read the extracts in parallel
+# (1 reads the files one after another, None uses one worker per CPU)
+ingest_workers = 1
+
+# Folder where the parsed extracts are cached between runs (None switches the cache off).
+# Files that have not changed since the last run are loaded from the cache instead of being parsed again.
+cache_dir = None
+
+# Indicators whose matching rows are also saved as line lists, one sheet per indicator
+# (e.g. ['PrEP_CT']). Left empty, only the facility counts are computed.
+line_list_indicators = []
+
+# Also count every indicator by MER fine age band (<1, 1-4, 5-9, ..., 65+) and Sex, saved to
+# disaggregates_output_path as a long table. With disaggregates_wide_sheet, a second sheet holds one
+# column per age band/Sex combination.
+disaggregate_by_age_sex = False
+disaggregates_wide_sheet = False
+
+# Also write the totals of the facility counts per LGA, State, project and nationally to a 'Rollups'
+# sheet of the output file. The LGA/State levels use rollup_geography_columns where the extracts have them.
+include_rollups = False
+rollup_geography_columns = ['State', 'LGA']
+
+# Trend mode: the (start, end) of every reporting period to count from the same extracts, e.g.
+# [('2024-10-01', '2024-12-31'), ('2025-01-01', '2025-03-31')]. The extracts are read once and the facility
+# counts of every period are saved to trend_output_path, one row per period and facility.
+trend_periods = []
+
+# Incremental mode (needs cache_dir): the facility counts of every input file are kept next to the cached
+# extracts, so a re-run only reads and counts the files that changed since the last run and adds up the
+# stored counts of the others. The line lists, disaggregates, trend and State/LGA rollups need every row,
+# so they are skipped in this mode.
+incremental = False
+
+# Save a profile of the run as JSON next to output_file_path (<name>_profile.json): the duration and peak memory
+# of every stage, i.e. reading and coercing each file, cleaning, the indicator masks, counting, assembling and
+# writing the output. Tracing the memory slows the run down somewhat, so it is off by default.
+profile_run = False
+
+# Date columns, converted to datetime format as each extract is read (invalid dates become NaT)
 date_columns = [
     'Date Of Commencement (yyyy-mm-dd)', 
     'Date Of Last Pickup (yyyy-mm-dd)'
 ]
-for col in date_columns:
-    combined_data[col] = pd.to_datetime(combined_data[col], errors='coerce')
-
-# Check for invalid dates
-invalid_dates = combined_data[date_columns].isnull().any(axis=1)
-if invalid_dates.any():
-    print(f"Warning: Invalid dates found in the following rows:\n{combined_data[invalid_dates]}")
-
-
-# Filters for PrEP_CT
-prep_ct = combined_data[
-    (combined_data['Date Of Commencement (yyyy-mm-dd)'] < Start_of_quarter) &
-    ((combined_data['Date Of Last Pickup (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Last Pickup (yyyy-mm-dd)'] <= End_of_quarter)) &  
-    (
-        (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
-        (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
-        (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
-        (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
-    ) &
-    (combined_data['Age'] >=15) &
-    (~combined_data['Sex'].isna())
-]
 
-# Filters for PrEP_CT_Type
-prep_ct_type = combined_data[
-    (combined_data['Date Of Commencement (yyyy-mm-dd)'] < Start_of_quarter) &
-    ((combined_data['Date Of Last Pickup (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Last Pickup (yyyy-mm-dd)'] <= End_of_quarter)) &  
-    (
-        (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
-        (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
-        (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
-        (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
-    ) &
-    ((combined_data['Current Prep Type'].str.contains('Oral')) | 
-     (combined_data['Current Prep Type'].isna()) | # Catches np.nan
-        (combined_data['Current Prep Type'] == '') | # Catches explicit empty strings
-        (combined_data['Current Prep Type'].str.strip() == '') # Catches strings with only whitespace) &
-    ) &
-    (combined_data['Age'] >=15) &
-    (~combined_data['Sex'].isna())
+# Columns read from the extracts: the facility keys, the date columns above and every
+# column the indicators below filter on. All other columns are skipped when the files are read.
+required_columns = ['Facility Name', 'Facility Id (Datim)'] + date_columns + [
+    'HIV status at PrEP Initiation',
+    'Age',
+    'Sex',
+    'Pregnancy Status',
+    'Current HIV Status',
+    'Current Prep Type',
+    'Current Prep Distribution Setting',
+    'Prep Type',
+    'Prep Distribution Setting'
 ]
 
-# Filters for PrEP_CT_Distribution
-prep_ct_distribution = combined_data[
-    (combined_data['Date Of Commencement (yyyy-mm-dd)'] < Start_of_quarter) &
-    ((combined_data['Date Of Last Pickup (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Last Pickup (yyyy-mm-dd)'] <= End_of_quarter)) &  
-    (
-        (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
-        (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
-        (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
-        (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
-    ) &
-    ((combined_data['Current Prep Distribution Setting'].str.contains('Facility|Community')) & (~combined_data['Current Prep Distribution Setting'].isna())) &
-    (combined_data['Age'] >=15) &
-    (~combined_data['Sex'].isna())
+# Low-cardinality columns loaded as categoricals (each distinct value is stored once and the
+# indicator filters compare integer codes instead of strings)
+categorical_columns = [
+    'Sex',
+    'Pregnancy Status',
+    'HIV status at PrEP Initiation',
+    'Current HIV Status',
+    'Current Prep Type',
+    'Current Prep Distribution Setting',
+    'Prep Type',
+    'Prep Distribution Setting'
 ]
 
-# Filters for PrEP_CT_Pregnant and Breastfeeding
-prep_ct_PBF = combined_data[
-    (combined_data['Date Of Commencement (yyyy-mm-dd)'] < Start_of_quarter) &
-    ((combined_data['Date Of Last Pickup (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Last Pickup (yyyy-mm-dd)'] <= End_of_quarter)) &  
-    (
-        (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
-        (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
-        (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
-        (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
-    ) &
-    (combined_data['Age'] >=15) &
-    (combined_data['Sex'] == 'Female') &
-    ((combined_data['Pregnancy Status'].str.contains('Pregnant|Breastfeeding')) & (~combined_data['Pregnancy Status'].isin(['Not Pregnant'])))
-]
 
 
-# Filters for PrEP_CT_TestResult
-common_condition = (
+# Date that puts a row in a reporting period for every indicator below: PrEP_CT counts the clients whose last
+# pickup falls in the period (and who started before it), PrEP_NEW the ones who started in it. A trend run
+# counts all of its periods in one grouped reduction per date (see count_trend), with Start_of_quarter/
+# End_of_quarter holding the bounds of each row's own period
+period_date_columns = {
+    'PrEP_CT': 'Date Of Last Pickup (yyyy-mm-dd)',
+    'PrEP_CT_Type': 'Date Of Last Pickup (yyyy-mm-dd)',
+    'PrEP_CT_Distribution': 'Date Of Last Pickup (yyyy-mm-dd)',
+    'PrEP_CT_TestResult': 'Date Of Last Pickup (yyyy-mm-dd)',
+    'PrEP_CT_PregnantandBreastfeeding': 'Date Of Last Pickup (yyyy-mm-dd)',
+    'PrEP_NEW': 'Date Of Commencement (yyyy-mm-dd)',
+    'PrEP_NEW_Type': 'Date Of Commencement (yyyy-mm-dd)',
+    'PrEP_NEW_Distribution': 'Date Of Commencement (yyyy-mm-dd)',
+    'PrEP_NEW_PregnantandBreastfeeding': 'Date Of Commencement (yyyy-mm-dd)',
+}
+
+
+# Indicator filters of one reporting period (Start_of_quarter to End_of_quarter). Returns the (name, mask)
+# pair of every indicator, in the column order of the summary. Only reads combined_data, so it can be
+# called once per period of a trend run.
+def period_indicators(combined_data, Start_of_quarter, End_of_quarter):
+    # Filters for PrEP_CT
+    prep_ct = (
         (combined_data['Date Of Commencement (yyyy-mm-dd)'] < Start_of_quarter) &
         ((combined_data['Date Of Last Pickup (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Last Pickup (yyyy-mm-dd)'] <= End_of_quarter)) &  
         (
-        (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
-        (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
-        (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
-        (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
-    ) &
+            (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
+            (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
+            (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
+            (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
+        ) &
         (combined_data['Age'] >=15) &
         (~combined_data['Sex'].isna())
-)
-
-negative = (combined_data['Current HIV Status'].str.contains('Negative'))
-positive = (combined_data['Current HIV Status'].str.contains('Positive'))
-other = ((combined_data['Current HIV Status'].isna()) | # Catches np.nan
-        (combined_data['Current HIV Status'] == '') | # Catches explicit empty strings
-        (combined_data['Current HIV Status'].str.strip() == ''))
-
-prep_ct_negative =combined_data[common_condition & (negative)]
-prep_ct_positive =combined_data[common_condition & (positive)]
-prep_ct_other =combined_data[common_condition & (other)]
-
-prep_ct_test_result = combined_data[common_condition & (negative|positive|other)]
-
-
-# Filters for PrEP_NEW
-prep_new = combined_data[
-    ((combined_data['Date Of Commencement (yyyy-mm-dd)'] >= Start_of_quarter) & 
-     (combined_data['Date Of Commencement (yyyy-mm-dd)'] <= End_of_quarter)) &
-    (
-        (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
-        (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
-        (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
-        (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
-    ) &
-    (combined_data['Age'] >= 15) &
-    (~combined_data['Sex'].isna())
-]
+    )
 
+    # Filters for PrEP_CT_Type
+    prep_ct_type = (
+        (combined_data['Date Of Commencement (yyyy-mm-dd)'] < Start_of_quarter) &
+        ((combined_data['Date Of Last Pickup (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Last Pickup (yyyy-mm-dd)'] <= End_of_quarter)) &  
+        (
+            (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
+            (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
+            (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
+            (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
+        ) &
+        ((combined_data['Current Prep Type'].str.contains('Oral')) | 
+         (combined_data['Current Prep Type'].isna()) | # Catches np.nan
+            (combined_data['Current Prep Type'] == '') | # Catches explicit empty strings
+            (combined_data['Current Prep Type'].str.strip() == '') # Catches strings with only whitespace) &
+        ) &
+        (combined_data['Age'] >=15) &
+        (~combined_data['Sex'].isna())
+    )
 
+    # Filters for PrEP_CT_Distribution
+    prep_ct_distribution = (
+        (combined_data['Date Of Commencement (yyyy-mm-dd)'] < Start_of_quarter) &
+        ((combined_data['Date Of Last Pickup (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Last Pickup (yyyy-mm-dd)'] <= End_of_quarter)) &  
+        (
+            (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
+            (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
+            (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
+            (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
+        ) &
+        ((combined_data['Current Prep Distribution Setting'].str.contains('Facility|Community')) & (~combined_data['Current Prep Distribution Setting'].isna())) &
+        (combined_data['Age'] >=15) &
+        (~combined_data['Sex'].isna())
+    )
 
-# Filters for PrEP_NEW_Pregnant and Breastfeeding
-prep_new_PBF = combined_data[
-    ((combined_data['Date Of Commencement (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Commencement (yyyy-mm-dd)'] <= End_of_quarter)) &  
-    (
-        (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
-        (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
-        (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
-        (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
-    ) &
-    (combined_data['Age'] >=15) &
-    (combined_data['Sex']=='Female') &
-    ((combined_data['Pregnancy Status'].str.contains('Pregnant|Breastfeeding')) & (~combined_data['Pregnancy Status'].isin(['Not Pregnant'])))
-]
+    # Filters for PrEP_CT_Pregnant and Breastfeeding
+    prep_ct_PBF = (
+        (combined_data['Date Of Commencement (yyyy-mm-dd)'] < Start_of_quarter) &
+        ((combined_data['Date Of Last Pickup (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Last Pickup (yyyy-mm-dd)'] <= End_of_quarter)) &  
+        (
+            (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
+            (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
+            (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
+            (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
+        ) &
+        (combined_data['Age'] >=15) &
+        (combined_data['Sex'] == 'Female') &
+        ((combined_data['Pregnancy Status'].str.contains('Pregnant|Breastfeeding')) & (~combined_data['Pregnancy Status'].isin(['Not Pregnant'])))
+    )
+
+
+    # Filters for PrEP_CT_TestResult
+    common_condition = (
+            (combined_data['Date Of Commencement (yyyy-mm-dd)'] < Start_of_quarter) &
+            ((combined_data['Date Of Last Pickup (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Last Pickup (yyyy-mm-dd)'] <= End_of_quarter)) &  
+            (
+            (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
+            (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
+            (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
+            (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
+        ) &
+            (combined_data['Age'] >=15) &
+            (~combined_data['Sex'].isna())
+    )
+
+    negative = (combined_data['Current HIV Status'].str.contains('Negative'))
+    positive = (combined_data['Current HIV Status'].str.contains('Positive'))
+    other = ((combined_data['Current HIV Status'].isna()) | # Catches np.nan
+            (combined_data['Current HIV Status'] == '') | # Catches explicit empty strings
+            (combined_data['Current HIV Status'].str.strip() == ''))
+
+    prep_ct_negative =common_condition & (negative)
+    prep_ct_positive =common_condition & (positive)
+    prep_ct_other =common_condition & (other)
+
+    prep_ct_test_result = common_condition & (negative|positive|other)
+
+
+    # Filters for PrEP_NEW
+    prep_new = (
+        ((combined_data['Date Of Commencement (yyyy-mm-dd)'] >= Start_of_quarter) & 
+         (combined_data['Date Of Commencement (yyyy-mm-dd)'] <= End_of_quarter)) &
+        (
+            (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
+            (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
+            (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
+            (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
+        ) &
+        (combined_data['Age'] >= 15) &
+        (~combined_data['Sex'].isna())
+    )
 
-# Filters for PrEP_NEW_Type
-prep_new_type = combined_data[
-    ((combined_data['Date Of Commencement (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Commencement (yyyy-mm-dd)'] <= End_of_quarter)) &  
-    (
-        (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
-        (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
-        (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
-        (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
-    ) &
-    ((combined_data['Prep Type'].str.contains('Oral', na=False)) | 
-     (combined_data['Prep Type'].isna()) | # Catches np.nan
-        (combined_data['Prep Type'] == '') | # Catches explicit empty strings
-        (combined_data['Prep Type'].str.strip() == '') # Catches strings with only whitespace) &
-    ) &
-    (combined_data['Age'] >=15) &
-    (~combined_data['Sex'].isna())
-]
 
-# Filters for PrEP_NEW_Distribution
-prep_new_distribution = combined_data[
-    ((combined_data['Date Of Commencement (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Commencement (yyyy-mm-dd)'] <= End_of_quarter)) &  
-    (
-        (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
-        (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
-        (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
-        (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
-    ) &
-    ((combined_data['Prep Distribution Setting'].str.contains('Facility|Community')) & (~combined_data['Prep Distribution Setting'].isna())) &
-    (combined_data['Age'] >=15) &
-    (~combined_data['Sex'].isna())
-]
 
+    # Filters for PrEP_NEW_Pregnant and Breastfeeding
+    prep_new_PBF = (
+        ((combined_data['Date Of Commencement (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Commencement (yyyy-mm-dd)'] <= End_of_quarter)) &  
+        (
+            (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
+            (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
+            (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
+            (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
+        ) &
+        (combined_data['Age'] >=15) &
+        (combined_data['Sex']=='Female') &
+        ((combined_data['Pregnancy Status'].str.contains('Pregnant|Breastfeeding')) & (~combined_data['Pregnancy Status'].isin(['Not Pregnant'])))
+    )
+
+    # Filters for PrEP_NEW_Type
+    prep_new_type = (
+        ((combined_data['Date Of Commencement (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Commencement (yyyy-mm-dd)'] <= End_of_quarter)) &  
+        (
+            (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
+            (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
+            (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
+            (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
+        ) &
+        ((combined_data['Prep Type'].str.contains('Oral', na=False)) | 
+         (combined_data['Prep Type'].isna()) | # Catches np.nan
+            (combined_data['Prep Type'] == '') | # Catches explicit empty strings
+            (combined_data['Prep Type'].str.strip() == '') # Catches strings with only whitespace) &
+        ) &
+        (combined_data['Age'] >=15) &
+        (~combined_data['Sex'].isna())
+    )
+
+    # Filters for PrEP_NEW_Distribution
+    prep_new_distribution = (
+        ((combined_data['Date Of Commencement (yyyy-mm-dd)']>= Start_of_quarter) & (combined_data['Date Of Commencement (yyyy-mm-dd)'] <= End_of_quarter)) &  
+        (
+            (combined_data['HIV status at PrEP Initiation'].str.contains('Negative', na=False)) | # na=False ensures NaN values don't match 'Negative'
+            (combined_data['HIV status at PrEP Initiation'].isna()) | # Catches np.nan
+            (combined_data['HIV status at PrEP Initiation'] == '') | # Catches explicit empty strings
+            (combined_data['HIV status at PrEP Initiation'].str.strip() == '') # Catches strings with only whitespace
+        ) &
+        ((combined_data['Prep Distribution Setting'].str.contains('Facility|Community')) & (~combined_data['Prep Distribution Setting'].isna())) &
+        (combined_data['Age'] >=15) &
+        (~combined_data['Sex'].isna())
+    )
+
+
+
+
+    # Every indicator is a boolean row mask; all of them are counted per facility at once
+    # (one grouped sum over the masks), in the column order of the summary below
+    indicators = [
+        ('PrEP_CT', prep_ct),
+        ('PrEP_CT_Type', prep_ct_type),
+        ('PrEP_CT_Distribution', prep_ct_distribution),
+        ('PrEP_CT_TestResult', prep_ct_test_result),
+        ('PrEP_CT_PregnantandBreastfeeding', prep_ct_PBF),
+        ('PrEP_NEW', prep_new),
+        ('PrEP_NEW_Type', prep_new_type),
+        ('PrEP_NEW_Distribution', prep_new_distribution),
+        ('PrEP_NEW_PregnantandBreastfeeding', prep_new_PBF),
+    ]
+    return indicators
+
+
+# Reads the extracts of all_files into one validated DataFrame
+def load_files(all_files):
+    # Combine all files into one DataFrame (files are parsed by ingest_workers processes, or taken from the
+    # cache, with the date/numeric columns already converted, and concatenated once)
+    # State/LGA are only read for the rollups, and only from the files that have them
+    rollup_columns = rollup_geography_columns if include_rollups else []
+    combined_data = load_extracts(all_files, workers=ingest_workers, date_columns=date_columns, usecols=required_columns,
+                                  categorical_columns=categorical_columns + rollup_columns, cache_dir=cache_dir,
+                                  optional_columns=rollup_columns)
+
+    if combined_data.empty:
+        print("No valid files found or data could not be combined.")
+        exit()
 
+    # Extract project name from the 'Filename' column
+    # IMPORTANT: Ensure 'Filename' column exists before attempting to split
+    if 'Filename' not in combined_data.columns:
+        print("FATAL ERROR: 'Filename' column is missing from the combined data. Cannot extract ProjectName.")
+        exit()
 
+    combined_data['ProjectName'] = combined_data['Filename'].str.split('_').str[0]
+
+    # Every column the indicators need must be present in at least one input file
+    missing_columns = [col for col in required_columns if col not in combined_data.columns]
+    if missing_columns:
+        print(f"FATAL ERROR: Required column(s) missing from all input files: {missing_columns}")
+        exit()
 
-# Pivot_data function to group by 'ProjectName' AND 'Facility Name'
-# This ensures we can later filter by project but still have facility-level aggregates
-def pivot_data(data, value_name):
-    # Ensure the data passed to pivot_data has the required columns
-    for col in ['ProjectName', 'Facility Name','Facility Id (Datim)']:
-        if col not in data.columns:
-            print(f"Error: '{col}' not found in data passed to pivot_data. Skipping pivot.")
-            return pd.DataFrame(columns=['ProjectName', 'Facility Name', 'Facility Id (Datim)', value_name]) # Return empty DataFrame
-
-    return data.groupby(['ProjectName', 'Facility Name', 'Facility Id (Datim)']).size().reset_index(name=value_name)
-
-# Apply the pivot, aggregated by ProjectName and Facility Name
-prep_ct_pivot = pivot_data(prep_ct, 'PrEP_CT')
-prep_ct_type_pivot = pivot_data(prep_ct_type, 'PrEP_CT_Type')
-prep_ct_distribution_pivot = pivot_data(prep_ct_distribution, 'PrEP_CT_Distribution')
-prep_ct_test_result_pivot = pivot_data(prep_ct_test_result, 'PrEP_CT_TestResult')
-prep_ct_PBF_pivot = pivot_data(prep_ct_PBF, 'PrEP_CT_PregnantandBreastfeeding')
-prep_new_pivot = pivot_data(prep_new, 'PrEP_NEW')
-prep_new_type_pivot = pivot_data(prep_new_type, 'PrEP_NEW_Type')
-prep_new_distribution_pivot = pivot_data(prep_new_distribution, 'PrEP_NEW_Distribution')
-prep_new_PBF_pivot = pivot_data(prep_new_PBF, 'PrEP_NEW_PregnantandBreastfeeding')
-
-# List of all pivots to be merged into the master summary DataFrame
-all_pivots_for_summary = [
-    prep_ct_pivot,
-    prep_ct_type_pivot,
-    prep_ct_distribution_pivot,
-    prep_ct_test_result_pivot,
-    prep_ct_PBF_pivot,
-    prep_new_pivot,
-    prep_new_type_pivot,
-    prep_new_distribution_pivot,
-    prep_new_PBF_pivot
-    ] 
-
-# Get all unique combinations of ProjectName and Facility Name from the original combined data
-# This ensures all facilities are represented, even if they have no metrics for a pivot
-if not combined_data.empty:
-    unique_project_facility_combinations = combined_data[['ProjectName', 'Facility Name','Facility Id (Datim)']].drop_duplicates()
-else:
-    unique_project_facility_combinations = pd.DataFrame(columns=['ProjectName', 'Facility Name', 'Facility Id (Datim)'])
-
-# Initialize a master DataFrame that will contain all aggregated data (by ProjectName and Facility Name)
-master_aggregated_df = unique_project_facility_combinations.copy()
-
-# Merge all calculated pivots onto the master aggregated DataFrame
-for pivot_df in all_pivots_for_summary:
-    # Ensure pivot_df is not empty and has the keys before merging
-    if not pivot_df.empty and 'ProjectName' in pivot_df.columns and 'Facility Name' in pivot_df.columns:
-        master_aggregated_df = pd.merge(master_aggregated_df, pivot_df, 
-                                        on=['ProjectName', 'Facility Name', 'Facility Id (Datim)'], how='left')
-    else:
-        print(f"Warning: An aggregated pivot is empty or missing key columns (ProjectName/Facility Name/Facility Id (Datim)) and will not be merged.")
-        
 
+    # Check if 'ProjectName' and 'Facility Name' columns exist and are not entirely empty
+    required_cols_for_aggregation = ['ProjectName', 'Facility Name', 'Facility Id (Datim)']
+    for col in required_cols_for_aggregation:
+        if col not in combined_data.columns:
+            print(f"FATAL ERROR: Required column '{col}' is missing from the combined data.")
+            if col == 'ProjectName':
+                print("This usually means the 'Filename' column couldn't be processed to extract ProjectName.")
+                print(f"First 5 filenames: {combined_data['Filename'].head().tolist()}")
+            exit()
 
-# Fill NaN values (for facilities with no data for a particular metric) with 0 for counts
-for col in master_aggregated_df.columns:
-    if col not in ['ProjectName', 'Facility Name', 'Facility Id (Datim)']: # Only fill for metric columns
-        master_aggregated_df[col] = master_aggregated_df[col].fillna(0).astype(int)
+        # Convert to string and handle potential NaNs before further processing
+        # This helps prevent type-related errors in groupby/merge
+        # Stored as a categorical of strings: same values as astype(str), so missing values become 'nan'
+        combined_data[col] = as_key_category(combined_data[col])
+
+        if (combined_data[col] == 'UNKNOWN').all():
+            print(f"Warning: Column '{col}' is entirely 'UNKNOWN' (or NaN in original data). This might affect grouping and filtering.")
+        elif combined_data[col].nunique() == 1 and combined_data[col].iloc[0] == 'UNKNOWN':
+             print(f"Warning: Column '{col}' contains only 'UNKNOWN' values. This might indicate an issue with data extraction or input.")
+
+
+    # Blank and unparseable dates, counted per column and facility (the rows themselves only go to
+    # invalid_dates_sample_path)
+    report_date_quality(combined_data, date_columns, ['ProjectName', 'Facility Name', 'Facility Id (Datim)'], invalid_dates_sample_path)
+    return combined_data
+
+
+# Reads every CSV/Excel extract in folder (see load_files)
+def load(folder):
+    return load_files(list_input_files(folder))
+
+
+# The (name, mask) of every indicator of the output for period, a (start, end) pair of dates, or the quarter in
+# Defining Periods when None, in the order of its columns (the filters equivalence.py counts the legacy way)
+def indicator_masks(combined_data, period=None):
+    if period is None:
+        with stage('indicator masks'):
+            return period_indicators(combined_data, Start_of_quarter, End_of_quarter)
+    label, start, end = parse_periods([period])[0]
+    with stage('indicator masks'):
+        return period_indicators(combined_data, start, end)
+
+
+# Facility counts of every indicator over combined_data (from load) for period, a (start, end) pair of dates,
+# or the quarter in Defining Periods when None. The same table as the main output, without the rollups.
+def aggregate(combined_data, period=None):
+    keys = ['ProjectName', 'Facility Name', 'Facility Id (Datim)']
+    indicators = indicator_masks(combined_data, period)
+    return assemble_counts(combined_data[keys].drop_duplicates(), count_indicators(combined_data, indicators, keys), keys, fill_zero=True)
+
+
+# Saves the facility counts (and their rollups) to output_path (output_file_path when None). geography holds
+# the rollup columns of every facility (see facility_geography), None to only total by project and nationally.
+def save_report(master_aggregated_df, geography=None, output_path=None):
+    output_path = output_path or output_file_path
+
+    # Get unique project names for creating separate sheets
+    project_names = master_aggregated_df['ProjectName'].unique()
+
+    # Create the Excel writer object
+    with stage('write report'), pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+        # Loop through each unique ProjectName and save its aggregated data to a separate sheet
+        if master_aggregated_df.empty:
+            print("Master aggregated DataFrame is empty. No project sheets will be created.")
+        else:
+            for project in project_names:
+                # Sanitize project name for Excel sheet name (max 31 chars, no invalid chars)
+                sheet_name = str(project)[:31]
+                sheet_name = re.sub(r'[\\/*?[\]:]', '', sheet_name) # Remove invalid characters
+
+                # Filter the master aggregated data for the current project
+                project_aggregated_data = master_aggregated_df[master_aggregated_df['ProjectName'] == project].copy()
+
+                # Drop the ProjectName column before saving, as it's redundant on a project-specific sheet
+                if 'ProjectName' in project_aggregated_data.columns:
+                    project_aggregated_data = project_aggregated_data.drop(columns=['ProjectName'])
+
+                # Save project-specific aggregated data to its own sheet
+                if not project_aggregated_data.empty:
+                    project_aggregated_data.to_excel(writer, sheet_name=sheet_name, index=False)
+                    print(f"Aggregated data for Project '{project}' (by Facility Name and Facility Id (Datim)) saved to sheet '{sheet_name}'.")
+                else:
+                    print(f"No aggregated data found for Project: {project} after filtering, skipping sheet creation.")
+
+        # LGA, State, project and national totals, summed from the facility rows
+        if include_rollups and not master_aggregated_df.empty:
+            rollups = rollup_counts(master_aggregated_df, ['ProjectName', 'Facility Name', 'Facility Id (Datim)'], geography)
+            rollups.to_excel(writer, sheet_name=ROLLUP_SHEET, index=False)
+            print(f"Totals by {', '.join(rollups['Level'].unique())} saved to sheet '{ROLLUP_SHEET}'.")
+
+    print(f"Analysis complete. Results saved to: {output_path}")
+
+
+# Incremental run (see incremental): only the files changed since the last run are read and counted, per
+# file, and the stored counts of every file are added up into the facility counts
+def run_incremental(all_files):
+    skipped = [name for name, setting in [('line_list_indicators', line_list_indicators),
+                                          ('disaggregate_by_age_sex', disaggregate_by_age_sex),
+                                          ('trend_periods', trend_periods),
+                                          ('rollup_geography_columns', include_rollups and rollup_geography_columns)] if setting]
+    if skipped:
+        print(f"Warning: {', '.join(skipped)} need every row and are ignored in incremental mode.")
+
+    keys = ['ProjectName', 'Facility Name', 'Facility Id (Datim)']
+    # The stored counts depend on the indicator filters, on everything load_files derives their columns with (the
+    # columns read and converted, the cleaners and classifiers, flags such as age cut-offs) and on the period, not
+    # on the settings only used after loading (line lists, trend, ...), which can change without a recount
+    partials = PartialCounts(cache_dir, 'prep', run_fingerprint([period_indicators, load_files], Start_of_quarter, End_of_quarter))
+    changed = partials.changed_files(all_files)
+    if changed:
+        combined_data = load_files(changed)
+        # Counted per file as well, so the counts of every file are kept apart
+        partials.update(combined_data, count_indicators(combined_data, period_indicators(combined_data, Start_of_quarter, End_of_quarter),
+                                                        ['Filename'] + keys), keys, changed)
+
+    save_report(partials.combine(keys, fill_zero=True))
+
+
+# Runs the whole aggregation. Kept behind the __main__ guard so that the worker
+# processes used for reading the extracts can import this script safely.
+def main():
+    # List all CSV/Excel extracts in the input folder
+    all_files = list_input_files(folder_path)
+
+    if incremental:
+        if cache_dir is not None:
+            run_incremental(all_files)
+            return
+        print("Warning: incremental needs a cache_dir to keep the counts of every file in. Every file is read and counted.")
+
+    combined_data = load_files(all_files)
+
+    # Indicator filters of the quarter defined at the top of the file
+    with stage('indicator masks'):
+        indicators = period_indicators(combined_data, Start_of_quarter, End_of_quarter)
+    if disaggregate_by_age_sex:
+        # The same grouped sum, also split by age band and Sex (the facility totals are summed from it)
+        all_pivots_for_summary, disaggregates = count_indicators(combined_data, indicators, ['ProjectName', 'Facility Name', 'Facility Id (Datim)'],
+                                                                 by=mer_disaggregation(combined_data))
+        save_disaggregates(disaggregates, ['ProjectName', 'Facility Name', 'Facility Id (Datim)'], disaggregates_output_path, wide=disaggregates_wide_sheet)
+    else:
+        all_pivots_for_summary = count_indicators(combined_data, indicators, ['ProjectName', 'Facility Name', 'Facility Id (Datim)'])
 
-# Get unique project names for creating separate sheets
-project_names = master_aggregated_df['ProjectName'].unique()
+    # Line lists (the matching rows) are only built for the indicators listed in line_list_indicators
+    save_line_lists(combined_data, indicators, line_list_indicators, line_list_output_path)
 
-# Create the Excel writer object
-with pd.ExcelWriter(output_file_path, engine='openpyxl') as writer:
-    # Loop through each unique ProjectName and save its aggregated data to a separate sheet
-    if master_aggregated_df.empty:
-        print("Master aggregated DataFrame is empty. No project sheets will be created.")
+    # Get all unique combinations of ProjectName and Facility Name from the original combined data
+    # This ensures all facilities are represented, even if they have no metrics for a pivot
+    if not combined_data.empty:
+        unique_project_facility_combinations = combined_data[['ProjectName', 'Facility Name','Facility Id (Datim)']].drop_duplicates()
     else:
-        for project in project_names:
-            # Sanitize project name for Excel sheet name (max 31 chars, no invalid chars)
-            sheet_name = str(project)[:31]
-            sheet_name = re.sub(r'[\\/*?[\]:]', '', sheet_name) # Remove invalid characters
-
-            # Filter the master aggregated data for the current project
-            project_aggregated_data = master_aggregated_df[master_aggregated_df['ProjectName'] == project].copy()
-            
-            # Drop the ProjectName column before saving, as it's redundant on a project-specific sheet
-            if 'ProjectName' in project_aggregated_data.columns:
-                project_aggregated_data = project_aggregated_data.drop(columns=['ProjectName'])
-            
-            # Save project-specific aggregated data to its own sheet
-            if not project_aggregated_data.empty:
-                project_aggregated_data.to_excel(writer, sheet_name=sheet_name, index=False)
-                print(f"Aggregated data for Project '{project}' (by Facility Name and Facility Id (Datim)) saved to sheet '{sheet_name}'.")
-            else:
-                print(f"No aggregated data found for Project: {project} after filtering, skipping sheet creation.")
-
-print(f"Analysis complete. Results saved to: {output_file_path}")
\ No newline at end of file
+        unique_project_facility_combinations = pd.DataFrame(columns=['ProjectName', 'Facility Name', 'Facility Id (Datim)'])
+
+    # Put all calculated pivots next to the facilities in one keyed step (missing counts are 0)
+    master_aggregated_df = assemble_counts(unique_project_facility_combinations, all_pivots_for_summary,
+                                           ['ProjectName', 'Facility Name', 'Facility Id (Datim)'], fill_zero=True)
+
+    # State/LGA of every facility for the rollups, where the extracts have them
+    geography = [col for col in rollup_geography_columns if include_rollups and col in combined_data.columns]
+    save_report(master_aggregated_df, facility_geography(combined_data, ['ProjectName', 'Facility Name', 'Facility Id (Datim)'], geography) if geography else None)
+
+    # Trend mode: the same indicators for every period of trend_periods, counted from the data loaded above
+    if trend_periods:
+        trend = count_trend(unique_project_facility_combinations, ['ProjectName', 'Facility Name', 'Facility Id (Datim)'], trend_periods,
+                            lambda start, end, keys: count_indicators(combined_data, period_indicators(combined_data, start, end), keys),
+                            fill_zero=True, data=combined_data, period_dates=period_date_columns)
+        save_trend(trend, trend_output_path)
+
+
+if __name__ == '__main__':
+    if profile_run:
+        start_profile()
+    main()
+    if profile_run:
+        save_profile(output_file_path, script=os.path.basename(__file__))
@@ -4,12 +4,36 @@ from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 import re
 
+from cleaning_lookup import CleaningLookup, apply_distinct
+from date_quality import report_date_quality
+from incremental import PartialCounts, run_fingerprint
+from indicator_counts import assemble_counts, count_indicators, mer_age_band, mer_disaggregation, save_disaggregates, save_line_lists
+from ingestion import list_input_files, load_extracts
+from profiling import save_profile, stage, start_profile
+from rollups import ROLLUP_SHEET, facility_geography, rollup_counts
+from mask_engine import MaskEngine
+from schema import as_key_category, with_category
+from trend import count_trend, parse_periods, save_trend, semi_annual_start
+
 # Path to the directory containing the CSV files
 folder_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/FY25Q4_RADET/FY25Q4 Reporting/IP_RADET/new'#/Updated'
 
 # Output path for the final Excel file
 output_file_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/IP_CARE2_Treatment_data_IP_FY25Q4_updateddd.xlsx'
 
+# Output path for the line lists of line_list_indicators
+line_list_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/IP_CARE2_Treatment_data_IP_FY25Q4_updateddd_line_lists.xlsx'
+
+# Output path for the MER age/sex disaggregates (disaggregate_by_age_sex)
+disaggregates_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/IP_CARE2_Treatment_data_IP_FY25Q4_updateddd_disaggregates.xlsx'
+
+# Output path for the trend of trend_periods
+trend_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Output_by_facility/IP_CARE2_Treatment_data_IP_FY25Q4_updateddd_trend.xlsx'
+
+# Workbook the blank and unparseable date counts per column and facility are saved to, with the first rows
+# holding a date that could not be read (see date_quality.py). None only prints the summary.
+invalid_dates_sample_path = None
+
 # Path for the separate viral load output file
 viral_load_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium International, LLC/Documents/DataFi/Cleaned_Viral_Load_Values.xlsx'
 
@@ -20,69 +44,50 @@ unique_cd4_output_path = 'C:/Users/oluwabukola.arowolo/OneDrive - Palladium Inte
 # Defining Periods
 Start_of_quarter = pd.to_datetime('2025-07-01')
 End_of_quarter = pd.to_datetime('2025-09-30')
-vl_start = End_of_quarter - pd.DateOffset(months=12, days=-1) #12 months from the end of the quarter
 six_months_ago = pd.to_datetime('2025-04-01')
-End_of_vl_month = Start_of_quarter + pd.DateOffset(months=4, days=-1) #taking into consideration the one month of result received for vl samples collected within the 12 months period
-
-# Combine all CSV files into one DataFrame, specifying 'latin1' encoding
-all_files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith(('.csv', '.xlsx', '.xls'))]
-
-# Combine all files into one DataFrame
-combined_data = pd.DataFrame()
-
-for file in all_files:
-    try:
-        if file.endswith('.csv'):
-            data = pd.read_csv(file, encoding='latin1', on_bad_lines='skip')
-        elif file.endswith('.xlsx'):
-            data = pd.read_excel(file, engine='openpyxl')
-        elif file.endswith('.xls'):
-            data = pd.read_excel(file)
-        else:
-            continue
-        
-        # Add Filename column
-        data['Filename'] = os.path.basename(file)
-        combined_data = pd.concat([combined_data, data], ignore_index=True)
-    except Exception as e:
-        print(f"Error processing file {file}: {e}")
-
-if combined_data.empty:
-    print("No valid files found or data could not be combined.")
-    exit()
-
-# Extract project name from the 'Filename' column
-# IMPORTANT: Ensure 'Filename' column exists before attempting to split
-if 'Filename' not in combined_data.columns:
-    print("FATAL ERROR: 'Filename' column is missing from the combined data. Cannot extract ProjectName.")
-    exit()
-
-combined_data['ProjectName'] = combined_data['Filename'].str.split('_').str[0]
-
-# --- NEW: Robust column validation ---
-# Check if 'ProjectName' and 'Facility Name' columns exist and are not entirely empty
-required_cols_for_aggregation = ['ProjectName', 'Facility Name', 'DatimId']
-for col in required_cols_for_aggregation:
-    if col not in combined_data.columns:
-        print(f"FATAL ERROR: Required column '{col}' is missing from the combined data.")
-        if col == 'ProjectName':
-            print("This usually means the 'Filename' column couldn't be processed to extract ProjectName.")
-            print(f"First 5 filenames: {combined_data['Filename'].head().tolist()}")
-        exit()
-    
-    # Convert to string and handle potential NaNs before further processing
-    # This helps prevent type-related errors in groupby/merge
-    combined_data[col] = combined_data[col].astype(str).fillna('UNKNOWN')
-
-    if (combined_data[col] == 'UNKNOWN').all():
-        print(f"Warning: Column '{col}' is entirely 'UNKNOWN' (or NaN in original data). This might affect grouping and filtering.")
-    elif combined_data[col].nunique() == 1 and combined_data[col].iloc[0] == 'UNKNOWN':
-         print(f"Warning: Column '{col}' contains only 'UNKNOWN' values. This might indicate an issue with data extraction or input.")
-
-
-
-
-# Ensure date columns are in datetime format
+# (the VL period and the TPT start/completion periods are derived from these in period_indicators)
+
+# Number of worker processes used to read the extracts in parallel
+# (1 reads the files one after another, None uses one worker per CPU)
+ingest_workers = 1
+
+# Folder where the parsed extracts are cached between runs (None switches the cache off).
+# Files that have not changed since the last run are loaded from the cache instead of being parsed again.
+cache_dir = None
+
+# Indicators whose matching rows are also saved as line lists, one sheet per indicator
+# (e.g. ['TX_CURR', 'TX_NEW']). Left empty, only the facility counts are computed.
+line_list_indicators = []
+
+# Also count every indicator by MER fine age band (<1, 1-4, 5-9, ..., 65+) and Sex, saved to
+# disaggregates_output_path as a long table. With disaggregates_wide_sheet, a second sheet holds one
+# column per age band/Sex combination.
+disaggregate_by_age_sex = False
+disaggregates_wide_sheet = False
+
+# Also write the totals of the facility counts per LGA, State, project and nationally to a 'Rollups'
+# sheet of the output file. The LGA/State levels use rollup_geography_columns where the extracts have them.
+include_rollups = False
+rollup_geography_columns = ['State', 'LGA']
+
+# Trend mode: the (start, end) of every reporting period to count from the same extracts, e.g.
+# [('2024-10-01', '2024-12-31'), ('2025-01-01', '2025-03-31')]. The extracts are read once and the facility
+# counts of every period are saved to trend_output_path, one row per period and facility. The rolling
+# windows (VL period, last six months, TPT start/completion periods) are derived from each period.
+trend_periods = []
+
+# Incremental mode (needs cache_dir): the facility counts of every input file are kept next to the cached
+# extracts, so a re-run only reads and counts the files that changed since the last run and adds up the
+# stored counts of the others. The line lists, disaggregates, trend and State/LGA rollups need every row,
+# so they are skipped in this mode, and the CD4 and viral load value lists are only saved when files are read.
+incremental = False
+
+# Save a profile of the run as JSON next to output_file_path (<name>_profile.json): the duration and peak memory
+# of every stage, i.e. reading and coercing each file, cleaning, the indicator masks, counting, assembling and
+# writing the output. Tracing the memory slows the run down somewhat, so it is off by default.
+profile_run = False
+
+# Date columns, converted to datetime format as each extract is read (invalid dates become NaT)
 date_columns = [
     'ART Start Date (yyyy-mm-dd)', 
     'Date of Current ViralLoad Result Sample (yyyy-mm-dd)', 
@@ -99,52 +104,84 @@ date_columns = [
     'TPT Completion date (yyyy-mm-dd)',
     'Date of Last CD4 Count'
 ]
-for col in date_columns:
-    combined_data[col] = pd.to_datetime(combined_data[col], errors='coerce')
 
-# Checks for invalid dates
-invalid_dates = combined_data[date_columns].isnull().any(axis=1)
-if invalid_dates.any():
-    print(f"Warning: Invalid dates found in the following rows:\n{combined_data[invalid_dates]}")
+# Numeric fields, converted with pd.to_numeric as each extract is read
+numeric_columns = ['Age']
+
+# Columns read from the extracts: the facility keys, the date/numeric columns above and every
+# column the indicators below filter on. All other columns are skipped when the files are read.
+required_columns = ['Facility Name', 'DatimId'] + date_columns + numeric_columns + [
+    'Sex',
+    'Pregnancy Status',
+    'Care Entry Point',
+    'Date of Registration',
+    'Client Verification Outcome',
+    'Current ART Status',
+    'Previous ART Status',
+    'Months of ARV Refill',
+    'Cause of Death',
+    'Current Viral Load (c/ml)',
+    'Last CD4 Count',
+    'Cervical Cancer Screening Type',
+    'Cervical Cancer Screening Method',
+    'Result of Cervical Cancer Screening',
+    'Precancerous Lesions Treatment Methods',
+    'TB Screening Type',
+    'TB status',
+    'TB Diagnostic Test Type',
+    'TB Diagnostic Result',
+    'TPT Type',
+    'TPT Completion status'
+]
+
+# Low-cardinality columns loaded as categoricals (each distinct value is stored once and the
+# indicator filters compare integer codes instead of strings)
+categorical_columns = [
+    'Sex',
+    'Pregnancy Status',
+    'Care Entry Point',
+    'Client Verification Outcome',
+    'Current ART Status',
+    'Previous ART Status',
+    'TB Screening Type',
+    'TB status',
+    'TB Diagnostic Test Type',
+    'TPT Type',
+    'TPT Completion status',
+    'Cervical Cancer Screening Type',
+    'Cervical Cancer Screening Method',
+    'Result of Cervical Cancer Screening',
+    'Precancerous Lesions Treatment Methods'
+]
 
 
 # --- Updated Viral Load Cleaning Function ---
-def clean_viral_load(value):
-    """
-    Cleans and maps viral load values based on specific rules,
-    returning a string 'NULL' for missing or non-mappable values.
-    """
-    if pd.isna(value) or str(value).strip() == '':
-        return 'NULL'  # Return 'NULL' for NaN/blank values
-    
-    val_str = str(value).strip().lower().replace(' ', '') # Normalize by removing ALL spaces
+# Undetected/Not Detected/TNF/TND variants, matched against the normalized text (no spaces, lower case)
+undetected_viral_load_pattern = re.compile(r'undetected|notdetected|tnf|tnd|nd|t\.n\.d|notdet|not/d')
+# Integer/float patterns, including those with special characters (<, >, =) and comma separators
+viral_load_number_pattern = re.compile(r'^[<>=]?(-?[0-9,]+(?:(?:\.|,)[0-9]+)?)')
 
-    # Rule: Undetected/Not Detected/TNF/TND variants
-    # The regex patterns are now simplified to match the normalized string
-    undetected_patterns = [
-        r'undetected', r'notdetected', r'tnf', r'tnd', r'nd', r't\.n\.d', r'notdet', r'not/d'
-    ]
-    if any(re.search(pattern, val_str) for pattern in undetected_patterns):
-        return 0
-    
-    # Rule: Handle integer/float patterns, including those with special characters
-    match = re.search(r'^[<>=]?(-?[0-9,]+(?:(?:\.|,)[0-9]+)?)', val_str)
-    
-    if match:
-        try:
-            number_str = match.group(1).replace(',', '').replace('..', '.')
-            return float(number_str)
-        except (ValueError, TypeError):
-            pass
 
-    # All other values not caught by the above rules will return 'NULL'
-    return 'NULL'
+def clean_viral_load(values):
+    """
+    Cleans and maps a column of viral load values based on specific rules, all
+    rows at once. Returns a float column: undetected variants become 0, missing
+    or non-mappable values NaN.
+    """
+    missing = values.isna()
+    val_str = values.astype(str).str.strip()
+    missing |= val_str == ''
+    val_str = val_str.str.lower().str.replace(' ', '', regex=False) # Normalize by removing ALL spaces
 
-# Apply the cleaning function to create the new column
-combined_data['Cleaned Current Viral Load (c/ml)'] = combined_data['Current Viral Load (c/ml)'].apply(clean_viral_load)
+    # Rule: Handle integer/float patterns (anything else, e.g. ',' alone, gives NaN)
+    number_str = val_str.str.extract(viral_load_number_pattern, expand=False)
+    number_str = number_str.str.replace(',', '', regex=False).str.replace('..', '.', regex=False)
+    cleaned = pd.to_numeric(number_str, errors='coerce').astype(float)
 
-# --- END OF SECTION ---
+    # Rule: Undetected variants are 0, whatever number they contain
+    cleaned = cleaned.mask(val_str.str.contains(undetected_viral_load_pattern), 0.0)
 
+    return cleaned.mask(missing)
 
 
 # Convert columns to integers where possible
@@ -155,619 +192,56 @@ def convert_to_integer_columns(df, columns):
         
     return df
 
-# Example usage
-columns_to_clean = ['Last CD4 Count',  'Months of ARV Refill', 'Age'] #'Current Viral Load (c/ml)',
-combined_data = convert_to_integer_columns(combined_data, columns_to_clean)
-
 
 def standardize_art_status(df):
+    # The status columns are categoricals, so 'Stopped Treatment' must be a known category before it is assigned
+    df['Current ART Status'] = with_category(df['Current ART Status'], 'Stopped Treatment')
+    df['Previous ART Status'] = with_category(df['Previous ART Status'], 'Stopped Treatment')
     df.loc[df['Current ART Status'].str.contains('STOPPED TREATMENT', case=False, na=False), 'Current ART Status'] = 'Stopped Treatment'
     df.loc[df['Previous ART Status'].str.contains('STOPPED TREATMENT', case=False, na=False), 'Previous ART Status'] = 'Stopped Treatment'
     
     return df
 
-combined_data = standardize_art_status(combined_data)
 
 def screentype(df):
+    df['TB Screening Type'] = with_category(df['TB Screening Type'], 'Others')
     df.loc[df['TB Screening Type'].str.contains('None', case=False, na=False), 'TB Screening Type'] = 'Others'
     
     return df
 
-combined_data = screentype(combined_data)
-
-# Filters for TX_CURR
-tx_curr = combined_data[
-    (combined_data['Current ART Status'].str.contains('Active')) &
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) | #str.strip() == 'valid' ) |#
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &  
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-
-# Filters for TX_CURR-ARV Dispense
-tx_curr_ARV_Disp = combined_data[
-    (combined_data['Current ART Status'].isin(['Active', 'Active Restart'])) &
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    (~(combined_data['Months of ARV Refill'].isna()) | ~(combined_data['Months of ARV Refill'] == 0.0)) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-]
-
-
-vl_eligibility = (combined_data[
-      (combined_data['Current ART Status'].isin(['Active', 'Active Restart'])) &
-     ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    ((combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days >= 180)&
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-    ])
-
-# Filters for TX_PVLS_D
-tx_pvls_d = (combined_data[
-    (combined_data['Current ART Status'].isin(['Active', 'Active Restart'])) &
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | 
-     (combined_data['Client Verification Outcome'] == '') | 
-     (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] >= vl_start) &
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] >= vl_start) &
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] <= End_of_vl_month) &
-    ((combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days >= 180) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-])
-
-
-tx_pvls_d_pbf = (combined_data[
-      (combined_data['Current ART Status'].isin(['Active', 'Active Restart'])) &
-     ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-     (combined_data['Pregnancy Status'].isin(['Pregnant', 'Breastfeeding'])) &
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] >= vl_start) &       
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] >=vl_start) & 
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] <= End_of_vl_month) &
-    ((combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days >= 180) &
-    (combined_data['Sex'] == 'Female') &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-
-    ])
-
-
-tx_pvls_d_pregnant = (combined_data[
-      (combined_data['Current ART Status'].isin(['Active', 'Active Restart'])) &
-     ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-     (combined_data['Pregnancy Status'] =='Pregnant') &
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] >= vl_start) &        
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] >= vl_start) &         
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] <= End_of_vl_month) &
-    ((combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days >= 180)&
-    (combined_data['Sex'] == 'Female') &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-
-    ])
-
-tx_pvls_d_breastfeeding = (combined_data[
-      (combined_data['Current ART Status'].isin(['Active', 'Active Restart'])) &
-     ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-     (combined_data['Pregnancy Status'] =='Breastfeeding') &
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] >= vl_start) &         
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] >= vl_start) &              
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] <= End_of_vl_month) &
-    ((combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days >= 180) &
-    (combined_data['Sex'] == 'Female') &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-
-    ])
-
-
-# Filters for TX_PVLS_N
-tx_pvls_n = (combined_data[
-    (combined_data['Current ART Status'].isin(['Active', 'Active Restart'])) &
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) |
-     (combined_data['Client Verification Outcome'] == '') |
-     (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] >= vl_start) &
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] >= vl_start) &
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] <= End_of_vl_month) &
-    ((combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days >= 180) &
-    (combined_data['Cleaned Current Viral Load (c/ml)'] != 'NULL') &
-    (pd.to_numeric(combined_data['Cleaned Current Viral Load (c/ml)'], errors='coerce').between(0, 999, inclusive='both').fillna(False)) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-])
-
-tx_pvls_n_pbf = (combined_data[
-      (combined_data['Current ART Status'].isin(['Active', 'Active Restart'])) &
-     ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-     (combined_data['Pregnancy Status'].isin(['Pregnant', 'Breastfeeding'])) &
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] >= vl_start)&  
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] >= vl_start)&  
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] <= End_of_vl_month) &
-    ((combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days >= 180) &
-    (combined_data['Cleaned Current Viral Load (c/ml)'] != 'NULL') &
-    (pd.to_numeric(combined_data['Cleaned Current Viral Load (c/ml)'], errors='coerce').between(0, 999, inclusive='both').fillna(False)) &
-    (combined_data['Sex'] == 'Female') &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-    ])
-
-tx_pvls_n_pregnant = (combined_data[
-      (combined_data['Current ART Status'].isin(['Active', 'Active Restart'])) &
-     ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-     (combined_data['Pregnancy Status'] =='Pregnant') &
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] >= vl_start)&             
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] >= vl_start)&                        
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] <= End_of_vl_month) &
-    ((combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days >= 180) &
-    (combined_data['Cleaned Current Viral Load (c/ml)'] != 'NULL') &
-    (pd.to_numeric(combined_data['Cleaned Current Viral Load (c/ml)'], errors='coerce').between(0, 999, inclusive='both').fillna(False)) &
-    (combined_data['Sex'] == 'Female') &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-    ])
-
-tx_pvls_n_breastfeeding = (combined_data[
-      (combined_data['Current ART Status'].isin(['Active', 'Active Restart'])) &
-     ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-     (combined_data['Pregnancy Status'] =='Breastfeeding') &
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] >= vl_start)&             
-    (combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] <= End_of_quarter) &
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] >= vl_start)&  
-    (combined_data['Date of Current Viral Load (yyyy-mm-dd)'] <= End_of_vl_month) &
-    ((combined_data['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days >= 180) &
-    (combined_data['Cleaned Current Viral Load (c/ml)'] != 'NULL') &
-    (pd.to_numeric(combined_data['Cleaned Current Viral Load (c/ml)'], errors='coerce').between(0, 999, inclusive='both').fillna(False)) &
-    (combined_data['Sex'] == 'Female') &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-    ])
-
-
 
 # --- CORRECTED CD4 COUNT MAPPING FUNCTION (MODIFIED FOR TEXT VALUES) ---
-def map_cd4_count(value):
-    s = str(value).strip()
-    
-    # Handle blanks first, returning pd.NA to keep them blank in output
-    if pd.isna(value) or s == "":
-        return pd.NA
-    
-    # Handle specific text values, returning the string 'NULL'
-    if re.search(r'copies/ml|cells|positive|P0sitive|suggestive|failed|N/A', s, re.IGNORECASE):
-        return 'NULL'
-    
-    # Replace common non-numeric characters that look like numbers
-    s = s.replace('O', '0').replace('o', '0')
-    
-    # Regex to find the first integer or float
-    match = re.search(r'[\d]+(?:\.[\d]+)?', s)
-    
-    if match:
-        try:
-            # Extract the matched string and convert to float
-            cleaned_value = float(match.group(0))
-            return cleaned_value
-        except (ValueError, IndexError):
-            return 'NULL'
-    else:
-        return 'NULL'
+# Text results that are not a count
+cd4_text_result_pattern = re.compile(r'copies/ml|cells|positive|P0sitive|suggestive|failed|N/A', re.IGNORECASE)
+# The first integer or float
+cd4_number_pattern = re.compile(r'([\d]+(?:\.[\d]+)?)')
 
-# Apply the new mapping to create the 'Cleaned Last CD4 Count' column
-if 'Last CD4 Count' in combined_data.columns:
-    combined_data['Cleaned Last CD4 Count'] = combined_data['Last CD4 Count'].apply(map_cd4_count)
-else:
-    print("Warning: 'Last CD4 Count' column not found. Skipping CD4 mapping.")
-    combined_data['Cleaned Last CD4 Count'] = 'NULL'
 
-# ----------------- MODIFIED SECTION -----------------
-# Create a DataFrame of unique values for original and cleaned CD4 counts
-if 'Last CD4 Count' in combined_data.columns:
-    unique_cd4_values_df = combined_data[['Last CD4 Count', 'Cleaned Last CD4 Count']].drop_duplicates().sort_values(by='Last CD4 Count').reset_index(drop=True)
-    unique_cd4_values_df.to_excel(unique_cd4_output_path, index=False)
-    print(f"Unique CD4 Count values saved to: {unique_cd4_output_path}")
+def clean_cd4_count(values):
+    """
+    Maps a column of CD4 counts to numbers based on specific rules, all rows at
+    once. Returns a float column, NaN for blanks and for values without a count
+    (text results such as copies/ml, cells or positive).
+    """
+    s = values.astype(str).str.strip()
+    text_result = s.str.contains(cd4_text_result_pattern)
 
-# ----------------- END OF MODIFIED SECTION -----------------
+    # Replace common non-numeric characters that look like numbers
+    s = s.str.replace('O', '0', regex=False).str.replace('o', '0', regex=False)
 
+    # Extract the first number found and convert it to float
+    cleaned = s.str.extract(cd4_number_pattern, expand=False).astype(float)
+    return cleaned.mask(values.isna() | text_result)
 
-def is_valid_cd4(value):
-    # Handle blank (NaN) or empty string.
-    if pd.isna(value) or str(value).strip() == "":
-        return False
-    
-    try:
-        numeric_value = float(value)
-        return numeric_value <= 1600
-    except (ValueError, TypeError):
-        return False
-
-def grt_cd4(value):
-    if pd.isna(value) or str(value).strip() == "":
-        return False
-    
-    try:
-        numeric_value = float(value)
-        return numeric_value > 1600
-    except (ValueError, TypeError):
-        return False
-
-    
 
+def lower_tb_result(values):
+    # 'TB Diagnostic Result' in lowercase for case-insensitive matching, blanks as ''
+    return values.str.lower().fillna('')
 
-# Filters for TX_NEW
-# add all cd4 >1600 to unknown as well as blank
-common_condition_tx_new = (
-    ((combined_data['ART Start Date (yyyy-mm-dd)'] >= Start_of_quarter) &
-    (combined_data['ART Start Date (yyyy-mm-dd)'] <= End_of_quarter)) &
-    (combined_data['Care Entry Point'] != 'Transfer-in') &
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-)
-
-# Use the 'Cleaned Last CD4 Count' for analysis
-first_condition = ((combined_data['Age'] >4) & (~combined_data['Cleaned Last CD4 Count'].isna()) & (combined_data['Cleaned Last CD4 Count'].apply(is_valid_cd4)))
-second_condition = ((combined_data['Age'] <5) | ((combined_data['Age'] >4) & (combined_data['Cleaned Last CD4 Count'].apply(grt_cd4))) | ((combined_data['Age'] >4) & (combined_data['Cleaned Last CD4 Count'].isna())))
-
-
-tx_new_first_condition = combined_data[common_condition_tx_new & first_condition]
-tx_new_second_condition = combined_data[common_condition_tx_new & second_condition]
-tx_new = combined_data[common_condition_tx_new & (first_condition | second_condition)]
-
-# Filters for TX_NEW(P/BF)
-Breastfeeding = (
-    (combined_data['Pregnancy Status'].isin(['Breastfeeding'])) &
-    (combined_data['Sex'] == 'Female')) 
-
-Pregnant = (
-    (combined_data['Pregnancy Status'].isin(['Pregnant'])) &
-    (combined_data['Sex'] == 'Female')) 
-
-Pregnant_and_BF = (
-    (combined_data['Pregnancy Status'].isin(['Pregnant', 'Breastfeeding'])) &
-    (combined_data['Sex'] == 'Female')) 
-
-tx_new_BF = combined_data[common_condition_tx_new & ((first_condition | second_condition) & Breastfeeding)]
-tx_new_Pregnant = combined_data[common_condition_tx_new & ((first_condition | second_condition) & Pregnant)]
-tx_new_Pregnant_and_BF = combined_data[common_condition_tx_new & ((first_condition | second_condition) & Pregnant_and_BF)]
-
-tx_rtt = combined_data[(
-    (combined_data['Current ART Status'].isin(['Active Restart'])) &
-    ((combined_data['Date of Current ART Status'] >= Start_of_quarter) & (combined_data['Date of Current ART Status'] <= End_of_quarter)) &
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    (combined_data['Previous ART Status'].isin(['IIT', 'Stopped Treatment', 'Stopped treatment', 'Invalid - Long-term IIT', 'STOPPED TREATMENT', 'Invalid – Long-term IIT'])) &#.str.contains('IIT', 'Stopped Treatment', 'STOPPED TREATMENT',)) & #, 'Invalid - Long-term IIT', 'Invalid - Long-term IIT','STOPPED TREATMENT' 'Died' 'Stopped Treatment'
-    (combined_data['Confirmed Date of Previous ART Status'] < Start_of_quarter) &
-    (~combined_data['Sex'].isna()) &
-    (~combined_data['Age'].isna()) &
-     (combined_data['Age'] != '')
-    )]
-
-
-# TX_ML
-# Filters for TX_ML (Transferred out)
-# Filters for TX_ML (Died)
-# Filters for TX_ML (Stopped Treatment)
-common_condition_tx_ml = (
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    ((combined_data['Date of Current ART Status'] >= Start_of_quarter) & (combined_data['Date of Current ART Status'] <= End_of_quarter)) &
-    (((combined_data['Previous ART Status'].str.contains('Active')) & (combined_data['Confirmed Date of Previous ART Status'] < Start_of_quarter)) |
-    ((combined_data['Previous ART Status'].isna()) & ((combined_data['ART Start Date (yyyy-mm-dd)'] >= Start_of_quarter) & (combined_data['ART Start Date (yyyy-mm-dd)'] <= End_of_quarter)))))
-
-
-
-Transfer_out = (combined_data['Current ART Status'].str.contains('Transfer')) 
-Died = (combined_data['Current ART Status'].str.contains('Died')) 
-Stopped = (combined_data['Current ART Status'].str.contains('Stop')) 
-
-tx_ml_Transfer_out = combined_data[common_condition_tx_ml & (Transfer_out) & (~combined_data['Sex'].isna()) & ((~combined_data['Age'].isna()) |(~combined_data['Age'] == ''))]
-tx_ml_Died = combined_data[common_condition_tx_ml & (Died) & (~combined_data['Sex'].isna()) & ((~combined_data['Age'].isna()) |(~combined_data['Age'] == ''))]
-tx_ml_Stopped_TX = combined_data[common_condition_tx_ml & (Stopped) & (~combined_data['Sex'].isna()) & ((~combined_data['Age'].isna()) |(~combined_data['Age'] == ''))]
-
-
-# TX_ML(tx_lt_three)
-# TX_ML(tx_btwn_three_to_five)
-# TX_ML(tx_gt_six)
-tx_lt_three = (
-    (((combined_data['Date of Current ART Status'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days >= 0) &
-    ((combined_data['Date of Current ART Status'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days < 90)) &
-    (combined_data['Current ART Status'].isin(['IIT'])))
-
-
-tx_btwn_three_to_five = (
-    (((combined_data['Date of Current ART Status'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days >= 90) &
-    ((combined_data['Date of Current ART Status'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days <= 179)) &
-    (combined_data['Current ART Status'].isin(['IIT'])))
-
-
-tx_gt_six = (
-    ((combined_data['Date of Current ART Status'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days >= 180) &
-(combined_data['Current ART Status'].isin(['IIT'])))
-
-
-tx_ml_IIT = (combined_data[common_condition_tx_ml & (combined_data['Current ART Status'].isin(['IIT'])) & (~combined_data['Sex'].isna())])
-tx_ml_IIT_lt_three = combined_data[common_condition_tx_ml & (tx_lt_three)] 
-tx_ml_IIT_btwn_three_to_five = combined_data[common_condition_tx_ml & (tx_btwn_three_to_five)] 
-tx_ml_IIT_gt_six = combined_data[common_condition_tx_ml & (tx_gt_six)] 
-
-
-# Filter TX_ML_Died Cause of death
-combined_data['Cause of Death'] = combined_data['Cause of Death'].str.lower() #.fillna()
-tx_ml_Died_Unknown = (combined_data[(
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    ((combined_data['Date of Current ART Status'] >= Start_of_quarter) & (combined_data['Date of Current ART Status'] <= End_of_quarter)) &
-    (((combined_data['Previous ART Status'].str.contains('Active')) & (combined_data['Confirmed Date of Previous ART Status'] < Start_of_quarter)) |
-    ((combined_data['Previous ART Status'].isna()) & ((combined_data['ART Start Date (yyyy-mm-dd)'] >= Start_of_quarter) & (combined_data['ART Start Date (yyyy-mm-dd)'] <= End_of_quarter)))) &
-    (combined_data['Current ART Status'].str.contains('Died'))  &
-    (combined_data['Cause of Death'].isin(['Unknown', 'unknown', 'uknown', 'unknown cause'])))
-    ])
-
-tx_ml_Died_Non_natural = (combined_data[(
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    ((combined_data['Date of Current ART Status'] >= Start_of_quarter) & (combined_data['Date of Current ART Status'] <= End_of_quarter)) &
-    (((combined_data['Previous ART Status'].str.contains('Active')) & (combined_data['Confirmed Date of Previous ART Status'] < Start_of_quarter)) |
-    ((combined_data['Previous ART Status'].isna()) & ((combined_data['ART Start Date (yyyy-mm-dd)'] >= Start_of_quarter) & (combined_data['ART Start Date (yyyy-mm-dd)'] <= End_of_quarter)))) &
-    (combined_data['Current ART Status'].str.contains('Died')) &
-    (combined_data['Cause of Death'].isin(['Non-natural causes', 'non-natural causes']))) # 'Suspected ARV Side effect (Specify)',
-    ])
-
-tx_ml_Died_Other_HIV_Disease = (combined_data[(
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    ((combined_data['Date of Current ART Status'] >= Start_of_quarter) & (combined_data['Date of Current ART Status'] <= End_of_quarter)) &
-    (((combined_data['Previous ART Status'].str.contains('Active')) & (combined_data['Confirmed Date of Previous ART Status'] < Start_of_quarter)) |
-    ((combined_data['Previous ART Status'].isna()) & ((combined_data['ART Start Date (yyyy-mm-dd)'] >= Start_of_quarter) & (combined_data['ART Start Date (yyyy-mm-dd)'] <= End_of_quarter)))) &
-    (combined_data['Current ART Status'].str.contains('Died'))  &
-    (combined_data['Cause of Death'].isin(['other hiv disease resulting in other disease or conditions leading to death', 'suspected arv side effect (speciify)'])))
-    ])
-
-tx_ml_Died_other_infectious = (combined_data[(
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    ((combined_data['Date of Current ART Status'] >= Start_of_quarter) & (combined_data['Date of Current ART Status'] <= End_of_quarter)) &
-    (((combined_data['Previous ART Status'].str.contains('Active')) & (combined_data['Confirmed Date of Previous ART Status'] < Start_of_quarter)) |
-    ((combined_data['Previous ART Status'].isna()) & ((combined_data['ART Start Date (yyyy-mm-dd)'] >= Start_of_quarter) & (combined_data['ART Start Date (yyyy-mm-dd)'] <= End_of_quarter)))) &
-    (combined_data['Current ART Status'].str.contains('Died'))  &
-    (combined_data['Cause of Death'].isin(['suspected opportunistic infection (specify)', 'hiv disease resulting in other infectious and parasitic disease'])))
-    ])
-
-tx_ml_Died_TB = (combined_data[(
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    ((combined_data['Date of Current ART Status'] >= Start_of_quarter) & (combined_data['Date of Current ART Status'] <= End_of_quarter)) &
-    (((combined_data['Previous ART Status'].str.contains('Active')) & (combined_data['Confirmed Date of Previous ART Status'] < Start_of_quarter)) |
-    ((combined_data['Previous ART Status'].isna()) & ((combined_data['ART Start Date (yyyy-mm-dd)'] >= Start_of_quarter) & (combined_data['ART Start Date (yyyy-mm-dd)'] <= End_of_quarter)))) &
-    (combined_data['Current ART Status'].str.contains('Died'))  &
-    (combined_data['Cause of Death'].isin(['hiv disease resulting in tb', 'tuberculosis'])))
-    ])
-
-tx_ml_Died_cancer = (combined_data[(
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    ((combined_data['Date of Current ART Status'] >= Start_of_quarter) & (combined_data['Date of Current ART Status'] <= End_of_quarter)) &
-    (((combined_data['Previous ART Status'].str.contains('Active')) & (combined_data['Confirmed Date of Previous ART Status'] < Start_of_quarter)) |
-    ((combined_data['Previous ART Status'].isna()) & ((combined_data['ART Start Date (yyyy-mm-dd)'] >= Start_of_quarter) & (combined_data['ART Start Date (yyyy-mm-dd)'] <= End_of_quarter)))) &
-    (combined_data['Current ART Status'].str.contains('Died')) &
-    (combined_data['Cause of Death'].isin(['hiv-related (cancer,parasitic disease)'])))
-    ])
-
-tx_ml_Died_Other_natural = (combined_data[(
-    ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    ((combined_data['Date of Current ART Status'] >= Start_of_quarter) & (combined_data['Date of Current ART Status'] <= End_of_quarter)) &
-    (((combined_data['Previous ART Status'].str.contains('Active')) & (combined_data['Confirmed Date of Previous ART Status'] < Start_of_quarter)) |
-    ((combined_data['Previous ART Status'].isna()) & ((combined_data['ART Start Date (yyyy-mm-dd)'] >= Start_of_quarter) & (combined_data['ART Start Date (yyyy-mm-dd)'] <= End_of_quarter)))) &
-    (combined_data['Current ART Status'].str.contains('Died')) &
-    (combined_data['Cause of Death'].isin(['other cause of death', 'natural cause', 'other natural causes'])))
-    ])
-
-
-# Filters for CXCA_SCRN
-cxca_scrn = combined_data[
-   (combined_data['Sex'] == 'Female') &
-   (combined_data['Age'] >= 15) &
-   ((combined_data['Date of Cervical Cancer Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of Cervical Cancer Screening (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Cervical Cancer Screening Type'].isin(['First Time Screening', 'Follow-up after previous negative result or suspected cancer', 'Post-treatment Follow-up'])) &
-   (~combined_data['Cervical Cancer Screening Method'].isin([''])) &
-   (combined_data['Result of Cervical Cancer Screening'].isin(['Negative', 'Positive', 'Suspicious for cancer']))]
-
-
-# Filters for CXCA_TX
-cxca_tx = combined_data[
-   (combined_data['Sex'] == 'Female') &
-   (combined_data['Age'] >= 15) &
-   ((combined_data['Date of Cervical Cancer Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of Cervical Cancer Screening (yyyy-mm-dd)'] <= End_of_quarter)) &
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    (combined_data['Current ART Status'].str.contains('Active')) &
-   (combined_data['Cervical Cancer Screening Type'].isin(['First Time Screening', 'Follow-up after previous negative result or suspected cancer', 'Post-treatment Follow-up'])) &
-   (~combined_data['Cervical Cancer Screening Method'].isin([''])) &
-   (combined_data['Result of Cervical Cancer Screening'].str.contains('Positive')) &
-   ((combined_data['Date of Precancerous Lesions Treatment (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of Precancerous Lesions Treatment (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['Cervical Cancer Screening Method'].isna())
-#    (combined_data['Precancerous Lesions Treatment Methods'].str.contains('cryotherapy', 'LEEP', 'Thermal'))
-]
 
 
-#Filters for TX_TB_D (include this if needed:Disaggregated by already/new on ART and TB Status)
-tx_tb_d = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['TB status'].str.contains('Presumptive TB|No signs or symptoms of TB|No sign or symptoms of TB|Presumptive TB and referred for evaluation|TB Suspected and referred for evaluation|Confirmed TB|Currently on TPT')) |
-   ((combined_data['TB status'].isin(['Currently on TB treatment'])) & ((combined_data['Date of Start of TB Treatment (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of Start of TB Treatment (yyyy-mm-dd)'] <=End_of_quarter)))) &
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray with CAD','Chest X-ray', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-   (~combined_data['TB status'].isna())
-   ]
-
-
-
-tx_tb_d_old_scrnpos = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['TB status'].str.contains('Presumptive TB|Presumptive TB and referred for evaluation|TB Suspected and referred for evaluation|Confirmed TB')) |
-   ((combined_data['TB status'].isin(['Currently on TB treatment'])) & ((combined_data['Date of Start of TB Treatment (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of Start of TB Treatment (yyyy-mm-dd)'] <=End_of_quarter)))) &
-   (combined_data['ART Start Date (yyyy-mm-dd)'] < six_months_ago) &
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray with CAD', 'Chest X-ray','Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-   (~combined_data['TB status'].isna())
-   ]
-
-tx_tb_d_new_scrnpos = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['TB status'].str.contains('Presumptive TB|Presumptive TB and referred for evaluation|TB Suspected and referred for evaluation|Confirmed TB')) |
-   ((combined_data['TB status'].isin(['Currently on TB treatment'])) & ((combined_data['Date of Start of TB Treatment (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of Start of TB Treatment (yyyy-mm-dd)'] <=End_of_quarter)))) &
-   ((combined_data['ART Start Date (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['ART Start Date (yyyy-mm-dd)'] <=End_of_quarter)) &
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray with CAD', 'Chest X-ray','Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-   (~combined_data['TB status'].isna())
-   ]
-
-tx_tb_d_old_scrnneg = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   (combined_data['TB status'].str.contains('No signs or symptoms of TB|No sign or symptoms of TB|Currently on TPT')) &
-   (combined_data['ART Start Date (yyyy-mm-dd)'] < six_months_ago) &
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD','Chest X-ray', 'Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-   (~combined_data['TB status'].isna())
-   ]
-
-
-tx_tb_d_new_scrnneg = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   (combined_data['TB status'].str.contains('No signs or symptoms of TB|No sign or symptoms of TB|Currently on TPT')) &
-   ((combined_data['ART Start Date (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['ART Start Date (yyyy-mm-dd)'] <=End_of_quarter)) &
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray with CAD','Chest X-ray', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-   (~combined_data['TB status'].isna())
-   ]
-
- # Filters for TX_TB_D (Screening type)
-tx_tb_d_Screening_type = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['TB status'].str.contains('Presumptive TB|No signs or symptoms of TB|No sign or symptoms of TB|TB Suspected and referred for evaluation|Presumptive TB and referred for evaluation|Confirmed TB|Currently on TPT')) |
-   ((combined_data['TB status'].isin(['Currently on TB treatment'])) & ((combined_data['Date of Start of TB Treatment (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of Start of TB Treatment (yyyy-mm-dd)'] <=End_of_quarter)))) &
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray with CAD','Chest X-ray', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-   (~combined_data['TB status'].isna())
-#    ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-   ]
-
-# Filters for TX_TB_D (Specimen sent)
-tx_tb_d_Specimen_sent = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) &
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray with CAD','Chest X-ray', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-   (combined_data['TB status'].str.contains('Presumptive TB|Presumptive TB and referred for evaluation|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter))
-   ]
-
-
-# 'TB Diagnostic Result' to lowercase for case-insensitive matching
-combined_data['TB Diagnostic Result'] = combined_data['TB Diagnostic Result'].str.lower().fillna('')
-
-
-# Define the pattern for positive and negative results
+# --- TB DIAGNOSTIC RESULT CLASSIFIER ---
+# Patterns for positive and negative results (matched against the lowercase 'TB Diagnostic Result')
 pos_neg_pattern = r'pos|neg|\+|\-|\_|\+ve|\-ve|nag|p0s|nrg|pso|ng|ned'
 chest_x_ray_pos_neg_pattern = r'not sugestive|suggestive|mbt detectected|mt detected|mt not detected|mtb n0t detected|dectected|mtb not detectd|not detected|detected|dtected|detectted|detectd|dedected|detect|mtbd|deteted|dectected|\-mtb'
 mtb_pos_neg_pattern = r'mbt detectected|mt detected|mt not detected|mtb n0t detected|dectected|mtb not detectd|not detected|detected|dtected|detectted|detectd|dedected|detect|mtbd|deteted|mtb trace|dectected|\-mtb|error|incomplete|invalid'
@@ -782,641 +256,720 @@ mtb_pos_pattern = r'^(mtb detected|mbt detectected|mt detected|detected|mtbdetec
 tb_pos_exclusion_pattern = r'(?:TB\s+(?:positive|pos|p0s))'
 afb_pos_exclusion_pattern = r'(?:AFB\s+(?:positive|pos|p0s))'
 
+# TB test families and the result rules of each diagnostic test type:
+# (family, test type pattern, result reported, result positive), the rules as functions of the result matches
+tb_test_types = [
+    ('Xpert', 'Gene Xpert', lambda r: r['mtb_pos_neg'], lambda r: r['mtb_pos']),
+    ('TrueNAT', 'TrueNAT', lambda r: r['mtb_pos_neg'], lambda r: r['mtb_pos']),
+    ('LAM', 'LF-LAM|TB LAMP',
+     lambda r: r['pos_neg'] & ~r['tb_excluded'] & ~r['afb_excluded'],
+     lambda r: r['pos'] & ~r['tb_pos_excluded'] & ~r['afb_pos_excluded']),
+    ('LAM', 'TB-LAM', lambda r: r['pos_neg'] & ~r['afb_excluded'], lambda r: r['pos'] & ~r['afb_pos_excluded']),
+    ('AFB', 'AFB Smear Microscopy', lambda r: r['pos_neg'] & ~r['tb_excluded'], lambda r: r['pos'] & ~r['tb_pos_excluded']),
+    ('X-ray', 'Chest X-ray', lambda r: r['chest_x_ray_pos_neg'], lambda r: r['chest_x_ray_pos']),
+    ('Clinical', 'Clinical evaluation only',
+     lambda r: r['pos_neg'] & ~r['tb_excluded'] & ~r['afb_excluded'],
+     lambda r: r['pos'] & ~r['tb_pos_excluded'] & ~r['afb_pos_excluded']),
+]
+tb_test_families = ['Xpert', 'TrueNAT', 'LAM', 'AFB', 'X-ray', 'Clinical']
+tb_result_classes = ['pos', 'neg', 'invalid', 'none']
 
-tx_tb_d_TB_Test_Type = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Presumptive TB and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-    ((combined_data['TB Diagnostic Test Type'].str.contains('LF-LAM|TB LAMP|Clinical evaluation only', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_neg_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(tb_exclusion_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(afb_exclusion_pattern, na=False)))  |
-
-    ((combined_data['TB Diagnostic Test Type'].str.contains('AFB Smear Microscopy', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_neg_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(tb_exclusion_pattern, na=False)))    |
-    
-    ((combined_data['TB Diagnostic Test Type'].str.contains('TB-LAM', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_neg_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(afb_exclusion_pattern, na=False)))   |
-     
-    ((combined_data['TB Diagnostic Test Type'].str.contains('Chest X-ray', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(chest_x_ray_pos_neg_pattern, na=False)))   |
-     
-    ((combined_data['TB Diagnostic Test Type'].str.contains('Gene Xpert|TrueNAT', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(mtb_pos_neg_pattern, na=False)))
-    )
-    ]
 
-tx_tb_d_TB_Test_Type_Xpert = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-         
-    ((combined_data['TB Diagnostic Test Type'].str.contains('Gene Xpert', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(mtb_pos_neg_pattern, na=False)))
+def classify_tb_result(pairs):
+    """
+    Classifies distinct ('TB Diagnostic Test Type', 'TB Diagnostic Result') pairs.
+    Returns, per pair:
+      tb_test_family     the test families named by the test type ('Xpert', 'LAM', ..., or
+                         'Xpert/TrueNAT' for a test type naming several); NaN when none
+      tb_result_reported a result (positive or negative) was reported under the rules of the test type
+      tb_result_class    'pos' for a positive result, 'invalid' for a reported error/invalid/incomplete
+                         result, 'neg' for any other reported result and 'none' otherwise
+    """
+    test_type = pairs['TB Diagnostic Test Type']
+    result = pairs['TB Diagnostic Result']
+    matches = {
+        'pos_neg': result.str.contains(pos_neg_pattern, na=False),
+        'chest_x_ray_pos_neg': result.str.contains(chest_x_ray_pos_neg_pattern, na=False),
+        'mtb_pos_neg': result.str.contains(mtb_pos_neg_pattern, na=False),
+        'tb_excluded': result.str.contains(tb_exclusion_pattern, na=False),
+        'afb_excluded': result.str.contains(afb_exclusion_pattern, na=False),
+        'pos': result.str.contains(pos_pattern, na=False),
+        'chest_x_ray_pos': result.str.contains(chest_x_ray_pos_pattern, na=False),
+        'mtb_pos': result.str.contains(mtb_pos_pattern, na=False),
+        'tb_pos_excluded': result.str.contains(tb_pos_exclusion_pattern, na=False),
+        'afb_pos_excluded': result.str.contains(afb_pos_exclusion_pattern, na=False),
+    }
+
+    families = pd.Series('', index=pairs.index)
+    reported = pd.Series(False, index=pairs.index)
+    positive = pd.Series(False, index=pairs.index)
+    for family, test_type_pattern, is_reported, is_positive in tb_test_types:
+        is_test = test_type.str.contains(test_type_pattern, na=False)
+        named = is_test & ~families.str.split('/').map(lambda names: family in names)
+        families[named] = families[named] + '/' + family
+        reported |= is_test & is_reported(matches)
+        positive |= is_test & is_positive(matches)
+    families = families.str.strip('/').replace('', pd.NA)
+
+    result_class = pd.Series('none', index=pairs.index)
+    result_class[reported] = 'neg'
+    result_class[reported & result.str.contains('error|incomplete|invalid', na=False)] = 'invalid'
+    result_class[positive] = 'pos'
+
+    return pd.DataFrame({
+        'tb_test_family': families.astype('category'),
+        'tb_result_reported': reported,
+        'tb_result_class': pd.Categorical(result_class, categories=tb_result_classes),
+    })
+
+
+# Indicator filters of one reporting period (Start_of_quarter to End_of_quarter, with six_months_ago
+# the start of its semi-annual period). Returns the (name, mask) pair of every indicator, in the column
+# order of the summary. Only reads combined_data, so it can be called once per period of a trend run.
+def period_indicators(combined_data, Start_of_quarter, End_of_quarter, six_months_ago):
+    vl_start = End_of_quarter - pd.DateOffset(months=12, days=-1) #12 months from the end of the quarter
+    End_of_vl_month = Start_of_quarter + pd.DateOffset(months=4, days=-1) #taking into consideration the one month of result received for vl samples collected within the 12 months period
+
+    # Shared filter predicates. Each condition below is evaluated once over the whole dataset the
+    # first time an indicator uses it and cached as a boolean array (see mask_engine.py); the
+    # indicator filters combine the cached arrays instead of re-evaluating the same checks.
+    m = MaskEngine(combined_data)
+
+    # Valid (or blank) 'Client Verification Outcome'
+    m.define('verified', lambda d:
+        (d['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
+        (d['Client Verification Outcome'].isna()) | # Catches np.nan
+        (d['Client Verification Outcome'] == '') | # Catches explicit empty strings
+        (d['Client Verification Outcome'].str.strip() == ''))
+    m.define('sex_age_known', lambda d: (~d['Sex'].isna()) & (~d['Age'].isna()) & (d['Age'] != ''))
+    m.define('female', lambda d: d['Sex'] == 'Female')
+    m.define('female_age_known', lambda d: (d['Sex'] == 'Female') & (~d['Age'].isna()) & (d['Age'] != ''))
+    m.define('active', lambda d: d['Current ART Status'].str.contains('Active', na=False))
+    m.define('active_or_restart', lambda d: d['Current ART Status'].isin(['Active', 'Active Restart']))
+    m.define('pregnant', lambda d: d['Pregnancy Status'] == 'Pregnant')
+    m.define('breastfeeding', lambda d: d['Pregnancy Status'] == 'Breastfeeding')
+    m.define('pregnant_or_breastfeeding', lambda d: d['Pregnancy Status'].isin(['Pregnant', 'Breastfeeding']))
+    m.define('started_art_in_quarter', lambda d:
+        (d['ART Start Date (yyyy-mm-dd)'] >= Start_of_quarter) & (d['ART Start Date (yyyy-mm-dd)'] <= End_of_quarter))
+    m.define('art_status_changed_in_quarter', lambda d:
+        (d['Date of Current ART Status'] >= Start_of_quarter) & (d['Date of Current ART Status'] <= End_of_quarter))
+
+    # Viral load: sample and result dates inside the VL period, sample taken 180+ days after ART start
+    m.define('vl_in_period', lambda d:
+        (d['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] >= vl_start) &
+        (d['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] <= End_of_quarter) &
+        (d['Date of Current Viral Load (yyyy-mm-dd)'] >= vl_start) &
+        (d['Date of Current Viral Load (yyyy-mm-dd)'] <= End_of_vl_month))
+    m.define('vl_180_days_on_art', lambda d:
+        (d['Date of Current ViralLoad Result Sample (yyyy-mm-dd)'] - d['ART Start Date (yyyy-mm-dd)']).dt.days >= 180)
+    m.define('vl_suppressed', lambda d:
+        d['Cleaned Current Viral Load (c/ml)'].between(0, 999, inclusive='both'))
+    m.define('tx_pvls_d', lambda d: m.all_of('active_or_restart', 'verified', 'vl_in_period', 'vl_180_days_on_art'))
+
+
+    # Filters for TX_CURR
+    tx_curr = m.all_of('active', 'verified', 'sex_age_known')
+
+
+
+    # Filters for TX_CURR-ARV Dispense
+    tx_curr_ARV_Disp = (
+        m.all_of('active_or_restart', 'verified', 'sex_age_known') &
+        (~(combined_data['Months of ARV Refill'].isna()) | ~(combined_data['Months of ARV Refill'] == 0.0))
     )
-    ]
 
-tx_tb_d_TB_Test_Type_TrueNAT = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-         
-    ((combined_data['TB Diagnostic Test Type'].str.contains('TrueNAT', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(mtb_pos_neg_pattern, na=False)))
+    vl_eligibility = m.all_of('active_or_restart', 'verified', 'vl_180_days_on_art', 'sex_age_known')
+
+    # Filters for TX_PVLS_D
+    tx_pvls_d = m.all_of('tx_pvls_d', 'sex_age_known')
+    tx_pvls_d_pbf = m.all_of('tx_pvls_d', 'pregnant_or_breastfeeding', 'female_age_known')
+    tx_pvls_d_pregnant = m.all_of('tx_pvls_d', 'pregnant', 'female_age_known')
+    tx_pvls_d_breastfeeding = m.all_of('tx_pvls_d', 'breastfeeding', 'female_age_known')
+
+
+    # Filters for TX_PVLS_N
+    tx_pvls_n = m.all_of('tx_pvls_d', 'vl_suppressed', 'sex_age_known')
+    tx_pvls_n_pbf = m.all_of('tx_pvls_d', 'vl_suppressed', 'pregnant_or_breastfeeding', 'female_age_known')
+    tx_pvls_n_pregnant = m.all_of('tx_pvls_d', 'vl_suppressed', 'pregnant', 'female_age_known')
+    tx_pvls_n_breastfeeding = m.all_of('tx_pvls_d', 'vl_suppressed', 'breastfeeding', 'female_age_known')
+
+
+    # Filters for TX_NEW
+    # add all cd4 >1600 to unknown as well as blank
+    m.define('tx_new', lambda d:
+        m.all_of('started_art_in_quarter', 'verified', 'sex_age_known') &
+        (d['Care Entry Point'] != 'Transfer-in'))
+
+    m.define('cd4_le_1600', lambda d: (d['Age'] >4) & d['cd4_le_1600'])
+    m.define('cd4_gt_1600_or_unknown', lambda d: (d['Age'] <5) | ((d['Age'] >4) & d['cd4_gt_1600']) | ((d['Age'] >4) & (d['Cleaned Last CD4 Count'].isna())))
+    m.define('tx_new_with_cd4', lambda d: m['tx_new'] & m.any_of('cd4_le_1600', 'cd4_gt_1600_or_unknown'))
+
+
+    tx_new_first_condition = m.all_of('tx_new', 'cd4_le_1600')
+    tx_new_second_condition = m.all_of('tx_new', 'cd4_gt_1600_or_unknown')
+    tx_new = m['tx_new_with_cd4']
+
+    # Filters for TX_NEW(P/BF)
+    tx_new_BF = m.all_of('tx_new_with_cd4', 'breastfeeding', 'female')
+    tx_new_Pregnant = m.all_of('tx_new_with_cd4', 'pregnant', 'female')
+    tx_new_Pregnant_and_BF = m.all_of('tx_new_with_cd4', 'pregnant_or_breastfeeding', 'female')
+
+    tx_rtt = (
+        m.all_of('art_status_changed_in_quarter', 'verified', 'sex_age_known') &
+        (combined_data['Current ART Status'].isin(['Active Restart'])) &
+        (combined_data['Previous ART Status'].isin(['IIT', 'Stopped Treatment', 'Stopped treatment', 'Invalid - Long-term IIT', 'STOPPED TREATMENT', 'Invalid – Long-term IIT'])) &#.str.contains('IIT', 'Stopped Treatment', 'STOPPED TREATMENT',)) & #, 'Invalid - Long-term IIT', 'Invalid - Long-term IIT','STOPPED TREATMENT' 'Died' 'Stopped Treatment'
+        (combined_data['Confirmed Date of Previous ART Status'] < Start_of_quarter)
+        )
+
+
+    # TX_ML
+    # Filters for TX_ML (Transferred out)
+    # Filters for TX_ML (Died)
+    # Filters for TX_ML (Stopped Treatment)
+    # Active before the quarter, or new on ART this quarter, and the status changed during the quarter
+    m.define('tx_ml', lambda d:
+        m.all_of('verified', 'art_status_changed_in_quarter') &
+        (((d['Previous ART Status'].str.contains('Active', na=False)) & (d['Confirmed Date of Previous ART Status'] < Start_of_quarter)) |
+        ((d['Previous ART Status'].isna()) & m['started_art_in_quarter'])))
+    m.define('tx_ml_sex_age_known', lambda d: (~d['Sex'].isna()) & ((~d['Age'].isna()) |(~d['Age'] == '')))
+    m.define('transferred_out', lambda d: d['Current ART Status'].str.contains('Transfer', na=False))
+    m.define('died', lambda d: d['Current ART Status'].str.contains('Died', na=False))
+    m.define('stopped', lambda d: d['Current ART Status'].str.contains('Stop', na=False))
+    m.define('iit', lambda d: d['Current ART Status'].isin(['IIT']))
+
+    tx_ml_Transfer_out = m.all_of('tx_ml', 'transferred_out', 'tx_ml_sex_age_known')
+    tx_ml_Died = m.all_of('tx_ml', 'died', 'tx_ml_sex_age_known')
+    tx_ml_Stopped_TX = m.all_of('tx_ml', 'stopped', 'tx_ml_sex_age_known')
+
+
+    # TX_ML(tx_lt_three)
+    # TX_ML(tx_btwn_three_to_five)
+    # TX_ML(tx_gt_six)
+    days_on_art = (combined_data['Date of Current ART Status'] - combined_data['ART Start Date (yyyy-mm-dd)']).dt.days
+    tx_lt_three = (days_on_art >= 0) & (days_on_art < 90)
+    tx_btwn_three_to_five = (days_on_art >= 90) & (days_on_art <= 179)
+    tx_gt_six = days_on_art >= 180
+
+
+    tx_ml_IIT = m.all_of('tx_ml', 'iit') & (~combined_data['Sex'].isna())
+    tx_ml_IIT_lt_three = m.all_of('tx_ml', 'iit') & tx_lt_three
+    tx_ml_IIT_btwn_three_to_five = m.all_of('tx_ml', 'iit') & tx_btwn_three_to_five
+    tx_ml_IIT_gt_six = m.all_of('tx_ml', 'iit') & tx_gt_six
+
+
+    # Filter TX_ML_Died Cause of death
+    tx_ml_died = m.all_of('tx_ml', 'died')
+    tx_ml_Died_Unknown = tx_ml_died & (combined_data['Cause of Death'].isin(['Unknown', 'unknown', 'uknown', 'unknown cause']))
+    tx_ml_Died_Non_natural = tx_ml_died & (combined_data['Cause of Death'].isin(['Non-natural causes', 'non-natural causes'])) # 'Suspected ARV Side effect (Specify)',
+    tx_ml_Died_Other_HIV_Disease = tx_ml_died & (combined_data['Cause of Death'].isin(['other hiv disease resulting in other disease or conditions leading to death', 'suspected arv side effect (speciify)']))
+    tx_ml_Died_other_infectious = tx_ml_died & (combined_data['Cause of Death'].isin(['suspected opportunistic infection (specify)', 'hiv disease resulting in other infectious and parasitic disease']))
+    tx_ml_Died_TB = tx_ml_died & (combined_data['Cause of Death'].isin(['hiv disease resulting in tb', 'tuberculosis']))
+    tx_ml_Died_cancer = tx_ml_died & (combined_data['Cause of Death'].isin(['hiv-related (cancer,parasitic disease)']))
+    tx_ml_Died_Other_natural = tx_ml_died & (combined_data['Cause of Death'].isin(['other cause of death', 'natural cause', 'other natural causes']))
+
+
+    # Women 15+ on ART screened for cervical cancer in the last six months
+    m.define('cxca_screened', lambda d:
+        m.all_of('female', 'active', 'verified') &
+        (d['Age'] >= 15) &
+        ((d['Date of Cervical Cancer Screening (yyyy-mm-dd)'] >= six_months_ago) & (d['Date of Cervical Cancer Screening (yyyy-mm-dd)'] <= End_of_quarter)) &
+        (d['Cervical Cancer Screening Type'].isin(['First Time Screening', 'Follow-up after previous negative result or suspected cancer', 'Post-treatment Follow-up'])) &
+        (~d['Cervical Cancer Screening Method'].isin([''])))
+
+    # Filters for CXCA_SCRN
+    cxca_scrn = (
+       m['cxca_screened'] &
+       (combined_data['Result of Cervical Cancer Screening'].isin(['Negative', 'Positive', 'Suspicious for cancer'])))
+
+
+    # Filters for CXCA_TX
+    cxca_tx = (
+       m['cxca_screened'] &
+       (combined_data['Result of Cervical Cancer Screening'].str.contains('Positive', na=False)) &
+       ((combined_data['Date of Precancerous Lesions Treatment (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of Precancerous Lesions Treatment (yyyy-mm-dd)'] <= End_of_quarter)) &
+       (~combined_data['Cervical Cancer Screening Method'].isna())
+    #    (combined_data['Precancerous Lesions Treatment Methods'].str.contains('cryotherapy', 'LEEP', 'Thermal'))
     )
-    ]
 
-tx_tb_d_TB_Test_Type_Xray = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-    
-    ((combined_data['TB Diagnostic Test Type'].str.contains('Chest X-ray', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(chest_x_ray_pos_neg_pattern, na=False)))  
-    )
-    ]
 
-tx_tb_d_TB_Test_Type_LAM = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-        
-    ((combined_data['TB Diagnostic Test Type'].str.contains('TB-LAM', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_neg_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(afb_exclusion_pattern, na=False))) |
-
-    ((combined_data['TB Diagnostic Test Type'].str.contains('LF-LAM|TB LAMP', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_neg_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(tb_exclusion_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(afb_exclusion_pattern, na=False))) 
-     
-    )
+    # Verified clients on ART screened for TB in the last six months with an accepted screening type
+    m.define('tb_screened', lambda d:
+        m.all_of('verified', 'active') &
+        ((d['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (d['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) &
+        (d['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray with CAD', 'Chest X-ray', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)'])) &
+        (~d['TB status'].isna()))
+    m.define('tb_screen_positive', lambda d:
+        (d['TB status'].str.contains('Presumptive TB|Presumptive TB and referred for evaluation|TB Suspected and referred for evaluation|Confirmed TB', na=False)) |
+        ((d['TB status'].isin(['Currently on TB treatment'])) & ((d['Date of Start of TB Treatment (yyyy-mm-dd)'] >= six_months_ago) & (d['Date of Start of TB Treatment (yyyy-mm-dd)'] <=End_of_quarter))))
+    m.define('tb_screen_negative', lambda d: d['TB status'].str.contains('No signs or symptoms of TB|No sign or symptoms of TB|Currently on TPT', na=False))
+    m.define('art_start_before_six_months', lambda d: d['ART Start Date (yyyy-mm-dd)'] < six_months_ago)
+    m.define('art_start_in_six_months', lambda d: (d['ART Start Date (yyyy-mm-dd)'] >= six_months_ago) & (d['ART Start Date (yyyy-mm-dd)'] <=End_of_quarter))
+    m.define('tb_presumptive', lambda d: d['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Presumptive TB and referred for evaluation|Confirmed TB|Currently on TB treatment', na=False))
+    m.define('tb_specimen_sent', lambda d:
+        m.all_of('tb_screened', 'tb_presumptive') &
+        ((d['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (d['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)))
+
+    #Filters for TX_TB_D (include this if needed:Disaggregated by already/new on ART and TB Status)
+    tx_tb_d = m['tb_screened'] & m.any_of('tb_screen_positive', 'tb_screen_negative')
+
+    tx_tb_d_old_scrnpos = m.all_of('tb_screened', 'tb_screen_positive', 'art_start_before_six_months')
+    tx_tb_d_new_scrnpos = m.all_of('tb_screened', 'tb_screen_positive', 'art_start_in_six_months')
+    tx_tb_d_old_scrnneg = m.all_of('tb_screened', 'tb_screen_negative', 'art_start_before_six_months')
+    tx_tb_d_new_scrnneg = m.all_of('tb_screened', 'tb_screen_negative', 'art_start_in_six_months')
+
+     # Filters for TX_TB_D (Screening type)
+    tx_tb_d_Screening_type = m['tb_screened'] & m.any_of('tb_screen_positive', 'tb_screen_negative')
+
+    # Filters for TX_TB_D (Specimen sent)
+    tx_tb_d_Specimen_sent = m['tb_specimen_sent']
+
+
+    # Specimen sent, test type recorded and result received within the last six months
+    m.define('tb_result_received', lambda d:
+        m['tb_specimen_sent'] &
+        (~d['TB Diagnostic Test Type'].isna()) &
+        ((d['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (d['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)))
+
+
+    # A result (positive or negative) was reported, a positive result was reported
+    m.define('tb_reported', lambda d: d['tb_result_reported'])
+    m.define('tb_positive', lambda d: d['tb_result_class'] == 'pos')
+
+    # The test type names the test family (a test type such as 'Gene Xpert/TrueNAT' names several)
+    for family in tb_test_families:
+        family_labels = [label for label in combined_data['tb_test_family'].cat.categories if family in label.split('/')]
+        m.define(f'family_{family}', lambda d, family_labels=family_labels: d['tb_test_family'].isin(family_labels))
+
+
+    tx_tb_d_TB_Test_Type = m.all_of('tb_result_received', 'tb_reported')
+    tx_tb_d_TB_Test_Type_Xpert = m.all_of('tb_result_received', 'tb_reported', 'family_Xpert')
+    tx_tb_d_TB_Test_Type_TrueNAT = m.all_of('tb_result_received', 'tb_reported', 'family_TrueNAT')
+    tx_tb_d_TB_Test_Type_Xray = m.all_of('tb_result_received', 'tb_reported', 'family_X-ray')
+    tx_tb_d_TB_Test_Type_LAM = m.all_of('tb_result_received', 'tb_reported', 'family_LAM')
+    tx_tb_d_TB_Test_Type_AFB = m.all_of('tb_result_received', 'tb_reported', 'family_AFB')
+    tx_tb_d_TB_Test_Type_Clinical = m.all_of('tb_result_received', 'tb_reported', 'family_Clinical')
+
+
+    # Filters for TX_TB_D (Result Returned)
+    tx_tb_d_Result_returned = m.all_of('tb_result_received', 'tb_positive')
+    tx_tb_d_Result_returned_Xray = m.all_of('tb_result_received', 'tb_positive', 'family_X-ray')
+    tx_tb_d_Result_returned_Xpert = m.all_of('tb_result_received', 'tb_positive', 'family_Xpert')
+    tx_tb_d_Result_returned_TrueNAT = m.all_of('tb_result_received', 'tb_positive', 'family_TrueNAT')
+    tx_tb_d_Result_returned_LAM = m.all_of('tb_result_received', 'tb_positive', 'family_LAM')
+    tx_tb_d_Result_returned_Clinical = m.all_of('tb_result_received', 'tb_positive', 'family_Clinical')
+    tx_tb_d_Result_returned_AFB = m.all_of('tb_result_received', 'tb_positive', 'family_AFB')
+
+
+    # Filters for TX_TB_N (Started on TB Treatment)
+    tx_tb_n = (
+        m.all_of('tb_result_received', 'tb_positive') &
+        ((combined_data['Date of Start of TB Treatment (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of Start of TB Treatment (yyyy-mm-dd)'] <= End_of_quarter)))
+    # Define the target start and completion date ranges
+    #Print the date out just to confirm again
+    threehp_period1_start = Start_of_quarter - pd.DateOffset(months=9) #six months from the start of the new semi-annual period
+    threehp_period1_end = Start_of_quarter - pd.DateOffset(months=6, days=1) #end of last six months from the start of the new semi-annual period
+
+    threehp_period2_start = Start_of_quarter - pd.DateOffset(months=6)  #six months from the start of the new semi-annual period
+    threehp_period2_end = Start_of_quarter - pd.DateOffset(months=3, days=1) #end of last six months from the start of a new semi-annual period
+
+
+    inh_period1_start = Start_of_quarter - pd.DateOffset(months=9) #six months from the start of the new semi-annual period
+    inh_period1_end = Start_of_quarter - pd.DateOffset(months=3, days=1) #end of last three months from the start of a new semi-annual period
+
+    completion_period1_start = Start_of_quarter - pd.DateOffset(months=6)  #six months from the start of the new semi-annual period  
+    completion_period2_start = Start_of_quarter - pd.DateOffset(months=3)  #three months from the start of the new semi-annual period  
+    completion_period1_end = End_of_quarter
+
+
+
+
+    # Filters for TB_PREV_N
+    # Filter the DataFrame based on the conditions
+    m.define('tpt_3hp', lambda d: d['TPT Type'].str.contains('(3HP)|(3HR)', na=False)) #'Isoniazid and Rifapentine-(3HP)', 'Isoniazid and Rifampicin-(3HR)'
+    m.define('tpt_not_3hp', lambda d: ~((d['TPT Type'].str.contains('(3HP)|(3HR)')) & (d['TPT Type'].isna())))
+    m.define('tpt_completed', lambda d: d['TPT Completion status'].str.contains('Treatment Completed|Treatment success|Completed|completed', na=False))
+    m.define('tpt_3hp_started_period1', lambda d:
+        m['tpt_3hp'] &
+        (d['Date of TPT Start (yyyy-mm-dd)'] >= threehp_period1_start) & #Oct 2024
+        (d['Date of TPT Start (yyyy-mm-dd)'] <= threehp_period1_end)) #Dec 2024
+    m.define('tpt_3hp_started_period2', lambda d:
+        m['tpt_3hp'] &
+        (d['Date of TPT Start (yyyy-mm-dd)'] >= threehp_period2_start) & #Jan 2025
+        (d['Date of TPT Start (yyyy-mm-dd)'] <= threehp_period2_end)) #Mar 2025
+    m.define('tpt_inh_started', lambda d:
+        m['tpt_not_3hp'] &
+        (d['Date of TPT Start (yyyy-mm-dd)'] >= inh_period1_start) & #Oct 2024
+        (d['Date of TPT Start (yyyy-mm-dd)'] <= inh_period1_end)) #Mar 2025
+
+    # Condition for 3HP 
+    tb_prev_n_3HP_6mths = (
+            m.all_of('tpt_3hp_started_period1', 'tpt_completed') &
+            (combined_data['TPT Completion date (yyyy-mm-dd)'] >= completion_period1_start) & #Jan 2025
+            (combined_data['TPT Completion date (yyyy-mm-dd)'] <= completion_period1_end)) #Sept 2025
+
+
+    # Condition for 3HP      
+    tb_prev_n_3HP_3mths = (
+            m.all_of('tpt_3hp_started_period2', 'tpt_completed') &
+            (combined_data['TPT Completion date (yyyy-mm-dd)'] >= completion_period2_start) & #April 2025
+            (combined_data['TPT Completion date (yyyy-mm-dd)'] <= completion_period1_end)) #Sept 2025
+
+
+    # Condition for INH       
+    tb_prev_n_INH = (
+            m.all_of('tpt_inh_started', 'tpt_completed') &
+            (combined_data['TPT Completion date (yyyy-mm-dd)'] >= six_months_ago) & #April 2025
+            (combined_data['TPT Completion date (yyyy-mm-dd)'] <= End_of_quarter)) #September 2025
+
+
+    m.define('tb_prev', lambda d:
+        ((d['Client Verification Outcome'].isin(['valid'])) |
+         (d['Client Verification Outcome'].isna()) | # Catches np.nan
+         (d['Client Verification Outcome'] == '') | # Catches explicit empty strings
+         (d['Client Verification Outcome'].str.strip() == '')) &
+        (d['Current ART Status'].str.contains('Active|IIT|Stopped Treatment|Transferred Out|Died', na=False)))
+
+    m.define('transfer_in_before_six_months', lambda d: (d['Care Entry Point'].str.contains('Transfer-in', na=False)) & (d['Date of Registration'] < six_months_ago))
+
+
+    # Filters for TB_PREV_D
+    tb_prev_n = m['tb_prev'] & (tb_prev_n_3HP_6mths | tb_prev_n_3HP_3mths | tb_prev_n_INH)
+    tb_prev_d = m['tb_prev'] & m.any_of('tpt_3hp_started_period1', 'tpt_3hp_started_period2', 'tpt_inh_started') #'transfer_in_before_six_months' |
+
+    # Every indicator is a boolean row mask; all of them are counted per facility at once
+    # (one grouped sum over the masks), in the column order of the summary below
+    indicators = [
+        ('TX_CURR', tx_curr),
+        ('TX_CURR_ARV_DISP', tx_curr_ARV_Disp),
+        ('VL_ELIGIBILITY', vl_eligibility),
+        ('TX_PVLS_D', tx_pvls_d),
+        ('TX_PVLS_D_PBF', tx_pvls_d_pbf),
+        ('TX_PVLS_D_Pregnant', tx_pvls_d_pregnant),
+        ('TX_PVLS_D_Breastfeeding', tx_pvls_d_breastfeeding),
+        ('TX_PVLS_N', tx_pvls_n),
+        ('TX_PVLS_N_PBF', tx_pvls_n_pbf),
+        ('TX_PVLS_N_Pregnant', tx_pvls_n_pregnant),
+        ('TX_PVLS_N_Breastfeeding', tx_pvls_n_breastfeeding),
+        ('TX_NEW', tx_new),
+        ('TX_NEW_BF', tx_new_BF),
+        ('TX_RTT', tx_rtt),
+        ('TX_ML_Stopped_TX', tx_ml_Stopped_TX),
+        ('TX_ML_Died', tx_ml_Died),
+        ('TX_ML_Transfer_out', tx_ml_Transfer_out),
+        ('TX_ML_IIT', tx_ml_IIT),
+        ('IIT<3', tx_ml_IIT_lt_three),
+        ('IIT3-5', tx_ml_IIT_btwn_three_to_five),
+        ('IIT>=6', tx_ml_IIT_gt_six),
+        ('TX_ML_Died_Unknown', tx_ml_Died_Unknown),
+        ('TX_ML_Died_cancer', tx_ml_Died_cancer),
+        ('TX_ML_Died_Non_natural', tx_ml_Died_Non_natural),
+        ('TX_ML_Died_Other_HIV_Disease', tx_ml_Died_Other_HIV_Disease),
+        ('TX_ML_Died_Other_infectious', tx_ml_Died_other_infectious),
+        ('TX_ML_Died_Other_natural', tx_ml_Died_Other_natural),
+        ('TX_ML_Died_TB', tx_ml_Died_TB),
+        ('CXCA_SCRN', cxca_scrn),
+        ('CXCA_TX', cxca_tx),
+        ('TX_TB_D', tx_tb_d),
+        ('TX_TB_D_AlreadyonART_ScreenedPositive', tx_tb_d_old_scrnpos),
+        ('TX_TB_D_NewonART_ScreenedPositive', tx_tb_d_new_scrnpos),
+        ('TX_TB_D_AlreadyonART_ScreenedNegative', tx_tb_d_old_scrnneg),
+        ('TX_TB_D_NewonART_ScreenedNegative', tx_tb_d_new_scrnneg),
+        ('TX_TB_D(Screening type)', tx_tb_d_Screening_type),
+        ('TX_TB_D(Specimen sent)', tx_tb_d_Specimen_sent),
+        ('TX_TB_D(TB Test Type)', tx_tb_d_TB_Test_Type),
+        ('TX_TB_D(TB Test Type)_Xpert', tx_tb_d_TB_Test_Type_Xpert),
+        ('TX_TB_D(TB Test Type)_TrueNAT', tx_tb_d_TB_Test_Type_TrueNAT),
+        ('TX_TB_D(TB Test Type)_LAM', tx_tb_d_TB_Test_Type_LAM),
+        ('TX_TB_D(TB Test Type)_Xray', tx_tb_d_TB_Test_Type_Xray),
+        ('TX_TB_D(TB Test Type)_AFB', tx_tb_d_TB_Test_Type_AFB),
+        ('TX_TB_D(TB Test Type)_Clinical', tx_tb_d_TB_Test_Type_Clinical),
+        ('TX_TB_D(Result Returned)', tx_tb_d_Result_returned),
+        ('TX_TB_D(Result Returned)_Xpert', tx_tb_d_Result_returned_Xpert),
+        ('TX_TB_D(Result Returned)_TrueNAT', tx_tb_d_Result_returned_TrueNAT),
+        ('TX_TB_D(Result Returned)_LAM', tx_tb_d_Result_returned_LAM),
+        ('TX_TB_D(Result Returned)_Xray', tx_tb_d_Result_returned_Xray),
+        ('TX_TB_D(Result Returned)_AFB', tx_tb_d_Result_returned_AFB),
+        ('TX_TB_D(Result Returned)_Clinical', tx_tb_d_Result_returned_Clinical),
+        ('TX_TB_N', tx_tb_n),
+        ('TB_PREV_N', tb_prev_n),
+        ('TB_PREV_D', tb_prev_d),
     ]
+    return indicators
 
-tx_tb_d_TB_Test_Type_AFB = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-    
-    ((combined_data['TB Diagnostic Test Type'].str.contains('AFB Smear Microscopy', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_neg_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(tb_exclusion_pattern, na=False))) 
-    )
-    ]
 
-tx_tb_d_TB_Test_Type_Clinical = combined_data[
-   ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-    ((combined_data['TB Diagnostic Test Type'].str.contains('Clinical evaluation only', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_neg_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(tb_exclusion_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(afb_exclusion_pattern, na=False)))  
-    )
-    ]
+# Reads the extracts of all_files into one validated DataFrame, with the free-text columns cleaned
+def load_files(all_files):
+    # Combine all files into one DataFrame (files are parsed by ingest_workers processes, or taken from the
+    # cache, with the date/numeric columns already converted, and concatenated once)
+    # State/LGA are only read for the rollups, and only from the files that have them
+    rollup_columns = rollup_geography_columns if include_rollups else []
+    combined_data = load_extracts(all_files, workers=ingest_workers, date_columns=date_columns, numeric_columns=numeric_columns, usecols=required_columns,
+                                  categorical_columns=categorical_columns + rollup_columns, cache_dir=cache_dir,
+                                  optional_columns=rollup_columns)
 
+    if combined_data.empty:
+        print("No valid files found or data could not be combined.")
+        exit()
 
-# Filters for TX_TB_D (Result Returned)
-tx_tb_d_Result_returned = combined_data[
-    ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-    ((combined_data['TB Diagnostic Test Type'].str.contains('LF-LAM|TB LAMP|Clinical evaluation only', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(tb_pos_exclusion_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(afb_pos_exclusion_pattern, na=False)))  |
-
-    ((combined_data['TB Diagnostic Test Type'].str.contains('AFB Smear Microscopy', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(tb_pos_exclusion_pattern, na=False)))    |
-    
-    ((combined_data['TB Diagnostic Test Type'].str.contains('TB-LAM', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(afb_pos_exclusion_pattern, na=False)))   |
-     
-    ((combined_data['TB Diagnostic Test Type'].str.contains('Chest X-ray', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(chest_x_ray_pos_pattern, na=False)))   |
-     
-    ((combined_data['TB Diagnostic Test Type'].str.contains('Gene Xpert|TrueNAT', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(mtb_pos_pattern, na=False)))
-    )
-    ]
+    # Extract project name from the 'Filename' column
+    # IMPORTANT: Ensure 'Filename' column exists before attempting to split
+    if 'Filename' not in combined_data.columns:
+        print("FATAL ERROR: 'Filename' column is missing from the combined data. Cannot extract ProjectName.")
+        exit()
 
+    combined_data['ProjectName'] = combined_data['Filename'].str.split('_').str[0]
 
-tx_tb_d_Result_returned_Xray = combined_data[
-    ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-    ((combined_data['TB Diagnostic Test Type'].str.contains('Chest X-ray', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(chest_x_ray_pos_pattern, na=False)))  
-    )
-    ]
+    # Every column the indicators need must be present in at least one input file
+    missing_columns = [col for col in required_columns if col not in combined_data.columns]
+    if missing_columns:
+        print(f"FATAL ERROR: Required column(s) missing from all input files: {missing_columns}")
+        exit()
 
+    # --- NEW: Robust column validation ---
+    # Check if 'ProjectName' and 'Facility Name' columns exist and are not entirely empty
+    required_cols_for_aggregation = ['ProjectName', 'Facility Name', 'DatimId']
+    for col in required_cols_for_aggregation:
+        if col not in combined_data.columns:
+            print(f"FATAL ERROR: Required column '{col}' is missing from the combined data.")
+            if col == 'ProjectName':
+                print("This usually means the 'Filename' column couldn't be processed to extract ProjectName.")
+                print(f"First 5 filenames: {combined_data['Filename'].head().tolist()}")
+            exit()
 
-tx_tb_d_Result_returned_Xpert = combined_data[
-    ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-         
-    ((combined_data['TB Diagnostic Test Type'].str.contains('Gene Xpert', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(mtb_pos_pattern, na=False)))
-    )
-    ]
+        # Convert to string and handle potential NaNs before further processing
+        # This helps prevent type-related errors in groupby/merge
+        # Stored as a categorical of strings: same values as astype(str), so missing values become 'nan'
+        combined_data[col] = as_key_category(combined_data[col])
 
-tx_tb_d_Result_returned_TrueNAT = combined_data[
-    ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-         
-    ((combined_data['TB Diagnostic Test Type'].str.contains('TrueNAT', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(mtb_pos_pattern, na=False)))
-    )
-    ]
+        if (combined_data[col] == 'UNKNOWN').all():
+            print(f"Warning: Column '{col}' is entirely 'UNKNOWN' (or NaN in original data). This might affect grouping and filtering.")
+        elif combined_data[col].nunique() == 1 and combined_data[col].iloc[0] == 'UNKNOWN':
+             print(f"Warning: Column '{col}' contains only 'UNKNOWN' values. This might indicate an issue with data extraction or input.")
 
 
-tx_tb_d_Result_returned_LAM = combined_data[
-    ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-    ((combined_data['TB Diagnostic Test Type'].str.contains('LF-LAM|TB LAMP', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(tb_pos_exclusion_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(afb_pos_exclusion_pattern, na=False)))  |
-    
-    ((combined_data['TB Diagnostic Test Type'].str.contains('TB-LAM', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(afb_pos_exclusion_pattern, na=False)))   
-   )
-    ]
 
 
-tx_tb_d_Result_returned_Clinical = combined_data[
-    ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-    ((combined_data['TB Diagnostic Test Type'].str.contains('Clinical evaluation only', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(tb_pos_exclusion_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(afb_pos_exclusion_pattern, na=False)))   
-   )
-    ]
+    # Blank and unparseable dates, counted per column and facility (the rows themselves only go to
+    # invalid_dates_sample_path)
+    report_date_quality(combined_data, date_columns, ['ProjectName', 'Facility Name', 'DatimId'], invalid_dates_sample_path)
 
 
-tx_tb_d_Result_returned_AFB = combined_data[
-    ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-    ((combined_data['TB Diagnostic Test Type'].str.contains('AFB Smear Microscopy', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(tb_pos_exclusion_pattern, na=False)))
-    )
-    ]
+    # Free-text columns are cleaned once per distinct value (remembered in cache_dir between runs)
+    cleaning = CleaningLookup(cache_dir)
 
+    # Apply the cleaning function to create the new column
+    combined_data['Cleaned Current Viral Load (c/ml)'] = cleaning.clean(combined_data['Current Viral Load (c/ml)'], clean_viral_load)
 
-# Filters for TX_TB_N (Started on TB Treatment)
-tx_tb_n = combined_data[
-    ((combined_data['Date of TB Screening (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Screening (yyyy-mm-dd)'] <= End_of_quarter)) & 
-   ((combined_data['Client Verification Outcome'].isin(['valid', 'valid ', ' valid', 'Valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-   (combined_data['Current ART Status'].str.contains('Active')) &
-   ((combined_data['TB Screening Type'].isin(['CXR', 'Smear', 'Gene Xpert', 'Chest X-ray without CAD', 'Chest X-ray','Chest X-ray with CAD', 'Chest X-Ray with CAD and/or Symptom screening', 'Symptom screen (alone)']))) &
-    (combined_data['TB status'].str.contains('Presumptive TB|TB Suspected and referred for evaluation|Confirmed TB|Currently on TB treatment')) &
-   ((combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Sample Collection (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (~combined_data['TB Diagnostic Test Type'].isna()) &
-   ((combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of TB Diagnostic Result Received (yyyy-mm-dd)'] <= End_of_quarter)) &
-   ((combined_data['Date of Start of TB Treatment (yyyy-mm-dd)'] >= six_months_ago) & (combined_data['Date of Start of TB Treatment (yyyy-mm-dd)'] <= End_of_quarter)) &
-   (
-    ((combined_data['TB Diagnostic Test Type'].str.contains('LF-LAM|TB LAMP|Clinical evaluation only', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(tb_pos_exclusion_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(afb_pos_exclusion_pattern, na=False)))  |
-
-    ((combined_data['TB Diagnostic Test Type'].str.contains('AFB Smear Microscopy', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(tb_pos_exclusion_pattern, na=False)))    |
-    
-    ((combined_data['TB Diagnostic Test Type'].str.contains('TB-LAM', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(pos_pattern, na=False)) &
-    (~combined_data['TB Diagnostic Result'].str.contains(afb_pos_exclusion_pattern, na=False)))   |
-     
-    ((combined_data['TB Diagnostic Test Type'].str.contains('Chest X-ray', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(chest_x_ray_pos_pattern, na=False)))   |
-     
-    ((combined_data['TB Diagnostic Test Type'].str.contains('Gene Xpert|TrueNAT', na=False)) &
-    (combined_data['TB Diagnostic Result'].str.contains(mtb_pos_pattern, na=False)))
-    )]
-    
-    
- 
-# Define the target start and completion date ranges
-#Print the date out just to confirm again
-threehp_period1_start = Start_of_quarter - pd.DateOffset(months=9) #six months from the start of the new semi-annual period
-threehp_period1_end = Start_of_quarter - pd.DateOffset(months=6, days=1) #end of last six months from the start of the new semi-annual period
+    # --- END OF SECTION ---
 
-threehp_period2_start = Start_of_quarter - pd.DateOffset(months=6)  #six months from the start of the new semi-annual period
-threehp_period2_end = Start_of_quarter - pd.DateOffset(months=3, days=1) #end of last six months from the start of a new semi-annual period
 
 
-inh_period1_start = Start_of_quarter - pd.DateOffset(months=9) #six months from the start of the new semi-annual period
-inh_period1_end = Start_of_quarter - pd.DateOffset(months=3, days=1) #end of last three months from the start of a new semi-annual period
+    # The MER age band (disaggregate_by_age_sex) is taken from the Age as reported: the conversion below fills a
+    # missing Age with 0, which would put every client without an age in the <1 band instead of Unknown
+    combined_data['Age Band'] = mer_age_band(combined_data['Age'])
 
-completion_period1_start = Start_of_quarter - pd.DateOffset(months=6)  #six months from the start of the new semi-annual period  
-completion_period2_start = Start_of_quarter - pd.DateOffset(months=3)  #three months from the start of the new semi-annual period  
-completion_period1_end = End_of_quarter
- 
+    # Example usage
+    columns_to_clean = ['Last CD4 Count',  'Months of ARV Refill', 'Age'] #'Current Viral Load (c/ml)',
+    combined_data = convert_to_integer_columns(combined_data, columns_to_clean)
 
 
+    combined_data = standardize_art_status(combined_data)
 
-# Filters for TB_PREV_N
-# Filter the DataFrame based on the conditions
-# Condition for 3HP 
-tb_prev_n_3HP_6mths =(        
-        (combined_data['Date of TPT Start (yyyy-mm-dd)'] >= threehp_period1_start) & #Oct 2024
-        (combined_data['Date of TPT Start (yyyy-mm-dd)'] <= threehp_period1_end) & #Dec 2024
-        (combined_data['TPT Completion date (yyyy-mm-dd)'] >= completion_period1_start) & #Jan 2025
-        (combined_data['TPT Completion date (yyyy-mm-dd)'] <= completion_period1_end) & #Sept 2025
-        (combined_data['TPT Type'].str.contains('(3HP)|(3HR)')) &  #'Isoniazid and Rifapentine-(3HP)', 'Isoniazid and Rifampicin-(3HR)'
-        (combined_data['TPT Completion status'].str.contains('Treatment Completed|Treatment success|Completed|completed')))
-        
+    combined_data = screentype(combined_data)
 
-# Condition for 3HP      
-tb_prev_n_3HP_3mths = (        
-        ((combined_data['Date of TPT Start (yyyy-mm-dd)'] >= threehp_period2_start) & #Jan 2025
-        (combined_data['Date of TPT Start (yyyy-mm-dd)'] <= threehp_period2_end)) & #Mar 2025
-        ((combined_data['TPT Completion date (yyyy-mm-dd)'] >= completion_period2_start) & #April 2025
-        (combined_data['TPT Completion date (yyyy-mm-dd)'] <= completion_period1_end)) & #Sept 2025
-        (combined_data['TPT Type'].str.contains('(3HP)|(3HR)')) &
-        (combined_data['TPT Completion status'].str.contains('Treatment Completed|Treatment success|Completed|completed')))
-
-
-# Condition for INH       
-tb_prev_n_INH = (        
-        ((combined_data['Date of TPT Start (yyyy-mm-dd)'] >= inh_period1_start) & #Oct 2024
-        (combined_data['Date of TPT Start (yyyy-mm-dd)'] <= inh_period1_end)) & #Mar 2025
-        ((combined_data['TPT Completion date (yyyy-mm-dd)'] >= six_months_ago) & #April 2025
-        (combined_data['TPT Completion date (yyyy-mm-dd)'] <= End_of_quarter)) & #September 2025
-        (~((combined_data['TPT Type'].str.contains('(3HP)|(3HR)')) & (combined_data['TPT Type'].isna()))) &
-        (combined_data['TPT Completion status'].str.contains('Treatment Completed|Treatment success|Completed|completed')))
-
-
-common_conditions_tb = (
-    ((combined_data['Client Verification Outcome'].fillna('').isin(['valid'])) |
-     (combined_data['Client Verification Outcome'].isna()) | # Catches np.nan
-        (combined_data['Client Verification Outcome'] == '') | # Catches explicit empty strings
-        (combined_data['Client Verification Outcome'].str.strip() == '') ) &
-    (combined_data['Current ART Status'].str.contains('Active|IIT|Stopped Treatment|Transferred Out|Died')) 
-    )
+    # Apply the new mapping to create the 'Cleaned Last CD4 Count' column
+    if 'Last CD4 Count' in combined_data.columns:
+        combined_data['Cleaned Last CD4 Count'] = cleaning.clean(combined_data['Last CD4 Count'], clean_cd4_count)
+    else:
+        print("Warning: 'Last CD4 Count' column not found. Skipping CD4 mapping.")
+        combined_data['Cleaned Last CD4 Count'] = float('nan')
+
+    # ----------------- MODIFIED SECTION -----------------
+    # Create a DataFrame of unique values for original and cleaned CD4 counts
+    if 'Last CD4 Count' in combined_data.columns:
+        unique_cd4_values_df = cleaning.table('Last CD4 Count', 'Cleaned Last CD4 Count').sort_values(by='Last CD4 Count').reset_index(drop=True)
+        unique_cd4_values_df.to_excel(unique_cd4_output_path, index=False)
+        print(f"Unique CD4 Count values saved to: {unique_cd4_output_path}")
 
-Tranferin_condition = ((combined_data['Care Entry Point'].str.contains('Transfer-in')) & (combined_data['Date of Registration'] < six_months_ago))
-
-
-# Filters for TB_PREV_D
-# Filter the DataFrame based on the conditions
-tb_prev_d_3HP_6mths =(        
-        (combined_data['Date of TPT Start (yyyy-mm-dd)'] >= threehp_period1_start) &  #Oct 2024
-        (combined_data['Date of TPT Start (yyyy-mm-dd)'] <= threehp_period1_end) & #Dec 2024
-        (combined_data['TPT Type'].str.contains('(3HP)|(3HR)')))
-
-# Condition for 'Date of TPT Start' 
-tb_prev_d_3HP_3mths = (        
-        ((combined_data['Date of TPT Start (yyyy-mm-dd)'] >= threehp_period2_start) & #Jan 2025
-        (combined_data['Date of TPT Start (yyyy-mm-dd)'] <= threehp_period2_end)) & #Mar 2025
-        (combined_data['TPT Type'].str.contains('(3HP)|(3HR)')))
-
-
-tb_prev_d_INH = (        
-        ((combined_data['Date of TPT Start (yyyy-mm-dd)'] >= inh_period1_start) & #Oct 2024
-        (combined_data['Date of TPT Start (yyyy-mm-dd)'] <= inh_period1_end)) & #Mar 2025
-        (~((combined_data['TPT Type'].str.contains('(3HP)|(3HR)')) & (combined_data['TPT Type'].isna())))) 
-
-tb_prev_n = combined_data[common_conditions_tb & (tb_prev_n_3HP_6mths | tb_prev_n_3HP_3mths | tb_prev_n_INH)]
-tb_prev_d = combined_data[common_conditions_tb & (tb_prev_d_3HP_6mths | tb_prev_d_3HP_3mths | tb_prev_d_INH)] #Tranferin_condition |
-
-
-# Pivot_data function to group by 'ProjectName' AND 'Facility Name'
-def pivot_data(data, value_name):
-    # Ensure the data passed to pivot_data has the required columns
-    for col in ['ProjectName', 'Facility Name','DatimId']:
-        if col not in data.columns:
-            print(f"Error: '{col}' not found in data passed to pivot_data. Skipping pivot.")
-            return pd.DataFrame(columns=['ProjectName', 'Facility Name', 'DatimId', value_name]) # Return empty DataFrame
-
-    return data.groupby(['ProjectName', 'Facility Name', 'DatimId']).size().reset_index(name=value_name)
-
-# Apply the pivot, aggregated by ProjectName and Facility Name
-tx_curr_pivot = pivot_data(tx_curr, 'TX_CURR')
-tx_curr_ARV_Disp_pivot = pivot_data(tx_curr_ARV_Disp, 'TX_CURR_ARV_DISP')
-vl_eligibility_pivot = pivot_data(vl_eligibility, 'VL_ELIGIBILITY')
-tx_pvls_d_pivot = pivot_data(tx_pvls_d, 'TX_PVLS_D')
-tx_pvls_d_pbf_pivot = pivot_data(tx_pvls_d_pbf, 'TX_PVLS_D_PBF')
-tx_pvls_d_pregnant_pivot = pivot_data(tx_pvls_d_pregnant, 'TX_PVLS_D_Pregnant')
-tx_pvls_d_breastfeeding_pivot = pivot_data(tx_pvls_d_breastfeeding, 'TX_PVLS_D_Breastfeeding')
-tx_pvls_n_pivot = pivot_data(tx_pvls_n, 'TX_PVLS_N')
-tx_pvls_n_pbf_pivot = pivot_data(tx_pvls_n_pbf, 'TX_PVLS_N_PBF')
-tx_pvls_n_pregnant_pivot = pivot_data(tx_pvls_n_pregnant, 'TX_PVLS_N_Pregnant')
-tx_pvls_n_breastfeeding_pivot = pivot_data(tx_pvls_n_breastfeeding, 'TX_PVLS_N_Breastfeeding')
-tx_new_pivot = pivot_data(tx_new, 'TX_NEW')
-tx_new_BF_pivot = pivot_data(tx_new_BF, 'TX_NEW_BF')
-tx_rtt_pivot = pivot_data(tx_rtt, 'TX_RTT')
-tx_ml_Stopped_pivot = pivot_data(tx_ml_Stopped_TX, 'TX_ML_Stopped_TX')
-tx_ml_Died_pivot = pivot_data(tx_ml_Died, 'TX_ML_Died')
-tx_ml_Transfer_out_pivot = pivot_data(tx_ml_Transfer_out, 'TX_ML_Transfer_out')
-tx_ml_IIT_pivot = pivot_data(tx_ml_IIT, 'TX_ML_IIT') 
-tx_ml_IIT_lt_three_pivot = pivot_data(tx_ml_IIT_lt_three, 'IIT<3')
-tx_ml_IIT_btwn_three_to_five_pivot = pivot_data(tx_ml_IIT_btwn_three_to_five, 'IIT3-5')
-tx_ml_IIT_gt_six_pivot = pivot_data(tx_ml_IIT_gt_six, 'IIT>=6')
-tx_ml_Died_Unknown_pivot = pivot_data(tx_ml_Died_Unknown, 'TX_ML_Died_Unknown')
-tx_ml_Died_cancer_pivot = pivot_data(tx_ml_Died_cancer, 'TX_ML_Died_cancer')
-tx_ml_Died_Non_natural_pivot = pivot_data(tx_ml_Died_Non_natural, 'TX_ML_Died_Non_natural')
-tx_ml_Died_Other_HIV_Disease_pivot = pivot_data(tx_ml_Died_Other_HIV_Disease, 'TX_ML_Died_Other_HIV_Disease')
-tx_ml_Died_other_infectious_pivot = pivot_data(tx_ml_Died_other_infectious, 'TX_ML_Died_Other_infectious')
-tx_ml_Died_Other_natural_pivot = pivot_data(tx_ml_Died_Other_natural, 'TX_ML_Died_Other_natural')
-tx_ml_Died_TB_pivot = pivot_data(tx_ml_Died_TB, 'TX_ML_Died_TB')
-cxca_scrn_pivot = pivot_data(cxca_scrn, 'CXCA_SCRN')
-cxca_tx_pivot = pivot_data(cxca_tx, 'CXCA_TX')
-tx_tb_d_pivot = pivot_data(tx_tb_d, 'TX_TB_D')
-tx_tb_d_old_scrnpos_pivot = pivot_data(tx_tb_d_old_scrnpos, 'TX_TB_D_AlreadyonART_ScreenedPositive')
-tx_tb_d_new_scrnpos_pivot = pivot_data(tx_tb_d_new_scrnpos, 'TX_TB_D_NewonART_ScreenedPositive')
-tx_tb_d_old_scrnneg_pivot = pivot_data(tx_tb_d_old_scrnneg, 'TX_TB_D_AlreadyonART_ScreenedNegative')
-tx_tb_d_new_scrnneg_pivot = pivot_data(tx_tb_d_new_scrnneg, 'TX_TB_D_NewonART_ScreenedNegative')
-tx_tb_d_Screening_type_pivot = pivot_data(tx_tb_d_Screening_type, 'TX_TB_D(Screening type)')
-tx_tb_d_Specimen_sent_pivot = pivot_data(tx_tb_d_Specimen_sent, 'TX_TB_D(Specimen sent)')
-tx_tb_d_TB_Test_Type_pivot = pivot_data(tx_tb_d_TB_Test_Type, 'TX_TB_D(TB Test Type)')
-tx_tb_d_TB_Test_Type_Xpert_pivot =pivot_data(tx_tb_d_TB_Test_Type_Xpert, 'TX_TB_D(TB Test Type)_Xpert')
-tx_tb_d_TB_Test_Type_TrueNAT_pivot = pivot_data(tx_tb_d_TB_Test_Type_TrueNAT, 'TX_TB_D(TB Test Type)_TrueNAT')
-tx_tb_d_TB_Test_Type_LAM_pivot = pivot_data(tx_tb_d_TB_Test_Type_LAM, 'TX_TB_D(TB Test Type)_LAM')
-tx_tb_d_TB_Test_Type_Xray_pivot =pivot_data(tx_tb_d_TB_Test_Type_Xray, 'TX_TB_D(TB Test Type)_Xray')
-tx_tb_d_TB_Test_Type_AFB_pivot =pivot_data(tx_tb_d_TB_Test_Type_AFB, 'TX_TB_D(TB Test Type)_AFB')
-tx_tb_d_TB_Test_Type_Clinical_pivot =pivot_data(tx_tb_d_TB_Test_Type_Clinical, 'TX_TB_D(TB Test Type)_Clinical')
-tx_tb_d_Result_returned_pivot = pivot_data(tx_tb_d_Result_returned, 'TX_TB_D(Result Returned)')
-tx_tb_d_Result_returned_Xpert_pivot = pivot_data(tx_tb_d_Result_returned_Xpert, 'TX_TB_D(Result Returned)_Xpert')
-tx_tb_d_Result_returned_TrueNAT_pivot= pivot_data(tx_tb_d_Result_returned_TrueNAT, 'TX_TB_D(Result Returned)_TrueNAT')
-tx_tb_d_Result_returned_LAM_pivot= pivot_data(tx_tb_d_Result_returned_LAM, 'TX_TB_D(Result Returned)_LAM')
-tx_tb_d_Result_returned_Xray_pivot= pivot_data(tx_tb_d_Result_returned_Xray, 'TX_TB_D(Result Returned)_Xray')
-tx_tb_d_Result_returned_AFB_pivot= pivot_data(tx_tb_d_Result_returned_AFB, 'TX_TB_D(Result Returned)_AFB')
-tx_tb_d_Result_returned_Clinical_pivot = pivot_data(tx_tb_d_Result_returned_Clinical, 'TX_TB_D(Result Returned)_Clinical')
-tx_tb_n_pivot = pivot_data(tx_tb_n, 'TX_TB_N')
-tb_prev_n_pivot =pivot_data(tb_prev_n, 'TB_PREV_N')
-tb_prev_d_pivot =pivot_data(tb_prev_d, 'TB_PREV_D')
-
-# List of all pivots to be merged into the master summary DataFrame
-all_pivots_for_summary = [
-    tx_curr_pivot,
-    tx_curr_ARV_Disp_pivot,
-    vl_eligibility_pivot,
-    tx_pvls_d_pivot,
-    tx_pvls_d_pbf_pivot,
-    tx_pvls_d_pregnant_pivot,
-    tx_pvls_d_breastfeeding_pivot,
-    tx_pvls_n_pivot,
-    tx_pvls_n_pbf_pivot,
-    tx_pvls_n_pregnant_pivot,
-    tx_pvls_n_breastfeeding_pivot,
-    tx_new_pivot,
-    tx_new_BF_pivot,
-    tx_rtt_pivot,
-    tx_ml_Stopped_pivot,
-    tx_ml_Died_pivot,
-    tx_ml_Transfer_out_pivot,
-    tx_ml_IIT_pivot,
-    tx_ml_IIT_lt_three_pivot,
-    tx_ml_IIT_btwn_three_to_five_pivot,
-    tx_ml_IIT_gt_six_pivot,
-    tx_ml_Died_Unknown_pivot,
-    tx_ml_Died_cancer_pivot,
-    tx_ml_Died_Non_natural_pivot,
-    tx_ml_Died_Other_HIV_Disease_pivot,
-    tx_ml_Died_other_infectious_pivot,
-    tx_ml_Died_Other_natural_pivot,
-    tx_ml_Died_TB_pivot,
-    cxca_scrn_pivot,
-    cxca_tx_pivot,
-    tx_tb_d_pivot,
-    tx_tb_d_old_scrnpos_pivot,
-    tx_tb_d_new_scrnpos_pivot,
-    tx_tb_d_old_scrnneg_pivot,
-    tx_tb_d_new_scrnneg_pivot,
-    tx_tb_d_Screening_type_pivot,
-    tx_tb_d_Specimen_sent_pivot,
-    tx_tb_d_TB_Test_Type_pivot,
-    tx_tb_d_TB_Test_Type_Xpert_pivot,
-    tx_tb_d_TB_Test_Type_TrueNAT_pivot,
-    tx_tb_d_TB_Test_Type_LAM_pivot,
-    tx_tb_d_TB_Test_Type_Xray_pivot,
-    tx_tb_d_TB_Test_Type_AFB_pivot,
-    tx_tb_d_TB_Test_Type_Clinical_pivot,
-    tx_tb_d_Result_returned_pivot,
-    tx_tb_d_Result_returned_Xpert_pivot,
-    tx_tb_d_Result_returned_TrueNAT_pivot,
-    tx_tb_d_Result_returned_LAM_pivot,
-    tx_tb_d_Result_returned_Xray_pivot,
-    tx_tb_d_Result_returned_AFB_pivot,
-    tx_tb_d_Result_returned_Clinical_pivot,
-    tx_tb_n_pivot,
-    tb_prev_n_pivot,
-    tb_prev_d_pivot
-    ] 
-
-# Get all unique combinations of ProjectName and Facility Name from the original combined data
-# This ensures all facilities are represented, even if they have no metrics for a pivot
-if not combined_data.empty:
-    unique_project_facility_combinations = combined_data[['ProjectName', 'Facility Name','DatimId']].drop_duplicates()
-else:
-    unique_project_facility_combinations = pd.DataFrame(columns=['ProjectName', 'Facility Name', 'DatimId'])
-
-# Initialize a master DataFrame that will contain all aggregated data (by ProjectName and Facility Name)
-master_aggregated_df = unique_project_facility_combinations.copy()
-
-# Merge all calculated pivots onto the master aggregated DataFrame
-for pivot_df in all_pivots_for_summary:
-    # Ensure pivot_df is not empty and has the keys before merging
-    if not pivot_df.empty and 'ProjectName' in pivot_df.columns and 'Facility Name' in pivot_df.columns:
-        master_aggregated_df = pd.merge(master_aggregated_df, pivot_df, 
-                                        on=['ProjectName', 'Facility Name', 'DatimId'], how='left')
+    # ----------------- END OF MODIFIED SECTION -----------------
+
+    # --- Save original and cleaned viral load data to a new file ---
+    viral_load_columns = ['Current Viral Load (c/ml)', 'Cleaned Current Viral Load (c/ml)']
+    if all(col in combined_data.columns for col in viral_load_columns):
+        distinct_viral_load_df = cleaning.table(*viral_load_columns)
+
+        try:
+            distinct_viral_load_df.to_excel(viral_load_output_path, index=False)
+            print(f"\nSuccessfully saved distinct viral load data to: {viral_load_output_path}")
+        except Exception as e:
+            print(f"\nError saving viral load data: {e}")
     else:
-        print(f"Warning: An aggregated pivot is empty or missing key columns (ProjectName/Facility Name/Datim Id) and will not be merged.")
-        
+        print("\nWarning: 'Current Viral Load (c/ml)' or 'Cleaned Current Viral Load (c/ml)' column not found. Skipping viral load data export.")
+
+    # Use the 'Cleaned Last CD4 Count' for analysis (a missing count is unknown, never <=1600 or >1600)
+    combined_data['cd4_le_1600'] = combined_data['Cleaned Last CD4 Count'] <= 1600
+    combined_data['cd4_gt_1600'] = combined_data['Cleaned Last CD4 Count'] > 1600
+
+    # 'Cause of Death' to lowercase for the TX_ML_Died cause of death filters
+    combined_data['Cause of Death'] = combined_data['Cause of Death'].str.lower() #.fillna()
+
+    # 'TB Diagnostic Result' to lowercase for case-insensitive matching
+    combined_data['TB Diagnostic Result'] = cleaning.clean(combined_data['TB Diagnostic Result'], lower_tb_result)
+
+    # Test family and result class of every row, classified once per distinct (test type, result) pair
+    tb_results = apply_distinct(combined_data[['TB Diagnostic Test Type', 'TB Diagnostic Result']], classify_tb_result)
+    for col in tb_results.columns:
+        combined_data[col] = tb_results[col]
+    return combined_data
+
+
+# Reads every CSV/Excel extract in folder (see load_files)
+def load(folder):
+    return load_files(list_input_files(folder))
 
 
-# Fill NaN values (for facilities with no data for a particular metric) with 0 for counts
-for col in master_aggregated_df.columns:
-    if col not in ['ProjectName', 'Facility Name', 'DatimId']: # Only fill for metric columns
-        master_aggregated_df[col] = master_aggregated_df[col].fillna(0).astype(int)
+# The (name, mask) of every indicator of the output for period, a (start, end) pair of dates, or the quarter in
+# Defining Periods when None, in the order of its columns (the filters equivalence.py counts the legacy way)
+def indicator_masks(combined_data, period=None):
+    if period is None:
+        with stage('indicator masks'):
+            return period_indicators(combined_data, Start_of_quarter, End_of_quarter, six_months_ago)
+    label, start, end = parse_periods([period])[0]
+    with stage('indicator masks'):
+        return period_indicators(combined_data, start, end, semi_annual_start(start))
 
-# Get unique project names for creating separate sheets
-project_names = master_aggregated_df['ProjectName'].unique()
 
-# # Create the Excel writer object
-with pd.ExcelWriter(output_file_path, engine='openpyxl') as writer:
-    # Loop through each unique ProjectName and save its aggregated data to a separate sheet
-    if master_aggregated_df.empty:
-        print("Master aggregated DataFrame is empty. No project sheets will be created.")
+# Facility counts of every indicator over combined_data (from load) for period, a (start, end) pair of dates,
+# or the quarter in Defining Periods when None. The same table as the main output, without the rollups.
+def aggregate(combined_data, period=None):
+    keys = ['ProjectName', 'Facility Name', 'DatimId']
+    indicators = indicator_masks(combined_data, period)
+    return assemble_counts(combined_data[keys].drop_duplicates(), count_indicators(combined_data, indicators, keys), keys, fill_zero=True)
+
+
+# Saves the facility counts (and their rollups) to output_path (output_file_path when None). geography holds
+# the rollup columns of every facility (see facility_geography), None to only total by project and nationally.
+def save_report(master_aggregated_df, geography=None, output_path=None):
+    output_path = output_path or output_file_path
+
+    # Get unique project names for creating separate sheets
+    project_names = master_aggregated_df['ProjectName'].unique()
+
+    # # Create the Excel writer object
+    with stage('write report'), pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+        # Loop through each unique ProjectName and save its aggregated data to a separate sheet
+        if master_aggregated_df.empty:
+            print("Master aggregated DataFrame is empty. No project sheets will be created.")
+        else:
+            for project in project_names:
+                # Sanitize project name for Excel sheet name (max 31 chars, no invalid chars)
+                sheet_name = str(project)[:31]
+                sheet_name = re.sub(r'[\\/*?[\]:]', '', sheet_name) # Remove invalid characters
+
+                # Filter the master aggregated data for the current project
+                project_aggregated_data = master_aggregated_df[master_aggregated_df['ProjectName'] == project].copy()
+
+                # Drop the ProjectName column before saving, as it's redundant on a project-specific sheet
+                if 'ProjectName' in project_aggregated_data.columns:
+                    project_aggregated_data = project_aggregated_data.drop(columns=['ProjectName'])
+
+                # Save project-specific aggregated data to its own sheet
+                if not project_aggregated_data.empty:
+                    project_aggregated_data.to_excel(writer, sheet_name=sheet_name, index=False)
+                    print(f"Aggregated data for Project '{project}' (by Facility Name and Datim Id) saved to sheet '{sheet_name}'.")
+                else:
+                    print(f"No aggregated data found for Project: {project} after filtering, skipping sheet creation.")
+
+        # LGA, State, project and national totals, summed from the facility rows
+        if include_rollups and not master_aggregated_df.empty:
+            rollups = rollup_counts(master_aggregated_df, ['ProjectName', 'Facility Name', 'DatimId'], geography)
+            rollups.to_excel(writer, sheet_name=ROLLUP_SHEET, index=False)
+            print(f"Totals by {', '.join(rollups['Level'].unique())} saved to sheet '{ROLLUP_SHEET}'.")
+
+    print(f"Analysis complete. Results saved to: {output_path}")
+
+
+# Incremental run (see incremental): only the files changed since the last run are read and counted, per
+# file, and the stored counts of every file are added up into the facility counts
+def run_incremental(all_files):
+    skipped = [name for name, setting in [('line_list_indicators', line_list_indicators),
+                                          ('disaggregate_by_age_sex', disaggregate_by_age_sex),
+                                          ('trend_periods', trend_periods),
+                                          ('rollup_geography_columns', include_rollups and rollup_geography_columns)] if setting]
+    if skipped:
+        print(f"Warning: {', '.join(skipped)} need every row and are ignored in incremental mode.")
+
+    keys = ['ProjectName', 'Facility Name', 'DatimId']
+    # The stored counts depend on the indicator filters, on everything load_files derives their columns with (the
+    # columns read and converted, the cleaners and classifiers, flags such as age cut-offs) and on the period, not
+    # on the settings only used after loading (line lists, trend, ...), which can change without a recount
+    fingerprint = run_fingerprint([period_indicators, load_files], Start_of_quarter, End_of_quarter, six_months_ago)
+    partials = PartialCounts(cache_dir, 'radet', fingerprint)
+    changed = partials.changed_files(all_files)
+    if changed:
+        combined_data = load_files(changed)
+        # Counted per file as well, so the counts of every file are kept apart
+        partials.update(combined_data, count_indicators(combined_data, period_indicators(combined_data, Start_of_quarter, End_of_quarter, six_months_ago),
+                                                        ['Filename'] + keys), keys, changed)
+
+    save_report(partials.combine(keys, fill_zero=True))
+
+
+# Runs the whole aggregation. Kept behind the __main__ guard so that the worker
+# processes used for reading the extracts can import this script safely.
+def main():
+    # List all CSV/Excel extracts in the input folder
+    all_files = list_input_files(folder_path)
+
+    if incremental:
+        if cache_dir is not None:
+            run_incremental(all_files)
+            return
+        print("Warning: incremental needs a cache_dir to keep the counts of every file in. Every file is read and counted.")
+
+    combined_data = load_files(all_files)
+
+    # Indicator filters of the quarter defined at the top of the file
+    with stage('indicator masks'):
+        indicators = period_indicators(combined_data, Start_of_quarter, End_of_quarter, six_months_ago)
+    if disaggregate_by_age_sex:
+        # The same grouped sum, also split by age band and Sex (the facility totals are summed from it)
+        all_pivots_for_summary, disaggregates = count_indicators(combined_data, indicators, ['ProjectName', 'Facility Name', 'DatimId'],
+                                                                 by=mer_disaggregation(combined_data))
+        save_disaggregates(disaggregates, ['ProjectName', 'Facility Name', 'DatimId'], disaggregates_output_path, wide=disaggregates_wide_sheet)
     else:
-        for project in project_names:
-            # Sanitize project name for Excel sheet name (max 31 chars, no invalid chars)
-            sheet_name = str(project)[:31]
-            sheet_name = re.sub(r'[\\/*?[\]:]', '', sheet_name) # Remove invalid characters
-
-            # Filter the master aggregated data for the current project
-            project_aggregated_data = master_aggregated_df[master_aggregated_df['ProjectName'] == project].copy()
-            
-            # Drop the ProjectName column before saving, as it's redundant on a project-specific sheet
-            if 'ProjectName' in project_aggregated_data.columns:
-                project_aggregated_data = project_aggregated_data.drop(columns=['ProjectName'])
-            
-            # Save project-specific aggregated data to its own sheet
-            if not project_aggregated_data.empty:
-                project_aggregated_data.to_excel(writer, sheet_name=sheet_name, index=False)
-                print(f"Aggregated data for Project '{project}' (by Facility Name and Datim Id) saved to sheet '{sheet_name}'.")
-            else:
-                print(f"No aggregated data found for Project: {project} after filtering, skipping sheet creation.")
-
-print(f"Analysis complete. Results saved to: {output_file_path}")
-
-
-
-# --- Save original and cleaned viral load data to a new file ---
-viral_load_columns = ['Current Viral Load (c/ml)', 'Cleaned Current Viral Load (c/ml)']
-if all(col in combined_data.columns for col in viral_load_columns):
-    viral_load_df = combined_data[viral_load_columns].copy()
-    distinct_viral_load_df = viral_load_df.drop_duplicates()
-
-    try:
-        distinct_viral_load_df.to_excel(viral_load_output_path, index=False)
-        print(f"\nSuccessfully saved distinct viral load data to: {viral_load_output_path}")
-    except Exception as e:
-        print(f"\nError saving viral load data: {e}")
-else:
-    print("\nWarning: 'Current Viral Load (c/ml)' or 'Cleaned Current Viral Load (c/ml)' column not found. Skipping viral load data export.")
+        all_pivots_for_summary = count_indicators(combined_data, indicators, ['ProjectName', 'Facility Name', 'DatimId'])
 
+    # Line lists (the matching rows) are only built for the indicators listed in line_list_indicators
+    save_line_lists(combined_data, indicators, line_list_indicators, line_list_output_path)
 
+    # Get all unique combinations of ProjectName and Facility Name from the original combined data
+    # This ensures all facilities are represented, even if they have no metrics for a pivot
+    if not combined_data.empty:
+        unique_project_facility_combinations = combined_data[['ProjectName', 'Facility Name','DatimId']].drop_duplicates()
+    else:
+        unique_project_facility_combinations = pd.DataFrame(columns=['ProjectName', 'Facility Name', 'DatimId'])
+
+    # Put all calculated pivots next to the facilities in one keyed step (missing counts are 0)
+    master_aggregated_df = assemble_counts(unique_project_facility_combinations, all_pivots_for_summary,
+                                           ['ProjectName', 'Facility Name', 'DatimId'], fill_zero=True)
+
+    # State/LGA of every facility for the rollups, where the extracts have them
+    geography = [col for col in rollup_geography_columns if include_rollups and col in combined_data.columns]
+    save_report(master_aggregated_df, facility_geography(combined_data, ['ProjectName', 'Facility Name', 'DatimId'], geography) if geography else None)
+
+    # Trend mode: the same indicators for every period of trend_periods, counted from the data loaded above
+    if trend_periods:
+        trend = count_trend(unique_project_facility_combinations, ['ProjectName', 'Facility Name', 'DatimId'], trend_periods,
+                            lambda start, end, keys: count_indicators(combined_data, period_indicators(combined_data, start, end, semi_annual_start(start)),
+                                                                      keys),
+                            fill_zero=True)
+        save_trend(trend, trend_output_path)
+
+
+if __name__ == '__main__':
+    if profile_run:
+        start_profile()
+    main()
+    if profile_run:
+        save_profile(output_file_path, script=os.path.basename(__file__))
@@ -0,0 +1,150 @@
+import argparse
+import importlib
+import os
+import time
+
+from profiling import save_profile, start_profile
+
+# Command-line entry point for the aggregate_data_*.py scripts, e.g.
+#   python aggregate_indicators.py radet "IP1/RADET" "IP2/RADET" --output-dir Output --period 2025-07-01 2025-09-30
+# Each report is imported once as a module and every input folder is run through its load(folder),
+# aggregate(combined_data, period) and save_report(...) functions in the same process, so the imports,
+# the extract cache and the cleaned-value lookups (cache_dir) stay warm from one folder to the next.
+# The settings not given on the command line are taken from the top of the script. The batch subcommand
+# runs a manifest of jobs on a process pool instead (see batch.py).
+
+# Module of every report subcommand
+REPORTS = {
+    'radet': 'aggregate_data_radet',
+    'hts': 'aggregate_data_hts',
+    'hts-index': 'aggregate_data_hts_index',
+    'pmtct-hts': 'aggregate_data_pmtct_hts',
+    'prep': 'aggregate_data_prep',
+}
+
+
+def report_module(report, cache_dir=None, workers=None):
+    # The module of report, with the cache and ingest settings given on the command line
+    module = importlib.import_module(REPORTS[report])
+    if cache_dir is not None:
+        module.cache_dir = cache_dir
+    if workers is not None:
+        module.ingest_workers = workers
+    return module
+
+
+def folder_names(folders):
+    # Name of every folder in its output files: the folder's own name, or its whole path (IP1_RADET) when
+    # several folders share that name
+    names = [os.path.basename(os.path.normpath(folder)) for folder in folders]
+    return [name if names.count(name) == 1 else
+            os.path.splitdrive(os.path.normpath(folder))[1].strip(os.sep).replace(os.sep, '_')
+            for folder, name in zip(folders, names)]
+
+
+def folder_output_path(output_dir, name, report):
+    # <output_dir>/<folder name>_<report>.xlsx
+    return os.path.join(output_dir, f"{name}_{report}.xlsx")
+
+
+def redirect_outputs(module, output_path):
+    # Points the other outputs of module (e.g. the RADET CD4 and viral load value lists) next to output_path,
+    # as <output name>_<output>.xlsx
+    stem = os.path.splitext(output_path)[0]
+    for name in [name for name in vars(module) if name.endswith('_output_path')]:
+        setattr(module, name, f"{stem}_{name[:-len('_output_path')]}.xlsx")
+
+
+def aggregate_folder(module, folder, output_path, period=None, profile=False):
+    """
+    Aggregates the extracts of folder with the report module (see
+    report_module) for period and saves the facility counts to output_path.
+    The other outputs written along the way (e.g. the RADET CD4 and viral
+    load value lists) go next to it, as <output name>_<output>.xlsx, and with
+    profile so does the run profile (see profiling.py). Returns the number of
+    rows read and of facilities saved.
+    """
+    redirect_outputs(module, output_path)
+    if profile:
+        start_profile()
+    combined_data = module.load(folder)
+    rows = len(combined_data)
+    master_aggregated_df = module.aggregate(combined_data, period)
+    del combined_data
+    module.save_report(master_aggregated_df, output_path=output_path)
+    if profile:
+        save_profile(output_path, script=module.__name__, input_folder=folder)
+    return rows, len(master_aggregated_df)
+
+
+def run_report(report, folders, output_dir, period=None, cache_dir=None, workers=None, profile=False):
+    """
+    Aggregates report over every folder of folders, one after another in this
+    process, saving the facility counts of each folder to output_dir (see
+    folder_output_path). period is a (start, end) pair of dates, the quarter
+    at the top of the script when None. With profile, the run profile of
+    every folder is saved next to its report. A folder that cannot be
+    aggregated is reported and skipped. Returns the paths of the saved reports.
+    """
+    module = report_module(report, cache_dir, workers)
+    os.makedirs(output_dir, exist_ok=True)
+    saved = []
+    for folder, folder_name in zip(folders, folder_names(folders)):
+        print(f"\n=== {report}: {folder} ===")
+        output_path = folder_output_path(output_dir, folder_name, report)
+        start = time.perf_counter()
+        try:
+            aggregate_folder(module, folder, output_path, period, profile)
+        except SystemExit:
+            # The scripts stop on a FATAL ERROR (already printed); the other folders still run
+            print(f"Warning: {folder} could not be aggregated. Skipping it.")
+            continue
+        saved.append(output_path)
+        print(f"{folder} aggregated in {time.perf_counter() - start:.1f}s.")
+
+    print(f"\n{len(saved)} of {len(folders)} folder(s) aggregated for {report}.")
+    return saved
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Aggregate the indicators of one report over one or more input folders, "
+                                                 "or run a batch of jobs from a manifest.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for report in REPORTS:
+        subparser = subparsers.add_parser(report, help=f"aggregate the {report} indicators ({REPORTS[report]}.py)")
+        subparser.add_argument('folders', nargs='+', help="input folders holding the CSV/Excel extracts")
+        subparser.add_argument('--output-dir', default='.', help="folder the reports are saved to (default: the current folder)")
+        subparser.add_argument('--period', nargs=2, metavar=('START', 'END'),
+                               help="first and last day of the reporting period (default: the quarter set in the script)")
+        subparser.add_argument('--cache-dir', help="folder of the extract cache (default: cache_dir of the script)")
+        subparser.add_argument('--workers', type=int, help="worker processes reading the extracts (default: ingest_workers of the script)")
+        subparser.add_argument('--profile', action='store_true',
+                               help="save the duration and peak memory of every stage as <report name>_profile.json")
+
+    subparser = subparsers.add_parser('batch', help="run the jobs of a manifest on a process pool (see batch.py)")
+    subparser.add_argument('manifest', help="CSV/Excel file with the columns report, input_folder, output_path "
+                                            "and optionally period_start, period_end")
+    subparser.add_argument('--summary', default='batch_summary.csv', help="run summary file, .csv or .xlsx (default: batch_summary.csv)")
+    subparser.add_argument('--workers', type=int, help="jobs run at the same time at most (default: one per CPU)")
+    subparser.add_argument('--memory-limit', type=float, metavar='MB',
+                           help="estimated memory the running jobs may use together (default: 75%% of the physical memory)")
+    subparser.add_argument('--cache-dir', help="folder of the extract caches, one subfolder per report and input folder")
+    subparser.add_argument('--profile', action='store_true', help="save the run profile of every job next to its report")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    if args.command == 'batch':
+        # Imported here: batch.py itself builds on the functions above
+        from batch import read_manifest, run_batch, save_summary
+        summary = run_batch(read_manifest(args.manifest), workers=args.workers, memory_limit_mb=args.memory_limit,
+                            cache_dir=args.cache_dir, profile=args.profile)
+        save_summary(summary, args.summary)
+    else:
+        run_report(args.command, args.folders, args.output_dir, period=args.period, cache_dir=args.cache_dir,
+                   workers=args.workers, profile=args.profile)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import contextlib
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+from aggregate_indicators import REPORTS, aggregate_folder, report_module
+from ingestion import list_input_files
+from profiling import peak_memory_mb
+from trend import parse_periods
+
+# Batch mode of aggregate_indicators.py: runs a manifest of jobs (report, input folder, output path and
+# optionally the period) on a process pool. Jobs are started largest first, as long as their estimated
+# memory fits in what the running jobs leave of the memory limit (a job larger than the limit runs on its
+# own), so several small PrEP jobs run next to each other while a large RADET job gets the machine.
+# Every job runs in its own process, writes its console output to a .log file next to its report, and
+# a summary of all jobs (status, duration, rows read, facilities, peak memory) is saved at the end.
+
+# Columns of the manifest (period_start/period_end may be left out or blank for the quarter in the script)
+MANIFEST_COLUMNS = ['report', 'input_folder', 'output_path', 'period_start', 'period_end']
+
+# Rough peak memory of a job per MB of CSV input (RADET rows are wide and get the most derived columns)
+MEMORY_PER_INPUT_MB = {'radet': 8, 'hts': 5, 'hts-index': 4, 'pmtct-hts': 4, 'prep': 4}
+
+# Excel files are zipped: one MB of .xlsx/.xls holds about as much data as this many MB of CSV
+EXCEL_EXPANSION = 5
+
+# Memory of a job process before it reads anything (Python, pandas and the report module)
+JOB_OVERHEAD_MB = 200
+
+# Share of the physical memory the jobs may use together when no memory limit is given
+DEFAULT_MEMORY_SHARE = 0.75
+
+
+def read_manifest(path):
+    """
+    Reads the jobs of the manifest at path (CSV or Excel, one row per job
+    with the MANIFEST_COLUMNS). Returns one dict per job, in manifest order.
+    """
+    manifest = pd.read_excel(path) if path.endswith(('.xlsx', '.xls')) else pd.read_csv(path)
+    manifest.columns = [str(col).strip().lower() for col in manifest.columns]
+    missing_columns = [col for col in MANIFEST_COLUMNS[:3] if col not in manifest.columns]
+    if missing_columns:
+        print(f"FATAL ERROR: Column(s) missing from the manifest {path}: {missing_columns}")
+        exit()
+
+    jobs = []
+    for number, row in enumerate(manifest.to_dict('records'), start=1):
+        report = str(row['report']).strip().lower()
+        if report not in REPORTS:
+            print(f"FATAL ERROR: Unknown report '{row['report']}' in job {number} of the manifest. Use one of {list(REPORTS)}.")
+            exit()
+        start, end = row.get('period_start'), row.get('period_end')
+        if pd.isna(start) != pd.isna(end):
+            print(f"FATAL ERROR: Job {number} of the manifest has only one of period_start and period_end.")
+            exit()
+        period = None if pd.isna(start) else (str(start), str(end))
+        jobs.append({
+            'job': number,
+            'report': report,
+            'input_folder': str(row['input_folder']),
+            'output_path': str(row['output_path']),
+            'period': period,
+            # Checks the dates up front, so a bad period stops the batch before any job runs
+            'period_label': parse_periods([period])[0][0] if period else 'script quarter',
+        })
+    return jobs
+
+
+def estimate_job_mb(job):
+    # Estimated peak memory of job, from the size of its input files
+    folder = job['input_folder']
+    files = list_input_files(folder) if os.path.isdir(folder) else []
+    input_mb = sum(os.path.getsize(file) * (1 if file.endswith('.csv') else EXCEL_EXPANSION) for file in files) / 1024 ** 2
+    return JOB_OVERHEAD_MB + input_mb * MEMORY_PER_INPUT_MB[job['report']]
+
+
+def total_memory_mb():
+    # Physical memory of the machine in MB, None when it cannot be determined on this platform
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 2
+    except (AttributeError, ValueError, OSError):
+        # Windows has no sysconf; fall back to psutil when it is installed
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.virtual_memory().total / 1024 ** 2
+
+
+def job_cache_dir(cache_dir, job):
+    # Own cache folder per report and input folder: concurrent jobs never share (and prune) a cache manifest
+    if cache_dir is None:
+        return None
+    folder_hash = hashlib.sha256(os.path.abspath(job['input_folder']).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{job['report']}-{folder_hash}")
+
+
+def run_job(job, cache_dir=None, profile=False):
+    """
+    Runs one job of the manifest (in a worker process) and returns its row of
+    the run summary. The console output of the job goes to a .log file next
+    to its report, and with profile its run profile too (see profiling.py).
+    """
+    start = time.perf_counter()
+    output_dir = os.path.dirname(os.path.abspath(job['output_path']))
+    os.makedirs(output_dir, exist_ok=True)
+    log_path = os.path.splitext(job['output_path'])[0] + '.log'
+    result = {'status': 'failed', 'rows': None, 'facilities': None, 'error': ''}
+    with open(log_path, 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        try:
+            # The job pool is the parallelism; the extracts of a job are read one after another
+            module = report_module(job['report'], job_cache_dir(cache_dir, job), workers=1)
+            result['rows'], result['facilities'] = aggregate_folder(module, job['input_folder'], job['output_path'],
+                                                                      job['period'], profile)
+            result['status'] = 'ok'
+        except SystemExit:
+            result['error'] = "stopped on a FATAL ERROR (see the log)"
+        except Exception as e:
+            result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = round(time.perf_counter() - start, 2)
+    result['peak_memory_mb'] = peak_memory_mb()
+    result['log'] = log_path
+    return result
+
+
+def run_batch(jobs, workers=None, memory_limit_mb=None, cache_dir=None, profile=False):
+    """
+    Runs jobs (see read_manifest) on up to workers processes (None for one
+    per CPU), keeping the estimated memory of the running jobs within
+    memory_limit_mb (None for DEFAULT_MEMORY_SHARE of the physical memory).
+    With profile, every job saves its run profile next to its report.
+    Returns the run summary, one row per job in manifest order.
+    """
+    workers = workers or os.cpu_count() or 1
+    if memory_limit_mb is None:
+        total_mb = total_memory_mb()
+        memory_limit_mb = total_mb * DEFAULT_MEMORY_SHARE if total_mb else float('inf')
+    for job in jobs:
+        job['estimated_mb'] = round(estimate_job_mb(job))
+    print(f"Running {len(jobs)} job(s) on up to {workers} worker(s) within {memory_limit_mb:,.0f} MB.")
+
+    # One process per job, so its memory is returned as soon as it ends (and its peak is its own)
+    pool_options = {'max_tasks_per_child': 1} if sys.version_info >= (3, 11) else {}
+    pending = sorted(jobs, key=lambda job: job['estimated_mb'], reverse=True)
+    running = {}
+    results = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, **pool_options) as executor:
+        while pending or running:
+            # Largest waiting jobs first, while they fit next to the running ones
+            for job in list(pending):
+                if len(running) >= workers:
+                    break
+                in_use_mb = sum(running_job['estimated_mb'] for running_job in running.values())
+                busy_caches = {job_cache_dir(cache_dir, running_job) for running_job in running.values()}
+                if running and (in_use_mb + job['estimated_mb'] > memory_limit_mb or
+                                (cache_dir is not None and job_cache_dir(cache_dir, job) in busy_caches)):
+                    continue
+                running[executor.submit(run_job, job, cache_dir, profile)] = job
+                pending.remove(job)
+                print(f"Started job {job['job']}: {job['report']} {job['input_folder']} (~{job['estimated_mb']:,} MB).")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # The worker process itself died (e.g. killed for running out of memory)
+                    result = {'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+                results[job['job']] = dict(job, **result)
+                print(f"Finished job {job['job']}: {results[job['job']]['status']} "
+                      f"({results[job['job']].get('seconds', 0):.1f}s).")
+
+    summary = pd.DataFrame([results[job['job']] for job in jobs])
+    summary = summary.drop(columns=['period']).rename(columns={'period_label': 'period'})
+    summary[['rows', 'facilities']] = summary[['rows', 'facilities']].astype('Int64')
+    summary['peak_memory_mb'] = summary['peak_memory_mb'].round()
+    ok = (summary['status'] == 'ok').sum()
+    print(f"Batch finished in {time.perf_counter() - start:.1f}s: {ok} of {len(jobs)} job(s) succeeded.")
+    return summary
+
+
+def save_summary(summary, path):
+    # CSV, or Excel for a .xlsx path
+    if path.endswith('.xlsx'):
+        summary.to_excel(path, index=False)
+    else:
+        summary.to_csv(path, index=False)
+    print(f"Run summary saved to: {path}")
@@ -0,0 +1,261 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from aggregate_indicators import REPORTS, aggregate_folder, report_module
+from profiling import peak_memory_mb, save_profile, start_profile
+from synthetic_extracts import default_file_format, generate_extracts
+
+# Benchmark suite of the aggregate_data_*.py scripts, e.g.
+#   python benchmark.py --sizes 10k 1m --baseline benchmark_baseline.json
+# Every report is run end to end (load, aggregate, save_report) over synthetic extracts (see
+# synthetic_extracts.py) of every size, each run in a fresh process so its peak memory is its own. The
+# wall time, peak memory and throughput of the run and of every profiled stage (see profiling.py) are
+# compared with a stored baseline: a run or stage that got slower or bigger by more than the threshold
+# is reported as a regression, and a run whose output workbook differs from the baseline's in any cell
+# fails, so a speedup can never change the indicator counts unnoticed.
+
+# Sizes of the synthetic datasets: (rows, files, facilities)
+SIZES = {
+    '10k': (10000, 10, 10),
+    '1m': (1000000, 100, 100),
+    '10m': (10000000, 1000, 1000),
+}
+
+# Relative slowdown (or memory growth) above which a run or stage counts as a regression
+DEFAULT_THRESHOLD = 0.2
+
+# A run or stage only counts as slower when it also takes this many seconds more: differences of short
+# timings are mostly noise
+MIN_SECONDS = 0.5
+
+# Bump when the layout of the results changes, so an old baseline is not compared with them
+RESULTS_VERSION = 1
+
+
+def dataset_folder(data_dir, report, size, seed=0):
+    """
+    Folder of the synthetic extracts of report at size, written on first use
+    and reused as long as the settings they were written with are the same.
+    """
+    rows, files, facilities = SIZES[size]
+    folder = os.path.join(data_dir, f"{report}-{size}-seed{seed}")
+    settings = {'report': report, 'rows': rows, 'files': files, 'facilities': facilities, 'seed': seed,
+                'format': default_file_format(report)}
+    marker = os.path.join(folder, 'synthetic.json')
+    if os.path.exists(marker):
+        with open(marker, encoding='utf-8') as f:
+            if json.load(f) == settings:
+                return folder
+        # Written with other settings: the old files would be read along with the new ones
+        for name in os.listdir(folder):
+            os.remove(os.path.join(folder, name))
+    print(f"Writing the {size} {report} dataset to {folder}...")
+    generate_extracts(report, folder, rows, files=files, facilities=facilities, seed=seed)
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(settings, f)
+    return folder
+
+
+def output_summary(output_path):
+    """
+    Fingerprint of the output workbook at output_path: a hash of every cell
+    of every sheet, and the total of every count column (to show which
+    indicators changed when the hash does).
+    """
+    sheets = pd.read_excel(output_path, sheet_name=None)
+    digest = hashlib.sha256()
+    totals = {}
+    for sheet_name, sheet in sheets.items():
+        digest.update(sheet_name.encode('utf-8'))
+        digest.update(sheet.to_csv(index=False).encode('utf-8'))
+        for col in sheet.select_dtypes('number').columns:
+            totals[col] = totals.get(col, 0) + int(sheet[col].sum())
+    return {'digest': digest.hexdigest(), 'totals': totals}
+
+
+def run_benchmark(run):
+    """
+    Runs one benchmark (in a fresh worker process): aggregates the extracts
+    of run['folder'] with run['report'] and returns its timings, peak memory,
+    throughput per stage and the summary of its output.
+    """
+    os.makedirs(run['output_dir'], exist_ok=True)
+    name = f"{run['report']}-{run['size']}"
+    output_path = os.path.join(run['output_dir'], f"{name}.xlsx")
+    with open(os.path.join(run['output_dir'], f"{name}.log"), 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        module = report_module(run['report'], workers=run['workers'])
+        start_profile(trace_memory=run['trace_memory'])
+        start = time.perf_counter()
+        try:
+            rows, facilities = aggregate_folder(module, run['folder'], output_path)
+        except SystemExit:
+            # The scripts stop on a FATAL ERROR (printed to the log)
+            raise RuntimeError("the script stopped on a FATAL ERROR") from None
+        seconds = time.perf_counter() - start
+        profile_file = save_profile(output_path, script=module.__name__, input_folder=run['folder'])
+
+    with open(profile_file, encoding='utf-8') as f:
+        profile = json.load(f)
+    stages = {}
+    for stage_name, total in profile['totals'].items():
+        stage_peaks = [entry['python_peak_mb'] for entry in profile['stages']
+                       if entry['stage'] == stage_name and entry.get('python_peak_mb') is not None]
+        stages[stage_name] = {'seconds': total['seconds'], 'count': total['count'],
+                              'rows_per_sec': round(rows / total['seconds']) if total['seconds'] > 0 else None,
+                              'python_peak_mb': max(stage_peaks) if stage_peaks else None}
+    peak_mb = peak_memory_mb()
+    return dict(output_summary(output_path), seconds=round(seconds, 3), rows=rows, facilities=facilities,
+                rows_per_sec=round(rows / seconds) if seconds > 0 else None,
+                peak_rss_mb=round(peak_mb, 1) if peak_mb is not None else None, stages=stages)
+
+
+def compare(result, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Differences of result from its baseline: a list of (kind, message),
+    kind being 'output' for a changed output and 'regression' for a run or
+    stage that got slower or bigger by more than threshold.
+    """
+    problems = []
+    if result['digest'] != baseline['digest']:
+        changed = sorted(col for col in set(result['totals']) | set(baseline['totals'])
+                         if result['totals'].get(col) != baseline['totals'].get(col))
+        detail = ', '.join(f"{col}: {baseline['totals'].get(col)} -> {result['totals'].get(col)}" for col in changed[:10])
+        problems.append(('output', "output differs from the baseline" +
+                         (f" ({detail}{', ...' if len(changed) > 10 else ''})" if changed else " (same totals, other cells)")))
+
+    def check(label, new, old, minimum=0.0):
+        if new is None or old is None:
+            return
+        if new > old * (1 + threshold) and new - old >= minimum:
+            problems.append(('regression', f"{label} {old:,.2f} -> {new:,.2f} (+{new / old - 1:.0%})" if old > 0 else
+                             f"{label} {old:,.2f} -> {new:,.2f}"))
+
+    check("wall time (s)", result['seconds'], baseline['seconds'], MIN_SECONDS)
+    check("peak memory (MB)", result['peak_rss_mb'], baseline['peak_rss_mb'])
+    for stage_name, stage in result['stages'].items():
+        old = baseline['stages'].get(stage_name)
+        if old is not None:
+            check(f"stage '{stage_name}' (s)", stage['seconds'], old['seconds'], MIN_SECONDS)
+            check(f"stage '{stage_name}' Python peak (MB)", stage['python_peak_mb'], old['python_peak_mb'])
+    return problems
+
+
+def environment():
+    # What the timings depend on besides the code, saved with the results
+    return {'python': platform.python_version(), 'pandas': pd.__version__, 'platform': platform.platform(),
+            'cpus': os.cpu_count()}
+
+
+def load_baseline(path):
+    if path is None:
+        return None
+    if not os.path.exists(path):
+        print(f"No baseline at {path}: the runs are not compared. Save one with --save-baseline.")
+        return None
+    with open(path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('version') != RESULTS_VERSION:
+        print(f"Warning: The baseline {path} was saved by another version of the benchmark and is not used.")
+        return None
+    if baseline.get('environment') != environment():
+        print(f"Warning: The baseline {path} was recorded on {baseline.get('environment')}; timings may not be comparable.")
+    return baseline
+
+
+def run_suite(reports, sizes, data_dir, output_dir, baseline_path=None, threshold=DEFAULT_THRESHOLD, workers=None,
+              trace_memory=False, seed=0):
+    """
+    Benchmarks every report of reports at every size of sizes (see SIZES),
+    one run at a time, each in a fresh process, and compares the runs with
+    the baseline at baseline_path when there is one. workers is ingest_workers
+    (None for the setting of the script); trace_memory also measures the
+    Python memory peak of every stage (slower). Returns (results, number of
+    runs that failed: changed output, regression or error).
+    """
+    baseline = load_baseline(baseline_path)
+    results = {'version': RESULTS_VERSION, 'environment': environment(), 'threshold': threshold, 'runs': {}}
+    failed = 0
+    for size in sizes:
+        for report in reports:
+            name = f"{report}-{size}"
+            run = {'report': report, 'size': size, 'folder': dataset_folder(data_dir, report, size, seed),
+                   'output_dir': output_dir, 'workers': workers, 'trace_memory': trace_memory}
+            print(f"Running {name}...")
+            # A fresh process per run: its peak memory is its own and no module state is carried over
+            try:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    result = executor.submit(run_benchmark, run).result()
+            except Exception as e:
+                print(f"  FAILED: {type(e).__name__}: {e} (see {os.path.join(output_dir, name + '.log')})")
+                failed += 1
+                continue
+            results['runs'][name] = result
+
+            old = (baseline or {}).get('runs', {}).get(name)
+            problems = compare(result, old, threshold) if old else []
+            change = f" ({result['seconds'] / old['seconds'] - 1:+.0%} vs baseline)" if old and old['seconds'] > 0 else ""
+            print(f"  {result['rows']:,} rows, {result['facilities']:,} facilities in {result['seconds']:.2f}s{change}, "
+                  f"{result['rows_per_sec'] or 0:,} rows/sec, peak memory {result['peak_rss_mb']} MB")
+            for kind, message in problems:
+                print(f"  {'OUTPUT CHANGED' if kind == 'output' else 'REGRESSION'}: {message}")
+            if old is None and baseline is not None:
+                print("  (not in the baseline)")
+            failed += bool(problems)
+    return results, failed
+
+
+def save_results(results, path, merge=False):
+    # Writes results to path; with merge, the runs of path that were not run this time are kept
+    if merge and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            stored = json.load(f)
+        if stored.get('version') == RESULTS_VERSION:
+            results = dict(results, runs=dict(stored.get('runs', {}), **results['runs']))
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=1)
+    print(f"Benchmark results saved to: {path}")
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the reports end to end and per stage on synthetic extracts, "
+                                                 "and compare the timings and outputs with a stored baseline.")
+    parser.add_argument('--reports', nargs='+', choices=list(REPORTS), default=list(REPORTS), help="reports to run (default: all)")
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['10k'],
+                        help="dataset sizes: 10k rows in 10 files, 1m in 100, 10m in 1000 (default: 10k)")
+    parser.add_argument('--data-dir', default='benchmark_data', help="folder of the synthetic extracts (default: benchmark_data)")
+    parser.add_argument('--output-dir', default='benchmark_output', help="folder of the reports, profiles and logs (default: benchmark_output)")
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help="baseline to compare with (default: benchmark_baseline.json)")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown or memory growth reported as a regression (default: 0.2, i.e. 20%%)")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results of this run as the baseline")
+    parser.add_argument('--results', default='benchmark_results.json', help="file the results are saved to (default: benchmark_results.json)")
+    parser.add_argument('--workers', type=int, help="worker processes reading the extracts (default: ingest_workers of the script)")
+    parser.add_argument('--trace-memory', action='store_true', help="also measure the Python memory peak of every stage (slower)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic extracts (default: 0)")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    results, failed = run_suite(args.reports, args.sizes, args.data_dir, args.output_dir,
+                                None if args.save_baseline else args.baseline, args.threshold, args.workers,
+                                args.trace_memory, args.seed)
+    save_results(results, args.results)
+    if args.save_baseline:
+        save_results(results, args.baseline, merge=True)
+    elif failed:
+        print(f"{failed} of {len(args.reports) * len(args.sizes)} benchmark run(s) failed.")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
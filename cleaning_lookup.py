@@ -0,0 +1,210 @@
+import hashlib
+import inspect
+import itertools
+import os
+import pickle
+import re
+
+import numpy as np
+import pandas as pd
+
+from profiling import stage
+
+# Memoized cleaning of free-text columns, used by the aggregate_data_*.py scripts.
+# Columns such as 'Current Viral Load (c/ml)' or 'Last CD4 Count' hold millions of
+# rows but only a few thousand distinct texts. A cleaner is therefore run once over
+# the distinct values of a column and the results are broadcast back to the rows
+# through the factorized codes of the column. The distinct values and their cleaned
+# form are kept in a lookup table, which also feeds the troubleshooting exports,
+# and can be stored on disk so later runs only clean values they have not seen.
+
+# File the lookup is stored in inside cache_dir (not .pkl/.parquet, so the extract
+# cache pruning leaves it alone)
+LOOKUP_FILE = 'cleaned_values.pickle'
+
+# Values kept per column in the stored lookup. The values of every run are moved to the end, and the ones
+# no run has seen for longest are dropped first, so the file stays bounded as quarters and IPs come and go.
+MAX_STORED_VALUES = 100000
+
+
+def source_fingerprint(functions, include_values=False):
+    """
+    Fingerprint of the rules of functions: their source plus the source of the
+    module functions and the regex patterns they use, so anything stored from
+    their results can be dropped as soon as any of them changes. With
+    include_values, the module-level lists, tuples, dicts, sets and dates they
+    use (e.g. rule tables, column lists, period bounds) are part of it too,
+    including the ones only used inside lambdas and comprehensions.
+    """
+    parts = []
+    seen = set()
+    pending = list(functions)
+    while pending:
+        function = pending.pop()
+        if id(function) in seen:
+            continue
+        seen.add(id(function))
+        try:
+            parts.append(inspect.getsource(function))
+        except (OSError, TypeError):
+            parts.append(getattr(function, '__qualname__', repr(function)))
+        code = getattr(function, '__code__', None)
+        if code is None:
+            continue
+        names = list(code.co_names)
+        if include_values:
+            nested = [const for const in code.co_consts if inspect.iscode(const)]
+            while nested:
+                inner = nested.pop()
+                names += inner.co_names
+                nested += [const for const in inner.co_consts if inspect.iscode(const)]
+        for name in names:
+            value = getattr(function, '__globals__', {}).get(name)
+            if inspect.isfunction(value):
+                pending.append(value)
+            elif isinstance(value, re.Pattern):
+                parts.append(value.pattern)
+            elif include_values and isinstance(value, (set, frozenset)):
+                # Sets are listed in sorted order: their own order changes from one run to the next
+                parts.append(f'{name} = {sorted(value, key=repr)!r}')
+            elif include_values and isinstance(value, (list, tuple, dict, pd.Timestamp)):
+                # Functions held in a table (e.g. lambdas of rules) are listed by their source, not their address
+                pending += _functions_in(value)
+                parts.append(f"{name} = {re.sub(r' at 0x[0-9a-fA-F]+', '', repr(value))}")
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()[:12]
+
+
+def _functions_in(value):
+    # Functions anywhere in the lists, tuples and dicts of value
+    if inspect.isfunction(value):
+        return [value]
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return [function for item in value for function in _functions_in(item)]
+    return []
+
+
+def cleaner_version(cleaner):
+    """
+    Fingerprint of a cleaner's rules: its source plus the source of the
+    module functions and the regex patterns it uses, so stored results are
+    dropped as soon as any of them changes.
+    """
+    return source_fingerprint([cleaner])
+
+
+def apply_distinct(frame, function):
+    """
+    Runs function once over the distinct rows of frame (e.g. distinct pairs of
+    two text columns) and broadcasts its result back to every row. function
+    takes a DataFrame of distinct rows and returns a DataFrame with one row per
+    input row.
+    """
+    # Combine the codes of the columns into one number per distinct row
+    combined = np.zeros(len(frame), dtype=np.int64)
+    for col in frame.columns:
+        col_codes, col_uniques = pd.factorize(frame[col], use_na_sentinel=False)
+        combined = combined * max(len(col_uniques), 1) + col_codes
+    first_rows, codes = np.unique(combined, return_index=True, return_inverse=True)[1:]
+
+    with stage('classify', function=function.__name__, distinct=len(first_rows)):
+        result = function(frame.iloc[first_rows].reset_index(drop=True))
+    broadcast = result.take(codes)
+    broadcast.index = frame.index
+    return broadcast
+
+
+class CleaningLookup:
+    """
+    Runs cleaners over the distinct values of columns and remembers the results.
+    With a cache_dir the lookup is loaded from and saved to that folder, so the
+    values cleaned in earlier runs are reused.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.path = os.path.join(cache_dir, LOOKUP_FILE) if cache_dir is not None else None
+        # Per column: the cleaner version and a dict of original value -> cleaned value
+        self._stored = self._load()
+        # Per column: the distinct values of this run and their cleaned values
+        self._tables = {}
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            print(f"Warning: Could not read the cleaning lookup {self.path} ({e}). Values will be cleaned again.")
+            return {}
+
+    def save(self):
+        # Written to a temporary file first so an interrupted run never leaves a broken lookup
+        # Each column keeps its MAX_STORED_VALUES most recently seen values (see clean)
+        if self.path is None:
+            return
+        for entry in self._stored.values():
+            values = entry['values']
+            for value in list(itertools.islice(values, max(len(values) - MAX_STORED_VALUES, 0))):
+                del values[value]
+        tmp_path = self.path + f'.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(self._stored, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Warning: Could not save the cleaning lookup {self.path} ({e}).")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def clean(self, values, cleaner):
+        """
+        Returns cleaner applied to the column values, computed once per distinct
+        value. cleaner takes a Series of values and returns a Series of the same
+        length with the cleaned values.
+        """
+        name = values.name
+        version = cleaner_version(cleaner)
+        entry = self._stored.get(name)
+        if entry is None or entry['version'] != version:
+            entry = {'version': version, 'values': {}}
+            self._stored[name] = entry
+        known = entry['values']
+
+        # Missing values get a code of their own, so the cleaner decides what they become
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        distinct = pd.Series(uniques, name=name)
+        missing = distinct.isna().to_numpy()
+
+        # Only values not seen before (and missing values, which cannot be looked up) are cleaned
+        todo = missing | ~np.fromiter((value in known for value in distinct), dtype=bool, count=len(distinct))
+        cleaned = np.empty(len(distinct), dtype=object)
+        if todo.any():
+            with stage('clean', column=name, cleaner=cleaner.__name__, values=int(todo.sum())):
+                result = cleaner(distinct[todo].reset_index(drop=True))
+            cleaned[todo] = result.to_numpy(dtype=object)
+            for value, value_cleaned in zip(distinct[todo & ~missing], cleaned[todo & ~missing]):
+                known[value] = value_cleaned
+        for i in np.flatnonzero(~todo):
+            cleaned[i] = known[distinct.iloc[i]]
+        # The values of this run become the most recent ones, the last to be dropped when the lookup is saved
+        for value in distinct[~missing & ~todo]:
+            known[value] = known.pop(value)
+
+        if (todo & ~missing).any():
+            self.save()
+
+        cleaned = pd.Series(cleaned).infer_objects()
+        self._tables[name] = (distinct, cleaned)
+        return pd.Series(cleaned.to_numpy()[codes], index=values.index, name=name)
+
+    def table(self, column, cleaned_column):
+        """
+        The distinct values of column seen in this run next to their cleaned
+        values, in order of first appearance.
+        """
+        distinct, cleaned = self._tables[column]
+        return pd.DataFrame({column: distinct.to_numpy(), cleaned_column: cleaned.to_numpy()})
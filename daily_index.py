@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from extract_cache import source_file_keys
+
+# Per-facility daily histogram of an extract, used by the aggregate_data_*.py scripts.
+# For every facility and combination of the category columns (e.g. HTS modality and
+# test result) the index holds the number of rows of every calendar day, with a
+# running total (prefix sum) per group. The count of any date range is then the
+# running total at the end of the range minus the running total just before it, so
+# date-range questions are answered from the index without touching the extracts.
+# The index is stored in cache_dir next to the cached extracts, one histogram per
+# source file (keyed by its name and content hash), so a rebuild only counts the
+# files that changed since the last run.
+
+# Bump when the layout of the stored index changes, so old indexes are rebuilt
+INDEX_VERSION = 1
+
+# Name of the day level of the index
+DAY = 'Day'
+
+
+def index_path(cache_dir, name):
+    # Not .pkl/.parquet, so the extract cache pruning leaves it alone
+    return os.path.join(cache_dir, f'daily_index-{name}.pickle')
+
+
+def index_fingerprint(date_column, keys, categories, definition=''):
+    # Changes whenever what is counted changes, so an index built with other settings is not reused
+    spec = json.dumps({'version': INDEX_VERSION, 'date_column': date_column, 'keys': list(keys),
+                       'categories': list(categories), 'definition': definition}, sort_keys=True)
+    return hashlib.sha256(spec.encode('utf-8')).hexdigest()[:12]
+
+
+def _load_stored(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception as e:
+        print(f"Warning: Could not read the daily index {path} ({e}). It will be rebuilt.")
+        return None
+
+
+def _save_stored(path, stored):
+    # Written to a temporary file first so an interrupted run never leaves a broken index
+    tmp_path = path + f'.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(stored, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Warning: Could not save the daily index {path} ({e}).")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def build_daily_index(data, all_files, cache_dir, name, date_column, keys, categories, row_filter=None,
+                      definition=''):
+    """
+    Updates the daily index called name in cache_dir for the files in
+    all_files and returns it as a DailyIndex. data holds the rows of those
+    files (with their 'Filename' column), row_filter the rows to count.
+    Only the files whose contents changed since the index was stored are
+    counted; the histograms of files no longer in all_files are dropped.
+    definition is any text describing how the category columns were derived
+    (e.g. the version of a classifier), so changing it rebuilds the index.
+    """
+    path = index_path(cache_dir, name)
+    fingerprint = index_fingerprint(date_column, keys, categories, definition)
+    stored = _load_stored(path)
+    if stored is None or stored.get('fingerprint') != fingerprint:
+        stored = {'fingerprint': fingerprint, 'files': {}}
+    histograms = stored['files']
+
+    # The name is part of the key because the project is taken from it
+    file_keys = {os.path.basename(file): file_key for file, file_key in source_file_keys(cache_dir, all_files).items()}
+
+    changed = [filename for filename, file_key in file_keys.items() if file_key not in histograms]
+    if changed:
+        # One grouped count over the rows of every changed file, split per file afterwards
+        rows = data['Filename'].isin(changed).to_numpy()
+        if row_filter is not None:
+            rows &= np.asarray(row_filter, dtype=bool)
+        subset = data.loc[rows, ['Filename'] + keys + categories]
+        subset[DAY] = data.loc[rows, date_column].dt.normalize()
+        counts = subset.groupby(['Filename'] + keys + categories + [DAY], observed=True, dropna=False).size()
+        counts = counts[counts.index.get_level_values(DAY).notna()]
+        for filename in changed:
+            if filename in counts.index.get_level_values('Filename'):
+                histograms[file_keys[filename]] = counts.xs(filename, level='Filename')
+            else:
+                histograms[file_keys[filename]] = counts.iloc[:0].droplevel('Filename')
+
+    current = set(file_keys.values())
+    for file_key in [file_key for file_key in histograms if file_key not in current]:
+        del histograms[file_key]
+    if changed or len(histograms) != len(stored['files']):
+        _save_stored(path, stored)
+    print(f"Daily index '{name}' updated for {len(changed)} of {len(all_files)} file(s).")
+
+    return DailyIndex([histograms[file_key] for file_key in file_keys.values()])
+
+
+def load_daily_index(cache_dir, name):
+    """
+    Returns the daily index called name stored in cache_dir by the last run,
+    or None when there is none.
+    """
+    stored = _load_stored(index_path(cache_dir, name))
+    if stored is None:
+        print(f"Warning: No daily index '{name}' in {cache_dir}.")
+        return None
+    return DailyIndex(list(stored['files'].values()))
+
+
+class DailyIndex:
+    """
+    Daily row counts per group (facility keys plus categories) with their
+    running totals. count(start, end, filters) returns the number of rows of
+    every facility between start and end (both included).
+    """
+
+    def __init__(self, histograms):
+        histograms = [histogram for histogram in histograms if len(histogram)]
+        if not histograms:
+            self.groups = pd.DataFrame()
+            self._positions = np.zeros(0, dtype=np.int64)
+            self._cumulative = np.zeros(0, dtype=np.int64)
+            return
+        counts = pd.concat(histograms)
+        levels = list(counts.index.names)
+        # Facilities do not span files, but summing keeps the index right when they do
+        counts = counts.groupby(level=levels, observed=True, dropna=False).sum().sort_index()
+
+        group_levels = levels[:-1]
+        group_index = counts.index.droplevel(DAY)
+        group_codes, group_values = pd.factorize(group_index, sort=False)
+        self.groups = pd.DataFrame(list(group_values), columns=group_levels)
+
+        # Rows are sorted by group and day: one position per (group, day), increasing along the index
+        days = counts.index.get_level_values(DAY).to_numpy().astype('datetime64[D]').astype(np.int64)
+        self._day_offset = days.min()
+        self._positions = group_codes.astype(np.int64) << 32 | (days - self._day_offset)
+        running = counts.to_numpy().astype(np.int64).cumsum()
+        # Running total per group: the global running total minus the total of the groups before it
+        group_starts = np.flatnonzero(np.r_[True, group_codes[1:] != group_codes[:-1]])
+        before_group = np.r_[0, running][group_starts]
+        self._cumulative = running - np.repeat(before_group, np.diff(np.r_[group_starts, len(running)]))
+
+    def _running_total(self, groups, day):
+        # Running total of every group in groups up to and including day (0 before its first row)
+        if day < self._day_offset:
+            return np.zeros(len(groups), dtype=np.int64)
+        position = groups.astype(np.int64) << 32 | min(day - self._day_offset, 0xFFFFFFFF)
+        last = np.searchsorted(self._positions, position, side='right') - 1
+        found = (last >= 0) & ((self._positions[np.maximum(last, 0)] >> 32) == groups)
+        return np.where(found, self._cumulative[np.maximum(last, 0)], 0)
+
+    def count(self, start, end, filters=None, by=None):
+        """
+        Number of rows between start and end (dates, both included) per group
+        of by (the facility keys and categories to keep, all of them when
+        None). filters maps a column to the value (or list of values) to
+        keep, e.g. {'Facility': 'Facility 1', 'Final HIV Test Result': ['Positive']}.
+        """
+        if self.groups.empty:
+            return pd.DataFrame(columns=(by or []) + ['Count'])
+        selected = np.ones(len(self.groups), dtype=bool)
+        for col, values in (filters or {}).items():
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            selected &= self.groups[col].isin(values).to_numpy()
+        groups = np.flatnonzero(selected)
+
+        start_day = pd.Timestamp(start).to_datetime64().astype('datetime64[D]').astype(np.int64)
+        end_day = pd.Timestamp(end).to_datetime64().astype('datetime64[D]').astype(np.int64)
+        counts = self._running_total(groups, end_day) - self._running_total(groups, start_day - 1)
+
+        result = self.groups.iloc[groups].assign(Count=counts)
+        by = list(self.groups.columns) if by is None else list(by)
+        if not by:
+            return pd.DataFrame({'Count': [int(counts.sum())]})
+        return result.groupby(by, dropna=False, sort=True)['Count'].sum().reset_index()
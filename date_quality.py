@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+from ingestion import UNPARSEABLE_DATES_COLUMN
+from profiling import stage
+
+# Data-quality summary of the date columns of the aggregate_data_*.py scripts.
+# Blank cells and text that is not a date both become NaT as the extracts are read; ingestion marks the
+# second kind in UNPARSEABLE_DATES_COLUMN, so once the extracts are combined both are counted per column
+# and per facility in one pass over the date columns, without copying or printing the rows. Blank dates
+# are mostly expected (e.g. no viral load sample yet); unparseable ones are data-entry problems the
+# facility can correct. The rows holding them can be saved to a capped sample workbook for follow-up.
+
+# Rows with an unparseable date saved to the sample workbook at most
+MAX_SAMPLE_ROWS = 10000
+
+# Facilities with the most unparseable dates listed on the console
+TOP_FACILITIES = 10
+
+
+def date_quality(combined_data, date_columns, keys):
+    """
+    Counts the blank and the unparseable values of every date column of
+    combined_data (see UNPARSEABLE_DATES_COLUMN). Returns the counts per
+    column, the counts per facility (keys) that has any, most unparseable
+    first, and the number of unparseable dates of every row.
+    """
+    if UNPARSEABLE_DATES_COLUMN in combined_data.columns:
+        marks = combined_data[UNPARSEABLE_DATES_COLUMN].to_numpy()
+    else:
+        marks = np.zeros(len(combined_data), dtype=np.uint8)
+    blank_rows = np.zeros(len(combined_data), dtype=np.int16)
+    unparseable_rows = np.zeros(len(combined_data), dtype=np.int16)
+    by_column = []
+    for bit, col in enumerate(date_columns):
+        if col not in combined_data.columns:
+            continue
+        unparseable = (marks >> marks.dtype.type(bit)) & 1 == 1
+        blank = combined_data[col].isna().to_numpy() & ~unparseable
+        by_column.append((col, int(blank.sum()), int(unparseable.sum())))
+        blank_rows += blank
+        unparseable_rows += unparseable
+
+    by_column = pd.DataFrame(by_column, columns=['Column', 'Blank', 'Unparseable'])
+    by_facility = pd.DataFrame({'Blank': blank_rows, 'Unparseable': unparseable_rows}, index=combined_data.index).groupby(
+        [combined_data[key] for key in keys], observed=True).sum()
+    by_facility = by_facility[(by_facility['Blank'] > 0) | (by_facility['Unparseable'] > 0)]
+    by_facility = by_facility.sort_values('Unparseable', ascending=False, kind='stable').reset_index()
+    return by_column, by_facility, unparseable_rows
+
+
+def unparseable_sample(combined_data, date_columns, keys, unparseable_rows, max_rows=MAX_SAMPLE_ROWS):
+    # The first max_rows rows with an unparseable date: the facility, file and the names of those columns,
+    # then every date column (the unparseable ones hold NaT, their text is not kept)
+    rows = combined_data[unparseable_rows > 0].head(max_rows)
+    marks = rows[UNPARSEABLE_DATES_COLUMN].to_numpy() if UNPARSEABLE_DATES_COLUMN in rows.columns else np.zeros(0, dtype=np.uint8)
+    columns = [col for col in date_columns if col in combined_data.columns]
+    names = [', '.join(col for bit, col in enumerate(date_columns) if (mark >> bit) & 1) for mark in marks.tolist()]
+    file_column = ['Filename'] if 'Filename' in rows.columns else []
+    return rows[keys + file_column].assign(**{'Unparseable columns': names}).join(rows[columns])
+
+
+def report_date_quality(combined_data, date_columns, keys, sample_path=None, max_sample_rows=MAX_SAMPLE_ROWS):
+    """
+    Prints the blank and unparseable date counts of combined_data per column,
+    and the facilities (keys) with the most unparseable dates (see
+    date_quality). With sample_path, the counts per column and facility and
+    the first max_sample_rows rows with an unparseable date are saved there
+    as a workbook. The marks of ingestion are dropped from combined_data
+    afterwards.
+    """
+    with stage('date quality', rows=len(combined_data)):
+        by_column, by_facility, unparseable_rows = date_quality(combined_data, date_columns, keys)
+        blank = by_column['Blank'].sum()
+        unparseable = by_column['Unparseable'].sum()
+        if blank or unparseable:
+            print(f"Date columns: {blank:,} blank and {unparseable:,} unparseable value(s):\n"
+                  f"{by_column[(by_column['Blank'] > 0) | (by_column['Unparseable'] > 0)].to_string(index=False)}")
+        if unparseable:
+            facilities = by_facility[by_facility['Unparseable'] > 0]
+            print(f"Warning: {unparseable:,} date(s) could not be read in {(unparseable_rows > 0).sum():,} rows of "
+                  f"{len(facilities)} facilities. Most at:\n{facilities.head(TOP_FACILITIES).to_string(index=False)}")
+
+        if sample_path is not None:
+            sample = unparseable_sample(combined_data, date_columns, keys, unparseable_rows, max_sample_rows)
+            with pd.ExcelWriter(sample_path) as writer:
+                by_column.to_excel(writer, sheet_name='By column', index=False)
+                by_facility.to_excel(writer, sheet_name='By facility', index=False)
+                sample.to_excel(writer, sheet_name='Unparseable rows', index=False)
+            print(f"Date quality summary ({len(sample):,} of {(unparseable_rows > 0).sum():,} rows with an "
+                  f"unparseable date) saved to: {sample_path}")
+
+    if UNPARSEABLE_DATES_COLUMN in combined_data.columns:
+        del combined_data[UNPARSEABLE_DATES_COLUMN]
@@ -0,0 +1,335 @@
+import argparse
+import ast
+import contextlib
+import importlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from aggregate_indicators import REPORTS, redirect_outputs, report_module
+from indicator_counts import EXCEL_MAX_ROWS
+from trend import parse_periods, semi_annual_start
+
+# Differential test of an indicator engine against the legacy code path, e.g.
+#   python equivalence.py radet "IP1/RADET" --engine my_engine:aggregate --output radet_equivalence.xlsx
+# The legacy path is the original script of the report, frozen in the legacy folder as it was before any of
+# the shared modules existed: it reads the raw extracts of the folder itself and counts every indicator its own
+# way (its cleaners, filters, one filtered copy per indicator grouped by facility and left-merged one after
+# another, quirks included), only with the folder, output paths and period swapped in. So a regression in the
+# cleaners, classifiers or filters the engine shares with the current scripts shows up as a difference. The
+# engine under test (the report's own aggregate by default) runs on the extracts as the current script loads
+# them. Every (facility, indicator) cell where the two tables differ is reported, with the first client rows
+# the legacy filter counts for it, and so is any difference in the order of the rows or columns or in the type
+# of a count column: an engine is only equivalent when it gives the same table.
+
+LEGACY_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'legacy')
+
+# Facility columns of every report, and whether its script sorts the facilities on them as it saves the table
+LEGACY_LAYOUT = {
+    'radet': (['ProjectName', 'Facility Name', 'DatimId'], False),
+    'hts': (['ProjectName', 'Facility', 'Facility Id (Datim)'], True),
+    'hts-index': (['ProjectName', 'Facility Name', 'Facility Id (Datim)'], False),
+    'pmtct-hts': (['ProjectName', 'Facility'], True),
+    'prep': (['ProjectName', 'Facility Name', 'Facility Id (Datim)'], False),
+}
+
+# Client rows saved per facility and indicator that differ
+DEFAULT_SAMPLE_ROWS = 5
+
+
+def legacy_program(path, names):
+    # The legacy script at path compiled with its top-level assignments of names taken from __overrides__
+    # instead, and its pivot_data wrapped by __record__
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    body = []
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name) \
+                and node.targets[0].id in names:
+            node.value = ast.parse(f"__overrides__[{node.targets[0].id!r}]", mode='eval').body
+        body.append(node)
+        if isinstance(node, ast.FunctionDef) and node.name == 'pivot_data':
+            body.extend(ast.parse("pivot_data = __record__(pivot_data)").body)
+    tree.body = body
+    return compile(ast.fix_missing_locations(tree), path, 'exec')
+
+
+def assigned_names(path):
+    # Names the legacy script at path assigns at its top level
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    return {node.targets[0].id for node in tree.body if isinstance(node, ast.Assign) and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name)}
+
+
+def run_legacy(report, folder, output_stem, period=None):
+    """
+    Runs the legacy script of report (see LEGACY_FOLDER) on the extracts of
+    folder for period, a (start, end) pair of dates, the quarter at the top of
+    the script when None. Its workbooks are saved as <output_stem>.xlsx and
+    <output_stem>_<output>.xlsx, its console output as <output_stem>.log.
+    Returns its facility table and, for each of its count columns, the client
+    rows it counted.
+    """
+    path = os.path.join(LEGACY_FOLDER, f"{REPORTS[report]}.py")
+    names = assigned_names(path)
+    overrides = {'folder_path': folder, 'output_file_path': f"{output_stem}.xlsx"}
+    for name in names:
+        if name.endswith('_output_path'):
+            overrides[name] = f"{output_stem}_{name[:-len('_output_path')]}.xlsx"
+    if period is not None:
+        label, start, end = parse_periods([period])[0]
+        overrides.update({'Start_of_quarter': start, 'End_of_quarter': end, 'six_months_ago': semi_annual_start(start)})
+    if not {'folder_path', 'output_file_path', 'Start_of_quarter', 'End_of_quarter'} <= names:
+        print(f"FATAL ERROR: {path} does not set its folder, output path and quarter at the top.")
+        exit(1)
+
+    filtered = {}
+
+    def record(pivot_data):
+        # pivot_data that also keeps the rows each pivot counts, by the pivot
+        def recording_pivot_data(data, value_name):
+            pivot_df = pivot_data(data, value_name)
+            filtered[id(pivot_df)] = data
+            return pivot_df
+        return recording_pivot_data
+
+    namespace = {'__name__': '__legacy__', '__file__': path, '__overrides__': overrides, '__record__': record}
+    console = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(console):
+            exec(legacy_program(path, names & overrides.keys()), namespace)
+    except (Exception, SystemExit) as e:
+        print(console.getvalue()[-2000:])
+        print(f"FATAL ERROR: The legacy {report} script stopped: {e!r}")
+        exit(1)
+    finally:
+        with open(f"{output_stem}.log", 'w', encoding='utf-8') as f:
+            f.write(console.getvalue())
+    if 'master_aggregated_df' not in namespace:
+        print(f"FATAL ERROR: The legacy {report} script stopped before its facility table was made. See {output_stem}.log.")
+        exit(1)
+
+    # The count columns the pivots become, as pd.merge names them (a repeated name gets the _x/_y suffixes)
+    keys, _ = LEGACY_LAYOUT[report]
+    columns = list(keys)
+    sources = {}
+    for pivot_df in namespace['all_pivots_for_summary']:
+        if pivot_df.empty:
+            continue
+        name = pivot_df.columns[-1]
+        if name in columns:
+            columns[columns.index(name)] = f"{name}_x"
+            sources[f"{name}_x"] = sources.pop(name)
+            name = f"{name}_y"
+        columns.append(name)
+        sources[name] = filtered.get(id(pivot_df))
+    return namespace['master_aggregated_df'].reset_index(drop=True), sources
+
+
+def layout_differences(legacy_df, engine_df, keys):
+    """
+    Differences between the two tables that are not in any one cell: the
+    order of the count columns and of the facilities, and the type of the
+    count columns present in both. Returns a list of messages.
+    """
+    problems = []
+    legacy_columns = [col for col in legacy_df.columns if col not in keys]
+    engine_columns = [col for col in engine_df.columns if col not in keys]
+    if list(engine_df.columns[:len(keys)]) != keys:
+        problems.append(f"The engine's first columns are {list(engine_df.columns[:len(keys)])}, not {keys}.")
+    duplicated = sorted(set(col for col in engine_columns if engine_columns.count(col) > 1))
+    if duplicated:
+        problems.append(f"The engine's output repeats the columns {duplicated}.")
+    shared = [col for col in legacy_columns if col in engine_columns]
+    if [col for col in engine_columns if col in shared] != shared:
+        problems.append("The count columns are in a different order.")
+
+    legacy_facilities = pd.MultiIndex.from_frame(legacy_df[keys].astype(str))
+    engine_facilities = pd.MultiIndex.from_frame(engine_df[keys].astype(str))
+    if engine_facilities.has_duplicates:
+        problems.append(f"The engine's output has {engine_facilities.duplicated().sum()} repeated facilities.")
+    in_both = legacy_facilities.isin(engine_facilities)
+    if not legacy_facilities[in_both].equals(engine_facilities[engine_facilities.isin(legacy_facilities)]):
+        problems.append("The facilities are in a different order.")
+
+    for col in shared:
+        if not duplicated and legacy_df[col].dtype != engine_df[col].dtype:
+            problems.append(f"{col} is {engine_df[col].dtype} instead of {legacy_df[col].dtype}.")
+    return problems
+def cell_differences(legacy_df, engine_df, keys):
+    """
+    Every (facility, indicator) cell whose value differs between the two
+    tables, as a DataFrame of the facility columns, the Indicator, the Legacy
+    and Engine values and a Note when the facility or the indicator is
+    missing from one of them. Facilities are matched on their columns as
+    strings and listed in the legacy order; NaN equals NaN.
+    """
+    legacy = legacy_df.set_index(pd.MultiIndex.from_frame(legacy_df[keys].astype(str))).drop(columns=keys)
+    engine = engine_df.set_index(pd.MultiIndex.from_frame(engine_df[keys].astype(str))).drop(columns=keys)
+    engine = engine.loc[~engine.index.duplicated(), ~engine.columns.duplicated()]
+    facilities = legacy.index.append(engine.index[~engine.index.isin(legacy.index)])
+    missing_facility = pd.Series('', index=facilities)
+    missing_facility[~facilities.isin(engine.index)] = 'facility missing from the engine output'
+    missing_facility[~facilities.isin(legacy.index)] = 'facility missing from the legacy output'
+
+    differences = []
+    for name in list(dict.fromkeys(list(legacy.columns) + list(engine.columns))):
+        if name not in engine.columns:
+            note = 'indicator missing from the engine output'
+        elif name not in legacy.columns:
+            note = 'indicator missing from the legacy output'
+        else:
+            note = None
+        legacy_values = legacy[name].reindex(facilities) if name in legacy.columns else pd.Series(None, index=facilities, dtype=object)
+        engine_values = engine[name].reindex(facilities) if name in engine.columns else pd.Series(None, index=facilities, dtype=object)
+        differ = ~((legacy_values == engine_values) | (legacy_values.isna() & engine_values.isna()))
+        if note is not None:
+            differ[:] = True
+        if not differ.any():
+            continue
+        differences.append(pd.DataFrame({'Indicator': name,
+                                         'Legacy': legacy_values[differ].astype(object),
+                                         'Engine': engine_values[differ].astype(object),
+                                         'Note': note if note is not None else missing_facility[differ]}))
+
+    if not differences:
+        return pd.DataFrame(columns=keys + ['Indicator', 'Legacy', 'Engine', 'Note'])
+    differences = pd.concat(differences)
+    differences.index.names = keys
+    return differences.reset_index()
+
+
+def contributing_rows(differences, sources, keys, sample_rows=DEFAULT_SAMPLE_ROWS):
+    """
+    The first sample_rows client rows the legacy filter counts for every
+    differing cell (see cell_differences), from the rows the legacy script
+    kept for each of its count columns (sources, see run_legacy), with the
+    Indicator they are counted in, in the facility and indicator order of
+    differences. Cells of an indicator the legacy path does not have get no
+    rows.
+    """
+    samples = []
+    for name, cells in differences.groupby('Indicator', sort=False):
+        data = sources.get(name)
+        if data is None or data.empty:
+            continue
+        facilities = pd.MultiIndex.from_frame(data[keys].astype(str))
+        rows = facilities.isin(pd.MultiIndex.from_frame(cells[keys]))
+        if not rows.any():
+            continue
+        sample = data[rows].groupby(facilities[rows], sort=False).head(sample_rows)
+        samples.append(sample.assign(Indicator=name)[['Indicator'] + list(data.columns)])
+    if not samples:
+        return pd.DataFrame(columns=['Indicator'] + keys)
+    return pd.concat(samples, ignore_index=True)
+
+
+def load_engine(spec):
+    # The function of a 'module:function' spec, e.g. my_engine:aggregate
+    module_name, _, function_name = spec.partition(':')
+    try:
+        return getattr(importlib.import_module(module_name), function_name or 'aggregate')
+    except (ImportError, AttributeError) as e:
+        print(f"FATAL ERROR: Cannot load the engine {spec}: {e}")
+        exit()
+
+
+def run_equivalence(report, folder, engine=None, period=None, output_path=None, sample_rows=DEFAULT_SAMPLE_ROWS,
+                    cache_dir=None, workers=None):
+    """
+    Compares the facility counts of engine with those of the legacy script of
+    report (see run_legacy) on the extracts of folder, for period, a (start,
+    end) pair of dates, the quarter at the top of the scripts when None.
+    engine is called as engine(combined_data, period) on the extracts loaded
+    by the report module and must return the table of the report's aggregate
+    (the default engine). With output_path, the problems, the differing cells
+    and their contributing client rows are saved there as a workbook, the
+    legacy outputs next to it as <output name>_legacy*.xlsx and the other
+    outputs of the load (e.g. the RADET value lists) as <output name>_*.xlsx.
+    Returns the list of problems and the DataFrame of differing cells; both
+    are empty when the engine is equivalent.
+    """
+    keys, sorted_on_save = LEGACY_LAYOUT[report]
+    if output_path is not None:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with tempfile.TemporaryDirectory() as scratch:
+        output_stem = os.path.splitext(output_path)[0] if output_path is not None else os.path.join(scratch, report)
+        start = time.perf_counter()
+        legacy_df, sources = run_legacy(report, folder, f"{output_stem}_legacy", period)
+        print(f"Legacy script: {len(legacy_df)} facilities in {time.perf_counter() - start:.1f}s.")
+    if output_path is None:
+        # The rows the legacy filters counted are only saved with the report
+        sources = {}
+
+    module = report_module(report, cache_dir, workers)
+    engine = engine or module.aggregate
+    if output_path is not None:
+        redirect_outputs(module, output_path)
+    combined_data = module.load(folder)
+    start = time.perf_counter()
+    engine_df = engine(combined_data, period)
+    print(f"Engine {getattr(engine, '__module__', '')}.{getattr(engine, '__name__', engine)}: "
+          f"{len(engine_df)} facilities in {time.perf_counter() - start:.1f}s.")
+    del combined_data
+    if sorted_on_save:
+        # The legacy table is the one the script saved, sorted on the facility columns
+        engine_df = engine_df.loc[engine_df[keys].astype(str).sort_values(keys).index].reset_index(drop=True)
+
+    problems = layout_differences(legacy_df, engine_df, keys)
+    differences = cell_differences(legacy_df, engine_df, keys)
+    if len(differences):
+        problems.append(f"{len(differences)} cell(s) differ in {differences['Indicator'].nunique()} indicator(s) "
+                        f"over {len(differences[keys].drop_duplicates())} facilities.")
+    for problem in problems:
+        print(f"Warning: {problem}")
+    if not problems:
+        print(f"The engine reproduces the legacy {report} counts of all {len(legacy_df)} facilities.")
+
+    if output_path is not None:
+        rows = contributing_rows(differences, sources, keys, sample_rows)
+        for name, table in [('differing cells', differences), ('contributing rows', rows)]:
+            if len(table) > EXCEL_MAX_ROWS:
+                print(f"Warning: There are {len(table):,} {name}; only the first {EXCEL_MAX_ROWS:,} fit in the sheet.")
+        with pd.ExcelWriter(output_path) as writer:
+            pd.DataFrame({'Problem': problems or ['None: the engine reproduces the legacy counts.']}).to_excel(
+                writer, sheet_name='Summary', index=False)
+            differences.head(EXCEL_MAX_ROWS).to_excel(writer, sheet_name='Differences', index=False)
+            rows.head(EXCEL_MAX_ROWS).to_excel(writer, sheet_name='Contributing rows', index=False)
+        print(f"Equivalence report saved to: {output_path}")
+    return problems, differences
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Compare the facility counts of an indicator engine with the legacy "
+                                                 "script of the report, cell by cell.")
+    parser.add_argument('report', choices=list(REPORTS), help="report whose indicators are compared")
+    parser.add_argument('folder', help="input folder holding the CSV/Excel extracts")
+    parser.add_argument('--engine', help="engine under test as module:function, called with (combined_data, period) "
+                                         "(default: aggregate of the report's script)")
+    parser.add_argument('--period', nargs=2, metavar=('START', 'END'),
+                        help="first and last day of the reporting period (default: the quarter set in the script)")
+    parser.add_argument('--output', default='equivalence_report.xlsx',
+                        help="workbook the differences are saved to (default: equivalence_report.xlsx)")
+    parser.add_argument('--sample-rows', type=int, default=DEFAULT_SAMPLE_ROWS,
+                        help=f"client rows saved per differing cell (default: {DEFAULT_SAMPLE_ROWS})")
+    parser.add_argument('--cache-dir', help="folder of the extract cache (default: cache_dir of the script)")
+    parser.add_argument('--workers', type=int, help="worker processes reading the extracts (default: ingest_workers of the script)")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    engine = load_engine(args.engine) if args.engine else None
+    problems, differences = run_equivalence(args.report, args.folder, engine, tuple(args.period) if args.period else None,
+                                            args.output, args.sample_rows, args.cache_dir, args.workers)
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+# On-disk cache of parsed extracts, used by ingestion.load_extracts.
+# Each parsed (and type-coerced) file is stored as Parquet, named after the
+# SHA-256 of the raw file contents plus the coercion applied to it, so a file
+# that has not changed is loaded from the cache instead of being parsed again.
+# A manifest maps every source path to its size, mtime and content hash, which
+# lets unchanged files skip the hashing step as well.
+
+# Bump when the way extracts are parsed or coerced changes, so old entries are ignored
+# (2: the unparseable dates are marked as the extract is coerced)
+CACHE_VERSION = 2
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def file_content_hash(file):
+    # SHA-256 of the raw file contents, read in 1 MB chunks
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_signature(file):
+    # Path, size and modification time of a source file, as stored in the manifest
+    stat = os.stat(file)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_manifest(cache_dir):
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not read the cache manifest {manifest_path} ({e}). Files will be hashed again.")
+        return {}
+
+
+def save_manifest(cache_dir, manifest):
+    # Written to a temporary file first so an interrupted run never leaves a broken manifest
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def known_content_hash(manifest, file):
+    # Content hash recorded for file, if its size and mtime are unchanged since it was hashed
+    entry = manifest.get(os.path.abspath(file))
+    if entry is None:
+        return None
+    try:
+        signature = file_signature(file)
+    except OSError:
+        return None
+    if entry.get('size') != signature['size'] or entry.get('mtime_ns') != signature['mtime_ns']:
+        return None
+    return entry.get('sha256')
+
+
+def source_file_keys(cache_dir, all_files):
+    """
+    Returns the (file name, content hash) of every file in all_files, the key
+    under which results derived from the file are stored. The hash is taken
+    from the manifest in cache_dir when the file is unchanged since it was
+    recorded there, and computed otherwise.
+    """
+    manifest = load_manifest(cache_dir) if os.path.exists(cache_dir) else {}
+    file_keys = {}
+    for file in all_files:
+        content_hash = known_content_hash(manifest, file) or file_content_hash(file)
+        file_keys[file] = (os.path.basename(file), content_hash)
+    return file_keys
+
+
+def read_spec_key(date_columns, numeric_columns, usecols=None, categorical_columns=()):
+    # Short fingerprint of the column projection and coercion baked into a cached copy
+    spec = json.dumps({'version': CACHE_VERSION,
+                       'date_columns': list(date_columns),
+                       'numeric_columns': list(numeric_columns),
+                       'usecols': sorted(usecols) if usecols is not None else None,
+                       'categorical_columns': list(categorical_columns)}, sort_keys=True)
+    return hashlib.sha256(spec.encode('utf-8')).hexdigest()[:12]
+
+
+def cache_entry_path(cache_dir, content_hash, date_columns, numeric_columns, usecols=None, categorical_columns=()):
+    # Path of the cached copy without extension (.parquet, or .pkl for frames Parquet cannot store)
+    return os.path.join(cache_dir, f"{content_hash}-{read_spec_key(date_columns, numeric_columns, usecols, categorical_columns)}")
+
+
+def read_cached(entry_path):
+    """
+    Returns the cached DataFrame stored at entry_path, or None when there is no
+    usable cached copy.
+    """
+    if os.path.exists(entry_path + '.parquet'):
+        try:
+            data = pd.read_parquet(entry_path + '.parquet')
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable cache entry {entry_path}.parquet ({e}).")
+            return None
+        # Parquet returns missing text values as None; the raw readers give NaN
+        for col in data.columns[data.dtypes == object]:
+            data[col] = data[col].where(data[col].notna(), float('nan'))
+        return data
+    if os.path.exists(entry_path + '.pkl'):
+        try:
+            return pd.read_pickle(entry_path + '.pkl')
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable cache entry {entry_path}.pkl ({e}).")
+            return None
+    return None
+
+
+def write_cached(entry_path, data):
+    """
+    Stores data at entry_path as Parquet. Frames Parquet cannot represent
+    (e.g. text columns that also hold numbers, or non-text column names) and
+    setups without pyarrow/fastparquet are stored as a pickle instead.
+    """
+    tmp_path = entry_path + f'.{os.getpid()}.tmp'
+    try:
+        try:
+            data.to_parquet(tmp_path, index=False)
+            final_path = entry_path + '.parquet'
+        except Exception:
+            data.to_pickle(tmp_path)
+            final_path = entry_path + '.pkl'
+        os.replace(tmp_path, final_path)
+    except OSError as e:
+        print(f"Warning: Could not write cache entry {entry_path} ({e}).")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def prune_cache(cache_dir, manifest):
+    """
+    Drops manifest entries for source files that no longer exist and deletes
+    cached copies whose content hash is no longer referenced by the manifest.
+    """
+    for path in [path for path in manifest if not os.path.exists(path)]:
+        del manifest[path]
+    referenced = {entry.get('sha256') for entry in manifest.values()}
+    for name in os.listdir(cache_dir):
+        if not name.endswith(('.parquet', '.pkl')):
+            continue
+        if name.split('-')[0] not in referenced:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
@@ -0,0 +1,128 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from cleaning_lookup import source_fingerprint
+from extract_cache import source_file_keys
+from indicator_counts import assemble_counts
+from schema import as_key_category
+
+# Incremental re-aggregation for the aggregate_data_*.py scripts.
+# Every indicator is a count per facility, and a facility's rows come from its
+# own extract, so the facility counts of a source file can be kept and added up
+# with the counts of the other files. The counts of every file are stored in
+# cache_dir, keyed by the file name and content hash, together with a
+# fingerprint of the indicator definitions and the reporting period. A re-run
+# only reads and counts the files that changed; a change to the definitions or
+# the period drops every stored count.
+
+# Bump when the layout of the stored counts changes, so old counts are dropped
+PARTIALS_VERSION = 1
+
+
+def run_fingerprint(functions, *values):
+    """
+    Fingerprint of what the counts depend on: the source of functions (and of
+    the module functions, patterns and rule tables they use) and values
+    (e.g. the period bounds).
+    """
+    return f"{PARTIALS_VERSION}-{source_fingerprint(functions, include_values=True)}-" + \
+        '-'.join(str(value) for value in values)
+
+
+class PartialCounts:
+    """
+    Facility counts of every source file, kept in cache_dir between runs.
+    changed_files() lists the files that need to be counted again, update()
+    stores their counts and combine() adds up the counts of all files.
+    """
+
+    def __init__(self, cache_dir, name, fingerprint):
+        self.path = os.path.join(cache_dir, f'partial_counts-{name}.pickle')
+        self.cache_dir = cache_dir
+        self._file_keys = {}
+        stored = self._load()
+        if stored is None or stored.get('fingerprint') != fingerprint:
+            if stored is not None:
+                print("The indicator definitions or the period changed since the last run: every file is counted again.")
+            stored = {'fingerprint': fingerprint, 'names': None, 'files': {}}
+        self._stored = stored
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            print(f"Warning: Could not read the stored counts {self.path} ({e}). Every file is counted again.")
+            return None
+
+    def save(self):
+        # Written to a temporary file first so an interrupted run never leaves broken counts
+        tmp_path = self.path + f'.{os.getpid()}.tmp'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(self._stored, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Warning: Could not save the stored counts {self.path} ({e}).")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def changed_files(self, all_files):
+        # Files of all_files without stored counts (new, changed, or counted under other definitions)
+        self._file_keys = source_file_keys(self.cache_dir, all_files)
+        changed = [file for file in all_files if self._file_keys[file] not in self._stored['files']]
+        print(f"Incremental run: {len(changed)} of {len(all_files)} file(s) changed since the last run.")
+        return changed
+
+    def update(self, data, pivots, keys, files):
+        """
+        Stores the facility counts of files, read into data. pivots are the
+        indicator pivots of data counted by ['Filename'] + keys (see
+        count_indicators), in the column order of the report. A file without
+        rows in data is stored with no facilities, as a full run skips it too.
+        """
+        by_file = ['Filename'] + keys
+        facilities = data[by_file].drop_duplicates()
+        index = pd.MultiIndex.from_frame(facilities)
+        counts = facilities.astype(object).reset_index(drop=True)
+        for i, pivot_df in enumerate(pivots):
+            counts[i] = pivot_df.set_index(by_file).iloc[:, 0].reindex(index).fillna(0).to_numpy(dtype=np.int64)
+        self._stored['names'] = [pivot_df.columns[-1] for pivot_df in pivots]
+
+        by_name = dict(list(counts.groupby('Filename', sort=False)))
+        for file in files:
+            file_counts = by_name.get(os.path.basename(file), counts.iloc[:0])
+            self._stored['files'][self._file_keys[file]] = file_counts.drop(columns='Filename').reset_index(drop=True)
+
+        # Counts of files that are gone or have changed since are dropped
+        current = set(self._file_keys.values())
+        for file_key in [file_key for file_key in self._stored['files'] if file_key not in current]:
+            del self._stored['files'][file_key]
+        self.save()
+
+    def combine(self, keys, fill_zero=False):
+        """
+        Adds up the stored counts of the files listed by changed_files() and
+        returns the same facility table assemble_counts gives for all their
+        rows at once.
+        """
+        parts = [self._stored['files'][file_key] for file_key in self._file_keys.values()
+                 if file_key in self._stored['files']]
+        names = self._stored['names'] or []
+        # A facility found in several files is counted once per file, and listed where it first appears
+        counts = pd.concat(parts, ignore_index=True).groupby(keys, sort=False).sum().reset_index() if parts \
+            else pd.DataFrame(columns=keys + list(range(len(names))))
+        # Sorted categoricals of strings, like the facility keys of a full run
+        for key in keys:
+            counts[key] = as_key_category(counts[key])
+
+        pivots = [counts.loc[counts[i] > 0, keys + [i]].astype({i: 'int64'}).rename(columns={i: name})
+                  for i, name in enumerate(names)]
+        return assemble_counts(counts[keys], pivots, keys, fill_zero=fill_zero)
@@ -0,0 +1,239 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from mask_engine import as_mask
+from profiling import stage
+
+# Count-only aggregation shared by the aggregate_data_*.py scripts.
+# Each indicator is kept as a boolean row mask instead of a filtered copy of the
+# combined data. The masks are stacked into one 0/1 matrix (a uint8 column per
+# indicator) and summed per facility with a single groupby, so no full-width
+# copy of the matching rows is ever made just to count them. Row-level line
+# lists are only built for the indicators that are asked for.
+
+# Rows per sheet that fit in an Excel worksheet (one row is taken by the header)
+EXCEL_MAX_ROWS = 1048575
+
+# MER fine age bands (lower bound included, upper bound excluded)
+MER_AGE_BINS = [0, 1, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65, np.inf]
+MER_AGE_BANDS = ['<1', '1-4', '5-9', '10-14', '15-19', '20-24', '25-29', '30-34', '35-39', '40-44',
+                 '45-49', '50-54', '55-59', '60-64', '65+']
+
+# Label of a missing age band or Sex in the disaggregates
+UNKNOWN = 'Unknown'
+
+
+def mer_age_band(ages):
+    # MER fine age band of every age, as a categorical with missing or invalid ages as 'Unknown'
+    age_band = pd.cut(pd.to_numeric(ages, errors='coerce'), bins=MER_AGE_BINS, labels=MER_AGE_BANDS, right=False)
+    return age_band.cat.add_categories([UNKNOWN]).fillna(UNKNOWN)
+
+
+def mer_disaggregation(data):
+    """
+    Returns the MER disaggregation columns of data: 'Age Band' (the fine age
+    band of 'Age') and 'Sex', as categoricals with missing or invalid values as
+    'Unknown'. An 'Age Band' column data already has (e.g. taken with
+    mer_age_band before missing ages were filled in) is used as it is. A column
+    the data does not have is left out.
+    """
+    columns = {}
+    if 'Age Band' in data.columns:
+        columns['Age Band'] = data['Age Band']
+    elif 'Age' in data.columns:
+        columns['Age Band'] = mer_age_band(data['Age'])
+    if 'Sex' in data.columns:
+        sex = data['Sex'].astype('category')
+        sex = sex.cat.set_categories(sex.cat.categories.astype(str))
+        columns['Sex'] = sex.cat.add_categories([UNKNOWN]).fillna(UNKNOWN)
+    return pd.DataFrame(columns, index=data.index)
+
+
+def disaggregate_long(counts, names, keys):
+    # Long table (keys, Indicator, disaggregation columns, Count) from counts indexed by keys + disaggregation columns
+    parts = []
+    for column, name in zip(counts.columns, names):
+        count = counts[column]
+        count = count[count > 0].astype('int64').reset_index(name='Count')
+        count.insert(len(keys), 'Indicator', name)
+        parts.append(count)
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=keys + ['Indicator', 'Count'])
+
+
+def count_indicators(data, indicators, keys, by=None):
+    """
+    Counts the rows of data matching each indicator per group of keys.
+    indicators is a list of (name, mask) pairs, mask being a boolean mask over
+    the rows of data. Returns one DataFrame per indicator, in the same order,
+    holding the key columns and a count column called name for the groups with
+    at least one matching row (the same frame pivot_data built from a filtered
+    copy of data).
+    With by (e.g. mer_disaggregation(data)), the same grouped sum is also split
+    by the columns of by, and (pivots, long table of the disaggregated counts)
+    is returned; the facility totals are the sums of the disaggregated counts.
+    """
+    with stage('count indicators', indicators=len(indicators)):
+        matrix = pd.DataFrame({i: as_mask(mask).view(np.uint8) for i, (name, mask) in enumerate(indicators)},
+                              index=data.index)
+        groups = [data[key] for key in keys]
+        if by is not None:
+            groups += [by[col] for col in by.columns]
+        counts = matrix.groupby(groups, observed=True).sum()
+
+    disaggregated = None
+    if by is not None:
+        disaggregated = counts
+        counts = counts.groupby(level=list(range(len(keys))), observed=True).sum()
+
+    pivots = []
+    for i, (name, mask) in enumerate(indicators):
+        count = counts[i]
+        pivots.append(count[count > 0].astype('int64').reset_index(name=name))
+    if by is None:
+        return pivots
+    return pivots, disaggregate_long(disaggregated, [name for name, mask in indicators], keys)
+
+
+def count_matrix(data, keys, row_filter, label_column, value_column, indicators, by=None):
+    """
+    Counts a family of indicators that only differ in the values of two columns
+    (e.g. the HTS modality and the test result) with one groupby over the keys
+    and both columns. indicators is a list of (name, labels, values) triples:
+    the rows of row_filter whose label_column is one of labels and value_column
+    one of values. Returns one DataFrame per indicator, in the same order and
+    shape as count_indicators, and with by also the long table of the
+    disaggregated counts.
+    """
+    with stage('count matrix', indicators=len(indicators)):
+        row_filter = as_mask(row_filter)
+        rows = data.loc[row_filter, keys + [label_column, value_column]]
+        levels = list(keys)
+        if by is not None:
+            rows = pd.concat([rows, by.loc[row_filter]], axis=1)
+            levels += list(by.columns)
+        counts = rows.groupby(levels + [label_column, value_column], observed=True).size()
+    labels = counts.index.get_level_values(label_column)
+    values = counts.index.get_level_values(value_column)
+
+    pivots = []
+    disaggregated = {}
+    for i, (name, name_labels, name_values) in enumerate(indicators):
+        selected = counts[labels.isin(name_labels) & values.isin(name_values)]
+        if by is not None:
+            selected = selected.groupby(level=levels, observed=True).sum()
+            disaggregated[i] = selected
+        count = selected.groupby(level=keys, observed=True).sum()
+        pivots.append(count[count > 0].astype('int64').reset_index(name=name))
+    if by is None:
+        return pivots
+    disaggregated = pd.concat(disaggregated, axis=1).fillna(0) if disaggregated else pd.DataFrame()
+    return pivots, disaggregate_long(disaggregated, [name for name, labels, values in indicators], keys)
+
+
+def assemble_counts(universe, pivots, keys, fill_zero=False, keep_empty=False):
+    """
+    Puts the count column of every pivot next to the facilities of universe in
+    one step: the pivots are indexed by keys, concatenated along the columns and
+    reindexed against universe (the distinct key combinations of the data, in
+    their original order). Gives the same frame as left-merging the pivots onto
+    universe one after another, including the _x/_y suffixes of repeated
+    indicator names. With fill_zero, missing counts become 0 and every count
+    column is cast to int once at the end. With keep_empty, an empty pivot
+    still gets its (empty) column instead of being left out, so every call
+    gives the same columns.
+    """
+    counts = []
+    columns = list(keys)
+    for pivot_df in pivots:
+        name = pivot_df.columns[-1]
+        if pivot_df.empty and not keep_empty:
+            print(f"Warning: The aggregated pivot for {name} is empty and will not be merged.")
+            continue
+        # A name that is already taken is suffixed the way pd.merge does it
+        if name in columns:
+            columns[columns.index(name)] = f"{name}_x"
+            name = f"{name}_y"
+        columns.append(name)
+        counts.append(pivot_df.set_index(keys).iloc[:, 0])
+
+    with stage('assemble counts', facilities=len(universe)):
+        facilities = pd.MultiIndex.from_frame(universe[keys])
+        if counts:
+            assembled = pd.concat(counts, axis=1).reindex(facilities)
+        else:
+            assembled = pd.DataFrame(index=facilities)
+    assembled.columns = columns[len(keys):]
+
+    if fill_zero:
+        assembled = assembled.fillna(0).astype(int)
+    else:
+        # A left merge only turns the columns that end up with missing counts into floats
+        for i in range(assembled.shape[1]):
+            column = assembled.iloc[:, i]
+            if not column.isna().any():
+                assembled.isetitem(i, column.astype('int64'))
+
+    return assembled.reset_index()
+
+
+def save_line_lists(data, indicators, names, output_path):
+    """
+    Saves the rows matching each indicator listed in names to its own sheet of
+    output_path. A mask may also be given as a function returning it, which is
+    only called for the indicators listed. Nothing is built or written when
+    names is empty.
+    """
+    if not names:
+        return
+
+    known = [name for name, mask in indicators]
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        print(f"Warning: No indicator called {unknown}. Available indicators: {known}")
+    if len(unknown) == len(names):
+        return
+
+    written = set()
+    with stage('write line lists'), pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+        for name, mask in indicators:
+            if name not in names or name in written:
+                continue
+            written.add(name)
+            rows = data[as_mask(mask() if callable(mask) else mask)]
+            if len(rows) > EXCEL_MAX_ROWS:
+                print(f"Warning: The {name} line list has {len(rows):,} rows; only the first {EXCEL_MAX_ROWS:,} fit in the sheet.")
+                rows = rows.iloc[:EXCEL_MAX_ROWS]
+            # Sanitize the sheet name (max 31 chars, no invalid chars)
+            sheet_name = re.sub(r'[\\/*?[\]:]', '', name[:31])
+            rows.to_excel(writer, sheet_name=sheet_name, index=False)
+            print(f"Line list for '{name}' ({len(rows):,} rows) saved to sheet '{sheet_name}'.")
+
+    print(f"Line lists saved to: {output_path}")
+
+
+def save_disaggregates(disaggregates, keys, output_path, wide=False):
+    """
+    Saves the long table of disaggregated counts to output_path. With wide, a
+    second sheet holds one row per facility and indicator and one column per
+    combination of the disaggregation columns (e.g. '<1 Female').
+    """
+    by = [col for col in disaggregates.columns if col not in keys and col not in ('Indicator', 'Count')]
+    with stage('write disaggregates'), pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+        long_table = disaggregates
+        if len(long_table) > EXCEL_MAX_ROWS:
+            print(f"Warning: The disaggregates have {len(long_table):,} rows; only the first {EXCEL_MAX_ROWS:,} fit in the sheet.")
+            long_table = long_table.iloc[:EXCEL_MAX_ROWS]
+        long_table.to_excel(writer, sheet_name='Disaggregates', index=False)
+
+        if wide and by:
+            wide_table = disaggregates.pivot_table(index=keys + ['Indicator'], columns=by, values='Count',
+                                                   aggfunc='sum', fill_value=0, observed=True, sort=False)
+            # Columns in age band order (the disaggregation columns are categoricals)
+            wide_table = wide_table.sort_index(axis=1)
+            wide_table.columns = [' '.join(str(part) for part in col) if isinstance(col, tuple) else str(col)
+                                  for col in wide_table.columns]
+            wide_table.reset_index().to_excel(writer, sheet_name='Disaggregates_wide', index=False)
+
+    print(f"Disaggregates saved to: {output_path}")
@@ -0,0 +1,237 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from extract_cache import (cache_entry_path, file_content_hash, file_signature, known_content_hash,
+                           load_manifest, prune_cache, read_cached, save_manifest, write_cached)
+from profiling import collect_stages, peak_memory_mb, record_stages, stage
+from schema import apply_categoricals, unify_categoricals
+
+# Shared ingestion layer used by all the aggregate_data_*.py scripts.
+# Every facility extract is read into its own DataFrame, the frames are collected
+# in a list and combined with a single pd.concat at the end, so the cost of
+# combining grows linearly with the number of files instead of re-copying the
+# growing combined frame once per file. The files can optionally be parsed in
+# parallel worker processes, and the parsed copies can be kept in an on-disk
+# cache (see extract_cache.py) so unchanged files are not parsed again.
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
+# Column marking the date values that could not be read: bit i of a row is set when its value in the i-th
+# date column was there but is not a date. pd.to_datetime turns it into NaT just like a blank cell, so this
+# is the only trace of it once the extracts are coerced (see date_quality.py).
+UNPARSEABLE_DATES_COLUMN = 'Unparseable Dates'
+
+
+def list_input_files(folder_path):
+    # All CSV/Excel extracts in the input folder
+    return [os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith(SUPPORTED_EXTENSIONS)]
+
+
+def parse_extract(file, date_columns=(), numeric_columns=(), usecols=None, categorical_columns=()):
+    """
+    Parses a single CSV/XLSX/XLS extract and applies the report's type coercion.
+    With usecols, only those columns are read (columns the file does not have
+    are left out rather than raising). The type coercion is:
+    date_columns are converted with pd.to_datetime and numeric_columns with
+    pd.to_numeric (invalid values become NaT/NaN, the invalid dates being
+    marked in UNPARSEABLE_DATES_COLUMN), and categorical_columns are stored as
+    categoricals. Columns a file does not have are skipped.
+    Returns None for files with an unsupported extension.
+    """
+    # A callable keeps only the wanted columns without failing on absent ones
+    if usecols is not None:
+        wanted = set(usecols)
+        usecols = lambda col: col in wanted
+
+    if not file.endswith(SUPPORTED_EXTENSIONS):
+        return None
+    with stage('parse', file=os.path.basename(file)):
+        if file.endswith('.csv'):
+            data = pd.read_csv(file, encoding='latin1', on_bad_lines='skip', usecols=usecols)
+        elif file.endswith('.xlsx'):
+            data = pd.read_excel(file, engine='openpyxl', usecols=usecols)
+        else:
+            data = pd.read_excel(file, usecols=usecols)
+
+    with stage('coerce', file=os.path.basename(file)):
+        coerce_columns(data, date_columns, numeric_columns, categorical_columns)
+    return data
+
+
+def unparseable_values(raw, converted):
+    # Mask of the values of raw that are neither blank (NaN or only spaces) nor converted
+    unparseable = converted.isna().to_numpy() & raw.notna().to_numpy()
+    if unparseable.any():
+        unparseable[unparseable] = raw[unparseable].astype(str).str.strip().to_numpy() != ''
+    return unparseable
+
+
+def coerce_columns(data, date_columns=(), numeric_columns=(), categorical_columns=()):
+    # Ensure date columns are in datetime format and numeric fields are numeric
+    # The dates that are there but could not be converted are marked in UNPARSEABLE_DATES_COLUMN, adding to
+    # the marks of an earlier coercion
+    if date_columns:
+        dtype = np.min_scalar_type(2 ** len(date_columns) - 1)
+        if UNPARSEABLE_DATES_COLUMN in data.columns:
+            marks = data[UNPARSEABLE_DATES_COLUMN].fillna(0).to_numpy().astype(dtype)
+        else:
+            marks = np.zeros(len(data), dtype=dtype)
+    for bit, col in enumerate(date_columns):
+        if col in data.columns and not pd.api.types.is_datetime64_any_dtype(data[col]):
+            raw = data[col]
+            data[col] = pd.to_datetime(raw, errors='coerce')
+            marks |= unparseable_values(raw, data[col]).astype(dtype) << dtype.type(bit)
+    if date_columns:
+        data[UNPARSEABLE_DATES_COLUMN] = marks
+    for col in numeric_columns:
+        if col in data.columns and not pd.api.types.is_numeric_dtype(data[col]):
+            data[col] = pd.to_numeric(data[col], errors='coerce')
+    apply_categoricals(data, categorical_columns)
+    return data
+
+
+def read_extract(file, date_columns=(), numeric_columns=(), usecols=None, categorical_columns=(),
+                 cache_dir=None, content_hash=None):
+    """
+    Reads a single extract (see parse_extract) and adds the 'Filename' column.
+    With a cache_dir the parsed copy is taken from / stored in the extract cache;
+    content_hash can be passed when it is already known, to skip hashing the file.
+    Returns (data, content_hash, loaded_from_cache).
+    """
+    from_cache = False
+    if cache_dir is None:
+        data = parse_extract(file, date_columns, numeric_columns, usecols, categorical_columns)
+    else:
+        if content_hash is None:
+            content_hash = file_content_hash(file)
+        entry_path = cache_entry_path(cache_dir, content_hash, date_columns, numeric_columns, usecols,
+                                      categorical_columns)
+        data = read_cached(entry_path)
+        from_cache = data is not None
+        if data is None:
+            data = parse_extract(file, date_columns, numeric_columns, usecols, categorical_columns)
+            if data is not None:
+                write_cached(entry_path, data)
+
+    # Add Filename column (a categorical: every row of the file holds the same name)
+    if data is not None:
+        data['Filename'] = pd.Categorical.from_codes(np.zeros(len(data), dtype=np.int8),
+                                                     categories=[os.path.basename(file)])
+    return data, content_hash, from_cache
+
+
+def combine_frames(frames, categorical_columns=()):
+    # One concat over all frames: columns are aligned across every file at once
+    # (union of columns in first-seen order, missing values filled with NaN).
+    # Categorical columns get shared categories first so they stay categorical.
+    if not frames:
+        return pd.DataFrame()
+    unify_categoricals(frames, ['Filename'] + list(categorical_columns))
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+def _read_extract_or_error(task):
+    # Worker entry point: read errors are returned as text instead of raised,
+    # so they can be reported per file in the parent process. The stages timed
+    # while reading the file are returned too, for the run profile of the parent
+    # (see profiling.py)
+    with collect_stages() as stages:
+        try:
+            with stage('read', file=os.path.basename(task[0])) as details:
+                result = read_extract(*task) + (None,)
+                details['rows'] = len(result[0]) if result[0] is not None else 0
+                details['from_cache'] = result[2]
+        except Exception as e:
+            result = None, None, False, str(e)
+    return result + (stages,)
+
+
+def resolve_workers(workers, n_files):
+    # None/0 means one worker per CPU; never start more workers than there are files
+    if not workers:
+        workers = os.cpu_count() or 1
+    return max(1, min(int(workers), n_files))
+
+
+def load_extracts(all_files, workers=1, date_columns=(), numeric_columns=(), usecols=None, categorical_columns=(),
+                  cache_dir=None, optional_columns=()):
+    """
+    Reads every file in all_files and combines them into one DataFrame.
+    With workers > 1 (or None for one per CPU) the files are parsed in a
+    process pool; the combined frame keeps the order of all_files either way.
+    date_columns/numeric_columns/categorical_columns are coerced per file
+    (see parse_extract).
+    With usecols only those columns are read; a file lacking some of them is
+    reported with a warning and its rows are left empty in those columns.
+    optional_columns are read as well when a file has them, without a warning.
+    With a cache_dir, unchanged files are loaded from the extract cache.
+    Files that cannot be read are reported and skipped. Prints the ingest
+    throughput (rows/sec) and peak memory once all files are combined.
+    """
+    start_time = time.perf_counter()
+
+    date_columns = list(date_columns)
+    numeric_columns = list(numeric_columns)
+    categorical_columns = list(categorical_columns)
+    required = None
+    if usecols is not None:
+        required = list(dict.fromkeys(usecols))
+        usecols = list(dict.fromkeys(required + list(optional_columns)))
+    manifest = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        manifest = load_manifest(cache_dir)
+    tasks = [(file, date_columns, numeric_columns, usecols, categorical_columns, cache_dir,
+              known_content_hash(manifest, file) if manifest is not None else None)
+             for file in all_files]
+
+    workers = resolve_workers(workers, len(all_files))
+    if workers > 1:
+        # Parsing is CPU bound, so separate processes are used rather than threads.
+        # executor.map returns the results in the order of all_files.
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_read_extract_or_error, tasks))
+    else:
+        results = [_read_extract_or_error(task) for task in tasks]
+
+    frames = []
+    cache_hits = 0
+    for file, (data, content_hash, from_cache, error, stages) in zip(all_files, results):
+        record_stages(stages)
+        if error is not None:
+            print(f"Error processing file {file}: {error}")
+            continue
+        if manifest is not None and content_hash is not None:
+            manifest[os.path.abspath(file)] = dict(file_signature(file), sha256=content_hash)
+        cache_hits += from_cache
+        if data is None:
+            continue
+        if required is not None:
+            missing = [col for col in required if col not in data.columns]
+            if missing:
+                print(f"Warning: {file} is missing required column(s) {missing}. They will be empty for its rows.")
+        frames.append(data)
+
+    if manifest is not None:
+        prune_cache(cache_dir, manifest)
+        save_manifest(cache_dir, manifest)
+
+    with stage('combine', files=len(frames)):
+        combined_data = combine_frames(frames, categorical_columns)
+        # Columns missing from some files come back from the concat as object; coerce them once more
+        coerce_columns(combined_data, date_columns, numeric_columns, categorical_columns)
+
+    elapsed = time.perf_counter() - start_time
+    rows_per_sec = len(combined_data) / elapsed if elapsed > 0 else float('inf')
+    peak_mb = peak_memory_mb()
+    peak_text = f"{peak_mb:,.0f} MB" if peak_mb is not None else "n/a"
+    cache_text = f" ({cache_hits} from cache)" if cache_dir is not None else ""
+    print(f"Ingested {len(combined_data):,} rows from {len(frames)} of {len(all_files)} files{cache_text} "
+          f"with {workers} worker(s) in {elapsed:.2f}s "
+          f"({rows_per_sec:,.0f} rows/sec, peak memory {peak_text} in the main process).")
+
+    return combined_data
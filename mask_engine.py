@@ -0,0 +1,80 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from profiling import record_stage
+
+# Shared-subexpression mask engine used to build the indicator filters.
+# Conditions that many indicators share (the verification outcome check, the
+# Sex/Age guard, the reporting-period date windows, ...) are registered once as
+# named predicates. A predicate is evaluated over the full dataset the first
+# time it is used and kept as a numpy boolean array, so every later use is a
+# cache lookup and an indicator filter is an element-wise &/| of cached arrays.
+# Missing values in a predicate's result (e.g. .str.contains on a blank cell)
+# count as False.
+
+
+def as_mask(values):
+    # Boolean numpy array from a predicate result, with NaN/NA entries as False
+    if isinstance(values, pd.Series):
+        if values.dtype == bool:
+            return values.to_numpy()
+        return values.to_numpy(dtype=object, na_value=False).astype(bool)
+    return np.asarray(values, dtype=bool)
+
+
+class MaskEngine:
+    """
+    Evaluates named row predicates over data once each and caches the results.
+    engine['name'] returns the cached mask of a predicate, all_of/any_of
+    combine several of them.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._predicates = {}
+        self._masks = {}
+        self._depth = 0
+        self.lookups = 0
+        self.evaluation_seconds = 0.0
+
+    def define(self, name, predicate):
+        # predicate is a function of the DataFrame returning a boolean Series/array.
+        # It is only evaluated when first used, so it may refer to columns that are
+        # derived later in the script, and to other predicates through the engine.
+        self._predicates[name] = predicate
+        self._masks.pop(name, None)
+
+    def __getitem__(self, name):
+        self.lookups += 1
+        mask = self._masks.get(name)
+        if mask is None:
+            predicate = self._predicates[name]
+            start_time = time.perf_counter()
+            self._depth += 1
+            try:
+                mask = as_mask(predicate(self.data))
+            finally:
+                self._depth -= 1
+            # Predicates built from other predicates are timed once, at the outermost level
+            if self._depth == 0:
+                seconds = time.perf_counter() - start_time
+                self.evaluation_seconds += seconds
+                record_stage('predicate', seconds, predicate=name)
+            if len(mask) != len(self.data):
+                raise ValueError(f"Predicate '{name}' returned {len(mask)} values for {len(self.data)} rows")
+            self._masks[name] = mask
+        return mask
+
+    def all_of(self, *names):
+        # Rows for which every named predicate holds
+        return np.logical_and.reduce([self[name] for name in names])
+
+    def any_of(self, *names):
+        # Rows for which at least one named predicate holds
+        return np.logical_or.reduce([self[name] for name in names])
+
+    def summary(self):
+        return (f"Evaluated {len(self._masks)} shared filter predicates once each "
+                f"({self.lookups} uses) in {self.evaluation_seconds:.2f}s.")
@@ -0,0 +1,153 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+# Stage-level run profile of the aggregate_data_*.py scripts.
+# The shared modules mark their stages (reading and coercing every file, cleaning, classifying, the
+# shared filter predicates, counting, assembling and writing the output) with stage(...). Nothing is
+# recorded unless a profile was started with start_profile(); save_profile() then writes every stage
+# with its duration, the peak memory allocated through Python while it ran (tracemalloc, which
+# includes pandas/numpy buffers) and the peak resident memory of the process so far, as JSON next to
+# the output workbook, so runs of different quarters can be compared.
+
+# Stages recorded in the current process (None when no profile is running)
+_stages = None
+# Running tracemalloc peak of every stage that is open, innermost last
+_open_peaks = []
+_started = None
+
+
+def peak_memory_mb():
+    """
+    Returns the peak resident memory of the current process in MB,
+    or None when it cannot be determined on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        # Windows has no resource module; fall back to psutil when it is installed
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024 ** 2
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def start_profile(trace_memory=True):
+    """
+    Starts recording the stages of this process. With trace_memory, the
+    Python memory peak of every stage is traced as well (tracemalloc slows
+    the run down somewhat).
+    """
+    global _stages, _started
+    _stages = []
+    _open_peaks.clear()
+    _started = (datetime.now(), time.perf_counter())
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+@contextmanager
+def stage(name, **details):
+    # Records the block as stage name when a profile is running. details (e.g. the file) are saved with it;
+    # the block gets them as a dict it can add to (e.g. the number of rows read)
+    if _stages is None:
+        yield details
+        return
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # The peak of the enclosing stage so far is kept before the peak is reset for this one
+        if _open_peaks:
+            _open_peaks[-1] = max(_open_peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        _open_peaks.append(0)
+    start = time.perf_counter()
+    try:
+        yield details
+    finally:
+        seconds = time.perf_counter() - start
+        python_peak_mb = None
+        if tracing:
+            peak = max(_open_peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if _open_peaks:
+                _open_peaks[-1] = max(_open_peaks[-1], peak)
+            python_peak_mb = round(peak / 1024 ** 2, 1)
+        record_stage(name, seconds, python_peak_mb=python_peak_mb, **details)
+
+
+def record_stage(name, seconds, **details):
+    # Adds a stage timed elsewhere (e.g. in a worker process) to the running profile
+    if _stages is None:
+        return
+    rss_peak_mb = peak_memory_mb()
+    _stages.append(dict({'stage': name, 'seconds': round(seconds, 4)}, **details,
+                        rss_peak_mb=round(rss_peak_mb, 1) if rss_peak_mb is not None else None))
+
+
+@contextmanager
+def collect_stages():
+    """
+    Records the stages of the block in a list of their own, whether or not a
+    profile is running, e.g. in a worker process whose stages are sent back
+    to the parent and added there with record_stages.
+    """
+    global _stages
+    outer = _stages
+    collected = []
+    _stages = collected
+    try:
+        yield collected
+    finally:
+        _stages = outer
+
+
+def record_stages(stages):
+    # Adds stages recorded by collect_stages (in this or another process) to the running profile
+    if _stages is not None:
+        _stages.extend(stages)
+
+
+def profile_path(output_path):
+    # <output workbook name>_profile.json, next to the workbook
+    return os.path.splitext(output_path)[0] + '_profile.json'
+
+
+def save_profile(output_path, **run_details):
+    """
+    Writes the stages recorded since start_profile to the profile JSON of
+    output_path (see profile_path), with the totals per stage name, and
+    stops the profile. run_details (e.g. the script) are saved with it.
+    """
+    global _stages
+    if _stages is None:
+        return None
+    started_at, start = _started
+    totals = {}
+    for entry in _stages:
+        total = totals.setdefault(entry['stage'], {'count': 0, 'seconds': 0.0})
+        total['count'] += 1
+        total['seconds'] = round(total['seconds'] + entry['seconds'], 4)
+    rss_peak_mb = peak_memory_mb()
+    profile = dict(run_details, output=output_path, started=started_at.isoformat(timespec='seconds'),
+                   total_seconds=round(time.perf_counter() - start, 3),
+                   rss_peak_mb=round(rss_peak_mb, 1) if rss_peak_mb is not None else None,
+                   python_peak_mb=round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 1) if tracemalloc.is_tracing() else None,
+                   totals=totals, stages=_stages)
+    _stages = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+    path = profile_path(output_path)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=1, default=str)
+    print(f"Run profile saved to: {path}")
+    return path
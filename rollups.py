@@ -0,0 +1,71 @@
+import pandas as pd
+
+from indicator_counts import UNKNOWN
+
+# Totals of the facility counts, used by the aggregate_data_*.py scripts.
+# Every indicator is a count, so the LGA, State, project and national totals are
+# plain sums of the facility rows. They are computed like SQL GROUPING SETS from
+# the assembled facility table, so the combined data is never scanned again for
+# them. Geography is rolled up on its own, across projects (State > LGA: a State
+# total covers every IP working in the State): the finest level is summed once
+# and every coarser level is summed from the level below it. The project totals
+# are a separate breakdown, and the national row covers everything.
+
+# Sheet of the output workbook holding the totals
+ROLLUP_SHEET = 'Rollups'
+
+# Name of the level grouped by a column in the 'Level' column of the totals
+LEVEL_NAMES = {'ProjectName': 'Project'}
+
+
+def facility_geography(data, keys, geography):
+    """
+    The geography columns (e.g. State and LGA) of every facility of data,
+    indexed by keys: the first value given for the facility in its rows, or
+    'Unknown' when none is.
+    """
+    return data.groupby(keys, observed=True, sort=False)[geography].first().astype(object).fillna(UNKNOWN)
+
+
+def rollup_counts(facility_counts, keys, geography=None):
+    """
+    Returns the totals of the count columns of facility_counts (one row per
+    facility, keys plus one column per indicator): a national row, one row per
+    project and, with geography, one row per State and per LGA across all
+    projects (geography columns > facility). The level is in a 'Level' column,
+    the columns of the other levels are left blank, and the number of
+    facilities summed is in 'Facilities'. geography is the frame returned by
+    facility_geography, or None to only total by project and nationally.
+    """
+    project = keys[0]
+    geography_columns = list(geography.columns) if geography is not None else []
+    count_columns = [col for col in facility_counts.columns if col not in keys]
+
+    facilities = facility_counts[keys + count_columns]
+    if geography_columns:
+        facilities = facilities.join(geography, on=keys)
+    facilities = facilities.assign(Facilities=1)
+    # Missing counts (facilities without a matching row) add nothing
+    facilities[count_columns] = facilities[count_columns].fillna(0)
+
+    summed = ['Facilities'] + count_columns
+    projects = facilities.groupby(project, observed=True, dropna=False, sort=True)[summed].sum()
+    levels = [projects.sum().to_frame().T.assign(Level='National'),
+              projects.reset_index().assign(Level=LEVEL_NAMES.get(project, project))]
+
+    if geography_columns:
+        totals = facilities.groupby(geography_columns, observed=True, dropna=False, sort=True)[summed].sum()
+        geography_levels = []
+        for depth in range(len(geography_columns), 0, -1):
+            columns = geography_columns[:depth]
+            if depth < len(geography_columns):
+                # Each coarser level is summed from the level below it
+                totals = totals.groupby(level=columns, observed=True, dropna=False, sort=True).sum()
+            geography_levels.append(totals.reset_index().assign(Level=LEVEL_NAMES.get(columns[-1], columns[-1])))
+        # From the coarsest geography down to the finest
+        levels += geography_levels[::-1]
+
+    rollups = pd.concat(levels, ignore_index=True)
+    rollups = rollups[['Level', project] + geography_columns + summed]
+    rollups[summed] = rollups[summed].astype('int64')
+    return rollups
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+# Dtype schema helpers shared by the aggregate_data_*.py scripts.
+# Low-cardinality report columns (statuses, settings, modalities, Sex, ...) and
+# the facility keys are stored as pandas categoricals: every distinct text is
+# kept once and each row only holds an integer code, so .isin/.str.contains
+# filters and groupby/merge on the keys work on the codes instead of scanning
+# millions of Python strings.
+
+
+def apply_categoricals(data, categorical_columns):
+    # Convert the schema's text columns to categoricals (columns a file does not have are skipped)
+    for col in categorical_columns:
+        if col in data.columns and not isinstance(data[col].dtype, pd.CategoricalDtype):
+            data[col] = data[col].astype('category')
+    return data
+
+
+def unify_categoricals(frames, categorical_columns):
+    """
+    Gives each categorical column the same categories in every frame, so that
+    pd.concat keeps it categorical instead of falling back to object.
+    """
+    for col in categorical_columns:
+        parts = [frame[col] for frame in frames if col in frame.columns]
+        if not parts or not all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            continue
+        categories = pd.Index(np.concatenate([part.cat.categories.astype(object) for part in parts])).unique()
+        for frame in frames:
+            if col in frame.columns:
+                frame[col] = frame[col].cat.set_categories(categories)
+    return frames
+
+
+def as_key_category(series):
+    """
+    Returns series as a categorical of strings holding the same values as
+    series.astype(str) (missing values become 'nan'), with the categories in
+    sorted order so sorting by the key matches sorting the strings.
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype('category')
+    labels = np.append(series.cat.categories.map(str).to_numpy(dtype=object), 'nan')
+    categories, inverse = np.unique(labels, return_inverse=True)
+    # Code -1 (missing) picks the trailing 'nan' label
+    codes = inverse[series.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=series.index, name=series.name)
+
+
+def with_category(series, value):
+    # Categoricals only accept known values: add value to the categories before assigning it
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    return series
@@ -0,0 +1,491 @@
+import argparse
+import importlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from aggregate_indicators import REPORTS
+from indicator_counts import EXCEL_MAX_ROWS
+
+# Synthetic client-level extracts for testing the aggregate_data_*.py scripts at scale, e.g.
+#   python synthetic_extracts.py radet Synthetic/RADET --rows 10000000 --files 100 --facilities 500
+# Every report gets the exact column headers its script reads, with plausible value distributions
+# around the reporting period (most clients active, a few tests positive, viral loads mostly
+# suppressed), and the spellings the filters have to cope with: 'Negetive', 'TBA Orthodx', viral load
+# texts such as '<40 copies' or 'TND', padded 'valid' verification outcomes, blank cells and a few
+# unparseable dates. No real client data is used. The files are named <project>_<report>_<number>, so
+# the scripts take the project from the file name, and each facility keeps its State and LGA.
+
+# Rows generated (and written) at a time, so files of millions of rows are never held in memory at once
+CHUNK_ROWS = 250000
+
+# Share of the filled-in dates written as text no parser understands
+INVALID_DATE_SHARE = 0.002
+INVALID_DATES = ['00/00/0000', 'N/A', '2025-13-45', 'unknown']
+
+# Date columns a script compares as dates without converting them when the extracts are read: they only work
+# as Excel date cells, so these reports are written as xlsx unless csv is asked for. RADET's transfer-in filter
+# is no longer counted, but the original script still compares 'Date of Registration' on every run
+UNCONVERTED_DATE_COLUMNS = {
+    'radet': ['Date of Registration'],
+    'hts-index': ['Date of Elicitation', 'Date of HTS'],
+}
+
+STATES = ['Lagos', 'Kano', 'Rivers', 'Oyo', 'Kaduna', 'Benue', 'Akwa Ibom', 'Cross River', 'Enugu', 'FCT',
+          'Delta', 'Plateau', 'Anambra', 'Nasarawa', 'Edo', 'Imo', 'Ogun', 'Kogi', 'Niger', 'Gombe']
+LGAS_PER_STATE = 6
+
+
+def _choice(rng, n, values, weights=None):
+    # n values drawn from values (None for a blank cell), with the relative weights given
+    values = np.array(values, dtype=object)
+    p = None if weights is None else np.asarray(weights, dtype=float) / sum(weights)
+    return values[rng.choice(len(values), size=n, p=p)]
+
+
+def _blank(rng, values, share):
+    # values with about share of them blanked out
+    values = values.copy()
+    values[rng.random(len(values)) < share] = None if values.dtype == object else np.datetime64('NaT')
+    return values
+
+
+def _dates(rng, n, start, end, blank=0.0):
+    # Days between start and end (both included), NaT for about blank of them
+    start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+    days = start + rng.integers(0, (end - start).astype(int) + 1, n).astype('timedelta64[D]')
+    return _blank(rng, days, blank)
+
+
+def _days_after(rng, dates, low, high, blank=0.0):
+    # dates moved by low to high days (NaT stays NaT), NaT for about blank of them
+    return _blank(rng, dates + rng.integers(low, high + 1, len(dates)).astype('timedelta64[D]'), blank)
+
+
+def _ages(rng, n, children=0.08, blank=0.01):
+    # Ages in years: mostly adults around 38, with a share of children under 15
+    adults = np.clip(rng.normal(38, 12, n), 15, 85)
+    ages = np.where(rng.random(n) < children, rng.integers(0, 15, n), adults).astype(int).astype(object)
+    return _blank(rng, ages, blank)
+
+
+def _sex(rng, n, female=0.6):
+    return _choice(rng, n, ['Female', 'Male', None], [female, 0.98 - female, 0.02])
+
+
+def _pregnancy_status(rng, sex, ages):
+    # Set for women of child-bearing age only
+    n = len(sex)
+    status = _choice(rng, n, ['Pregnant', 'Breastfeeding', 'Not Pregnant', None], [5, 6, 79, 10])
+    eligible = (sex == 'Female') & (pd.to_numeric(ages, errors='coerce') >= 15) & (pd.to_numeric(ages, errors='coerce') < 50)
+    status[~np.asarray(eligible, dtype=bool)] = None
+    return status
+
+
+def radet_columns(rng, n, start, end):
+    """
+    RADET rows (one row per client on ART): ART, viral load, CD4, cervical
+    cancer, TB and TPT history relative to the quarter start to end.
+    """
+    sex = _sex(rng, n, female=0.64)
+    ages = _ages(rng, n)
+    # About 6% of the clients started ART in the quarter, the others over the last twelve years
+    art_start = np.where(rng.random(n) < 0.06, _dates(rng, n, start, end), _dates(rng, n, end - np.timedelta64(12 * 365, 'D'), start))
+    art_start = _blank(rng, art_start, 0.005)
+    current_status = _choice(rng, n, ['Active', 'Active Restart', 'IIT', 'Died', 'Transferred Out', 'Stopped Treatment',
+                                      'STOPPED TREATMENT'], [70, 4, 12, 2, 6, 4, 2])
+    status_date = _dates(rng, n, start - np.timedelta64(270, 'D'), end + np.timedelta64(30, 'D'), blank=0.3)
+    restarted = current_status == 'Active Restart'
+    previous_status = np.where(restarted,
+                               _choice(rng, n, ['IIT', 'Stopped Treatment', 'STOPPED TREATMENT', 'Invalid - Long-term IIT',
+                                                'Invalid – Long-term IIT'], [60, 15, 10, 10, 5]),
+                               _choice(rng, n, ['Active', 'IIT', None], [30, 5, 65]))
+    died = current_status == 'Died'
+
+    # Viral load: about 80% sampled in the last year, the result received up to 45 days later
+    vl_sample = _dates(rng, n, end - np.timedelta64(365, 'D'), end, blank=0.2)
+    vl_result = _days_after(rng, vl_sample, 0, 45, blank=0.03)
+    viral_load = _choice(rng, n, ['<40 copies', 'TND', 'Not Detected', 'undetected', '<20', '<40', '20 cp/ml', 'LDL', 'T.N.D',
+                                  '45', '150', '850', '1,200', '1200.5', '15000', '>10000', 'n/a', '', None],
+                         [15, 12, 4, 3, 4, 8, 2, 2, 1, 8, 6, 5, 3, 2, 3, 2, 1, 2, 17])
+    viral_load[np.isnat(vl_sample)] = None
+
+    cd4_date = _dates(rng, n, end - np.timedelta64(2 * 365, 'D'), end, blank=0.5)
+    cd4 = _choice(rng, n, ['350', '120', '620', '1700', '200', 'cells 200', 'O5O', 'N/A', 'positive', None],
+                  [20, 15, 15, 3, 10, 2, 1, 2, 1, 31])
+    cd4[np.isnat(cd4_date)] = None
+
+    # Cervical cancer screening of about a third of the women of 25 to 49
+    age_numbers = pd.to_numeric(ages, errors='coerce')
+    screened = (sex == 'Female') & (age_numbers >= 25) & (age_numbers < 50) & (rng.random(n) < 0.35)
+    screening_date = np.where(screened, _dates(rng, n, start - np.timedelta64(365, 'D'), end), np.datetime64('NaT'))
+    screening_result = np.where(screened, _choice(rng, n, ['Negative', 'Positive', 'Suspicious for cancer'], [88, 10, 2]), None)
+    treated = screened & (screening_result == 'Positive') & (rng.random(n) < 0.7)
+
+    # TB screening of most clients; a diagnostic test for the presumptive ones
+    tb_status = _choice(rng, n, ['No signs or symptoms of TB', 'Presumptive TB', 'Confirmed TB', 'Currently on TB treatment',
+                                 'Currently on TPT', None], [60, 8, 2, 2, 10, 18])
+    tb_screening_date = _dates(rng, n, start - np.timedelta64(180, 'D'), end, blank=0.18)
+    presumptive = np.isin(tb_status, ['Presumptive TB', 'Confirmed TB'])
+    tb_sample = np.where(presumptive, _days_after(rng, tb_screening_date, 0, 14), np.datetime64('NaT'))
+    tb_result_received = _days_after(rng, tb_sample, 1, 21, blank=0.1)
+    tb_treatment = np.where(tb_status == 'Confirmed TB', _days_after(rng, tb_result_received, 0, 14), np.datetime64('NaT'))
+    on_tpt = tb_status == 'Currently on TPT'
+    tpt_start = np.where(on_tpt, _dates(rng, n, start - np.timedelta64(270, 'D'), end), np.datetime64('NaT'))
+    tpt_completed = on_tpt & (rng.random(n) < 0.6)
+
+    return {
+        'Age': ages,
+        'Sex': sex,
+        'Pregnancy Status': _pregnancy_status(rng, sex, ages),
+        'Care Entry Point': _choice(rng, n, ['HCT', 'OPD', 'Transfer-in', 'PMTCT', 'TB DOTS', 'Inpatient', 'Others', None],
+                                    [40, 15, 10, 10, 5, 5, 5, 10]),
+        'Date of Registration': _days_after(rng, art_start, -30, 0),
+        'ART Start Date (yyyy-mm-dd)': art_start,
+        'Client Verification Outcome': _choice(rng, n, ['Valid', 'valid', ' valid', 'valid ', 'Invalid', 'Pending', '', None],
+                                               [55, 10, 2, 2, 5, 3, 3, 20]),
+        'Current ART Status': current_status,
+        'Date of Current ART Status': status_date,
+        'Previous ART Status': previous_status,
+        'Confirmed Date of Previous ART Status': np.where(restarted | pd.notna(previous_status),
+                                                          _days_after(rng, status_date, -365, -30), np.datetime64('NaT')),
+        'Months of ARV Refill': _choice(rng, n, [1, 2, 3, 6, 0, None], [15, 10, 45, 22, 2, 6]),
+        'Cause of Death': np.where(died, _choice(rng, n, ['Unknown', 'Tuberculosis', 'HIV disease resulting in TB',
+                                                          'Other natural causes', 'Non-natural causes', None], [35, 15, 10, 20, 5, 15]), None),
+        'Date of Current ViralLoad Result Sample (yyyy-mm-dd)': vl_sample,
+        'Date of Current Viral Load (yyyy-mm-dd)': vl_result,
+        'Current Viral Load (c/ml)': viral_load,
+        'Last CD4 Count': cd4,
+        'Date of Last CD4 Count': cd4_date,
+        'Cervical Cancer Screening Type': np.where(screened, _choice(rng, n, ['First Time Screening', 'Rescreening',
+                                                                              'Post-treatment Follow-up'], [70, 20, 10]), None),
+        'Cervical Cancer Screening Method': np.where(screened, _choice(rng, n, ['VIA', 'HPV DNA', 'Pap Smear', ''], [75, 10, 5, 10]), None),
+        'Date of Cervical Cancer Screening (yyyy-mm-dd)': screening_date,
+        'Result of Cervical Cancer Screening': screening_result,
+        'Precancerous Lesions Treatment Methods': np.where(treated, _choice(rng, n, ['Cryotherapy', 'Thermal Ablation', 'LEEP']), None),
+        'Date of Precancerous Lesions Treatment (yyyy-mm-dd)': np.where(treated, _days_after(rng, screening_date, 0, 30),
+                                                                        np.datetime64('NaT')),
+        'TB status': tb_status,
+        'TB Screening Type': np.where(np.isnat(tb_screening_date), None,
+                                      _choice(rng, n, ['Symptom screen (alone)', 'CXR', 'Chest X-ray with CAD', 'None'], [70, 15, 10, 5])),
+        'Date of TB Screening (yyyy-mm-dd)': tb_screening_date,
+        'TB Diagnostic Test Type': np.where(presumptive, _choice(rng, n, ['Gene Xpert', 'TrueNAT', 'TB-LAM', 'LF-LAM', 'AFB Smear Microscopy',
+                                                                          'Chest X-ray', 'Clinical evaluation only', 'Gene Xpert/TrueNAT', None],
+                                                                 [35, 10, 12, 5, 8, 10, 5, 5, 10]), None),
+        'Date of TB Sample Collection (yyyy-mm-dd)': tb_sample,
+        'TB Diagnostic Result': np.where(presumptive, _choice(rng, n, ['MTB Not Detected', 'MTB Detected', 'Negative', 'Positive', 'Neg', '+ve',
+                                                                       'TB positive', 'AFB negative', 'Suggestive', 'Not suggestive',
+                                                                       'mtb trace', 'error', None],
+                                                              [30, 8, 15, 5, 5, 2, 2, 4, 3, 6, 1, 1, 18]), None),
+        'Date of TB Diagnostic Result Received (yyyy-mm-dd)': tb_result_received,
+        'Date of Start of TB Treatment (yyyy-mm-dd)': tb_treatment,
+        'TPT Type': np.where(on_tpt, _choice(rng, n, ['Isoniazid-(6H)', 'Isoniazid and Rifapentine-(3HP)', 'Isoniazid and Rifampicin-(3HR)'],
+                                             [50, 40, 10]), None),
+        'Date of TPT Start (yyyy-mm-dd)': tpt_start,
+        'TPT Completion status': np.where(on_tpt, np.where(tpt_completed, _choice(rng, n, ['Treatment Completed', 'completed'], [90, 10]),
+                                                           'Ongoing'), None),
+        'TPT Completion date (yyyy-mm-dd)': np.where(tpt_completed, _days_after(rng, tpt_start, 90, 200), np.datetime64('NaT')),
+    }
+
+
+# (Entry Point, Testing Setting, Modality) of the HTS tests, with their relative frequency. The last rows
+# are the incomplete combinations the troubleshooting indicators look for.
+HTS_SETTINGS = [
+    (('Facility', 'CT', 'VCT'), 20), (('Community', 'CT', 'VCT'), 8), (('Facility', 'Index', 'Index'), 6),
+    (('Community', 'Index', 'Index'), 4), (('Facility', 'ANC', 'PMTCT (ANC1 Only)'), 8),
+    (('Facility', 'Spoke health facility', 'PMTCT (ANC1 Only)'), 2), (('Community', 'TBA Orthodx', 'PMTCT (ANC1 Only)'), 2),
+    (('Community', 'TBA Orthodox', 'PMTCT (ANC1 Only)'), 1), (('Community', 'Delivery homes', 'PMTCT (ANC1 Only)'), 1),
+    (('Facility', 'L&D', 'PMTCT (Post ANC1: Pregnancy/L&D)'), 2),
+    (('Facility', 'Post Natal Ward/Breastfeeding', 'PMTCT (Post ANC1: Breastfeeding)'), 2),
+    (('Facility', 'Emergency', 'Emergency'), 3), (('Facility', 'Ward', 'Inpatient'), 3), (('Facility', 'Inpatient', 'Inpatient'), 2),
+    (('Facility', 'Malnutrition', 'Malnutrition'), 1), (('Facility', 'Pediatric', 'Pediatric'), 2),
+    (('Community', 'Outreach', 'Mobile'), 6), (('Community', 'OVC', 'Other Community Platforms'), 3),
+    (('Community', 'Standalone HTS', 'Other Community Platforms'), 1), (('Facility', 'FP', 'Other PITC'), 3),
+    (('Facility', 'Others', 'Other PITC'), 3), (('Facility', 'Blood Bank', 'Other PITC'), 1), (('Facility', 'TB', 'TB'), 2),
+    (('Facility', 'TB', 'TB_STAT/OtherPITC'), 1), (('Facility', 'STI', 'STI'), 3), (('Facility', 'SNS', 'SNS'), 2),
+    (('Community', 'SNS', 'SNS'), 2), (('Facility', 'PrEP Testing', 'PrEP_CT HTS'), 3),
+    ((None, 'CT', 'VCT'), 1), (('Facility', 'CT', None), 1), (('Facility', None, 'VCT'), 1),
+]
+
+
+def hts_columns(rng, n, start, end):
+    """
+    HTS rows (one row per test) tested around the quarter start to end.
+    """
+    settings = [setting for setting, weight in HTS_SETTINGS]
+    picked = rng.choice(len(settings), size=n, p=np.array([weight for setting, weight in HTS_SETTINGS], dtype=float) /
+                        sum(weight for setting, weight in HTS_SETTINGS))
+    entry_points, testing_settings, modalities = (np.array([setting[i] for setting in settings], dtype=object)[picked] for i in range(3))
+    return {
+        'Age': _ages(rng, n, children=0.1),
+        'Sex': _sex(rng, n, female=0.58),
+        'Entry Point': entry_points,
+        'Testing Setting': testing_settings,
+        'Modality': modalities,
+        'Final HIV Test Result': _choice(rng, n, ['Negative', 'Negetive', 'Positive', None], [88, 3, 5, 4]),
+        'Date Of HIV Testing (yyyy-mm-dd)': _dates(rng, n, start - np.timedelta64(45, 'D'), end + np.timedelta64(45, 'D'), blank=0.01),
+    }
+
+
+def hts_index_columns(rng, n, start, end):
+    """
+    Index testing rows (one row per contact elicited from an index client)
+    around the quarter start to end.
+    """
+    offered = _dates(rng, n, start - np.timedelta64(60, 'D'), end + np.timedelta64(30, 'D'), blank=0.02)
+    accepted = _choice(rng, n, ['Yes', 'No'], [85, 15])
+    elicited = np.where(accepted == 'Yes', _days_after(rng, offered, 0, 14, blank=0.05), np.datetime64('NaT'))
+    known_positive = _choice(rng, n, ['No', 'Yes', None], [75, 15, 10])
+    tested = (accepted == 'Yes') & (known_positive != 'Yes') & (rng.random(n) < 0.8)
+    return {
+        'Index client entry point': _choice(rng, n, ['Facility', 'Community', None], [65, 30, 5]),
+        'Sex': _sex(rng, n, female=0.55),
+        'Age': _ages(rng, n, children=0.15),
+        'Accepted Index Testing': accepted,
+        'Date offered index testing': offered,
+        'Date of Elicitation': elicited,
+        'Date of HTS': np.where(tested, _days_after(rng, elicited, 0, 30), np.datetime64('NaT')),
+        'HIV Test Result': np.where(tested, _choice(rng, n, ['Negative', 'Positive', None], [82, 15, 3]), None),
+        'elicitedclientknownpositive': known_positive,
+    }
+
+
+# (Point of Entry, ANC Setting, Modality) of the PMTCT tests, with their relative frequency
+PMTCT_SETTINGS = [
+    (('Facility', 'ANC', 'PMTCT (ANC1 Only)'), 45), (('Facility', 'Spoke health facility', 'PMTCT (ANC1 Only)'), 8),
+    (('Community', 'TBA Orthodx', 'PMTCT (ANC1 Only)'), 6), (('Community', 'TBA Orthodox', 'PMTCT (ANC1 Only)'), 3),
+    (('Community', 'TBA rt-HCW', 'PMTCT (ANC1 Only)'), 2), (('Community', 'Delivery homes', 'PMTCT (ANC1 Only)'), 3),
+    (('Community', 'Congregational setting', 'PMTCT (ANC1 Only)'), 3), (('Facility', 'L&D', 'PMTCT (Post ANC1: Pregnancy/L&D)'), 15),
+    (('Facility', 'Post Natal Ward/Breastfeeding', 'PMTCT (Post ANC1: Breastfeeding)'), 12), ((None, 'ANC', 'PMTCT (ANC1 Only)'), 1),
+    (('Facility', 'ANC', None), 2),
+]
+
+
+def pmtct_hts_columns(rng, n, start, end):
+    """
+    PMTCT HTS rows (one row per test of a pregnant or breastfeeding woman)
+    around the quarter start to end.
+    """
+    settings = [setting for setting, weight in PMTCT_SETTINGS]
+    picked = rng.choice(len(settings), size=n, p=np.array([weight for setting, weight in PMTCT_SETTINGS], dtype=float) /
+                        sum(weight for setting, weight in PMTCT_SETTINGS))
+    points_of_entry, anc_settings, modalities = (np.array([setting[i] for setting in settings], dtype=object)[picked] for i in range(3))
+    ages = np.clip(rng.normal(27, 6, n), 13, 49).astype(int).astype(object)
+    return {
+        'Age': _blank(rng, ages, 0.01),
+        'Point of Entry': points_of_entry,
+        'ANC Setting': anc_settings,
+        'Modality': modalities,
+        'HIV Test Result': _choice(rng, n, ['Negative', 'Negetive', 'Positive', None], [90, 4, 2, 4]),
+        'Date Tested for HIV': _dates(rng, n, start - np.timedelta64(45, 'D'), end + np.timedelta64(45, 'D'), blank=0.01),
+    }
+
+
+def prep_columns(rng, n, start, end):
+    """
+    PrEP rows (one row per client ever started on PrEP), commenced over the
+    two years before the quarter end, with their last pickup since.
+    """
+    sex = _sex(rng, n, female=0.55)
+    ages = _ages(rng, n, children=0.02)
+    commenced = _dates(rng, n, end - np.timedelta64(2 * 365, 'D'), end, blank=0.01)
+    last_pickup = np.minimum(_days_after(rng, commenced, 0, 400, blank=0.03), np.datetime64(end, 'D'))
+    prep_type = _choice(rng, n, ['Oral', 'Injectable', 'Event-Driven', '', None], [75, 10, 3, 4, 8])
+    distribution = _choice(rng, n, ['Facility', 'Community', 'Other', None], [60, 30, 3, 7])
+    return {
+        'HIV status at PrEP Initiation': _choice(rng, n, ['Negative', 'HIV Negative', '', ' ', None, 'Positive'], [70, 10, 4, 2, 12, 2]),
+        'Age': ages,
+        'Sex': sex,
+        'Pregnancy Status': _pregnancy_status(rng, sex, ages),
+        'Current HIV Status': _choice(rng, n, ['Negative', 'Positive', '', ' ', None], [80, 2, 5, 3, 10]),
+        'Current Prep Type': prep_type,
+        'Current Prep Distribution Setting': distribution,
+        'Prep Type': np.where(rng.random(n) < 0.9, prep_type, _choice(rng, n, ['Oral', 'Injectable'])),
+        'Prep Distribution Setting': np.where(rng.random(n) < 0.9, distribution, _choice(rng, n, ['Facility', 'Community'])),
+        'Date Of Commencement (yyyy-mm-dd)': commenced,
+        'Date Of Last Pickup (yyyy-mm-dd)': last_pickup,
+    }
+
+
+# Row generator and facility key columns of every report
+GENERATORS = {
+    'radet': (radet_columns, ['Facility Name', 'DatimId']),
+    'hts': (hts_columns, ['Facility', 'Facility Id (Datim)']),
+    'hts-index': (hts_index_columns, ['Facility Name', 'Facility Id (Datim)']),
+    'pmtct-hts': (pmtct_hts_columns, ['Facility']),
+    'prep': (prep_columns, ['Facility Name', 'Facility Id (Datim)']),
+}
+
+
+def facility_table(facilities, projects, seed=0):
+    """
+    The synthetic facilities: name, DATIM id, State, LGA and the project they
+    report under (IP1, IP2, ...), spread evenly over the projects.
+    """
+    rng = np.random.default_rng([seed, 0])
+    letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'))
+    alphanumerics = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'))
+    # DATIM ids are 11 characters starting with a letter
+    datim_ids = [letters[rng.integers(len(letters))] + ''.join(rng.choice(alphanumerics, 10)) for _ in range(facilities)]
+    states = rng.choice(STATES, size=facilities)
+    return pd.DataFrame({
+        'Facility Name': [f"Synthetic Facility {i + 1:0{len(str(facilities))}d}" for i in range(facilities)],
+        'Facility Id (Datim)': datim_ids,
+        'State': states,
+        'LGA': [f"{state} LGA {lga}" for state, lga in zip(states, rng.integers(1, LGAS_PER_STATE + 1, facilities))],
+        'Project': [f"IP{i % projects + 1}" for i in range(facilities)],
+    })
+
+
+def file_facilities(facilities, files):
+    """
+    The facilities (positions in the facility table) of every file. A file
+    only holds facilities of one project, and every project gets at least
+    one file; with more files than facilities, the rows of a facility are
+    spread over several files.
+    """
+    projects = facilities['Project'].to_numpy()
+    by_project = {project: np.flatnonzero(projects == project) for project in dict.fromkeys(projects)}
+    # Files are shared out over the projects by their number of facilities (largest remainders first),
+    # at least one file each
+    quotas = {project: files * len(positions) / len(facilities) for project, positions in by_project.items()}
+    shares = {project: max(1, int(quota)) for project, quota in quotas.items()}
+    for project in sorted(quotas, key=lambda project: quotas[project] - int(quotas[project]), reverse=True):
+        if sum(shares.values()) >= files:
+            break
+        shares[project] += 1
+    assignment = []
+    for project, positions in by_project.items():
+        for i in range(shares[project]):
+            # Facilities dealt out over the files of the project, or one facility per file when there are more files
+            assignment.append(positions[i::shares[project]] if shares[project] <= len(positions)
+                              else positions[[i % len(positions)]])
+    return assignment
+
+
+def extract_chunk(report, rng, n, facilities, positions, start, end, date_columns=(), excel_dates=False, extra_columns=0):
+    """
+    n rows of report for the facilities at positions of the facility table,
+    between the dates start and end of the quarter, as a DataFrame with the
+    headers of the extract. Dates are yyyy-mm-dd text (Excel dates with
+    excel_dates); a few of those in date_columns, the columns the script
+    converts to dates, are unparseable text.
+    """
+    generate, key_columns = GENERATORS[report]
+    rows = facilities.iloc[rng.choice(positions, size=n)]
+    chunk = {}
+    for key, column in zip(key_columns, ['Facility Name', 'Facility Id (Datim)']):
+        chunk[key] = rows[column].to_numpy()
+    chunk['State'] = rows['State'].to_numpy()
+    chunk['LGA'] = rows['LGA'].to_numpy()
+    for col, values in generate(rng, n, np.datetime64(start, 'D'), np.datetime64(end, 'D')).items():
+        values = np.asarray(values)
+        if values.dtype.kind == 'M':
+            dates = pd.Series(values.astype('datetime64[ns]')).astype(object).to_numpy() if excel_dates \
+                else np.datetime_as_string(values.astype('datetime64[D]')).astype(object)
+            dates[np.isnat(values)] = None
+            if col in date_columns:
+                invalid = ~np.isnat(values) & (rng.random(n) < INVALID_DATE_SHARE)
+                dates[invalid] = _choice(rng, invalid.sum(), INVALID_DATES)
+            values = dates
+        chunk[col] = values
+    for i in range(extra_columns):
+        # Columns the scripts do not read, to make the files as wide as the real exports
+        chunk[f'Extra Column {i + 1}'] = _choice(rng, n, ['Lorem', 'ipsum', 'dolor', None])
+    return pd.DataFrame(chunk)
+
+
+def check_columns(report, module):
+    # Warns about the columns the report's script reads that the generator does not write
+    generated = extract_chunk(report, np.random.default_rng(0), 1, facility_table(1, 1), [0],
+                              module.Start_of_quarter, module.End_of_quarter).columns
+    missing = [col for col in module.required_columns if col not in generated]
+    if missing:
+        print(f"Warning: The synthetic {report} extracts do not have the column(s) {missing} that {REPORTS[report]}.py reads.")
+
+
+def default_file_format(report):
+    # xlsx for the reports in UNCONVERTED_DATE_COLUMNS, csv (quicker to write and read) for the others
+    return 'xlsx' if report in UNCONVERTED_DATE_COLUMNS else 'csv'
+
+
+def generate_extracts(report, output_dir, rows, files=10, facilities=50, projects=3, file_format=None, period=None,
+                      extra_columns=0, seed=0):
+    """
+    Writes rows synthetic rows of report to files extracts in output_dir,
+    covering facilities facilities of projects projects. file_format is 'csv'
+    or 'xlsx' (None for default_file_format). period is the (start, end) the dates are
+    generated around, the quarter set in the report's script when None.
+    extra_columns adds that many columns the scripts do not read. The same
+    seed gives the same files. Returns the paths of the files written.
+    """
+    if file_format is None:
+        file_format = default_file_format(report)
+    if file_format not in ('csv', 'xlsx'):
+        print(f"FATAL ERROR: Unknown file format '{file_format}'. Use csv or xlsx.")
+        exit()
+    facilities = max(1, int(facilities))
+    facility_rows = facility_table(facilities, max(1, min(int(projects), facilities)), seed)
+    assignment = file_facilities(facility_rows, max(1, int(files)))
+    per_file = np.full(len(assignment), rows // len(assignment))
+    per_file[:rows % len(assignment)] += 1
+    if file_format == 'xlsx' and per_file.max() > EXCEL_MAX_ROWS:
+        print(f"FATAL ERROR: {per_file.max():,} rows per file do not fit in an Excel sheet ({EXCEL_MAX_ROWS:,} rows). "
+              f"Use more files or csv.")
+        exit()
+
+    module = importlib.import_module(REPORTS[report])
+    check_columns(report, module)
+    if file_format == 'csv' and report in UNCONVERTED_DATE_COLUMNS:
+        print(f"Warning: {REPORTS[report]}.py does not convert {UNCONVERTED_DATE_COLUMNS[report]} to dates, so comparing "
+              f"them as dates fails on the text dates of csv files. Use xlsx for this report.")
+    start, end = (pd.Timestamp(period[0]), pd.Timestamp(period[1])) if period else (module.Start_of_quarter, module.End_of_quarter)
+    options = {'date_columns': module.date_columns, 'excel_dates': file_format == 'xlsx', 'extra_columns': extra_columns}
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for number, (positions, n) in enumerate(zip(assignment, per_file)):
+        rng = np.random.default_rng([seed, 1, number])
+        project = facility_rows['Project'].iloc[positions[0]]
+        path = os.path.join(output_dir, f"{project}_{report}_{number + 1}.{file_format}")
+        if file_format == 'csv':
+            # Written a chunk at a time, so the size of a file is not limited by memory
+            for first in range(0, max(n, 1), CHUNK_ROWS):
+                chunk = extract_chunk(report, rng, min(CHUNK_ROWS, n - first), facility_rows, positions, start, end, **options)
+                chunk.to_csv(path, mode='w' if first == 0 else 'a', header=first == 0, index=False)
+        else:
+            extract_chunk(report, rng, n, facility_rows, positions, start, end, **options).to_excel(path, index=False)
+        paths.append(path)
+
+    print(f"Wrote {rows:,} synthetic {report} rows for {facilities} facilities to {len(paths)} {file_format} file(s) in {output_dir}.")
+    return paths
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Write synthetic extracts for one of the reports, e.g. to test it at scale.")
+    parser.add_argument('report', choices=list(REPORTS) + ['all'], help="report to write extracts for (all: one subfolder per report)")
+    parser.add_argument('output_dir', help="folder the extracts are written to")
+    parser.add_argument('--rows', type=int, default=100000, help="rows in all the files together (default: 100000)")
+    parser.add_argument('--files', type=int, default=10, help="number of files (default: 10)")
+    parser.add_argument('--facilities', type=int, default=50, help="number of facilities (default: 50)")
+    parser.add_argument('--projects', type=int, default=3, help="number of projects the facilities report under (default: 3)")
+    parser.add_argument('--format', dest='file_format', choices=['csv', 'xlsx'],
+                        help="file format (default: csv, or xlsx for radet and hts-index, whose scripts need Excel dates)")
+    parser.add_argument('--period', nargs=2, metavar=('START', 'END'),
+                        help="reporting period the dates are generated around (default: the quarter set in the script)")
+    parser.add_argument('--extra-columns', type=int, default=0, help="columns the scripts do not read, added to every file (default: 0)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed; the same seed gives the same files (default: 0)")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    reports = list(REPORTS) if args.report == 'all' else [args.report]
+    for report in reports:
+        output_dir = os.path.join(args.output_dir, report) if args.report == 'all' else args.output_dir
+        generate_extracts(report, output_dir, args.rows, files=args.files, facilities=args.facilities, projects=args.projects,
+                          file_format=args.file_format, period=args.period, extra_columns=args.extra_columns, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
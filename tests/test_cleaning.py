@@ -0,0 +1,140 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregate_data_radet import clean_cd4_count, clean_viral_load
+
+# The column cleaners of the RADET script against the per-row functions they replaced, copied unchanged
+# from the scripts as they were before the cleaners worked on whole columns.
+
+
+def legacy_clean_viral_load(value):
+    if pd.isna(value) or str(value).strip() == '':
+        return 'NULL'
+
+    val_str = str(value).strip().lower().replace(' ', '')
+
+    undetected_patterns = [
+        r'undetected', r'notdetected', r'tnf', r'tnd', r'nd', r't\.n\.d', r'notdet', r'not/d'
+    ]
+    if any(re.search(pattern, val_str) for pattern in undetected_patterns):
+        return 0
+
+    match = re.search(r'^[<>=]?(-?[0-9,]+(?:(?:\.|,)[0-9]+)?)', val_str)
+
+    if match:
+        try:
+            number_str = match.group(1).replace(',', '').replace('..', '.')
+            return float(number_str)
+        except (ValueError, TypeError):
+            pass
+
+    return 'NULL'
+
+
+def legacy_map_cd4_count(value):
+    s = str(value).strip()
+
+    if pd.isna(value) or s == "":
+        return pd.NA
+
+    if re.search(r'copies/ml|cells|positive|P0sitive|suggestive|failed|N/A', s, re.IGNORECASE):
+        return 'NULL'
+
+    s = s.replace('O', '0').replace('o', '0')
+
+    match = re.search(r'[\d]+(?:\.[\d]+)?', s)
+
+    if match:
+        try:
+            cleaned_value = float(match.group(0))
+            return cleaned_value
+        except (ValueError, IndexError):
+            return 'NULL'
+    else:
+        return 'NULL'
+
+
+def legacy_is_valid_cd4(value):
+    if pd.isna(value) or str(value).strip() == "":
+        return False
+
+    try:
+        numeric_value = float(value)
+        return numeric_value <= 1600
+    except (ValueError, TypeError):
+        return False
+
+
+def legacy_grt_cd4(value):
+    if pd.isna(value) or str(value).strip() == "":
+        return False
+
+    try:
+        numeric_value = float(value)
+        return numeric_value > 1600
+    except (ValueError, TypeError):
+        return False
+
+
+VIRAL_LOAD_VALUES = [
+    '<20', '< 20', '>10000000', '=50', 'TND', 'tnd', 'T.N.D', 'TNF', 'Not detected', 'NOT DETECTED', 'Undetected',
+    'not/d', 'ND', 'Target not detected', '1,200', '1,200.5', '1.2', '1.2e3', '12,34', '1..2', '-40', '0', '000',
+    '20 copies/ml', '45cp/ml', '', ' ', np.nan, None, 'pending', 'Sample rejected', 'N/A', ',', '.5', 'LDL', 'nil',
+    1200.0, 0.0, 45, 'Indeterminate',
+]
+
+CD4_VALUES = [
+    '350', ' 350 ', '350.5', '1600', '1600.0', '1601', '2000', 'O', '1O0', 'o5o', '<200', '>1600', 'CD4 350',
+    '350 cells', '200copies/ml', 'Positive', 'P0sitive', 'suggestive', 'failed', 'N/A', 'not done', 'pending',
+    '1,200', '1.2e3', '', ' ', np.nan, None, 350.0, 1600.0, 1601.0, 0, 'Other',
+]
+
+
+def as_legacy_float(value):
+    # The legacy result with its 'NULL' string and pd.NA as NaN, to compare with the float column
+    if value is pd.NA or value == 'NULL':
+        return np.nan
+    return float(value)
+
+
+@pytest.mark.parametrize('value', VIRAL_LOAD_VALUES, ids=repr)
+def test_clean_viral_load_matches_row_function(value):
+    cleaned = clean_viral_load(pd.Series([value], dtype=object))
+    assert cleaned.dtype == float
+    np.testing.assert_equal(cleaned.iloc[0], as_legacy_float(legacy_clean_viral_load(value)))
+
+
+def test_clean_viral_load_whole_column():
+    values = pd.Series(VIRAL_LOAD_VALUES, dtype=object)
+    expected = values.map(legacy_clean_viral_load).map(as_legacy_float)
+    pd.testing.assert_series_equal(clean_viral_load(values), expected.astype(float), check_names=False)
+
+
+@pytest.mark.parametrize('value', CD4_VALUES, ids=repr)
+def test_clean_cd4_count_matches_row_function(value):
+    cleaned = clean_cd4_count(pd.Series([value], dtype=object))
+    assert cleaned.dtype == float
+    np.testing.assert_equal(cleaned.iloc[0], as_legacy_float(legacy_map_cd4_count(value)))
+
+
+@pytest.mark.parametrize('value', CD4_VALUES, ids=repr)
+def test_cd4_cut_off_matches_row_functions(value):
+    cleaned = clean_cd4_count(pd.Series([value], dtype=object))
+    legacy = legacy_map_cd4_count(value)
+    assert bool((cleaned <= 1600).iloc[0]) == legacy_is_valid_cd4(legacy)
+    assert bool((cleaned > 1600).iloc[0]) == legacy_grt_cd4(legacy)
+
+
+@pytest.mark.parametrize('value', ['350 cells', '200copies/ml', 'Positive', 'suggestive', 'failed', 'N/A', 'pending'])
+def test_cd4_text_results_are_unknown_instead_of_null(value):
+    # Documented difference: a text result without a count was the string 'NULL', which is not missing, so a
+    # client over 4 with it was in neither TX_NEW CD4 group. It is NaN now and falls in the unknown group.
+    legacy = legacy_map_cd4_count(value)
+    assert legacy == 'NULL'
+    assert not pd.isna(legacy) and not legacy_is_valid_cd4(legacy) and not legacy_grt_cd4(legacy)
+
+    cleaned = clean_cd4_count(pd.Series([value], dtype=object))
+    assert cleaned.isna().iloc[0]
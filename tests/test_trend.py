@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicator_counts import count_indicators
+from trend import count_trend
+
+# The grouped trend (one reduction keyed on the period of a date column) against the per-period loop it
+# replaced for the reports whose indicators each count the rows dated in the period.
+
+KEYS = ['ProjectName', 'Facility']
+QUARTERS = [('2024-10-01', '2024-12-31'), ('2025-01-01', '2025-03-31'), ('2025-04-01', '2025-06-30')]
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    n = 5000
+    days = pd.Timestamp('2024-09-01') + pd.to_timedelta(rng.integers(0, 330, n), unit='D')
+    tested = pd.Series(days).where(rng.random(n) > 0.05)
+    started = (pd.Series(days) - pd.to_timedelta(rng.integers(0, 200, n), unit='D')).where(rng.random(n) > 0.05)
+    return pd.DataFrame({
+        'ProjectName': pd.Categorical(rng.choice(['IP1', 'IP2'], n)),
+        'Facility': pd.Categorical(rng.choice([f'Facility {i}' for i in range(6)], n)),
+        'Tested': tested,
+        'Started': started,
+        'Result': rng.choice(['Positive', 'Negative', None], n),
+    })
+
+
+def count_period(data):
+    # Indicators in the style of the scripts: one dated in the period by Tested, one by Started, and one
+    # held to a period by Tested that also compares Started with its start
+    def count(start, end, keys):
+        in_period = (data['Tested'] >= start) & (data['Tested'] <= end)
+        return count_indicators(data, [
+            ('Tested', in_period),
+            ('Tested_Positive', in_period & (data['Result'] == 'Positive')),
+            ('Started', (data['Started'] >= start) & (data['Started'] <= end)),
+            ('Tested_Started_Before', in_period & (data['Started'] < start)),
+        ], keys)
+    return count
+
+
+def test_grouped_trend_equals_the_per_period_loop(data):
+    universe = data[KEYS].drop_duplicates()
+    period_dates = {'Tested': 'Tested', 'Tested_Positive': 'Tested', 'Started': 'Started',
+                    'Tested_Started_Before': 'Tested'}
+    columns = list(data.columns)
+    for fill_zero in [False, True]:
+        loop = count_trend(universe, KEYS, QUARTERS, count_period(data), fill_zero=fill_zero)
+        grouped = count_trend(universe, KEYS, QUARTERS, count_period(data), fill_zero=fill_zero, data=data,
+                              period_dates=period_dates)
+        pd.testing.assert_frame_equal(grouped, loop)
+    assert list(data.columns) == columns
+
+
+def test_single_period_date(data):
+    universe = data[KEYS].drop_duplicates()
+    loop = count_trend(universe, KEYS, QUARTERS, count_period(data))
+    grouped = count_trend(universe, KEYS, QUARTERS, count_period(data), data=data, period_dates='Tested')
+    tested = ['Period'] + KEYS + ['Tested', 'Tested_Positive', 'Tested_Started_Before']
+    pd.testing.assert_frame_equal(grouped[tested], loop[tested])
+
+
+def test_overlapping_periods_are_counted_one_after_another(data, capsys):
+    universe = data[KEYS].drop_duplicates()
+    periods = QUARTERS + [('2025-02-01', '2025-04-30')]
+    loop = count_trend(universe, KEYS, periods, count_period(data))
+    grouped = count_trend(universe, KEYS, periods, count_period(data), data=data, period_dates='Tested')
+    assert 'overlap' in capsys.readouterr().out
+    pd.testing.assert_frame_equal(grouped, loop)
@@ -0,0 +1,133 @@
+import pandas as pd
+
+from indicator_counts import assemble_counts
+from profiling import stage
+
+# Multi-period (trend) runs of the aggregate_data_*.py scripts.
+# The extracts are ingested and cleaned once and the facility counts of every
+# period of trend_periods are stacked with a 'Period' column. When every
+# indicator counts the rows whose date (e.g. the test date) falls in the period,
+# the periods are counted in one grouped reduction: the date is bucketed into
+# its period once, the indicator masks are evaluated once against the bounds of
+# each row's own period, and the counts are summed per period and facility in
+# the same groupby. So the cost hardly grows with the number of periods. RADET
+# keeps a loop over the periods: its rolling windows (12 months of viral load,
+# semi-annual TB_PREV) overlap, so a client row can count in several periods
+# and no single period code per row would do. Overlapping trend_periods are
+# counted one after another for the same reason.
+
+# Sheet of the trend output file
+TREND_SHEET = 'Trend'
+
+# Column the period of every row is kept in while the periods are counted together
+PERIOD_COLUMN = 'Period'
+
+
+def fiscal_quarter_label(start, end):
+    # 'FY25Q4' for a whole PEPFAR fiscal quarter (the fiscal year starts in October), None otherwise
+    quarter_end = start + pd.DateOffset(months=3, days=-1)
+    if start.day != 1 or start.month % 3 != 1 or end != quarter_end:
+        return None
+    fiscal_year = start.year + 1 if start.month >= 10 else start.year
+    quarter = (start.month - 10) % 12 // 3 + 1
+    return f"FY{fiscal_year % 100:02d}Q{quarter}"
+
+
+def semi_annual_start(start_of_quarter):
+    # Start of the semi-annual reporting period (October-March or April-September) holding the quarter
+    if 4 <= start_of_quarter.month <= 9:
+        return pd.Timestamp(start_of_quarter.year, 4, 1)
+    if start_of_quarter.month >= 10:
+        return pd.Timestamp(start_of_quarter.year, 10, 1)
+    return pd.Timestamp(start_of_quarter.year - 1, 10, 1)
+
+
+def parse_periods(periods):
+    # (label, start, end) of every (start, end) pair in periods, in the order given
+    parsed = []
+    for start, end in periods:
+        start, end = pd.to_datetime(start), pd.to_datetime(end)
+        if end < start:
+            print(f"FATAL ERROR: Trend period {start:%Y-%m-%d} - {end:%Y-%m-%d} ends before it starts.")
+            exit()
+        label = fiscal_quarter_label(start, end) or f"{start:%Y-%m-%d} - {end:%Y-%m-%d}"
+        parsed.append((label, start, end))
+    return parsed
+
+
+def period_positions(dates, parsed):
+    # Position in parsed of the period holding each date (-1 for none), None when the periods overlap
+    periods = pd.IntervalIndex.from_arrays([start for label, start, end in parsed], [end for label, start, end in parsed],
+                                           closed='both')
+    if periods.is_overlapping:
+        return None
+    return periods.get_indexer(dates)
+
+
+def count_periods_together(data, universe, keys, parsed, count_period, period_dates, fill_zero):
+    # The trend of count_trend in one grouped reduction per date column of period_dates, None when it cannot be
+    # done that way (overlapping periods)
+    date_of = period_dates if isinstance(period_dates, dict) else None
+    columns = list(dict.fromkeys(date_of.values())) if date_of is not None else [period_dates]
+    labels = [label for label, start, end in parsed]
+    # The bounds of every period, with NaT (matching no date) for the rows outside all of them
+    starts = pd.DatetimeIndex([start for label, start, end in parsed] + [pd.NaT])
+    ends = pd.DatetimeIndex([end for label, start, end in parsed] + [pd.NaT])
+
+    pivots = {}
+    for column in columns:
+        positions = period_positions(data[column], parsed)
+        if positions is None:
+            return None
+        print(f"Counting the indicators for {', '.join(labels)} by '{column}'...")
+        data[PERIOD_COLUMN] = pd.Categorical.from_codes(positions, categories=labels)
+        try:
+            column_pivots = count_period(pd.Series(starts[positions], index=data.index),
+                                         pd.Series(ends[positions], index=data.index), [PERIOD_COLUMN] + keys)
+        finally:
+            del data[PERIOD_COLUMN]
+        for i, pivot_df in enumerate(column_pivots):
+            if date_of is None or date_of[pivot_df.columns[-1]] == column:
+                pivots[i] = pivot_df
+
+    universe = pd.concat([universe[keys].assign(**{PERIOD_COLUMN: label}) for label in labels], ignore_index=True)
+    return assemble_counts(universe[[PERIOD_COLUMN] + keys], [pivots[i] for i in sorted(pivots)], [PERIOD_COLUMN] + keys,
+                           fill_zero=fill_zero, keep_empty=True)
+
+
+def count_trend(universe, keys, periods, count_period, fill_zero=False, data=None, period_dates=None):
+    """
+    Counts the indicators of every period in periods (a list of (start, end)
+    pairs) for the facilities of universe. count_period(start, end, keys)
+    returns the pivots of the indicators counted per group of keys (as passed
+    to assemble_counts). Without period_dates it is called once per period.
+    period_dates is the date column of data that puts a row in a period when
+    every indicator only counts the rows whose date falls in it, or a
+    {indicator name: date column} dict when the indicators use different dates.
+    count_period is then called once per date column, with start and end
+    holding the bounds of the period of every row (NaT outside all periods),
+    and the period in a 'Period' column of data to group by. Returns one row
+    per period and facility, with the period in a 'Period' column. Every
+    period has a column for every indicator, even one with no matching rows.
+    """
+    parsed = parse_periods(periods)
+    if period_dates is not None and PERIOD_COLUMN not in data.columns:
+        with stage('count trend', periods=len(parsed)):
+            trend = count_periods_together(data, universe, keys, parsed, count_period, period_dates, fill_zero)
+        if trend is not None:
+            return trend
+        print("Note: The trend periods overlap, so they are counted one after another.")
+
+    tables = []
+    for label, start, end in parsed:
+        print(f"Counting the indicators for {label} ({start:%Y-%m-%d} to {end:%Y-%m-%d})...")
+        counts = assemble_counts(universe, count_period(start, end, keys), keys, fill_zero=fill_zero, keep_empty=True)
+        counts.insert(0, PERIOD_COLUMN, label)
+        tables.append(counts)
+    return pd.concat(tables, ignore_index=True)
+
+
+def save_trend(trend, output_path):
+    with stage('write trend'), pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+        trend.to_excel(writer, sheet_name=TREND_SHEET, index=False)
+    print(f"Trend of {trend['Period'].nunique()} period(s) saved to: {output_path}")